@@ -23,6 +23,29 @@ class Caja(models.Model):
     
     def __str__(self):
         return f"{self.codigo} - {self.nombre}"
+    
+    @classmethod
+    def obtener_ubicacion_id(cls, id_caja):
+        """
+        Devuelve el ID de la ubicación (sucursal) de la caja.
+        Si la caja no tiene ubicación asignada se usa la ubicación principal.
+        El resultado se guarda en caché porque cambia muy rara vez.
+        """
+        from django.core.cache import cache
+        from inventario.models import Ubicacion
+        
+        clave = f'caja:ubicacion:{id_caja}'
+        ubicacion_id = cache.get(clave)
+        if ubicacion_id is None:
+            ubicacion_id = cls.objects.filter(id=id_caja).values_list('ubicacion_id', flat=True).first()
+            if ubicacion_id is None:
+                ubicacion_id = Ubicacion.objects.filter(
+                    es_principal=True, activo=True
+                ).values_list('id', flat=True).first()
+            if ubicacion_id is None:
+                return None
+            cache.set(clave, ubicacion_id, 600)
+        return ubicacion_id
 
 
 class ArqueoCaja(models.Model):
@@ -122,17 +145,28 @@ class CierreCaja(models.Model):
         ordering = ['-fechaApertura']
     
     @classmethod
-    def obtener_caja_abierta(cls):
-        """Obtiene cualquier caja abierta (sin importar el día)"""
+    def obtener_caja_abierta(cls, usuario=None):
+        """
+        Obtiene una caja abierta (sin importar el día).
+        
+        Con varias sucursales hay varias cajas abiertas a la vez: si se indica
+        el usuario se prefiere la caja que él abrió, y si no tiene ninguna se
+        devuelve la última abierta.
+        """
         from django.db import connection, OperationalError
         from django.utils import timezone
         
         try:
             # Buscar cualquier caja abierta (sin filtro de fecha)
-            caja_abierta = cls.objects.filter(
+            abiertas = cls.objects.filter(
                 estado='ABIERTA',
                 anulado=False
-            ).order_by('-fechaApertura').first()
+            ).order_by('-fechaApertura')
+            caja_abierta = None
+            if usuario is not None and getattr(usuario, 'id', None):
+                caja_abierta = abiertas.filter(idUsuarioApertura=usuario.id).first()
+            if caja_abierta is None:
+                caja_abierta = abiertas.first()
             
             if caja_abierta:
                 return {
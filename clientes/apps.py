@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ClientesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'clientes'
+
+    def ready(self):
+        # Conectar los receptores que mantienen el índice de búsqueda de clientes
+        from . import utils_busqueda  # noqa: F401
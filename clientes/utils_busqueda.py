@@ -0,0 +1,330 @@
+"""
+Índice de búsqueda de clientes y sincronización incremental del caché offline
+
+- IndiceClientes: índice en memoria del proceso con los clientes activos.
+  La cédula/RUC exacta se resuelve con un diccionario; el resto de las
+  búsquedas por prefijo de palabra (nombres, apellidos, razón social y
+  documento) con búsqueda binaria sobre una lista ordenada de términos, y
+  si no hay coincidencias por similitud de trigramas (errores de tipeo).
+  Se mantiene con las señales de Cliente, con los clientes creados o
+  editados en la base desde la última revisión (creado_date/editado_date,
+  cada INTERVALO_VERIFICACION segundos, para ver los cambios de otros
+  procesos) y una reconstrucción cada TTL_INDICE segundos. Una cédula/RUC
+  exacta que no está en el índice se busca en la base.
+- consulta_cache_clientes / fila_cache_cliente: filas del caché offline
+  (IndexedDB del navegador) leídas con values_list() por bloques. Con una
+  versión (ms de la última creación/edición ya sincronizada) sólo devuelve
+  los clientes creados o editados desde entonces, incluidos los dados de
+  baja. editado_date se sella en cada save() (_sellar_edicion); los UPDATE
+  masivos sobre clientes deben asignarlo explícitamente.
+"""
+import bisect
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import transaction
+from django.db.models import Max, Q
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from productos.utils_duplicados import dice, normalizar_nombre, trigramas_palabras
+from .models import Cliente
+
+
+MAX_RESULTADOS = 10
+# La sincronización incremental vuelve a pedir este margen antes de la
+# versión recibida: una edición que se confirma tarde con una fecha anterior
+# a la última ya sincronizada no se pierde (el caché offline la sobrescribe)
+MARGEN_SINCRONIZACION = timedelta(minutes=5)
+SIMILITUD_MINIMA = 0.4
+# Revisión de clientes nuevos o editados en la base y reconstrucción completa
+INTERVALO_VERIFICACION = 10
+TTL_INDICE = 60 * 30
+CAMPOS_CLIENTE = (
+    'id', 'cedula_ruc', 'nombres', 'apellidos', 'razon_social', 'telefono', 'celular',
+    'email', 'direccion', 'estado', 'anulado', 'creado_date', 'editado_date',
+)
+
+
+def nombre_cliente(razon_social, nombres, apellidos):
+    """Igual que Cliente.nombre_completo, sin instanciar el modelo"""
+    if razon_social:
+        return razon_social
+    return f"{nombres or ''} {apellidos or ''}".strip()
+
+
+class IndiceClientes:
+    """
+    Clientes activos indexados por documento, prefijo de palabra y trigramas.
+
+    CACHES es LocMemCache (propia de cada proceso), así que los cambios de
+    otros procesos se leen de la base: cada intervalo_verificacion segundos
+    se reaplican los clientes creados o editados desde la última fecha vista
+    menos MARGEN_SINCRONIZACION, y cada ttl segundos se reconstruye todo
+    (UPDATE masivos que no sellan editado_date).
+    """
+
+    CAMPOS = ('id', 'cedula_ruc', 'nombres', 'apellidos', 'razon_social', 'celular', 'telefono')
+
+    def __init__(self, intervalo_verificacion=INTERVALO_VERIFICACION, ttl=TTL_INDICE):
+        self.intervalo_verificacion = intervalo_verificacion
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._datos = {}          # cliente_id -> (cedula_ruc, nombre, telefono, palabras)
+        self._por_documento = {}  # cedula_ruc -> cliente_id
+        self._terminos = []       # [(término, cliente_id)] ordenada
+        self._trigramas = {}      # trigrama -> {cliente_id}
+        self._ultima_fecha = None  # creación/edición más reciente indexada
+        self._construido = None
+        self._verificado = None
+
+    def _asegurar(self):
+        ahora = time.monotonic()
+        with self._lock:
+            if self._construido is None or ahora - self._construido > self.ttl:
+                self._construir()
+                self._construido = self._verificado = ahora
+            elif ahora - self._verificado >= self.intervalo_verificacion:
+                self._verificado = ahora
+                self._aplicar_cambios()
+
+    @staticmethod
+    def _fecha_maxima():
+        fechas = Cliente.objects.aggregate(creado=Max('creado_date'), editado=Max('editado_date'))
+        return max((fecha for fecha in fechas.values() if fecha), default=None)
+
+    def _construir(self):
+        self._datos = {}
+        self._por_documento = {}
+        self._terminos = []
+        self._trigramas = {}
+        self._ultima_fecha = self._fecha_maxima()
+        filas = Cliente.objects.filter(estado=True, anulado=False).values_list(
+            *self.CAMPOS
+        ).iterator(chunk_size=5000)
+        for cliente_id, cedula_ruc, nombres, apellidos, razon_social, celular, telefono in filas:
+            self._agregar(cliente_id, cedula_ruc, nombre_cliente(razon_social, nombres, apellidos),
+                          celular or telefono or '', ordenar=False)
+        self._terminos.sort()
+
+    def _aplicar_cambios(self):
+        """Reindexa los clientes creados o editados en la base desde la última revisión"""
+        if self._ultima_fecha is None:
+            clientes = Cliente.objects.all()
+        else:
+            fecha = self._ultima_fecha - MARGEN_SINCRONIZACION
+            clientes = Cliente.objects.filter(Q(creado_date__gte=fecha) | Q(editado_date__gte=fecha))
+        filas = clientes.order_by().values_list(*self.CAMPOS, 'estado', 'anulado', 'creado_date', 'editado_date')
+        for (cliente_id, cedula_ruc, nombres, apellidos, razon_social, celular, telefono,
+             estado, anulado, creado_date, editado_date) in filas:
+            self._quitar(cliente_id)
+            if estado and not anulado:
+                self._agregar(cliente_id, cedula_ruc, nombre_cliente(razon_social, nombres, apellidos),
+                              celular or telefono or '')
+            for fecha in (creado_date, editado_date):
+                if fecha and (self._ultima_fecha is None or fecha > self._ultima_fecha):
+                    self._ultima_fecha = fecha
+
+    def _buscar_documento(self, cedula_ruc):
+        """Cédula/RUC exacta que todavía no está en el índice: se busca en la base (índice único)"""
+        fila = Cliente.objects.filter(cedula_ruc=cedula_ruc, estado=True, anulado=False).values_list(
+            *self.CAMPOS
+        ).first()
+        if fila is None:
+            return None
+        cliente_id, cedula_ruc, nombres, apellidos, razon_social, celular, telefono = fila
+        self._quitar(cliente_id)
+        self._agregar(cliente_id, cedula_ruc, nombre_cliente(razon_social, nombres, apellidos),
+                      celular or telefono or '')
+        return cliente_id
+
+    def _agregar(self, cliente_id, cedula_ruc, nombre, telefono, ordenar=True):
+        palabras = tuple(sorted(set(normalizar_nombre(f'{cedula_ruc} {nombre}').split())))
+        self._datos[cliente_id] = (cedula_ruc, nombre, telefono, palabras)
+        self._por_documento[cedula_ruc] = cliente_id
+        for palabra in palabras:
+            if ordenar:
+                bisect.insort(self._terminos, (palabra, cliente_id))
+            else:
+                self._terminos.append((palabra, cliente_id))
+        for trigrama in trigramas_palabras(palabras):
+            self._trigramas.setdefault(trigrama, set()).add(cliente_id)
+
+    def _quitar(self, cliente_id):
+        datos = self._datos.pop(cliente_id, None)
+        if datos is None:
+            return
+        cedula_ruc, _, _, palabras = datos
+        if self._por_documento.get(cedula_ruc) == cliente_id:
+            del self._por_documento[cedula_ruc]
+        for palabra in palabras:
+            posicion = bisect.bisect_left(self._terminos, (palabra, cliente_id))
+            if posicion < len(self._terminos) and self._terminos[posicion] == (palabra, cliente_id):
+                del self._terminos[posicion]
+        for trigrama in trigramas_palabras(palabras):
+            ids = self._trigramas.get(trigrama)
+            if ids is not None:
+                ids.discard(cliente_id)
+                if not ids:
+                    del self._trigramas[trigrama]
+
+    def _por_prefijo(self, prefijo):
+        ids = set()
+        posicion = bisect.bisect_left(self._terminos, (prefijo,))
+        while posicion < len(self._terminos) and self._terminos[posicion][0].startswith(prefijo):
+            ids.add(self._terminos[posicion][1])
+            posicion += 1
+        return ids
+
+    def _por_similitud(self, palabras):
+        """Clientes cuyas palabras se parecen a cada palabra buscada (promedio de la mejor similitud)"""
+        trigramas_buscados = [trigramas_palabras([palabra]) for palabra in palabras]
+        conteo = Counter()
+        for trigrama in frozenset().union(*trigramas_buscados):
+            conteo.update(self._trigramas.get(trigrama, ()))
+        similares = []
+        for cliente_id, _ in conteo.most_common(MAX_RESULTADOS * 5):
+            trigramas_cliente = [trigramas_palabras([palabra]) for palabra in self._datos[cliente_id][3]]
+            similitud = sum(
+                max(dice(buscados, propios) for propios in trigramas_cliente)
+                for buscados in trigramas_buscados
+            ) / len(trigramas_buscados)
+            if similitud >= SIMILITUD_MINIMA:
+                similares.append((similitud, cliente_id))
+        similares.sort(key=lambda par: -par[0])
+        return [cliente_id for _, cliente_id in similares]
+
+    def buscar(self, texto, limite=MAX_RESULTADOS):
+        """
+        Clientes activos que coinciden con el texto.
+
+        Returns:
+            lista de dicts {'id', 'cedula_ruc', 'nombre', 'telefono'}
+        """
+        texto = (texto or '').strip()
+        if not texto:
+            return []
+        self._asegurar()
+
+        with self._lock:
+            exacto = self._por_documento.get(texto)
+            if exacto is None and texto.isdigit():
+                exacto = self._buscar_documento(texto)
+            if exacto is not None:
+                ids = [exacto]
+            else:
+                palabras = normalizar_nombre(texto).split()
+                coincidencias = None
+                for palabra in palabras:
+                    por_palabra = self._por_prefijo(palabra)
+                    coincidencias = por_palabra if coincidencias is None else coincidencias & por_palabra
+                    if not coincidencias:
+                        break
+                if coincidencias:
+                    ids = sorted(coincidencias, key=lambda cid: self._datos[cid][1])
+                elif any(len(palabra) >= 3 for palabra in palabras):
+                    ids = self._por_similitud(palabras)
+                else:
+                    ids = []
+
+            resultado = []
+            for cliente_id in ids[:limite]:
+                cedula_ruc, nombre, telefono, _ = self._datos[cliente_id]
+                resultado.append({'id': cliente_id, 'cedula_ruc': cedula_ruc, 'nombre': nombre, 'telefono': telefono})
+        return resultado
+
+    def actualizar(self, cliente):
+        """Aplica el alta, cambio o baja de un cliente hecho por este proceso"""
+        with self._lock:
+            if self._construido is None:
+                return
+            self._quitar(cliente.id)
+            if cliente.estado and not cliente.anulado:
+                self._agregar(cliente.id, cliente.cedula_ruc, cliente.nombre_completo, cliente.telefono_principal)
+
+    def limpiar(self):
+        with self._lock:
+            self._datos = {}
+            self._por_documento = {}
+            self._terminos = []
+            self._trigramas = {}
+            self._ultima_fecha = None
+            self._construido = None
+            self._verificado = None
+
+
+indice_clientes = IndiceClientes()
+
+
+@receiver(post_save, sender=Cliente, dispatch_uid='indice_clientes_por_cliente')
+def _actualizar_indice_clientes(sender, instance, **kwargs):
+    transaction.on_commit(lambda: indice_clientes.actualizar(instance))
+
+
+@receiver(post_delete, sender=Cliente, dispatch_uid='indice_clientes_por_baja_cliente')
+def _quitar_del_indice_clientes(sender, instance, **kwargs):
+    instance.anulado = True
+    transaction.on_commit(lambda: indice_clientes.actualizar(instance))
+
+
+# ============================================
+# CACHÉ OFFLINE INCREMENTAL
+# ============================================
+
+@receiver(pre_save, sender=Cliente, dispatch_uid='clientes_sellar_edicion')
+def _sellar_edicion(sender, instance, **kwargs):
+    # Toda edición queda con fecha, también las del admin (campo de sólo
+    # lectura). Con save(update_fields=...) hay que incluir editado_date.
+    if not instance._state.adding:
+        instance.editado_date = timezone.now()
+
+
+def version_de_fecha(fecha):
+    """Milisegundos desde epoch de una fecha de creación/edición"""
+    return int(fecha.timestamp() * 1000) if fecha else 0
+
+
+def fecha_de_version(version):
+    return datetime.fromtimestamp(int(version) / 1000, tz=dt_timezone.utc)
+
+
+def consulta_cache_clientes(desde=None):
+    """
+    Clientes para el caché offline.
+
+    Sin versión: los clientes activos. Con versión: los creados o editados
+    desde esa versión menos MARGEN_SINCRONIZACION, activos o no.
+    """
+    if desde is None:
+        clientes = Cliente.objects.filter(estado=True, anulado=False)
+    else:
+        fecha = fecha_de_version(desde) - MARGEN_SINCRONIZACION
+        clientes = Cliente.objects.filter(Q(creado_date__gte=fecha) | Q(editado_date__gte=fecha))
+    return clientes.order_by().values_list(*CAMPOS_CLIENTE)
+
+
+def fila_cache_cliente(fila):
+    """
+    Convierte una fila de consulta_cache_clientes al formato del caché offline.
+
+    Returns:
+        (dict del cliente o None si está dado de baja, id, versión de la fila)
+    """
+    (cliente_id, cedula_ruc, nombres, apellidos, razon_social, telefono, celular,
+     email, direccion, estado, anulado, creado_date, editado_date) = fila
+    version = max(version_de_fecha(creado_date), version_de_fecha(editado_date))
+    if not estado or anulado:
+        return None, cliente_id, version
+    nombre = nombre_cliente(razon_social, nombres, apellidos)
+    return {
+        'id': cliente_id,
+        'cedula': cedula_ruc,
+        'nombre': nombre,
+        'email': email or '',
+        'telefono': celular or telefono or '',
+        'direccion': direccion or '',
+        'searchable_text': f"{cedula_ruc} {nombre}".lower(),
+    }, cliente_id, version
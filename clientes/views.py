@@ -3,11 +3,14 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.core.paginator import Paginator
 from django.db.models import Q
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.utils import timezone
 from django.db import OperationalError
+import itertools
+import json
 from .models import Cliente
 from .forms import ClienteForm
+from .utils_busqueda import consulta_cache_clientes, fila_cache_cliente, indice_clientes
 
 
 @login_required
@@ -142,6 +145,9 @@ def eliminar_cliente(request, pk):
     if request.method == 'POST':
         cliente.estado = False
         cliente.anulado = True
+        # La fecha de edición marca la baja para la sincronización del caché offline
+        cliente.editado_por = request.user
+        cliente.editado_date = timezone.now()
         cliente.save()
         messages.success(request, 'Cliente eliminado exitosamente')
         return redirect('clientes:lista')
@@ -190,22 +196,15 @@ def buscar_clientes(request):
         search = request.GET.get('search', '')
         
         try:
-            clientes = Cliente.objects.filter(
-                Q(nombres__icontains=search) |
-                Q(apellidos__icontains=search) |
-                Q(cedula_ruc__icontains=search),
-                estado=True,
-                anulado=False
-            )[:10]
-            
+            # Índice en memoria: cédula/RUC exacta, prefijos de palabra y errores de tipeo
             clientes_data = []
-            for cliente in clientes:
+            for cliente in indice_clientes.buscar(search):
                 clientes_data.append({
-                    'id': cliente.id,
-                    'cedula_ruc': cliente.cedula_ruc,
-                    'nombre': cliente.nombre_completo,
-                    'documento': cliente.cedula_ruc,
-                    'telefono': cliente.telefono_principal
+                    'id': cliente['id'],
+                    'cedula_ruc': cliente['cedula_ruc'],
+                    'nombre': cliente['nombre'],
+                    'documento': cliente['cedula_ruc'],
+                    'telefono': cliente['telefono']
                 })
             
             return JsonResponse({'clientes': clientes_data})
@@ -229,52 +228,24 @@ def buscar_clientes(request):
 
 def clientes_cache_api(request):
     """
-    API para obtener todos los clientes para cache offline
-    Retorna información completa para IndexedDB
+    API para obtener los clientes para cache offline (IndexedDB)
+
+    Sin parámetros retorna todos los clientes activos. Con ?desde=<version>
+    (metadata.version de la sincronización anterior) retorna sólo los
+    clientes creados o editados desde entonces, y en 'eliminados' los ids
+    de los dados de baja. La respuesta se genera por bloques sin armar la
+    lista completa en memoria.
     """
+    desde = request.GET.get('desde')
     try:
-        print("=== INICIANDO API CACHE DE CLIENTES ===")
-        
-        # Obtener TODOS los clientes activos
-        clientes = Cliente.objects.filter(
-            estado=True, 
-            anulado=False
-        )
-        
-        total_clientes = clientes.count()
-        print(f"Total de clientes activos encontrados: {total_clientes}")
-        
-        # Preparar datos para cache
-        clientes_cache = []
-        for cliente in clientes:
-            try:
-                cliente_cache = {
-                    'id': cliente.id,
-                    'cedula': cliente.cedula_ruc,
-                    'nombre': cliente.nombre_completo,
-                    'email': cliente.email or '',
-                    'telefono': cliente.telefono_principal or '',
-                    'direccion': cliente.direccion or '',
-                    'searchable_text': f"{cliente.cedula_ruc} {cliente.nombre_completo}".lower(),
-                    'cache_timestamp': timezone.now().timestamp()
-                }
-                clientes_cache.append(cliente_cache)
-                
-            except Exception as e:
-                print(f"Error procesando cliente {cliente.id}: {str(e)}")
-                continue
-        
-        response_data = {
-            'success': True,
-            'clientes': clientes_cache,
-            'metadata': {
-                'total_clientes': len(clientes_cache),
-                'generated_at': timezone.now().isoformat()
-            }
-        }
-        
-        return JsonResponse(response_data)
-        
+        desde = int(desde) if desde else None
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Versión inválida', 'clientes': []}, status=400)
+
+    try:
+        filas = consulta_cache_clientes(desde).iterator(chunk_size=2000)
+        # La primera fila se lee aquí para que un error de conexión responda 500 en JSON
+        primera = next(filas, None)
     except Exception as e:
         print(f"ERROR en clientes_cache_api: {str(e)}")
         return JsonResponse({
@@ -282,3 +253,29 @@ def clientes_cache_api(request):
             'error': str(e),
             'clientes': []
         }, status=500)
+
+    def generar():
+        cache_timestamp = timezone.now().timestamp()
+        version = desde or 0
+        total = 0
+        eliminados = []
+        yield '{"success": true, "clientes": ['
+        if primera is not None:
+            for fila in itertools.chain([primera], filas):
+                cliente, cliente_id, version_fila = fila_cache_cliente(fila)
+                version = max(version, version_fila)
+                if cliente is None:
+                    eliminados.append(cliente_id)
+                    continue
+                cliente['cache_timestamp'] = cache_timestamp
+                yield (', ' if total else '') + json.dumps(cliente)
+                total += 1
+        yield '], "eliminados": ' + json.dumps(eliminados)
+        yield ', "metadata": ' + json.dumps({
+            'total_clientes': total,
+            'version': version,
+            'completo': desde is None,
+            'generated_at': timezone.now().isoformat()
+        }) + '}'
+
+    return StreamingHttpResponse(generar(), content_type='application/json')
@@ -0,0 +1,61 @@
+"""
+Cálculo de reportes contables para la cola de trabajos de reportes
+
+Los saldos de todas las cuentas se obtienen con una consulta agrupada de
+movimientos (en lugar de dos agregados por cuenta) y el resultado queda en
+caché por fecha de corte; ver reportes.utils_trabajos.
+"""
+from decimal import Decimal
+
+from django.db.models import Sum
+
+from reportes.utils_trabajos import registrar_tarea
+from .models import CuentaContable, MovimientoContable
+
+
+TIPOS_REPORTE = ['activo', 'pasivo', 'patrimonio', 'ingreso', 'gasto']
+
+
+def saldos_cuentas(fecha_corte):
+    """{cuenta_id: (debe, haber)} de los movimientos hasta la fecha de corte"""
+    movimientos = (
+        MovimientoContable.objects.filter(asiento__fecha__lte=fecha_corte)
+        .values('cuenta_id')
+        .annotate(debe=Sum('debe'), haber=Sum('haber'))
+        .order_by()
+    )
+    return {
+        fila['cuenta_id']: (fila['debe'] or Decimal('0'), fila['haber'] or Decimal('0'))
+        for fila in movimientos
+    }
+
+
+@registrar_tarea('contabilidad.reportes_contables', ttl=300)
+def calcular_reportes_contables(parametros):
+    """Balance general y estado de resultados a una fecha de corte (resultado serializable)"""
+    saldos = saldos_cuentas(parametros['fecha_corte'])
+
+    resultado = {tipo: [] for tipo in TIPOS_REPORTE}
+    totales = {tipo: Decimal('0') for tipo in TIPOS_REPORTE}
+
+    cuentas = CuentaContable.objects.filter(
+        tipo_cuenta__tipo__in=TIPOS_REPORTE, activo=True
+    ).select_related('tipo_cuenta').order_by('codigo')
+    for cuenta in cuentas:
+        tipo = cuenta.tipo_cuenta.tipo
+        debe, haber = saldos.get(cuenta.id, (Decimal('0'), Decimal('0')))
+        if tipo in ['activo', 'gasto']:
+            saldo = cuenta.saldo_inicial + debe - haber
+        else:  # pasivo, patrimonio, ingreso
+            saldo = cuenta.saldo_inicial + haber - debe
+        totales[tipo] += saldo
+        resultado[tipo].append({
+            'id': cuenta.id,
+            'codigo': cuenta.codigo,
+            'nombre': cuenta.nombre,
+            'saldo_actual': float(saldo),
+        })
+
+    resultado['totales'] = {tipo: float(total) for tipo, total in totales.items()}
+    resultado['utilidad_neta'] = float(totales['ingreso'] - totales['gasto'])
+    return resultado
@@ -11,7 +11,7 @@ from decimal import Decimal
 import json
 
 from .models import (
-    CuentaContable, AsientoContable, MovimientoContable,
+    AsientoContable, MovimientoContable,
     CuentaPorCobrar, PagoCuentaPorCobrar,
     CuentaPorPagar, PagoCuentaPorPagar,
     CuentaBancaria, MovimientoBancario,
@@ -333,58 +333,38 @@ def control_gastos(request):
 @login_required
 def reportes_contables(request):
     """Reportes contables principales"""
+    from reportes.utils_trabajos import resultado_o_encolar, respuesta_en_proceso
+    
     fecha_corte = request.GET.get('fecha_corte', date.today().strftime('%Y-%m-%d'))
     fecha_corte = datetime.strptime(fecha_corte, '%Y-%m-%d').date()
     
-    # Balance General
-    activos = CuentaContable.objects.filter(
-        tipo_cuenta__tipo='activo',
-        activo=True
-    ).order_by('codigo')
-    
-    pasivos = CuentaContable.objects.filter(
-        tipo_cuenta__tipo='pasivo',
-        activo=True
-    ).order_by('codigo')
-    
-    patrimonio = CuentaContable.objects.filter(
-        tipo_cuenta__tipo='patrimonio',
-        activo=True
-    ).order_by('codigo')
-    
-    # Estado de Resultados
-    ingresos = CuentaContable.objects.filter(
-        tipo_cuenta__tipo='ingreso',
-        activo=True
-    ).order_by('codigo')
-    
-    gastos = CuentaContable.objects.filter(
-        tipo_cuenta__tipo='gasto',
-        activo=True
-    ).order_by('codigo')
-    
-    # Calcular totales
-    total_activos = sum(cuenta.saldo_actual for cuenta in activos)
-    total_pasivos = sum(cuenta.saldo_actual for cuenta in pasivos)
-    total_patrimonio = sum(cuenta.saldo_actual for cuenta in patrimonio)
-    total_ingresos = sum(cuenta.saldo_actual for cuenta in ingresos)
-    total_gastos = sum(cuenta.saldo_actual for cuenta in gastos)
+    # Balance General y Estado de Resultados se calculan en la cola de
+    # reportes; las consultas con la misma fecha de corte usan el resultado en caché
+    trabajo, listo = resultado_o_encolar(
+        'contabilidad.reportes_contables', {'fecha_corte': fecha_corte.isoformat()}, request.user
+    )
+    if not listo:
+        if trabajo.estado != 'error':
+            return respuesta_en_proceso(request, trabajo, 'Reportes contables')
+        messages.error(request, f'Error al generar los reportes: {trabajo.error}')
+        return redirect('contabilidad:dashboard')
     
-    utilidad_neta = total_ingresos - total_gastos
+    resultado = trabajo.resultado
+    totales = resultado['totales']
     
     context = {
         'fecha_corte': fecha_corte,
-        'activos': activos,
-        'pasivos': pasivos,
-        'patrimonio': patrimonio,
-        'ingresos': ingresos,
-        'gastos': gastos,
-        'total_activos': total_activos,
-        'total_pasivos': total_pasivos,
-        'total_patrimonio': total_patrimonio,
-        'total_ingresos': total_ingresos,
-        'total_gastos': total_gastos,
-        'utilidad_neta': utilidad_neta,
+        'activos': resultado['activo'],
+        'pasivos': resultado['pasivo'],
+        'patrimonio': resultado['patrimonio'],
+        'ingresos': resultado['ingreso'],
+        'gastos': resultado['gasto'],
+        'total_activos': totales['activo'],
+        'total_pasivos': totales['pasivo'],
+        'total_patrimonio': totales['patrimonio'],
+        'total_ingresos': totales['ingreso'],
+        'total_gastos': totales['gasto'],
+        'utilidad_neta': resultado['utilidad_neta'],
     }
     
     return render(request, 'contabilidad/reportes_contables.html', context)
@@ -0,0 +1,30 @@
+-- ==================================================================
+-- SCRIPT: Índice de alertas de stock
+-- Descripción: Tabla con los productos en alerta de stock (global y
+--              por ubicación). Se mantiene de forma incremental desde
+--              la aplicación cada vez que cambia el stock, para que las
+--              pantallas de stock bajo y los badges no recorran toda la
+--              tabla productos.
+-- Después de crearla ejecutar: python manage.py reconstruir_alertas_stock
+-- ==================================================================
+
+CREATE TABLE IF NOT EXISTS inventario_alertastock (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    producto_id INT NOT NULL,
+    ubicacion_id INT NULL COMMENT 'NULL = alerta sobre el stock global del producto',
+    nivel VARCHAR(10) NOT NULL COMMENT 'agotado, bajo, reorden',
+    cantidad DECIMAL(12,2) NOT NULL DEFAULT 0.00,
+    stock_minimo DECIMAL(12,2) NOT NULL DEFAULT 0.00,
+    punto_reorden DECIMAL(12,2) NOT NULL DEFAULT 0.00,
+    fecha_actualizacion DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+
+    -- Índices
+    INDEX idx_alerta_ubicacion_nivel (ubicacion_id, nivel),
+    INDEX idx_alerta_producto_ubicacion (producto_id, ubicacion_id),
+    INDEX idx_alerta_fecha (fecha_actualizacion),
+
+    -- Claves foráneas
+    FOREIGN KEY (producto_id) REFERENCES productos(id) ON DELETE CASCADE,
+    FOREIGN KEY (ubicacion_id) REFERENCES inventario_ubicacion(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+COMMENT='Índice de productos con stock bajo';
@@ -0,0 +1,50 @@
+-- ==================================================================
+-- SCRIPT: Cola de envíos al SRI
+-- Descripción: Facturas y consultas de clave de acceso pendientes de
+--              enviar al servicio local del SRI (127.0.0.1:5001). Las
+--              vistas sólo encolan; los envíos los hace, con concurrencia
+--              limitada y reintentos, el comando:
+--                  python manage.py procesar_envios_sri
+-- ==================================================================
+
+CREATE TABLE IF NOT EXISTS envios_sri (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    tipo VARCHAR(10) NOT NULL COMMENT 'factura, consulta',
+    factura_id INT NULL COMMENT 'facturas_venta.id (tipo factura)',
+    clave_acceso VARCHAR(49) NOT NULL DEFAULT '' COMMENT 'Clave consultada (tipo consulta)',
+    estado VARCHAR(10) NOT NULL DEFAULT 'pendiente' COMMENT 'pendiente, procesando, completado, fallido',
+    intentos INT NOT NULL DEFAULT 0,
+    proximo_intento DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) COMMENT 'No se envía antes de esta fecha',
+    respuesta JSON NULL,
+    error LONGTEXT NOT NULL,
+    usuario_id INT NULL,
+    fecha_creacion DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+    fecha_inicio DATETIME(6) NULL,
+    fecha_fin DATETIME(6) NULL,
+    en_curso VARCHAR(60) NULL COMMENT 'factura:<id> o consulta:<clave> mientras está pendiente/procesando',
+
+    -- Índices
+    UNIQUE INDEX uq_envio_sri_en_curso (en_curso),
+    INDEX idx_envio_sri_estado (estado, proximo_intento),
+    INDEX idx_envio_sri_factura (factura_id, estado),
+    INDEX idx_envio_sri_clave (clave_acceso, estado),
+
+    -- Claves foráneas
+    FOREIGN KEY (usuario_id) REFERENCES auth_user(id) ON DELETE SET NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+COMMENT='Cola de envíos al servicio del SRI';
+
+-- Tablas creadas con una versión anterior de este script
+ALTER TABLE envios_sri ADD COLUMN IF NOT EXISTS en_curso VARCHAR(60) NULL
+    COMMENT 'factura:<id> o consulta:<clave> mientras está pendiente/procesando';
+UPDATE envios_sri
+SET en_curso = IF(tipo = 'factura', CONCAT('factura:', factura_id), CONCAT('consulta:', clave_acceso))
+WHERE estado IN ('pendiente', 'procesando') AND en_curso IS NULL
+AND id IN (
+    SELECT id FROM (
+        SELECT MAX(id) AS id FROM envios_sri
+        WHERE estado IN ('pendiente', 'procesando')
+        GROUP BY tipo, factura_id, clave_acceso
+    ) AS ultimos
+);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_envio_sri_en_curso ON envios_sri (en_curso);
@@ -0,0 +1,30 @@
+-- ==================================================================
+-- SCRIPT: Grupos de productos duplicados
+-- Descripción: Resultado del análisis de duplicados de todo el catálogo.
+--              Lo llena (cada noche) el comando:
+--                  python manage.py agrupar_productos_duplicados
+--              y se revisa por páginas en Productos > Duplicados.
+--              Los grupos revisados o descartados se conservan entre
+--              ejecuciones; los pendientes se reemplazan.
+-- ==================================================================
+
+CREATE TABLE IF NOT EXISTS grupos_duplicados_productos (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    clave VARCHAR(40) NOT NULL COMMENT 'SHA-1 de los IDs de productos del grupo',
+    producto_ids JSON NOT NULL,
+    pares JSON NOT NULL COMMENT '[[id1, id2, similitud], ...]',
+    tamano INT NOT NULL DEFAULT 0,
+    similitud_maxima DECIMAL(5,4) NOT NULL DEFAULT 0,
+    estado VARCHAR(10) NOT NULL DEFAULT 'pendiente' COMMENT 'pendiente, revisado, descartado',
+    fecha_generacion DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+    revisado_por_id INT NULL,
+    fecha_revision DATETIME(6) NULL,
+
+    -- Índices
+    INDEX idx_grupo_dup_estado (estado, tamano),
+    INDEX idx_grupo_dup_clave (clave),
+
+    -- Claves foráneas
+    FOREIGN KEY (revisado_por_id) REFERENCES auth_user(id) ON DELETE SET NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+COMMENT='Grupos de productos probablemente duplicados para revisión';
@@ -0,0 +1,41 @@
+-- ==================================================================
+-- SCRIPT: Reporte de caducidad por lotes
+-- Descripción: Índice por fecha de caducidad y ubicación sobre los
+--              lotes, y tabla con los totales precalculados por rango
+--              de vencimiento (vencido, 30, 60 y 90 días) para que el
+--              dashboard de caducados no agrupe todos los lotes en cada
+--              consulta.
+-- Después de crearla ejecutar: python manage.py actualizar_resumen_caducidad
+-- Programar el mismo comando una vez al día (cron) para que los rangos
+-- avancen con la fecha.
+-- ==================================================================
+
+-- Índice para consultas por rango de fechas de caducidad
+CREATE INDEX idx_lote_caducidad_ubicacion
+    ON inventario_loteproducto (fecha_caducidad, ubicacion_id);
+
+CREATE TABLE IF NOT EXISTS inventario_resumencaducidad (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    ubicacion_id INT NOT NULL,
+    rango VARCHAR(10) NOT NULL COMMENT 'vencido, 30, 60, 90',
+    lotes INT NOT NULL DEFAULT 0,
+    productos INT NOT NULL DEFAULT 0,
+    unidades DECIMAL(14,2) NOT NULL DEFAULT 0.00,
+    valor_costo DECIMAL(14,2) NOT NULL DEFAULT 0.00,
+    valor_venta DECIMAL(14,2) NOT NULL DEFAULT 0.00,
+    fecha_calculo DATE NOT NULL COMMENT 'Día de referencia usado para los rangos',
+    fecha_actualizacion DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+    pendiente TINYINT(1) NOT NULL DEFAULT 0 COMMENT 'Los lotes cambiaron desde el cálculo',
+
+    -- Índices
+    UNIQUE KEY uk_resumen_ubicacion_rango (ubicacion_id, rango),
+
+    -- Claves foráneas
+    FOREIGN KEY (ubicacion_id) REFERENCES inventario_ubicacion(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+COMMENT='Totales de lotes por rango de vencimiento y ubicación';
+
+-- Tablas creadas antes de la marca de pendiente (se compartía en la caché
+-- de cada proceso)
+ALTER TABLE inventario_resumencaducidad
+    ADD COLUMN IF NOT EXISTS pendiente TINYINT(1) NOT NULL DEFAULT 0 COMMENT 'Los lotes cambiaron desde el cálculo';
@@ -0,0 +1,34 @@
+-- ==================================================================
+-- SCRIPT: Cola de trabajos de reportes
+-- Descripción: Tabla con los reportes pesados encolados por las vistas
+--              (reporte consolidado, reportes contables, exportaciones
+--              grandes). Los procesa fuera de gunicorn el comando:
+--                  python manage.py procesar_trabajos_reportes
+--              El resultado de cada trabajo completado sirve como caché
+--              para las peticiones idénticas hasta fecha_expiracion.
+-- ==================================================================
+
+CREATE TABLE IF NOT EXISTS reportes_trabajoreporte (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    tipo VARCHAR(50) NOT NULL,
+    parametros JSON NOT NULL,
+    clave VARCHAR(64) NOT NULL COMMENT 'SHA-256 de tipo + parámetros',
+    estado VARCHAR(10) NOT NULL DEFAULT 'pendiente' COMMENT 'pendiente, procesando, completado, error',
+    resultado JSON NULL,
+    archivo VARCHAR(255) NOT NULL DEFAULT '' COMMENT 'Ruta del archivo generado (exportaciones)',
+    error LONGTEXT NOT NULL,
+    intentos INT NOT NULL DEFAULT 0,
+    usuario_id INT NULL,
+    fecha_creacion DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+    fecha_inicio DATETIME(6) NULL,
+    fecha_fin DATETIME(6) NULL,
+    fecha_expiracion DATETIME(6) NULL COMMENT 'Hasta cuándo el resultado sirve como caché',
+
+    -- Índices
+    INDEX idx_trabajo_estado (estado, id),
+    INDEX idx_trabajo_clave_estado (clave, estado),
+
+    -- Claves foráneas
+    FOREIGN KEY (usuario_id) REFERENCES auth_user(id) ON DELETE SET NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+COMMENT='Cola de trabajos de reportes';
@@ -0,0 +1,44 @@
+-- ==================================================================
+-- SCRIPT: Proyección de búsqueda de ventas
+-- Descripción: Una fila por documento de facturas_venta (FACTURA) y de
+--              ventas_venta (VENTA) con el cliente y el vendedor ya
+--              resueltos, y sus palabras buscables (número, cliente,
+--              cédula/RUC, vendedor). La lista de ventas y su búsqueda
+--              son una consulta indexada en lugar de un UNION de las dos
+--              tablas. Después de crearlas cargar los datos con:
+--                  python manage.py sincronizar_busqueda_ventas --completo
+-- ==================================================================
+
+CREATE TABLE IF NOT EXISTS ventas_busqueda (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    tipo_documento VARCHAR(10) NOT NULL COMMENT 'FACTURA (facturas_venta), VENTA (ventas_venta)',
+    documento_id INT NOT NULL COMMENT 'facturas_venta.id o ventas_venta.id',
+    numero VARCHAR(50) NOT NULL,
+    cliente_id INT NULL,
+    cliente VARCHAR(300) NOT NULL DEFAULT '',
+    cliente_documento VARCHAR(20) NOT NULL DEFAULT '' COMMENT 'Cédula/RUC',
+    vendedor_id INT NULL,
+    vendedor VARCHAR(300) NOT NULL DEFAULT '',
+    total DECIMAL(12,4) NOT NULL DEFAULT 0,
+    estado VARCHAR(20) NOT NULL,
+    metodo_pago VARCHAR(20) NOT NULL,
+    fecha DATETIME(6) NOT NULL,
+
+    -- Índices
+    UNIQUE KEY uq_venta_busqueda_documento (tipo_documento, documento_id),
+    INDEX idx_venta_busqueda_fecha (fecha),
+    INDEX idx_venta_busqueda_cliente (cliente_id),
+    INDEX idx_venta_busqueda_vendedor (vendedor_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS ventas_busqueda_palabras (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    venta_id BIGINT NOT NULL,
+    palabra VARCHAR(50) NOT NULL COMMENT 'Minúsculas, sin tildes ni signos',
+
+    -- Índices
+    INDEX idx_venta_busqueda_palabra (palabra, venta_id),
+
+    -- Claves foráneas
+    CONSTRAINT fk_venta_busqueda_palabra FOREIGN KEY (venta_id) REFERENCES ventas_busqueda (id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
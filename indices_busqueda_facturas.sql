@@ -0,0 +1,27 @@
+-- ==================================================================
+-- SCRIPT: Búsqueda indexada de facturas de venta por número
+-- Descripción: Claves de búsqueda calculadas por la base a partir de
+--              numeroFactura, así que se mantienen en cada INSERT/UPDATE
+--              sin importar quién escriba la factura (web o escritorio):
+--                numeroBusqueda         número sin guiones
+--                numeroBusquedaInverso  el mismo invertido (búsqueda por
+--                                       sufijo/secuencial como rango)
+--              Las usa ventas.utils_busqueda en lugar de LIKE '%...%'.
+-- ==================================================================
+
+ALTER TABLE facturas_venta
+ADD COLUMN IF NOT EXISTS numeroBusqueda VARCHAR(50)
+    AS (REPLACE(numeroFactura, '-', '')) STORED COMMENT 'numeroFactura sin guiones';
+
+ALTER TABLE facturas_venta
+ADD COLUMN IF NOT EXISTS numeroBusquedaInverso VARCHAR(50)
+    AS (REVERSE(REPLACE(numeroFactura, '-', ''))) STORED COMMENT 'numeroBusqueda invertido';
+
+CREATE INDEX IF NOT EXISTS idx_facturas_venta_busqueda ON facturas_venta (numeroBusqueda);
+CREATE INDEX IF NOT EXISTS idx_facturas_venta_inverso ON facturas_venta (numeroBusquedaInverso);
+CREATE INDEX IF NOT EXISTS idx_facturas_venta_autoriz ON facturas_venta (numeroAutorizacion);
+CREATE INDEX IF NOT EXISTS idx_facturas_venta_fecha ON facturas_venta (fechaEmision);
+
+-- Verificar (debe usar idx_facturas_venta_inverso, type = range):
+-- EXPLAIN SELECT id FROM facturas_venta
+--  WHERE numeroBusquedaInverso >= '321000000' AND numeroBusquedaInverso < '321000001';
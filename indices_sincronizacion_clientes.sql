@@ -0,0 +1,9 @@
+-- ==================================================================
+-- SCRIPT: Índices para la sincronización incremental de clientes
+-- Descripción: /clientes/api/cache/?desde=<version> filtra los clientes
+--              creados o editados desde la última sincronización del
+--              caché offline (creadoDate / editadoDate)
+-- ==================================================================
+
+CREATE INDEX IF NOT EXISTS idx_clientes_creado_date ON clientes (creadoDate);
+CREATE INDEX IF NOT EXISTS idx_clientes_editado_date ON clientes (editadoDate);
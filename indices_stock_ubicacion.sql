@@ -0,0 +1,11 @@
+-- ==================================================================
+-- SCRIPT: Índice de versión del stock por ubicación
+-- Descripción: la caché en memoria del stock por sucursal
+--              (inventario.utils_stock.cache_stock) lee cada pocos
+--              segundos MAX(editadoDate) de cada ubicación para saber si
+--              otro proceso cambió su stock. CACHES usa LocMemCache, que
+--              no se comparte entre procesos.
+-- ==================================================================
+
+CREATE INDEX IF NOT EXISTS idx_stockubicacion_editado
+    ON inventario_stockubicacion (ubicacion_id, editadoDate);
@@ -2,12 +2,15 @@
 """
 API endpoints para consultar stock por ubicación
 """
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponseNotModified
 from django.views.decorators.http import require_http_methods
 from django.contrib.auth.decorators import login_required
 from inventario.models import StockUbicacion, Ubicacion
+from inventario.utils_alertas import resumen_alertas
+from inventario.utils_stock import cache_stock, obtener_resumen_stocks
 from productos.models import Producto
 import json
+from decimal import Decimal
 
 
 @login_required
@@ -186,35 +189,23 @@ def api_resumen_stocks(request):
     }
     """
     try:
-        ubicaciones = Ubicacion.objects.filter(activo=True)
+        ubicaciones = list(Ubicacion.objects.filter(activo=True))
+        
+        # Un solo GROUP BY para todas las ubicaciones (cacheado por ubicación)
+        resumen = obtener_resumen_stocks([ubicacion.id for ubicacion in ubicaciones])
         
         resumen_data = []
         for ubicacion in ubicaciones:
-            stocks = StockUbicacion.objects.filter(
-                ubicacion=ubicacion
-            ).select_related('producto')
-            
-            total_productos = stocks.count()
-            productos_con_stock = stocks.filter(cantidad__gt=0).count()
-            productos_stock_bajo = stocks.filter(
-                cantidad__lte=models.F('stock_minimo'),
-                stock_minimo__gt=0
-            ).count()
-            
-            # Calcular valor del inventario
-            valor_inventario = 0
-            for stock in stocks:
-                valor_inventario += float(stock.cantidad) * float(stock.producto.precio_venta)
-            
+            datos = resumen[ubicacion.id]
             resumen_data.append({
                 'id': ubicacion.id,
                 'codigo': ubicacion.codigo,
                 'nombre': ubicacion.nombre,
                 'tipo': ubicacion.get_tipo_display(),
-                'total_productos': total_productos,
-                'productos_con_stock': productos_con_stock,
-                'productos_stock_bajo': productos_stock_bajo,
-                'valor_inventario': round(valor_inventario, 2)
+                'total_productos': datos['total_productos'],
+                'productos_con_stock': datos['productos_con_stock'],
+                'productos_stock_bajo': datos['productos_stock_bajo'],
+                'valor_inventario': float(datos['valor_inventario'])
             })
         
         return JsonResponse({
@@ -227,3 +218,147 @@ def api_resumen_stocks(request):
             'success': False,
             'error': str(e)
         }, status=500)
+
+
+MAX_PRODUCTOS_LOTE = 1000
+
+
+def _lista_ids(valor):
+    """Convierte "1,2,3" o [1, 2, 3] en una lista de enteros"""
+    if not valor:
+        return []
+    if isinstance(valor, str):
+        valor = valor.split(',')
+    return [int(v) for v in valor if str(v).strip()]
+
+
+@login_required
+@require_http_methods(["GET", "POST"])
+def api_stock_lote(request):
+    """
+    Obtiene el stock de varios productos en varias ubicaciones en una sola llamada
+    
+    GET  /inventario/api/stock-lote/?productos=1,2,3&ubicaciones=1,2
+    POST /inventario/api/stock-lote/  {"productos": [1, 2, 3], "ubicaciones": [1, 2]}
+    
+    Si no se indican ubicaciones se usan todas las activas.
+    
+    Response:
+    {
+        "success": true,
+        "ubicaciones": [{"id": 1, "codigo": "PRINC", "nombre": "Sucursal Principal"}, ...],
+        "productos": [
+            {
+                "producto_id": 10,
+                "total": 150.00,
+                "stocks": {"1": {"cantidad": 100.00, "stock_minimo": 10.00, "stock_bajo": false}, ...}
+            },
+            ...
+        ]
+    }
+    """
+    try:
+        if request.method == 'POST':
+            data = json.loads(request.body or '{}')
+        else:
+            data = request.GET
+        
+        producto_ids = list(dict.fromkeys(_lista_ids(data.get('productos'))))
+        ubicacion_ids = _lista_ids(data.get('ubicaciones'))
+        
+        if not producto_ids:
+            return JsonResponse({
+                'success': False,
+                'error': 'Se requiere al menos un producto'
+            }, status=400)
+        
+        if len(producto_ids) > MAX_PRODUCTOS_LOTE:
+            return JsonResponse({
+                'success': False,
+                'error': f'Máximo {MAX_PRODUCTOS_LOTE} productos por consulta'
+            }, status=400)
+        
+        ubicaciones = Ubicacion.objects.filter(activo=True)
+        if ubicacion_ids:
+            ubicaciones = ubicaciones.filter(id__in=ubicacion_ids)
+        ubicaciones = list(ubicaciones.values('id', 'codigo', 'nombre'))
+        ids_ubicaciones = [ubicacion['id'] for ubicacion in ubicaciones]
+        
+        # Una sola consulta para todo lo que no esté ya en memoria
+        matriz = cache_stock.obtener(producto_ids, ids_ubicaciones)
+        
+        productos_data = []
+        for producto_id in producto_ids:
+            stocks = {}
+            total = Decimal('0')
+            for ubicacion_id in ids_ubicaciones:
+                cantidad, stock_minimo, _ = matriz[(producto_id, ubicacion_id)]
+                total += cantidad
+                stocks[str(ubicacion_id)] = {
+                    'cantidad': float(cantidad),
+                    'stock_minimo': float(stock_minimo),
+                    'stock_bajo': cantidad <= stock_minimo,
+                }
+            productos_data.append({
+                'producto_id': producto_id,
+                'total': float(total),
+                'stocks': stocks,
+            })
+        
+        return JsonResponse({
+            'success': True,
+            'ubicaciones': ubicaciones,
+            'productos': productos_data
+        })
+        
+    except (ValueError, json.JSONDecodeError):
+        return JsonResponse({
+            'success': False,
+            'error': 'Lista de IDs inválida'
+        }, status=400)
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=500)
+
+
+@login_required
+@require_http_methods(["GET"])
+def api_alertas_stock(request):
+    """
+    Resumen de alertas de stock para los badges de la interfaz
+    
+    GET /inventario/api/alertas-stock/?version=<version>
+    
+    El cliente consulta periódicamente enviando la última versión recibida
+    (o el encabezado If-None-Match). Si el índice de alertas no cambió se
+    responde 304 sin cuerpo; sólo se envían datos cuando hay cambios.
+    
+    Response:
+    {
+        "success": true,
+        "version": "42-1731600000000",
+        "total": 15,
+        "por_ubicacion": {"global": {"total": 15, "bajo": 10, "agotado": 5}, "3": {...}}
+    }
+    """
+    try:
+        resumen = resumen_alertas()
+        etag = f'"alertas-{resumen["version"]}"'
+        
+        version_cliente = request.GET.get('version')
+        if version_cliente == resumen['version'] or request.headers.get('If-None-Match') == etag:
+            response = HttpResponseNotModified()
+        else:
+            response = JsonResponse({'success': True, **resumen})
+        
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+        
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=500)
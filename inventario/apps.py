@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class InventarioConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'inventario'
+
+    def ready(self):
+        # Conectar los receptores que mantienen el índice de alertas de stock,
+        # la caché del resumen de stocks, la caché de lotes FEFO y el
+        # resumen de caducidad
+        from . import utils_alertas, utils_caducidad, utils_lotes, utils_stock  # noqa: F401
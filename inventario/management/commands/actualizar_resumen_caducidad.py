@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+Comando para recalcular los totales de caducidad por ubicación (ResumenCaducidad)
+Uso: python manage.py actualizar_resumen_caducidad [--ubicacion ID]
+
+Programarlo una vez al día (después de medianoche): los rangos vencido,
+30, 60 y 90 días dependen de la fecha actual. Durante el día las
+ubicaciones cuyos lotes cambian se recalculan de forma incremental.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from inventario.utils_caducidad import calcular_resumen_caducidad
+
+
+class Command(BaseCommand):
+    help = 'Recalcula los totales de lotes por rango de vencimiento y ubicación'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ubicacion', type=int, action='append',
+                            help='ID de ubicación a recalcular (se puede repetir; default: todas)')
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+        total = calcular_resumen_caducidad(options['ubicacion'])
+        duracion = time.monotonic() - inicio
+
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ Resumen de caducidad actualizado: {total} filas en {duracion:.2f}s'
+        ))
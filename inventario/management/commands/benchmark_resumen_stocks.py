@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark del resumen de stocks por ubicación (api_resumen_stocks)
+Uso: python manage.py benchmark_resumen_stocks [--ubicaciones 20] [--productos 20000]
+
+Crea datos sintéticos dentro de una transacción, mide la implementación
+anterior (consultas por ubicación + suma en Python) contra el GROUP BY
+único, y revierte todo al terminar: no deja datos en la base.
+"""
+import time
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from inventario.models import StockUbicacion, Ubicacion
+from inventario.utils_stock import calcular_resumen_stocks
+from productos.models import Producto
+
+User = get_user_model()
+
+
+class _Revertir(Exception):
+    """Se lanza para deshacer los datos sintéticos al final del benchmark"""
+
+
+def resumen_legado(ubicaciones):
+    """Implementación anterior: N×M consultas y suma en floats"""
+    resumen = {}
+    for ubicacion in ubicaciones:
+        stocks = StockUbicacion.objects.filter(ubicacion=ubicacion).select_related('producto')
+        total_productos = stocks.count()
+        productos_con_stock = stocks.filter(cantidad__gt=0).count()
+        valor_inventario = 0
+        for stock in stocks:
+            valor_inventario += float(stock.cantidad) * float(stock.producto.precio_venta)
+        resumen[ubicacion.id] = (total_productos, productos_con_stock, round(valor_inventario, 2))
+    return resumen
+
+
+class Command(BaseCommand):
+    help = 'Mide el resumen de stocks por ubicación con datos sintéticos (no guarda cambios)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ubicaciones', type=int, default=20, help='Número de ubicaciones (default: 20)')
+        parser.add_argument('--productos', type=int, default=20000, help='Número de productos (default: 20000)')
+        parser.add_argument('--sin-legado', action='store_true',
+                            help='No medir la implementación anterior (es lenta con muchos datos)')
+
+    def handle(self, *args, **options):
+        n_ubicaciones = options['ubicaciones']
+        n_productos = options['productos']
+
+        self.stdout.write(self.style.WARNING('=' * 70))
+        self.stdout.write(self.style.WARNING(
+            f'BENCHMARK RESUMEN DE STOCKS: {n_ubicaciones} ubicaciones × {n_productos} productos'
+        ))
+        self.stdout.write(self.style.WARNING('=' * 70))
+
+        try:
+            with transaction.atomic():
+                ubicaciones = self._crear_datos(n_ubicaciones, n_productos)
+
+                if not options['sin_legado']:
+                    self._medir('Implementación anterior', lambda: resumen_legado(ubicaciones))
+
+                ids = [ubicacion.id for ubicacion in ubicaciones]
+                resumen = self._medir('GROUP BY único', lambda: calcular_resumen_stocks(ids))
+
+                total = sum((datos['valor_inventario'] for datos in resumen.values()), Decimal('0'))
+                self.stdout.write(f'  Valor total de inventario: {total}')
+
+                raise _Revertir()
+        except _Revertir:
+            self.stdout.write(self.style.SUCCESS('\n✓ Datos sintéticos revertidos'))
+
+    def _crear_datos(self, n_ubicaciones, n_productos):
+        inicio = time.monotonic()
+        usuario = User.objects.order_by('id').first()
+
+        ubicaciones = [
+            Ubicacion.objects.create(
+                codigo=f'BENCH{i:03d}', nombre=f'Benchmark {i}', tipo='sucursal', creadoPor=usuario
+            )
+            for i in range(n_ubicaciones)
+        ]
+
+        Producto.objects.bulk_create([
+            Producto(
+                nombre=f'Producto benchmark {i}',
+                codigo_principal=f'BENCH-{i:07d}',
+                precio_venta=Decimal('1.25') + Decimal(i % 100) / 10,
+                stock_minimo=Decimal('5'),
+            )
+            for i in range(n_productos)
+        ], batch_size=2000)
+        producto_ids = list(
+            Producto.objects.filter(codigo_principal__startswith='BENCH-').values_list('id', flat=True)
+        )
+
+        for ubicacion in ubicaciones:
+            StockUbicacion.objects.bulk_create([
+                StockUbicacion(
+                    producto_id=producto_id,
+                    ubicacion=ubicacion,
+                    cantidad=Decimal(producto_id % 50),
+                    stock_minimo=Decimal('5'),
+                )
+                for producto_id in producto_ids
+            ], batch_size=2000)
+
+        self.stdout.write(f'  Datos creados en {time.monotonic() - inicio:.1f}s')
+        return ubicaciones
+
+    def _medir(self, nombre, funcion):
+        with CaptureQueriesContext(connection) as consultas:
+            inicio = time.monotonic()
+            resultado = funcion()
+            duracion = time.monotonic() - inicio
+        self.stdout.write(f'  {nombre}: {duracion:.3f}s, {len(consultas)} consultas')
+        return resultado
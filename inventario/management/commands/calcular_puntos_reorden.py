@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+Comando para pronosticar la demanda y recalcular los puntos de reorden
+Uso: python manage.py calcular_puntos_reorden [--dias 90] [--metodo exponencial|promedio] [--sin-guardar]
+
+Programarlo cada noche, antes de generar las órdenes de compra automáticas.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from inventario.utils_pronostico import DIAS_HISTORIAL, METODOS, calcular_puntos_reorden, guardar_puntos_reorden
+
+
+class Command(BaseCommand):
+    help = 'Pronostica la demanda por producto y ubicación y actualiza stock mínimo y puntos de reorden'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=DIAS_HISTORIAL,
+                            help=f'Días de historial de ventas a usar (default: {DIAS_HISTORIAL})')
+        parser.add_argument('--metodo', choices=METODOS, default='exponencial',
+                            help='Método de pronóstico (default: exponencial)')
+        parser.add_argument('--sin-guardar', action='store_true',
+                            help='Solo calcular, sin actualizar StockUbicacion ni ConfiguracionStock')
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+        niveles = calcular_puntos_reorden(dias=options['dias'], metodo=options['metodo'])
+        self.stdout.write(
+            f'📈 Demanda pronosticada para {len(niveles)} combinaciones producto/ubicación '
+            f'({options["metodo"]}, {options["dias"]} días) en {time.monotonic() - inicio:.2f}s'
+        )
+
+        if options['sin_guardar']:
+            self.stdout.write('ℹ Niveles no guardados (--sin-guardar)')
+            return
+
+        stocks, configuraciones = guardar_puntos_reorden(niveles)
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ Puntos de reorden actualizados: {stocks} stocks por ubicación, '
+            f'{configuraciones} configuraciones en {time.monotonic() - inicio:.2f}s'
+        ))
@@ -1,16 +1,149 @@
 # -*- coding: utf-8 -*-
 """
 Comando para migrar stock global a stock por ubicación
-Uso: python manage.py migrar_stock_sucursales
+Uso: python manage.py migrar_stock_sucursales [--tamano-bloque 2000] [--hilos 4] [--reanudar] [--sobrescribir]
+
+Los productos activos se procesan en bloques de ids consecutivos. Cada bloque
+es una transacción con pocas consultas sin importar su tamaño:
+    1. Stock global de los productos del bloque.
+    2. Filas de StockUbicacion que ya existen en la ubicación principal.
+    3. bulk_create de las filas nuevas (ignore_conflicts: una fila creada
+       entretanto por una venta o un ajuste no se pisa).
+    4. Las filas que ya existían no se tocan: su cantidad es el stock real de
+       la sucursal. Con --sobrescribir se bloquean (SELECT ... FOR UPDATE) y
+       se reemplaza su cantidad por el stock global con bulk_update; una
+       venta o ajuste simultáneo espera al fin del bloque en lugar de perderse.
+    5. bulk_create del kardex inicial (SALDO INICIAL) de cada fila migrada.
+
+Los bloques terminados se guardan en un archivo de control; si la migración
+se interrumpe, --reanudar continúa con los bloques pendientes.
 """
-from django.core.management.base import BaseCommand
-from django.db import transaction
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
 from django.contrib.auth import get_user_model
-from inventario.models import Ubicacion, StockUbicacion
+from inventario.models import KardexMovimiento, Ubicacion, StockUbicacion
 from productos.models import Producto
 
 User = get_user_model()
 
+TAMANO_BLOQUE = 2000
+TAMANO_LOTE = 500
+ARCHIVO_CONTROL = 'migrar_stock_sucursales.checkpoint.json'
+
+
+def calcular_bloques(tamano_bloque):
+    """Rangos (desde_id, hasta_id) inclusivos con tamano_bloque productos activos cada uno"""
+    ids = list(
+        Producto.objects.filter(activo=True).order_by('id').values_list('id', flat=True).iterator(chunk_size=10000)
+    )
+    return [
+        (ids[i], ids[min(i + tamano_bloque, len(ids)) - 1])
+        for i in range(0, len(ids), tamano_bloque)
+    ]
+
+
+def migrar_bloque(desde, hasta, ubicacion_id, usuario, ubicaciones_adicionales=(), registrar_kardex=True,
+                  sobrescribir=False):
+    """
+    Migra el stock global de los productos activos con id en [desde, hasta].
+
+    Args:
+        sobrescribir: reemplazar también la cantidad de las filas que ya
+            existen (bloqueadas) por el stock global; si no, se omiten
+
+    Returns:
+        dict con productos, creados, actualizados, omitidos, conflictos y kardex
+    """
+    stocks = dict(
+        Producto.objects.filter(activo=True, id__gte=desde, id__lte=hasta).values_list('id', 'stock')
+    )
+    resultado = {'productos': len(stocks), 'creados': 0, 'actualizados': 0, 'omitidos': 0, 'conflictos': 0, 'kardex': 0}
+    if not stocks:
+        return resultado
+
+    with transaction.atomic():
+        filas = StockUbicacion.objects.filter(
+            ubicacion_id=ubicacion_id, producto_id__gte=desde, producto_id__lte=hasta
+        ).only('id', 'producto_id', 'cantidad')
+        if sobrescribir:
+            filas = filas.select_for_update().order_by('id')
+        existentes = {fila.producto_id: fila for fila in filas}
+
+        nuevos = [pid for pid in stocks if pid not in existentes]
+        StockUbicacion.objects.bulk_create(
+            [StockUbicacion(producto_id=pid, ubicacion_id=ubicacion_id, cantidad=stocks[pid], creadoPor=usuario)
+             for pid in nuevos],
+            batch_size=TAMANO_LOTE,
+            ignore_conflicts=True,
+        )
+        # Una fila que otro proceso creó entre la lectura y el insert conserva
+        # su cantidad: se cuenta como conflicto y no lleva kardex inicial
+        creados = set()
+        if nuevos:
+            creados = {
+                pid for pid, cantidad in StockUbicacion.objects.filter(
+                    ubicacion_id=ubicacion_id, producto_id__in=nuevos
+                ).values_list('producto_id', 'cantidad')
+                if cantidad == stocks[pid]
+            }
+
+        cambios = []
+        anteriores = {}
+        ahora = timezone.now()
+        for pid, fila in (existentes.items() if sobrescribir else ()):
+            if fila.cantidad != stocks[pid]:
+                anteriores[pid] = fila.cantidad
+                fila.cantidad = stocks[pid]
+                fila.editadoPor = usuario
+                fila.editadoDate = ahora
+                cambios.append(fila)
+        StockUbicacion.objects.bulk_update(cambios, ['cantidad', 'editadoPor', 'editadoDate'], batch_size=TAMANO_LOTE)
+
+        for adicional_id in ubicaciones_adicionales:
+            StockUbicacion.objects.bulk_create(
+                [StockUbicacion(producto_id=pid, ubicacion_id=adicional_id, creadoPor=usuario) for pid in stocks],
+                batch_size=TAMANO_LOTE,
+                ignore_conflicts=True,
+            )
+
+        kardex = []
+        if registrar_kardex:
+            for pid in sorted(creados):
+                kardex.append(_fila_kardex(pid, ubicacion_id, Decimal('0'), stocks[pid]))
+            for pid, anterior in anteriores.items():
+                kardex.append(_fila_kardex(pid, ubicacion_id, anterior, stocks[pid]))
+            kardex = [fila for fila in kardex if fila.ingreso or fila.egreso]
+            KardexMovimiento.objects.bulk_create(kardex, batch_size=TAMANO_LOTE)
+
+    resultado.update(
+        creados=len(creados),
+        actualizados=len(cambios),
+        omitidos=0 if sobrescribir else len(existentes),
+        conflictos=len(nuevos) - len(creados),
+        kardex=len(kardex),
+    )
+    return resultado
+
+
+def _fila_kardex(producto_id, ubicacion_id, anterior, saldo):
+    diferencia = Decimal(str(saldo)) - Decimal(str(anterior))
+    return KardexMovimiento(
+        idProducto=producto_id,
+        idUbicacion=ubicacion_id,
+        tipoMovimiento='SALDO INICIAL',
+        detalle='Migración de stock global a sucursales',
+        ingreso=diferencia if diferencia > 0 else Decimal('0.00'),
+        egreso=-diferencia if diferencia < 0 else Decimal('0.00'),
+        saldo=saldo,
+    )
+
 
 class Command(BaseCommand):
     help = 'Migra el stock global de productos a la ubicación principal'
@@ -32,127 +165,198 @@ class Command(BaseCommand):
             action='store_true',
             help='Simula la migración sin guardar cambios'
         )
+        parser.add_argument(
+            '--tamano-bloque',
+            type=int,
+            default=TAMANO_BLOQUE,
+            help=f'Productos por bloque/transacción (default: {TAMANO_BLOQUE})'
+        )
+        parser.add_argument(
+            '--hilos',
+            type=int,
+            default=1,
+            help='Bloques que se migran en paralelo, cada uno con su conexión (default: 1; SQLite sólo admite 1)'
+        )
+        parser.add_argument(
+            '--todas-las-ubicaciones',
+            action='store_true',
+            help='Crear también las filas (en cero) de las demás ubicaciones activas'
+        )
+        parser.add_argument(
+            '--sin-kardex',
+            action='store_true',
+            help='No registrar el movimiento SALDO INICIAL en el kardex'
+        )
+        parser.add_argument(
+            '--sobrescribir',
+            action='store_true',
+            help='Reemplazar con el stock global la cantidad de las filas que ya existen en la ubicación '
+                 '(por defecto se omiten)'
+        )
+        parser.add_argument(
+            '--reanudar',
+            action='store_true',
+            help='Continuar una migración interrumpida omitiendo los bloques ya terminados'
+        )
+        parser.add_argument(
+            '--archivo-control',
+            default=ARCHIVO_CONTROL,
+            help=f'Archivo con los bloques terminados (default: {ARCHIVO_CONTROL})'
+        )
 
     def handle(self, *args, **options):
         dry_run = options['dry_run']
         usuario_id = options['usuario']
-        
+        tamano_bloque = options['tamano_bloque']
+        if tamano_bloque <= 0 or options['hilos'] <= 0:
+            raise CommandError('--tamano-bloque y --hilos deben ser mayores a cero')
+
         self.stdout.write(self.style.WARNING('=' * 70))
         self.stdout.write(self.style.WARNING('MIGRACIÓN DE STOCK A SISTEMA DE SUCURSALES'))
         self.stdout.write(self.style.WARNING('=' * 70))
-        
+
         if dry_run:
             self.stdout.write(self.style.NOTICE('\n⚠️  Modo DRY-RUN activado - No se guardarán cambios\n'))
-        
+
+        # Obtener usuario
         try:
-            # Obtener usuario
-            try:
-                usuario = User.objects.get(id=usuario_id)
-                self.stdout.write(f'✓ Usuario: {usuario.username}')
-            except User.DoesNotExist:
-                self.stdout.write(self.style.ERROR(f'✗ Usuario con ID {usuario_id} no existe'))
-                return
-            
-            # Obtener o crear ubicación principal
-            if options['ubicacion']:
-                ubicacion = Ubicacion.objects.get(id=options['ubicacion'])
+            usuario = User.objects.get(id=usuario_id)
+            self.stdout.write(f'✓ Usuario: {usuario.username}')
+        except User.DoesNotExist:
+            self.stdout.write(self.style.ERROR(f'✗ Usuario con ID {usuario_id} no existe'))
+            return
+
+        # Obtener o crear ubicación principal
+        if options['ubicacion']:
+            ubicacion = Ubicacion.objects.get(id=options['ubicacion'])
+        else:
+            ubicacion, created = Ubicacion.objects.get_or_create(
+                es_principal=True,
+                defaults={
+                    'codigo': 'PRINC',
+                    'nombre': 'Sucursal Principal',
+                    'tipo': 'sucursal',
+                    'activo': True,
+                    'creadoPor': usuario
+                }
+            )
+            if created:
+                self.stdout.write(self.style.SUCCESS(f'✓ Ubicación principal creada: {ubicacion.nombre}'))
             else:
-                ubicacion, created = Ubicacion.objects.get_or_create(
-                    es_principal=True,
-                    defaults={
-                        'codigo': 'PRINC',
-                        'nombre': 'Sucursal Principal',
-                        'tipo': 'sucursal',
-                        'activo': True,
-                        'creadoPor': usuario
-                    }
+                self.stdout.write(f'✓ Ubicación principal: {ubicacion.nombre}')
+
+        adicionales = []
+        if options['todas_las_ubicaciones']:
+            adicionales = list(
+                Ubicacion.objects.filter(activo=True, anulado=False).exclude(id=ubicacion.id).values_list('id', flat=True)
+            )
+            self.stdout.write(f'✓ Ubicaciones adicionales (stock en cero): {len(adicionales)}')
+
+        bloques = calcular_bloques(tamano_bloque)
+        total_productos = Producto.objects.filter(activo=True).count()
+        self.stdout.write(f'\n📦 Total de productos activos: {total_productos} en {len(bloques)} bloques de {tamano_bloque}')
+
+        if dry_run:
+            self.stdout.write(self.style.NOTICE('\n🔍 Productos que se migrarían:'))
+            for producto in Producto.objects.filter(activo=True).order_by('id')[:10]:  # Mostrar solo los primeros 10
+                self.stdout.write(f'   - {producto.nombre}: {producto.stock} unidades')
+            if total_productos > 10:
+                self.stdout.write(f'   ... y {total_productos - 10} productos más')
+            self.stdout.write(self.style.WARNING('\n⚠️  Ejecuta sin --dry-run para aplicar los cambios'))
+            return
+
+        control = self._leer_control(options, ubicacion.id, tamano_bloque)
+        terminados = set(control['terminados'])
+        pendientes = [bloque for bloque in bloques if bloque[0] not in terminados]
+        if terminados:
+            self.stdout.write(f'↻ Reanudando: {len(bloques) - len(pendientes)} bloques ya migrados, {len(pendientes)} pendientes')
+
+        self.stdout.write('\n🔄 Migrando stock...')
+        totales = {'productos': 0, 'creados': 0, 'actualizados': 0, 'omitidos': 0, 'conflictos': 0, 'kardex': 0}
+        inicio = time.monotonic()
+
+        def migrar(bloque):
+            try:
+                return migrar_bloque(
+                    bloque[0], bloque[1], ubicacion.id, usuario,
+                    ubicaciones_adicionales=adicionales,
+                    registrar_kardex=not options['sin_kardex'],
+                    sobrescribir=options['sobrescribir'],
                 )
-                if created:
-                    self.stdout.write(self.style.SUCCESS(f'✓ Ubicación principal creada: {ubicacion.nombre}'))
-                else:
-                    self.stdout.write(f'✓ Ubicación principal: {ubicacion.nombre}')
-            
-            # Obtener productos activos
-            productos = Producto.objects.filter(activo=True)
-            total_productos = productos.count()
-            
-            self.stdout.write(f'\n📦 Total de productos activos: {total_productos}')
-            
-            if dry_run:
-                self.stdout.write(self.style.NOTICE('\n🔍 Productos que se migrarían:'))
-                for producto in productos[:10]:  # Mostrar solo los primeros 10
-                    stock_actual = getattr(producto, 'stock', 0)
-                    self.stdout.write(f'   - {producto.nombre}: {stock_actual} unidades')
-                if total_productos > 10:
-                    self.stdout.write(f'   ... y {total_productos - 10} productos más')
-                self.stdout.write(self.style.WARNING('\n⚠️  Ejecuta sin --dry-run para aplicar los cambios'))
-                return
-            
-            # Realizar migración con transacción
-            with transaction.atomic():
-                creados = 0
-                actualizados = 0
-                errores = 0
-                
-                self.stdout.write('\n🔄 Migrando stock...')
-                
-                for producto in productos:
-                    try:
-                        stock_actual = getattr(producto, 'stock', 0)
-                        
-                        # Obtener o crear stock por ubicación
-                        stock_ubicacion, created = StockUbicacion.objects.get_or_create(
-                            producto=producto,
-                            ubicacion=ubicacion,
-                            defaults={
-                                'cantidad': stock_actual,
-                                'stock_minimo': 0,
-                                'punto_reorden': 0,
-                                'creadoPor': usuario
-                            }
-                        )
-                        
-                        if created:
-                            creados += 1
-                            self.stdout.write(
-                                self.style.SUCCESS(
-                                    f'   ✓ {producto.nombre}: {stock_actual} unidades'
-                                )
-                            )
-                        else:
-                            # Si ya existe, actualizar cantidad si es diferente
-                            if stock_ubicacion.cantidad != stock_actual:
-                                stock_ubicacion.cantidad = stock_actual
-                                stock_ubicacion.editadoPor = usuario
-                                stock_ubicacion.save()
-                                actualizados += 1
-                                self.stdout.write(
-                                    f'   ↻ {producto.nombre}: actualizado a {stock_actual} unidades'
-                                )
-                    
-                    except Exception as e:
-                        errores += 1
-                        self.stdout.write(
-                            self.style.ERROR(f'   ✗ Error en {producto.nombre}: {str(e)}')
-                        )
-                
-                # Resumen
-                self.stdout.write('\n' + '=' * 70)
-                self.stdout.write(self.style.SUCCESS('✓ MIGRACIÓN COMPLETADA'))
-                self.stdout.write('=' * 70)
-                self.stdout.write(f'\n📊 Resumen:')
-                self.stdout.write(f'   • Productos nuevos: {creados}')
-                self.stdout.write(f'   • Productos actualizados: {actualizados}')
-                if errores > 0:
-                    self.stdout.write(self.style.ERROR(f'   • Errores: {errores}'))
-                self.stdout.write(f'   • Total procesados: {total_productos}')
-                
-                self.stdout.write('\n📍 Siguiente pasos:')
-                self.stdout.write('   1. Verifica los stocks en el admin de Django')
-                self.stdout.write('   2. Crea ubicaciones adicionales si tienes más sucursales')
-                self.stdout.write('   3. Asigna cada caja a su ubicación correspondiente')
-                self.stdout.write('   4. Comienza a usar transferencias entre sucursales')
-                
+            finally:
+                if options['hilos'] > 1:
+                    connection.close()  # Conexión propia de cada hilo
+
+        try:
+            with ThreadPoolExecutor(max_workers=options['hilos']) as ejecutor:
+                futuros = {ejecutor.submit(migrar, bloque): bloque for bloque in pendientes}
+                for futuro in as_completed(futuros):
+                    bloque = futuros[futuro]
+                    resultado = futuro.result()
+                    for clave in totales:
+                        totales[clave] += resultado[clave]
+                    control['terminados'].append(bloque[0])
+                    self._guardar_control(options['archivo_control'], control)
+
+                    transcurrido = time.monotonic() - inicio
+                    self.stdout.write(
+                        f'   ✓ Bloque {bloque[0]}-{bloque[1]}: {resultado["productos"]} productos '
+                        f'({len(control["terminados"])}/{len(bloques)} bloques, '
+                        f'{totales["productos"] / transcurrido if transcurrido else 0:.0f} productos/s)'
+                    )
         except Exception as e:
-            self.stdout.write(self.style.ERROR(f'\n✗ Error general: {str(e)}'))
+            self.stdout.write(self.style.ERROR(f'\n✗ Error: {str(e)}'))
+            self.stdout.write(self.style.WARNING('⚠️  Los bloques terminados quedaron guardados; usa --reanudar para continuar'))
             raise
+
+        # La caché de este comando es propia de su proceso: los procesos web
+        # recargan el stock en memoria al ver el nuevo editadoDate de las filas
+        # migradas y el resumen por sucursal cuando vence (TTL_RESUMEN)
+        if os.path.exists(options['archivo_control']):
+            os.remove(options['archivo_control'])
+
+        transcurrido = time.monotonic() - inicio
+        # Resumen
+        self.stdout.write('\n' + '=' * 70)
+        self.stdout.write(self.style.SUCCESS('✓ MIGRACIÓN COMPLETADA'))
+        self.stdout.write('=' * 70)
+        self.stdout.write(f'\n📊 Resumen:')
+        self.stdout.write(f'   • Productos nuevos: {totales["creados"]}')
+        self.stdout.write(f'   • Productos actualizados: {totales["actualizados"]}')
+        if totales['omitidos']:
+            self.stdout.write(self.style.WARNING(
+                f'   • Filas existentes sin cambios: {totales["omitidos"]} (usa --sobrescribir para reemplazarlas)'
+            ))
+        if totales['conflictos']:
+            self.stdout.write(self.style.WARNING(f'   • Filas creadas por otro proceso (sin cambios): {totales["conflictos"]}'))
+        self.stdout.write(f'   • Movimientos de kardex: {totales["kardex"]}')
+        self.stdout.write(f'   • Total procesados: {totales["productos"]} en {transcurrido:.2f}s '
+                          f'({totales["productos"] / transcurrido if transcurrido else 0:.0f} productos/s)')
+
+        self.stdout.write('\n📍 Siguiente pasos:')
+        self.stdout.write('   1. Verifica los stocks en el admin de Django')
+        self.stdout.write('   2. Crea ubicaciones adicionales si tienes más sucursales')
+        self.stdout.write('   3. Asigna cada caja a su ubicación correspondiente')
+        self.stdout.write('   4. Comienza a usar transferencias entre sucursales')
+
+    def _leer_control(self, options, ubicacion_id, tamano_bloque):
+        """Bloques terminados de una ejecución anterior (sólo con --reanudar)"""
+        nuevo = {'ubicacion_id': ubicacion_id, 'tamano_bloque': tamano_bloque, 'terminados': []}
+        ruta = options['archivo_control']
+        if not options['reanudar'] or not os.path.exists(ruta):
+            return nuevo
+        with open(ruta, encoding='utf-8') as archivo:
+            control = json.load(archivo)
+        if control.get('ubicacion_id') != ubicacion_id or control.get('tamano_bloque') != tamano_bloque:
+            raise CommandError(
+                f'El archivo de control {ruta} corresponde a otra ubicación o tamaño de bloque; '
+                'ejecuta con los mismos parámetros o sin --reanudar'
+            )
+        return control
+
+    @staticmethod
+    def _guardar_control(ruta, control):
+        temporal = f'{ruta}.tmp'
+        with open(temporal, 'w', encoding='utf-8') as archivo:
+            json.dump(control, archivo)
+        os.replace(temporal, ruta)
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""
+Comando para reconstruir el índice de alertas de stock (AlertaStock)
+Uso: python manage.py reconstruir_alertas_stock
+
+Se ejecuta una vez tras crear la tabla (crear_tabla_alertas_stock.sql) y
+opcionalmente cada noche como verificación; durante el día el índice se
+mantiene de forma incremental con cada movimiento de stock.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from inventario.utils_alertas import reconstruir_alertas_stock
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye el índice de productos con stock bajo (global y por ubicación)'
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+        total = reconstruir_alertas_stock()
+        duracion = time.monotonic() - inicio
+        
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ Índice de alertas reconstruido: {total} alertas en {duracion:.2f}s'
+        ))
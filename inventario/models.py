@@ -1,4 +1,4 @@
-from django.db import models, transaction
+from django.db import models
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator
 from decimal import Decimal
@@ -249,43 +249,11 @@ class TransferenciaStock(models.Model):
         """
         Marca la transferencia como 'transferido' y RESERVA (no descuenta) stock
         Estado: guardado → transferido
-        """
-        if self.estado != 'guardado':
-            raise ValueError(f'No se puede enviar una transferencia en estado {self.estado}. Debe estar en estado "guardado".')
-        
-        # Validar que hay productos
-        if not self.detalles.exists():
-            raise ValueError('La transferencia no tiene productos agregados.')
         
-        # RESERVAR stock en cada lote (NO descontar aún)
-        with transaction.atomic():
-            for detalle in self.detalles.all():
-                # Validar que tenga lote asignado
-                if not detalle.lote:
-                    raise ValueError(f'El producto {detalle.producto.nombre} no tiene un lote asignado.')
-                
-                # Validar que el lote pertenece a la ubicación origen
-                if detalle.lote.ubicacion_id != self.ubicacion_origen_id:
-                    raise ValueError(f'El lote {detalle.lote.numero_lote} no pertenece a la ubicación origen.')
-                
-                # Guardar stock antes del movimiento
-                detalle.stock_origen_antes = detalle.lote.cantidad_disponible
-                detalle.save()
-                
-                # RESERVAR cantidad en el lote (NO descontar)
-                try:
-                    detalle.lote.reservar_cantidad(
-                        cantidad=detalle.cantidad,
-                        detalle=f'Transferencia {self.numero_transferencia}'
-                    )
-                except ValueError as e:
-                    raise ValueError(f'Error al reservar {detalle.producto.nombre}: {str(e)}')
-            
-            # Actualizar estado de la transferencia
-            self.estado = 'transferido'
-            self.fecha_envio = timezone.now()
-            self.usuario_envio = usuario
-            self.save()
+        El trabajo se hace por conjuntos en inventario.utils_transferencias
+        """
+        from .utils_transferencias import enviar_transferencia
+        enviar_transferencia(self, usuario)
     
     def procesar(self, usuario, cantidades_recibidas=None):
         """
@@ -298,94 +266,8 @@ class TransferenciaStock(models.Model):
             usuario: Usuario que recibe/procesa
             cantidades_recibidas: Dict con {detalle_id: cantidad_recibida} (opcional)
         """
-        if self.estado != 'transferido':
-            raise ValueError(f'No se puede procesar una transferencia en estado {self.estado}. Debe estar en estado "transferido".')
-        
-        # VALIDACIÓN CRÍTICA: Usuario receptor ≠ usuario envío
-        if self.usuario_envio and usuario.id == self.usuario_envio.id:
-            raise ValueError(
-                f'ERROR DE SEGURIDAD: El usuario que transfiere ({self.usuario_envio.username}) '
-                f'no puede ser el mismo que procesa la transferencia. '
-                f'Debe ser procesada por un usuario diferente para garantizar auditoría.'
-            )
-        
-        with transaction.atomic():
-            for detalle in self.detalles.all():
-                # Determinar cantidad a recibir
-                cantidad_a_recibir = detalle.cantidad
-                if cantidades_recibidas and detalle.id in cantidades_recibidas:
-                    cantidad_a_recibir = cantidades_recibidas[detalle.id]
-                
-                # 1. DESCONTAR del lote origen y liberar reserva
-                detalle.lote.descontar_cantidad(
-                    cantidad=cantidad_a_recibir,
-                    detalle=f'Transferencia {self.numero_transferencia} procesada'
-                )
-                detalle.lote.liberar_reserva(cantidad=cantidad_a_recibir)
-                
-                # 2. CREAR o ACTUALIZAR lote en destino
-                # Buscar si ya existe el mismo lote en destino
-                lote_destino, created = LoteProducto.objects.get_or_create(
-                    producto=detalle.producto,
-                    ubicacion=self.ubicacion_destino,
-                    numero_lote=detalle.lote.numero_lote,
-                    fecha_caducidad=detalle.lote.fecha_caducidad,
-                    defaults={
-                        'creadoPor': usuario,
-                        'fecha_ingreso': timezone.now().date(),
-                        'fecha_creacion': detalle.lote.fecha_creacion,
-                        'cantidad_inicial': cantidad_a_recibir,
-                        'cantidad_disponible': cantidad_a_recibir,
-                        'proveedor': detalle.lote.proveedor,
-                        'costo_unitario': detalle.lote.costo_unitario,
-                    }
-                )
-                
-                if not created:
-                    # Si ya existía, solo sumar la cantidad
-                    lote_destino.cantidad_disponible += Decimal(str(cantidad_a_recibir))
-                    lote_destino.save()
-                
-                # Guardar información en el detalle
-                detalle.stock_destino_antes = lote_destino.cantidad_disponible - Decimal(str(cantidad_a_recibir))
-                detalle.cantidad_recibida = cantidad_a_recibir
-                
-                # Aplicar cambio de precio si corresponde
-                if detalle.cambio_precio and detalle.precio_destino != detalle.precio_origen:
-                    # Aquí podrías actualizar el precio en StockUbicacion o en el producto
-                    # Por ahora solo lo registramos en el detalle
-                    detalle.observaciones += f'\nPrecio cambiado de ${detalle.precio_origen} a ${detalle.precio_destino}'
-                
-                detalle.save()
-                
-                # 3. Registrar en kardex
-                # Salida en origen
-                KardexMovimiento.objects.create(
-                    idProducto=detalle.producto.id,
-                    idUbicacion=self.ubicacion_origen.id,
-                    tipoMovimiento='TRANSFERENCIA SALIDA',
-                    detalle=f'Transfer. {self.numero_transferencia} → {self.ubicacion_destino.nombre} (Lote: {detalle.lote.numero_lote})',
-                    egreso=cantidad_a_recibir,
-                    ingreso=0,
-                    saldo=detalle.lote.cantidad_disponible
-                )
-                
-                # Entrada en destino
-                KardexMovimiento.objects.create(
-                    idProducto=detalle.producto.id,
-                    idUbicacion=self.ubicacion_destino.id,
-                    tipoMovimiento='TRANSFERENCIA ENTRADA',
-                    detalle=f'Transfer. {self.numero_transferencia} ← {self.ubicacion_origen.nombre} (Lote: {detalle.lote.numero_lote})',
-                    ingreso=cantidad_a_recibir,
-                    egreso=0,
-                    saldo=lote_destino.cantidad_disponible
-                )
-            
-            # Actualizar estado de la transferencia
-            self.estado = 'procesado'
-            self.fecha_recepcion = timezone.now()
-            self.usuario_recepcion = usuario
-            self.save()
+        from .utils_transferencias import procesar_transferencia
+        procesar_transferencia(self, usuario, cantidades_recibidas)
     
     @property
     def total_productos(self):
@@ -430,6 +312,10 @@ class LoteProducto(models.Model):
         verbose_name_plural = "Lotes de Productos"
         ordering = ['fecha_caducidad', 'fecha_ingreso']  # FEFO: First Expired, First Out
         unique_together = [['producto', 'ubicacion', 'numero_lote', 'fecha_caducidad']]
+        indexes = [
+            # Reportes de caducidad: rango de fechas por ubicación
+            models.Index(fields=['fecha_caducidad', 'ubicacion'], name='idx_lote_caducidad_ubicacion'),
+        ]
     
     def __str__(self):
         return f"{self.producto.nombre} - Lote {self.numero_lote} - Venc: {self.fecha_caducidad}"
@@ -559,9 +445,15 @@ class ConfiguracionStock(models.Model):
     
     @property
     def necesita_reorden(self):
-        """Verifica si el producto necesita reorden basado en el stock actual"""
-        # Aquí iría la lógica para verificar el stock actual vs punto de reorden
-        return False  # Placeholder
+        """Verifica si el producto necesita reorden basado en el stock actual de la ubicación"""
+        cantidad = StockUbicacion.objects.filter(
+            producto_id=self.producto_id, ubicacion_id=self.ubicacion_id
+        ).values_list('cantidad', flat=True).first()
+        if cantidad is None:
+            return False
+        if self.punto_reorden > 0:
+            return cantidad <= self.punto_reorden
+        return self.stock_minimo > 0 and cantidad <= self.stock_minimo
 
 
 class Compra(models.Model):
@@ -818,6 +710,8 @@ class StockUbicacion(models.Model):
         indexes = [
             models.Index(fields=['producto', 'ubicacion']),
             models.Index(fields=['ubicacion', 'cantidad']),
+            # Versión de la caché de stock en memoria (inventario.utils_stock)
+            models.Index(fields=['ubicacion', 'editadoDate'], name='idx_stockubicacion_editado'),
         ]
     
     def __str__(self):
@@ -848,27 +742,106 @@ class StockUbicacion(models.Model):
             detalle: descripción del movimiento
             usuario: usuario que realiza el ajuste
         """
-        cantidad_anterior = self.cantidad
-        self.cantidad += Decimal(str(cantidad))
+        from .utils_movimientos import Movimiento, StockInsuficiente, aplicar_movimientos
         
-        # Validar que no quede negativo
-        if self.cantidad < 0:
-            raise ValueError(f'Stock insuficiente. Disponible: {cantidad_anterior}, Solicitado: {abs(cantidad)}')
+        # UPDATE atómico sobre la fila: no se pierde un ajuste simultáneo
+        try:
+            saldos = aplicar_movimientos(
+                [Movimiento(self.producto_id, cantidad, tipo_movimiento, f"{detalle} - {self.ubicacion.nombre}")],
+                ubicacion_id=self.ubicacion_id,
+                usuario=usuario,
+                permitir_negativo=False,
+                sender=StockUbicacion,
+            )
+        except StockInsuficiente:
+            disponible = StockUbicacion.objects.filter(pk=self.pk).values_list('cantidad', flat=True).first()
+            raise ValueError(f'Stock insuficiente. Disponible: {disponible}, Solicitado: {abs(cantidad)}')
         
+        self.cantidad = saldos[self.producto_id]
         self.editadoPor = usuario
-        self.save()
-        
-        # Registrar en kardex
-        KardexMovimiento.objects.create(
-            idProducto=self.producto.id,
-            idUbicacion=self.ubicacion.id,
-            fecha=timezone.now(),
-            tipoMovimiento=tipo_movimiento,
-            detalle=f"{detalle} - {self.ubicacion.nombre}",
-            ingreso=cantidad if cantidad > 0 else 0,
-            egreso=abs(cantidad) if cantidad < 0 else 0,
-            saldo=self.cantidad
-        )
-        
         return self.cantidad
 
+
+
+class AlertaStock(models.Model):
+    """
+    Índice de productos con stock bajo, mantenido de forma incremental.
+    
+    Contiene una fila por cada producto en alerta: con ubicacion nula para el
+    stock global (productos.stock <= productos.stockMinimo) y con ubicación
+    para el stock por sucursal (StockUbicacion). Así las pantallas y badges de
+    alertas consultan sólo los k productos en alerta en lugar de recorrer todo
+    el catálogo. Se actualiza desde inventario.utils_alertas cada vez que
+    cambia el stock.
+    
+    Requiere crear la tabla en MySQL: ver crear_tabla_alertas_stock.sql
+    """
+    NIVEL_CHOICES = [
+        ('agotado', 'Agotado'),
+        ('bajo', 'Bajo stock mínimo'),
+        ('reorden', 'En punto de reorden'),
+    ]
+    
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='alertas_stock')
+    ubicacion = models.ForeignKey(Ubicacion, on_delete=models.CASCADE, null=True, blank=True,
+                                  related_name='alertas_stock',
+                                  help_text='Nulo = alerta sobre el stock global del producto')
+    nivel = models.CharField(max_length=10, choices=NIVEL_CHOICES)
+    cantidad = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    stock_minimo = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    punto_reorden = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = "Alerta de Stock"
+        verbose_name_plural = "Alertas de Stock"
+        ordering = ['ubicacion', 'cantidad']
+        indexes = [
+            models.Index(fields=['ubicacion', 'nivel']),
+            models.Index(fields=['producto', 'ubicacion']),
+            models.Index(fields=['fecha_actualizacion']),
+        ]
+    
+    def __str__(self):
+        ambito = self.ubicacion.nombre if self.ubicacion_id else 'Global'
+        return f"{self.producto_id} ({ambito}): {self.get_nivel_display()}"
+
+
+class ResumenCaducidad(models.Model):
+    """
+    Totales precalculados de lotes por rango de vencimiento y ubicación.
+    
+    Una fila por (ubicación, rango): vencido, 30 (vence en 0-30 días),
+    60 (31-60 días) y 90 (61-90 días). El dashboard de caducados lee esta
+    tabla en lugar de agrupar todos los lotes en cada consulta. Se recalcula
+    cada noche (actualizar_resumen_caducidad) y, por ubicación, cuando cambian
+    sus lotes. Ver inventario.utils_caducidad.
+    
+    Requiere crear la tabla en MySQL: ver crear_tabla_resumen_caducidad.sql
+    """
+    RANGO_CHOICES = [
+        ('vencido', 'Vencidos'),
+        ('30', 'Vencen en 30 días'),
+        ('60', 'Vencen en 31-60 días'),
+        ('90', 'Vencen en 61-90 días'),
+    ]
+    
+    ubicacion = models.ForeignKey(Ubicacion, on_delete=models.CASCADE, related_name='resumen_caducidad')
+    rango = models.CharField(max_length=10, choices=RANGO_CHOICES)
+    lotes = models.IntegerField(default=0)
+    productos = models.IntegerField(default=0)
+    unidades = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    valor_costo = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    valor_venta = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    fecha_calculo = models.DateField(help_text='Día de referencia usado para los rangos')
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+    pendiente = models.BooleanField(default=False, help_text='Los lotes cambiaron desde el cálculo')
+    
+    class Meta:
+        verbose_name = "Resumen de Caducidad"
+        verbose_name_plural = "Resúmenes de Caducidad"
+        ordering = ['ubicacion', 'rango']
+        unique_together = [['ubicacion', 'rango']]
+    
+    def __str__(self):
+        return f"{self.ubicacion_id} - {self.get_rango_display()}: {self.lotes} lotes"
@@ -0,0 +1,36 @@
+"""
+Señales del módulo de inventario
+
+stock_modificado se emite cada vez que cambia el stock de uno o varios
+productos (ventas, compras, ingresos, transferencias, ajustes). Los módulos
+que mantienen datos derivados del stock (dashboard, alertas, cachés) se
+suscriben a ella en lugar de recalcular en cada consulta.
+
+Argumentos enviados:
+    producto_ids: lista de IDs de productos afectados
+    ubicacion_id: ID de la ubicación afectada (None = stock global)
+    saldos: dict opcional {producto_id: nueva cantidad} cuando se conoce
+"""
+from django.db import transaction
+from django.dispatch import Signal
+
+
+stock_modificado = Signal()
+
+
+def notificar_stock_modificado(sender, producto_ids, ubicacion_id=None, saldos=None):
+    """
+    Emite stock_modificado cuando la transacción actual se confirma.
+
+    Si no hay transacción abierta la señal se emite inmediatamente.
+    """
+    producto_ids = [int(pid) for pid in producto_ids if pid is not None]
+    if not producto_ids:
+        return
+
+    transaction.on_commit(lambda: stock_modificado.send(
+        sender=sender,
+        producto_ids=producto_ids,
+        ubicacion_id=ubicacion_id,
+        saldos=saldos,
+    ))
@@ -1,3 +1,307 @@
-from django.test import TestCase
+import threading
+import unittest
+from datetime import date
+from decimal import Decimal
 
-# Create your tests here.
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.db import connection, connections, transaction
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+
+from productos.models import Categoria, ClaseProducto, Laboratorio, Marca, Producto, Subcategoria, TipoProducto
+from proveedores.models import Proveedor
+from .models import (
+    Compra, DetalleCompra, DetalleTransferencia, Kardex, KardexMovimiento, LoteProducto, StockUbicacion,
+    TransferenciaStock, Ubicacion,
+)
+from .management.commands.migrar_stock_sucursales import migrar_bloque
+from .utils_compras import leer_lineas_compra, registrar_compra
+from .utils_movimientos import Movimiento, StockInsuficiente, aplicar_movimientos
+from .utils_stock import CacheStockUbicacion, cache_stock
+from .utils_transferencias import enviar_transferencia, procesar_transferencia
+from ventas.utils_sucursal import descontar_stock_venta, stock_disponible
+
+
+def crear_tablas_no_administradas():
+    """Crea en la base de pruebas las tablas de LogiPharmBD que Django no administra (managed = False)"""
+    existentes = set(connection.introspection.table_names())
+    with connection.schema_editor() as editor:
+        for modelo in apps.get_models():
+            if not modelo._meta.managed and modelo._meta.db_table not in existentes:
+                editor.create_model(modelo)
+                # create_model omite los índices de los modelos no administrados (en producción los crean los .sql)
+                for indice in modelo._meta.indexes:
+                    editor.add_index(modelo, indice)
+                existentes.add(modelo._meta.db_table)
+
+
+def vender(producto_id, cantidad):
+    """Descuento de stock tal como lo hace el punto de venta (ventas.views.crear_ajax)"""
+    return aplicar_movimientos(
+        [Movimiento(producto_id, -cantidad, 'VENTA', 'Factura Venta N° TEST')],
+        permitir_negativo=False, notificar=False,
+    )
+
+
+class StockTestCase(TransactionTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        crear_tablas_no_administradas()
+
+    def setUp(self):
+        self.usuario = User.objects.create(username='compras')
+        TipoProducto.objects.get_or_create(id=1, defaults={'nombre': 'Medicamento'})
+        ClaseProducto.objects.get_or_create(id=1, defaults={'nombre': 'General'})
+        categoria, _ = Categoria.objects.get_or_create(id=1, defaults={'nombre': 'General'})
+        Subcategoria.objects.get_or_create(id=1, defaults={'nombre': 'General', 'id_categoria': categoria})
+        Marca.objects.get_or_create(id=1, defaults={'nombre': 'Genérico'})
+        Laboratorio.objects.get_or_create(id=1, defaults={'nombre': 'Genérico'})
+        self.proveedor = Proveedor.objects.create(
+            ruc='1790000000001', razon_social='Distribuidora', creado_date=timezone.now(), editado_date=timezone.now()
+        )
+        self.productos = [
+            Producto.objects.create(nombre=f'Producto {i}', codigo_principal=f'P{i:03d}', stock=100)
+            for i in range(2)
+        ]
+
+    def _fixture_teardown(self):
+        super()._fixture_teardown()
+        # El flush entre pruebas no incluye las tablas no administradas
+        KardexMovimiento.objects.all().delete()
+        Producto.objects.all().delete()
+        Proveedor.objects.all().delete()
+
+
+class AplicarMovimientosTests(StockTestCase):
+
+    def test_saldos_y_kardex_por_movimiento(self):
+        p1, p2 = self.productos
+        saldos = aplicar_movimientos([
+            Movimiento(p1.id, 10, 'COMPRA', 'Compra 1'),
+            Movimiento(p1.id, -4, 'VENTA', 'Venta 1'),
+            Movimiento(p2.id, -1, 'VENTA', 'Venta 1'),
+        ])
+
+        self.assertEqual(saldos, {p1.id: Decimal('106'), p2.id: Decimal('99')})
+        self.assertEqual(
+            list(KardexMovimiento.objects.filter(idProducto=p1.id).order_by('id').values_list('ingreso', 'egreso', 'saldo')),
+            [(Decimal('10'), Decimal('0'), Decimal('110')), (Decimal('0'), Decimal('4'), Decimal('106'))],
+        )
+
+    def test_stock_insuficiente_no_aplica_el_lote(self):
+        p1, p2 = self.productos
+        with self.assertRaises(StockInsuficiente):
+            aplicar_movimientos([
+                Movimiento(p1.id, -5, 'VENTA', 'Venta 1'),
+                Movimiento(p2.id, -500, 'VENTA', 'Venta 1'),
+            ], permitir_negativo=False)
+
+        self.assertEqual(Producto.objects.get(id=p1.id).stock, Decimal('100'))
+        self.assertFalse(KardexMovimiento.objects.exists())
+
+    def test_ajuste_por_ubicacion(self):
+        ubicacion = Ubicacion.objects.create(codigo='SUC1', nombre='Sucursal 1', creadoPor=self.usuario)
+        stock = StockUbicacion.objects.create(producto=self.productos[0], ubicacion=ubicacion, cantidad=5)
+
+        self.assertEqual(stock.ajustar_stock(3, 'AJUSTE INGRESO', 'Ajuste', self.usuario), Decimal('8'))
+        with self.assertRaises(ValueError):
+            stock.ajustar_stock(-20, 'AJUSTE EGRESO', 'Ajuste', self.usuario)
+        self.assertEqual(StockUbicacion.objects.get(pk=stock.pk).cantidad, Decimal('8'))
+
+
+@override_settings(VENTAS_STOCK_POR_UBICACION=True)
+class VentaPorSucursalTests(StockTestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache_stock.limpiar()
+        self.sucursales = [
+            Ubicacion.objects.create(codigo=f'SUC{i}', nombre=f'Sucursal {i}', creadoPor=self.usuario)
+            for i in range(2)
+        ]
+        producto = self.productos[0]
+        for sucursal in self.sucursales:
+            StockUbicacion.objects.create(producto=producto, ubicacion=sucursal, cantidad=50)
+
+    def test_descuenta_solo_la_sucursal_y_el_total(self):
+        producto = self.productos[0]
+        sucursal, otra = self.sucursales
+
+        with transaction.atomic():
+            saldos = descontar_stock_venta([(producto.id, Decimal('3'))], sucursal.id, self.usuario, 'Factura Venta N° TEST')
+
+        self.assertEqual(saldos, {producto.id: Decimal('47')})
+        self.assertEqual(stock_disponible([producto.id], otra.id), {producto.id: Decimal('50')})
+        self.assertEqual(Producto.objects.get(id=producto.id).stock, Decimal('97'))
+        self.assertEqual(
+            list(KardexMovimiento.objects.order_by('id').values_list('idUbicacion', 'egreso', 'saldo')),
+            [(sucursal.id, Decimal('3'), Decimal('47'))],
+        )
+
+    def test_rechaza_venta_sin_stock_en_la_sucursal(self):
+        # El producto tiene stock global pero ninguna fila en la sucursal
+        producto = self.productos[1]
+        sucursal = self.sucursales[0]
+        self.assertEqual(stock_disponible([producto.id], sucursal.id), {producto.id: Decimal('0')})
+
+        with self.assertRaises(StockInsuficiente):
+            with transaction.atomic():
+                descontar_stock_venta([(producto.id, Decimal('1'))], sucursal.id, self.usuario, 'Factura Venta N° TEST')
+
+        self.assertEqual(Producto.objects.get(id=producto.id).stock, Decimal('100'))
+        self.assertFalse(StockUbicacion.objects.filter(producto=producto).exists())
+
+    def test_cache_en_memoria_ve_cambios_de_otro_proceso(self):
+        producto = self.productos[0]
+        sucursal = self.sucursales[0]
+        cache_local = CacheStockUbicacion(intervalo_version=0)
+        self.assertEqual(cache_local.obtener([producto.id], [sucursal.id])[(producto.id, sucursal.id)][0], Decimal('50'))
+
+        # Sin señal: como si el movimiento lo hiciera otro proceso
+        aplicar_movimientos([Movimiento(producto.id, -5, 'AJUSTE EGRESO', 'Ajuste')],
+                            ubicacion_id=sucursal.id, notificar=False)
+
+        self.assertEqual(cache_local.obtener([producto.id], [sucursal.id])[(producto.id, sucursal.id)][0], Decimal('45'))
+
+    @override_settings(VENTAS_STOCK_POR_UBICACION=True)
+    def test_transferencia_mueve_el_stock_entre_sucursales(self):
+        producto = self.productos[0]
+        origen, destino = self.sucursales
+        lote = LoteProducto.objects.create(
+            producto=producto, ubicacion=origen, numero_lote='L-1', fecha_caducidad=date(2030, 1, 1),
+            cantidad_inicial=20, cantidad_disponible=20, creadoPor=self.usuario,
+        )
+        transferencia = TransferenciaStock.objects.create(
+            numero_transferencia='TR-TEST', ubicacion_origen=origen, ubicacion_destino=destino,
+            usuario_creacion=self.usuario,
+        )
+        DetalleTransferencia.objects.create(transferencia=transferencia, producto=producto, lote=lote, cantidad=5)
+
+        enviar_transferencia(transferencia, self.usuario)
+        procesar_transferencia(transferencia, User.objects.create(username='bodega'))
+
+        self.assertEqual(
+            dict(StockUbicacion.objects.filter(producto=producto).values_list('ubicacion_id', 'cantidad')),
+            {origen.id: Decimal('45'), destino.id: Decimal('55')},
+        )
+        self.assertEqual(Producto.objects.get(id=producto.id).stock, Decimal('100'))
+
+
+class RegistrarCompraTests(StockTestCase):
+
+    def _comprar(self, lineas, numero='COMP-TEST', ubicacion_id=None):
+        return registrar_compra(self.usuario, {
+            'numero_compra': numero,
+            'fecha_factura': date.today(),
+            'proveedor_id': self.proveedor.id,
+        }, lineas, ubicacion_id=ubicacion_id)
+
+    def test_registra_detalles_stock_y_kardex(self):
+        p1, p2 = self.productos
+        lineas = leer_lineas_compra({
+            'productos[0][id]': str(p1.id), 'productos[0][cantidad]': '5', 'productos[0][precio]': '2.50',
+            'productos[1][id]': str(p2.id), 'productos[1][cantidad]': '10', 'productos[1][precio]': '1.00',
+            'productos[2][id]': str(p1.id), 'productos[2][cantidad]': '3', 'productos[2][precio]': '2.50',
+        })
+
+        compra = self._comprar(lineas)
+
+        self.assertEqual(compra.subtotal, Decimal('30.00'))
+        self.assertEqual(compra.total, Decimal('34.50'))
+        self.assertEqual(
+            dict(DetalleCompra.objects.filter(compra=compra).values_list('producto_id', 'cantidad')),
+            {p1.id: 8, p2.id: 10},
+        )
+        self.assertEqual(Producto.objects.get(id=p1.id).stock, Decimal('108'))
+        self.assertEqual(Producto.objects.get(id=p2.id).stock, Decimal('110'))
+        self.assertEqual(
+            dict(Kardex.objects.filter(numero_documento=compra.numero_compra).values_list('producto_id', 'saldo_cantidad')),
+            {p1.id: 108, p2.id: 110},
+        )
+
+    def test_compra_recibida_en_una_sucursal(self):
+        producto = self.productos[1]
+        sucursal = Ubicacion.objects.create(codigo='SUC', nombre='Sucursal', creadoPor=self.usuario)
+
+        self._comprar({producto.id: {'cantidad': 4, 'precio': Decimal('1')}}, numero='COMP-SUC', ubicacion_id=sucursal.id)
+
+        self.assertEqual(StockUbicacion.objects.get(producto=producto, ubicacion=sucursal).cantidad, Decimal('4'))
+        self.assertEqual(Producto.objects.get(id=producto.id).stock, Decimal('104'))
+        self.assertEqual(
+            list(KardexMovimiento.objects.values_list('idUbicacion', 'ingreso')),
+            [(sucursal.id, Decimal('4'))],
+        )
+
+    def test_producto_inexistente_no_registra_nada(self):
+        with self.assertRaises(Producto.DoesNotExist):
+            self._comprar({self.productos[0].id: {'cantidad': 1, 'precio': Decimal('1')},
+                           999999: {'cantidad': 1, 'precio': Decimal('1')}})
+        self.assertFalse(Compra.objects.exists())
+        self.assertEqual(Producto.objects.get(id=self.productos[0].id).stock, Decimal('100'))
+
+    @unittest.skipIf(connection.vendor == 'sqlite', 'Requiere una base de datos con escrituras concurrentes')
+    def test_compras_y_ventas_concurrentes_no_pierden_stock(self):
+        producto = self.productos[0]
+        hilos_por_tipo = 8
+        repeticiones = 5
+        barrera = threading.Barrier(hilos_por_tipo * 2)
+        errores = []
+
+        def comprar(indice):
+            try:
+                barrera.wait()
+                for repeticion in range(repeticiones):
+                    self._comprar(
+                        {producto.id: {'cantidad': 7, 'precio': Decimal('1.00')}},
+                        numero=f'COMP-{indice}-{repeticion}',
+                    )
+            except Exception as e:
+                errores.append(e)
+            finally:
+                connections.close_all()
+
+        def vender_en_hilo():
+            try:
+                barrera.wait()
+                for _ in range(repeticiones):
+                    vender(producto.id, 3)
+            except Exception as e:
+                errores.append(e)
+            finally:
+                connections.close_all()
+
+        hilos = [threading.Thread(target=comprar, args=(i,)) for i in range(hilos_por_tipo)]
+        hilos += [threading.Thread(target=vender_en_hilo) for _ in range(hilos_por_tipo)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(errores, [])
+        esperado = Decimal('100') + hilos_por_tipo * repeticiones * (7 - 3)
+        self.assertEqual(Producto.objects.get(id=producto.id).stock, esperado)
+        self.assertEqual(Kardex.objects.filter(producto=producto).count(), hilos_por_tipo * repeticiones)
+
+
+class MigrarStockSucursalesTests(StockTestCase):
+
+    def test_no_pisa_filas_existentes_sin_sobrescribir(self):
+        p1, p2 = self.productos
+        sucursal = Ubicacion.objects.create(codigo='PRINC', nombre='Principal', creadoPor=self.usuario)
+        StockUbicacion.objects.create(producto=p1, ubicacion=sucursal, cantidad=12)
+
+        resultado = migrar_bloque(p1.id, p2.id, sucursal.id, self.usuario)
+
+        self.assertEqual((resultado['creados'], resultado['omitidos'], resultado['actualizados']), (1, 1, 0))
+        self.assertEqual(
+            dict(StockUbicacion.objects.values_list('producto_id', 'cantidad')),
+            {p1.id: Decimal('12'), p2.id: Decimal('100')},
+        )
+
+        resultado = migrar_bloque(p1.id, p2.id, sucursal.id, self.usuario, sobrescribir=True)
+
+        self.assertEqual(resultado['actualizados'], 1)
+        self.assertEqual(StockUbicacion.objects.get(producto=p1).cantidad, Decimal('100'))
@@ -61,6 +61,8 @@ urlpatterns = [
     path('api/stock/<int:producto_id>/', api_stock.api_stock_por_ubicacion, name='api_stock_por_ubicacion'),
     path('api/productos-ubicacion/<int:ubicacion_id>/', api_stock.api_productos_con_stock, name='api_productos_con_stock'),
     path('api/resumen-stocks/', api_stock.api_resumen_stocks, name='api_resumen_stocks'),
+    path('api/stock-lote/', api_stock.api_stock_lote, name='api_stock_lote'),
+    path('api/alertas-stock/', api_stock.api_alertas_stock, name='api_alertas_stock'),
     
     # API Lotes (NUEVO)
     path('api/lotes-disponibles/', views.obtener_lotes_disponibles, name='api_lotes_disponibles'),
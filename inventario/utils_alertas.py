@@ -0,0 +1,216 @@
+"""
+Mantenimiento incremental del índice de alertas de stock (AlertaStock)
+
+En lugar de recorrer toda la tabla productos con "stock <= stockMinimo" en
+cada pantalla, se mantiene una tabla con los productos en alerta. Cada vez
+que cambia el stock de un conjunto de productos se recalcula sólo ese
+conjunto (una consulta de lectura, un DELETE y un INSERT por lote).
+
+Ámbitos:
+    - Global (ubicacion nula): productos.stock frente a productos.stockMinimo
+    - Por sucursal: StockUbicacion.cantidad frente a stock_minimo/punto_reorden
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Q
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from productos.models import Producto
+from .models import AlertaStock, StockUbicacion
+from .signals import stock_modificado
+from ventas.signals import venta_registrada
+
+
+TAMANO_LOTE = 1000
+
+
+def _nivel_alerta(cantidad, stock_minimo, punto_reorden):
+    """Devuelve el nivel de alerta o None si el stock está en orden"""
+    if cantidad <= 0:
+        return 'agotado'
+    if cantidad <= stock_minimo:
+        return 'bajo'
+    if punto_reorden > 0 and cantidad <= punto_reorden:
+        return 'reorden'
+    return None
+
+
+def _alertas_globales(filas):
+    """filas: (producto_id, stock, stock_minimo)"""
+    alertas = []
+    for producto_id, stock, stock_minimo in filas:
+        stock = stock or Decimal('0')
+        stock_minimo = stock_minimo or Decimal('0')
+        if stock > stock_minimo:
+            continue
+        alertas.append(AlertaStock(
+            producto_id=producto_id,
+            ubicacion_id=None,
+            nivel=_nivel_alerta(stock, stock_minimo, Decimal('0')),
+            cantidad=stock,
+            stock_minimo=stock_minimo,
+        ))
+    return alertas
+
+
+def _alertas_ubicacion(filas):
+    """filas: (producto_id, ubicacion_id, cantidad, stock_minimo, punto_reorden)"""
+    alertas = []
+    for producto_id, ubicacion_id, cantidad, stock_minimo, punto_reorden in filas:
+        bajo_minimo = stock_minimo > 0 and cantidad <= stock_minimo
+        en_reorden = punto_reorden > 0 and cantidad <= punto_reorden
+        if not (bajo_minimo or en_reorden):
+            continue
+        alertas.append(AlertaStock(
+            producto_id=producto_id,
+            ubicacion_id=ubicacion_id,
+            nivel=_nivel_alerta(cantidad, stock_minimo, punto_reorden),
+            cantidad=cantidad,
+            stock_minimo=stock_minimo,
+            punto_reorden=punto_reorden,
+        ))
+    return alertas
+
+
+def actualizar_alertas_stock(producto_ids, ubicacion_id=None):
+    """
+    Recalcula las alertas de un conjunto de productos.
+
+    Args:
+        producto_ids: IDs de productos cuyo stock cambió
+        ubicacion_id: si se indica, recalcula también el ámbito de esa
+            sucursal (StockUbicacion); el ámbito global se recalcula siempre
+    """
+    producto_ids = sorted({int(pid) for pid in producto_ids if pid is not None})
+    if not producto_ids:
+        return
+
+    with transaction.atomic():
+        for i in range(0, len(producto_ids), TAMANO_LOTE):
+            lote = producto_ids[i:i + TAMANO_LOTE]
+
+            filas = Producto.objects.filter(
+                id__in=lote, activo=True, anulado=False
+            ).values_list('id', 'stock', 'stock_minimo')
+            AlertaStock.objects.filter(producto_id__in=lote, ubicacion__isnull=True).delete()
+            AlertaStock.objects.bulk_create(_alertas_globales(filas))
+
+            if ubicacion_id is not None:
+                filas = StockUbicacion.objects.filter(
+                    producto_id__in=lote, ubicacion_id=ubicacion_id
+                ).values_list('producto_id', 'ubicacion_id', 'cantidad', 'stock_minimo', 'punto_reorden')
+                AlertaStock.objects.filter(producto_id__in=lote, ubicacion_id=ubicacion_id).delete()
+                AlertaStock.objects.bulk_create(_alertas_ubicacion(filas))
+
+
+def reconstruir_alertas_stock():
+    """
+    Reconstruye todo el índice de alertas recorriendo el catálogo una vez.
+
+    Se usa para la carga inicial y como verificación nocturna; el uso normal
+    es actualizar_alertas_stock() con los productos modificados.
+    """
+    with transaction.atomic():
+        AlertaStock.objects.all().delete()
+
+        globales = Producto.objects.filter(
+            activo=True, anulado=False, stock__lte=F('stock_minimo')
+        ).values_list('id', 'stock', 'stock_minimo')
+        AlertaStock.objects.bulk_create(
+            _alertas_globales(globales.iterator(chunk_size=TAMANO_LOTE)),
+            batch_size=TAMANO_LOTE,
+        )
+
+        por_ubicacion = StockUbicacion.objects.filter(
+            Q(stock_minimo__gt=0, cantidad__lte=F('stock_minimo')) |
+            Q(punto_reorden__gt=0, cantidad__lte=F('punto_reorden'))
+        ).values_list('producto_id', 'ubicacion_id', 'cantidad', 'stock_minimo', 'punto_reorden')
+        AlertaStock.objects.bulk_create(
+            _alertas_ubicacion(por_ubicacion.iterator(chunk_size=TAMANO_LOTE)),
+            batch_size=TAMANO_LOTE,
+        )
+
+    return AlertaStock.objects.count()
+
+
+# ============================================
+# CONSULTAS SOBRE EL ÍNDICE
+# ============================================
+
+def alertas_globales():
+    """QuerySet de alertas sobre el stock global"""
+    return AlertaStock.objects.filter(ubicacion__isnull=True)
+
+
+def contar_productos_bajo_stock(ubicacion_id=None):
+    """Número de productos en alerta (stock <= mínimo) en el ámbito indicado"""
+    if ubicacion_id is None:
+        return alertas_globales().count()
+    return AlertaStock.objects.filter(
+        ubicacion_id=ubicacion_id,
+        stock_minimo__gt=0,
+        cantidad__lte=F('stock_minimo'),
+    ).count()
+
+
+def ids_productos_bajo_stock():
+    """Subconsulta con los IDs de productos en alerta global"""
+    return alertas_globales().values('producto_id')
+
+
+def resumen_alertas():
+    """
+    Resumen para los badges de alertas: totales por ámbito y nivel, y una
+    versión que cambia cada vez que el índice se modifica.
+    """
+    filas = AlertaStock.objects.values('ubicacion_id', 'nivel').annotate(
+        total=Count('id'), ultima=Max('fecha_actualizacion')
+    )
+
+    por_ubicacion = {}
+    total_global = 0
+    total_filas = 0
+    ultima = None
+    for fila in filas:
+        clave = 'global' if fila['ubicacion_id'] is None else str(fila['ubicacion_id'])
+        niveles = por_ubicacion.setdefault(clave, {'total': 0})
+        niveles[fila['nivel']] = fila['total']
+        niveles['total'] += fila['total']
+        if fila['ubicacion_id'] is None:
+            total_global += fila['total']
+        total_filas += fila['total']
+        if fila['ultima'] and (ultima is None or fila['ultima'] > ultima):
+            ultima = fila['ultima']
+
+    version = f"{total_filas}-{int(ultima.timestamp() * 1000) if ultima else 0}"
+    return {
+        'version': version,
+        'total': total_global,
+        'por_ubicacion': por_ubicacion,
+    }
+
+
+# ============================================
+# ACTUALIZACIÓN POR SEÑALES
+# ============================================
+
+@receiver(stock_modificado, dispatch_uid='alertas_stock_por_stock_modificado')
+def _actualizar_por_stock_modificado(sender, producto_ids, ubicacion_id=None, **kwargs):
+    actualizar_alertas_stock(producto_ids, ubicacion_id)
+
+
+@receiver(venta_registrada, dispatch_uid='alertas_stock_por_venta')
+def _actualizar_por_venta(sender, producto_ids, ubicacion_id=None, **kwargs):
+    actualizar_alertas_stock(producto_ids, ubicacion_id)
+
+
+@receiver(post_save, sender=Producto, dispatch_uid='alertas_stock_por_producto')
+def _actualizar_por_producto(sender, instance, **kwargs):
+    actualizar_alertas_stock([instance.pk])
+
+
+@receiver(post_save, sender=StockUbicacion, dispatch_uid='alertas_stock_por_stock_ubicacion')
+def _actualizar_por_stock_ubicacion(sender, instance, **kwargs):
+    actualizar_alertas_stock([instance.producto_id], instance.ubicacion_id)
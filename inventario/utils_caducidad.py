@@ -0,0 +1,438 @@
+"""
+Motor de reportes de caducidad sobre los lotes (LoteProducto)
+
+Los lotes se consultan por rango de fecha_caducidad usando el índice
+(fecha_caducidad, ubicacion). Los totales por rango de vencimiento
+(vencido, 30, 60 y 90 días) se guardan por ubicación en ResumenCaducidad:
+
+    - Cada noche el comando actualizar_resumen_caducidad recalcula todo
+      (los rangos avanzan con la fecha aunque no cambien los lotes).
+    - Cuando cambian los lotes de una ubicación se marca como pendiente
+      (ResumenCaducidad.pendiente, en la base para que lo vean todos los
+      procesos) y se recalcula sólo esa ubicación en la siguiente lectura.
+
+Así el dashboard lee como máximo una fila por ubicación y rango, sin
+importar cuántos lotes existan.
+"""
+import csv
+import os
+import uuid
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import (
+    Case, CharField, Count, DecimalField, ExpressionWrapper, F, Q, Sum, Value, When,
+)
+from django.db.models.functions import Coalesce, NullIf
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from reportes.utils_exportacion import directorio_exportaciones
+from reportes.utils_trabajos import registrar_tarea
+from .models import LoteProducto, ResumenCaducidad, Ubicacion
+from .signals import stock_modificado
+from ventas.signals import venta_registrada
+
+
+RANGOS = (('vencido', None), ('30', 30), ('60', 60), ('90', 90))
+HORIZONTE_DIAS = 90
+DIAS_CRITICOS = 7
+CERO = Decimal('0.00')
+
+CAMPOS_RESUMEN = ['lotes', 'productos', 'unidades', 'valor_costo', 'valor_venta', 'fecha_calculo', 'fecha_actualizacion']
+
+DECIMAL = DecimalField(max_digits=14, decimal_places=2)
+
+
+def lotes_con_saldo():
+    """Lotes activos con unidades disponibles"""
+    return LoteProducto.objects.filter(activo=True, cantidad_disponible__gt=0)
+
+
+def costo_lote():
+    """Costo unitario del lote; si no se registró, el costo del producto"""
+    return Coalesce(
+        NullIf(F('costo_unitario'), Value(CERO)),
+        F('producto__costo_unidad'),
+        output_field=DECIMAL,
+    )
+
+
+def anotar_valores(queryset):
+    """Agrega costo, valor de costo y valor de venta del saldo de cada lote"""
+    return queryset.annotate(
+        costo=costo_lote(),
+        valor_costo=ExpressionWrapper(F('cantidad_disponible') * costo_lote(), output_field=DECIMAL),
+        valor_venta=ExpressionWrapper(F('cantidad_disponible') * F('producto__precio_venta'), output_field=DECIMAL),
+    )
+
+
+def _expresion_rango(hoy):
+    return Case(
+        When(fecha_caducidad__lt=hoy, then=Value('vencido')),
+        When(fecha_caducidad__lte=hoy + timedelta(days=30), then=Value('30')),
+        When(fecha_caducidad__lte=hoy + timedelta(days=60), then=Value('60')),
+        default=Value('90'),
+        output_field=CharField(),
+    )
+
+
+def calcular_resumen_caducidad(ubicacion_ids=None, hoy=None):
+    """
+    Recalcula ResumenCaducidad para las ubicaciones indicadas (None = todas).
+
+    Un GROUP BY (ubicación, rango) sobre el rango fecha_caducidad <= hoy+90,
+    que resuelve el índice (fecha_caducidad, ubicacion).
+
+    Las marcas de pendiente se borran antes de leer los lotes y las filas se
+    actualizan en su lugar sin tocar la marca: un cambio que se confirme
+    durante el cálculo vuelve a marcar la ubicación y no se pierde. Si el
+    cálculo falla se restauran.
+    """
+    hoy = hoy or timezone.now().date()
+    lotes = lotes_con_saldo().filter(fecha_caducidad__lte=hoy + timedelta(days=HORIZONTE_DIAS))
+    if ubicacion_ids is not None:
+        ubicacion_ids = [int(uid) for uid in ubicacion_ids]
+        lotes = lotes.filter(ubicacion_id__in=ubicacion_ids)
+    else:
+        ubicacion_ids = list(Ubicacion.objects.values_list('id', flat=True))
+
+    resumen = ResumenCaducidad.objects.filter(ubicacion_id__in=ubicacion_ids)
+    resumen.filter(pendiente=True).update(pendiente=False)
+    try:
+        nuevos = _filas_resumen(lotes, ubicacion_ids, hoy)
+        with transaction.atomic():
+            existentes = {
+                (ubicacion_id, rango): pk
+                for pk, ubicacion_id, rango in resumen.values_list('id', 'ubicacion_id', 'rango')
+            }
+            for fila in nuevos:
+                fila.id = existentes.get((fila.ubicacion_id, fila.rango))
+            ResumenCaducidad.objects.bulk_update([f for f in nuevos if f.id], CAMPOS_RESUMEN)
+            # Una lectura simultánea puede haber creado las filas entretanto
+            ResumenCaducidad.objects.bulk_create([f for f in nuevos if not f.id], ignore_conflicts=True)
+    except Exception:
+        resumen.update(pendiente=True)
+        raise
+    return len(nuevos)
+
+
+def _filas_resumen(lotes, ubicacion_ids, hoy):
+    """Filas de ResumenCaducidad de las ubicaciones, una por rango"""
+    filas = (
+        lotes.annotate(rango=_expresion_rango(hoy))
+        .values('ubicacion_id', 'rango')
+        .annotate(
+            n_lotes=Count('id'),
+            n_productos=Count('producto_id', distinct=True),
+            total_unidades=Sum('cantidad_disponible'),
+            total_costo=Sum(F('cantidad_disponible') * costo_lote(), output_field=DECIMAL),
+            total_venta=Sum(F('cantidad_disponible') * F('producto__precio_venta'), output_field=DECIMAL),
+        )
+        .order_by()
+    )
+
+    datos = {(uid, rango): None for uid in ubicacion_ids for rango, _ in RANGOS}
+    for fila in filas:
+        datos[(fila['ubicacion_id'], fila['rango'])] = fila
+
+    nuevos = []
+    ahora = timezone.now()
+    for (uid, rango), fila in datos.items():
+        nuevos.append(ResumenCaducidad(
+            ubicacion_id=uid,
+            rango=rango,
+            lotes=fila['n_lotes'] if fila else 0,
+            productos=fila['n_productos'] if fila else 0,
+            unidades=(fila['total_unidades'] or CERO) if fila else CERO,
+            valor_costo=(fila['total_costo'] or CERO) if fila else CERO,
+            valor_venta=(fila['total_venta'] or CERO) if fila else CERO,
+            fecha_calculo=hoy,
+            fecha_actualizacion=ahora,
+        ))
+    return nuevos
+
+
+def marcar_pendiente(*ubicacion_ids):
+    """
+    Marca ubicaciones cuyo resumen debe recalcularse en la próxima lectura.
+
+    La marca se pone al confirmar la transacción, cuando el cambio ya es
+    visible para el recálculo. Una ubicación sin filas de resumen no se
+    marca: se calcula igual en la próxima lectura.
+    """
+    ubicacion_ids = [uid for uid in ubicacion_ids if uid is not None]
+    if ubicacion_ids:
+        transaction.on_commit(lambda: ResumenCaducidad.objects.filter(
+            ubicacion_id__in=ubicacion_ids, pendiente=False
+        ).update(pendiente=True))
+
+
+def obtener_resumen_caducidad(ubicacion_id=None):
+    """
+    Totales por rango de vencimiento (sumados o de una ubicación).
+
+    Recalcula antes sólo las ubicaciones marcadas como pendientes o cuyo
+    resumen es de un día anterior.
+
+    Returns:
+        {rango: {'lotes', 'productos', 'unidades', 'valor_costo', 'valor_venta'}}
+    """
+    hoy = timezone.now().date()
+    if ubicacion_id is not None:
+        ubicacion_ids = [int(ubicacion_id)]
+    else:
+        ubicacion_ids = list(Ubicacion.objects.values_list('id', flat=True))
+    resumen = ResumenCaducidad.objects.filter(ubicacion_id__in=ubicacion_ids)
+    filas = list(resumen)
+
+    # Ubicaciones sin resumen, con resumen de otro día o marcadas como pendientes
+    vigentes = {fila.ubicacion_id for fila in filas if fila.fecha_calculo == hoy}
+    recalcular = set(ubicacion_ids) - vigentes
+    recalcular.update(fila.ubicacion_id for fila in filas if fila.pendiente)
+
+    if recalcular:
+        calcular_resumen_caducidad(sorted(recalcular), hoy=hoy)
+        filas = list(resumen.all())
+
+    totales = {rango: {'lotes': 0, 'productos': 0, 'unidades': CERO, 'valor_costo': CERO, 'valor_venta': CERO}
+               for rango, _ in RANGOS}
+    for fila in filas:
+        total = totales[fila.rango]
+        total['lotes'] += fila.lotes
+        # Un producto puede tener lotes en varias ubicaciones: es una cota superior
+        total['productos'] += fila.productos
+        total['unidades'] += fila.unidades
+        total['valor_costo'] += fila.valor_costo
+        total['valor_venta'] += fila.valor_venta
+    return totales
+
+
+def lotes_criticos(limite=10, dias=DIAS_CRITICOS, ubicacion_id=None):
+    """Lotes vencidos o que vencen en los próximos días (rango del índice)"""
+    hoy = timezone.now().date()
+    lotes = lotes_con_saldo().filter(fecha_caducidad__lte=hoy + timedelta(days=dias))
+    if ubicacion_id is not None:
+        lotes = lotes.filter(ubicacion_id=ubicacion_id)
+    return lotes.select_related('producto', 'ubicacion').order_by('fecha_caducidad', 'id')[:limite]
+
+
+def filtrar_lotes_reporte(hoy, fecha_limite, filtro_estado='todos', filtro_laboratorio='todos'):
+    """Lotes del reporte de caducados con sus filtros (parámetros enlazados)"""
+    lotes = lotes_con_saldo().filter(producto__activo=True, producto__anulado=False)
+    if filtro_estado == 'vencidos':
+        lotes = lotes.filter(fecha_caducidad__lt=hoy)
+    elif filtro_estado == 'por_vencer':
+        lotes = lotes.filter(fecha_caducidad__gte=hoy, fecha_caducidad__lte=fecha_limite)
+    elif filtro_estado == 'vigentes':
+        lotes = lotes.filter(fecha_caducidad__gt=fecha_limite)
+    if filtro_laboratorio != 'todos' and str(filtro_laboratorio).isdigit():
+        lotes = lotes.filter(producto__id_laboratorio_id=int(filtro_laboratorio))
+    return lotes
+
+
+def estadisticas_lotes(lotes, hoy, fecha_limite):
+    """Conteos y valores por estado en una sola consulta agregada"""
+    vencido = Q(fecha_caducidad__lt=hoy)
+    por_vencer = Q(fecha_caducidad__gte=hoy, fecha_caducidad__lte=fecha_limite)
+    valor = F('cantidad_disponible') * costo_lote()
+    datos = lotes.aggregate(
+        total=Count('id'),
+        vencidos=Count('id', filter=vencido),
+        por_vencer=Count('id', filter=por_vencer),
+        vigentes=Count('id', filter=Q(fecha_caducidad__gt=fecha_limite)),
+        valor_vencidos=Sum(valor, filter=vencido, output_field=DECIMAL),
+        valor_por_vencer=Sum(valor, filter=por_vencer, output_field=DECIMAL),
+    )
+    valor_vencidos = datos['valor_vencidos'] or CERO
+    valor_por_vencer = datos['valor_por_vencer'] or CERO
+    return {
+        'total_productos': datos['total'],
+        'productos_vencidos': datos['vencidos'],
+        'productos_por_vencer': datos['por_vencer'],
+        'productos_vigentes': datos['vigentes'],
+        'valor_total_vencidos': float(valor_vencidos),
+        'valor_total_por_vencer': float(valor_por_vencer),
+        'perdida_total_estimada': float(valor_vencidos + valor_por_vencer),
+    }
+
+
+def parametros_reporte(dias=30, estado='todos', laboratorio='todos', incluir_sin_fecha=False, fecha_actual=None):
+    """Filtros del reporte de caducados normalizados"""
+    try:
+        dias_anticipacion = int(dias)
+    except (TypeError, ValueError):
+        dias_anticipacion = 30
+    fecha_actual = fecha_actual or timezone.now().date()
+    return {
+        'dias_anticipacion': dias_anticipacion,
+        'filtro_estado': estado,
+        'filtro_laboratorio': laboratorio,
+        # Los lotes siempre tienen fecha de caducidad; se conserva por compatibilidad
+        'incluir_sin_fecha': incluir_sin_fecha,
+        'fecha_actual': fecha_actual,
+        'fecha_limite': fecha_actual + timedelta(days=dias_anticipacion),
+    }
+
+
+def lotes_reporte(parametros):
+    """Lotes del reporte como diccionarios, ordenados por fecha de caducidad (índice)"""
+    lotes = filtrar_lotes_reporte(
+        parametros['fecha_actual'], parametros['fecha_limite'],
+        parametros['filtro_estado'], parametros['filtro_laboratorio'],
+    )
+    return anotar_valores(lotes).values(
+        'id', 'producto_id', 'numero_lote', 'fecha_caducidad', 'cantidad_disponible', 'costo',
+        'valor_costo', 'valor_venta', 'ubicacion__nombre',
+        'producto__codigo_principal', 'producto__nombre', 'producto__precio_venta',
+        'producto__id_categoria__nombre', 'producto__id_laboratorio__nombre',
+    ).order_by('fecha_caducidad', 'producto__nombre', 'id')
+
+
+def fila_lote(lote, fecha_actual, fecha_limite):
+    """Convierte un lote en la fila que muestran el reporte y la exportación"""
+    dias_restantes = (lote['fecha_caducidad'] - fecha_actual).days
+    costo_total = lote['valor_costo'] or CERO
+    precio_total = lote['valor_venta'] or CERO
+
+    # Determinar la clase CSS y prioridad según el estado
+    if dias_restantes < 0:
+        estado = 'vencido'
+        clase_css = 'table-danger'
+        prioridad = 'Alta'
+        icono = 'fas fa-exclamation-triangle text-danger'
+    elif lote['fecha_caducidad'] <= fecha_limite:
+        estado = 'por_vencer'
+        if dias_restantes <= 7:
+            clase_css = 'table-warning'
+            prioridad = 'Alta'
+            icono = 'fas fa-exclamation-circle text-warning'
+        else:
+            clase_css = 'table-info'
+            prioridad = 'Media'
+            icono = 'fas fa-info-circle text-info'
+    else:
+        estado = 'vigente'
+        clase_css = ''
+        prioridad = 'Baja'
+        icono = 'fas fa-check-circle text-success'
+
+    return {
+        'id': lote['producto_id'],
+        'lote_id': lote['id'],
+        'numero_lote': lote['numero_lote'],
+        'ubicacion': lote['ubicacion__nombre'],
+        'codigo': lote['producto__codigo_principal'],
+        'nombre': lote['producto__nombre'],
+        'stock': float(lote['cantidad_disponible']),
+        'costo_unitario': float(lote['costo'] or 0),
+        'precio_unitario': float(lote['producto__precio_venta'] or 0),
+        'categoria': lote['producto__id_categoria__nombre'] or 'Sin categoría',
+        'laboratorio': lote['producto__id_laboratorio__nombre'] or 'Sin laboratorio',
+        'fecha_vencimiento': lote['fecha_caducidad'],
+        'estado': estado,
+        'dias_restantes': dias_restantes,
+        'dias_restantes_abs': abs(dias_restantes),
+        'costo_total': float(costo_total),
+        'precio_total': float(precio_total),
+        'perdida_potencial': float(precio_total - costo_total),
+        'clase_css': clase_css,
+        'prioridad': prioridad,
+        'icono': icono
+    }
+
+
+class _Eco:
+    """Pseudo-archivo para csv.writer: devuelve la línea en lugar de guardarla"""
+
+    def write(self, valor):
+        return valor
+
+
+def generar_csv_caducados(parametros):
+    """Líneas CSV del reporte de caducados (se leen los lotes por bloques)"""
+    fecha_actual = parametros['fecha_actual']
+    fecha_limite = parametros['fecha_limite']
+    writer = csv.writer(_Eco())
+
+    yield '\ufeff'  # BOM para UTF-8
+
+    # Encabezados
+    yield writer.writerow([
+        'Código',
+        'Nombre del Producto',
+        'Lote',
+        'Ubicación',
+        'Categoría',
+        'Laboratorio',
+        'Stock',
+        'Fecha Vencimiento',
+        'Días Restantes',
+        'Estado',
+        'Prioridad',
+        'Costo Unitario',
+        'Precio Unitario',
+        'Valor Total Stock',
+        'Pérdida Potencial'
+    ])
+
+    for lote in lotes_reporte(parametros).iterator(chunk_size=2000):
+        producto = fila_lote(lote, fecha_actual, fecha_limite)
+        yield writer.writerow([
+            producto['codigo'],
+            producto['nombre'],
+            producto['numero_lote'],
+            producto['ubicacion'],
+            producto['categoria'],
+            producto['laboratorio'],
+            producto['stock'],
+            producto['fecha_vencimiento'],
+            producto['dias_restantes'],
+            producto['estado'].replace('_', ' ').title(),
+            producto['prioridad'],
+            f"${producto['costo_unitario']:.2f}",
+            f"${producto['precio_unitario']:.2f}",
+            f"${producto['costo_total']:.2f}",
+            f"${producto['perdida_potencial']:.2f}"
+        ])
+
+
+@registrar_tarea('inventario.caducados_csv', ttl=600)
+def tarea_exportar_caducados(parametros):
+    """Exportación de caducados como archivo descargable (cola de reportes)"""
+    filtros = parametros_reporte(
+        parametros['dias'], parametros['estado'], parametros['laboratorio'],
+        fecha_actual=date.fromisoformat(parametros['fecha']),
+    )
+    nombre_archivo = f'productos_caducados_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+    ruta = os.path.join(directorio_exportaciones(), f'{uuid.uuid4().hex}_{nombre_archivo}')
+    filas = -2  # BOM y encabezados
+    with open(ruta, 'w', encoding='utf-8', newline='') as destino:
+        for linea in generar_csv_caducados(filtros):
+            destino.write(linea)
+            filas += 1
+    return {'archivo': ruta, 'nombre_archivo': nombre_archivo, 'formato': 'csv', 'filas': filas}
+
+
+# ---------- actualización incremental ----------
+
+@receiver(post_save, sender=LoteProducto, dispatch_uid='caducidad_por_lote_guardado')
+@receiver(post_delete, sender=LoteProducto, dispatch_uid='caducidad_por_lote_eliminado')
+def _marcar_por_lote(sender, instance, **kwargs):
+    marcar_pendiente(instance.ubicacion_id)
+
+
+@receiver(stock_modificado, dispatch_uid='caducidad_por_stock_modificado')
+def _marcar_por_stock_modificado(sender, producto_ids, ubicacion_id=None, **kwargs):
+    # Transferencias y ajustes actualizan lotes con UPDATE masivos (sin post_save)
+    if ubicacion_id is not None:
+        marcar_pendiente(ubicacion_id)
+
+
+@receiver(venta_registrada, dispatch_uid='caducidad_por_venta')
+def _marcar_por_venta(sender, factura_id, producto_ids, ubicacion_id=None, **kwargs):
+    # La venta descuenta lotes FEFO de la ubicación de la caja
+    if ubicacion_id is not None:
+        marcar_pendiente(ubicacion_id)
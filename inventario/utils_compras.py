@@ -0,0 +1,141 @@
+"""
+Registro de compras por conjuntos
+
+nueva_compra delega aquí. Los productos de la compra se validan con una
+sola consulta, los detalles y el kardex se insertan con bulk_create y el
+stock se incrementa con el servicio de movimientos (utils_movimientos: un
+UPDATE atómico stock = stock + CASE id ...), de modo que una venta
+simultánea sobre el mismo producto no pierde su descuento ni la compra su
+ingreso. Con una ubicación de recepción (VENTAS_STOCK_POR_UBICACION) la
+compra suma también al stock de esa sucursal.
+"""
+import re
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+
+from productos.models import Producto
+from .models import Compra, DetalleCompra, Kardex
+from .utils_movimientos import Movimiento, aplicar_en_ubicacion, aplicar_movimientos
+
+
+IVA = Decimal('0.15')
+CENTAVOS = Decimal('0.01')
+PATRON_LINEA = re.compile(r'^productos\[(\w+)\]\[(\w+)\]$')
+
+
+def leer_lineas_compra(post):
+    """
+    Extrae las líneas productos[i][id|cantidad|precio] del POST.
+
+    Las líneas repetidas del mismo producto se suman (un detalle por
+    producto); el precio es el de la última línea.
+
+    Returns:
+        dict producto_id -> {'cantidad': int, 'precio': Decimal}
+    """
+    productos_data = {}
+    for key, value in post.items():
+        coincidencia = PATRON_LINEA.match(key)
+        if coincidencia:
+            index, field = coincidencia.groups()
+            productos_data.setdefault(index, {})[field] = value
+
+    lineas = {}
+    for producto_data in productos_data.values():
+        if not all(key in producto_data for key in ['id', 'cantidad', 'precio']):
+            continue
+        try:
+            producto_id = int(producto_data['id'])
+            cantidad = int(producto_data['cantidad'])
+            precio = Decimal(producto_data['precio'])
+        except (ValueError, InvalidOperation):
+            raise ValueError(f'Línea de compra inválida: {producto_data}')
+        if cantidad <= 0:
+            raise ValueError('La cantidad de cada producto debe ser mayor a cero')
+
+        linea = lineas.setdefault(producto_id, {'cantidad': 0, 'precio': precio})
+        linea['cantidad'] += cantidad
+        linea['precio'] = precio
+    return lineas
+
+
+def registrar_compra(usuario, datos, lineas, ubicacion_id=None):
+    """
+    Registra una compra con sus detalles, ingreso de stock y kardex.
+
+    Args:
+        usuario: usuario que registra
+        datos: dict con numero_compra, numero_factura_proveedor, fecha_factura,
+               proveedor_id, tipo_pago, observaciones y descuento
+        lineas: dict producto_id -> {'cantidad', 'precio'} (ver leer_lineas_compra)
+        ubicacion_id: ubicación que recibe la mercadería, o None para sumar
+               sólo al stock global
+
+    Returns:
+        la Compra creada
+    """
+    if not lineas:
+        raise ValueError('La compra no tiene productos')
+
+    existentes = set(Producto.objects.filter(id__in=list(lineas)).values_list('id', flat=True))
+    faltantes = sorted(set(lineas) - existentes)
+    if faltantes:
+        raise Producto.DoesNotExist(f'Productos no encontrados: {", ".join(map(str, faltantes))}')
+
+    subtotal = sum((linea['cantidad'] * linea['precio'] for linea in lineas.values()), Decimal('0'))
+    descuento = Decimal(str(datos.get('descuento') or 0))
+    impuesto = ((subtotal - descuento) * IVA).quantize(CENTAVOS)
+
+    with transaction.atomic():
+        compra = Compra.objects.create(
+            numero_compra=datos['numero_compra'],
+            numero_factura_proveedor=datos.get('numero_factura_proveedor', ''),
+            fecha_factura=datos.get('fecha_factura'),
+            proveedor_id=datos.get('proveedor_id'),
+            usuario=usuario,
+            tipo_pago=datos.get('tipo_pago') or 'efectivo',
+            observaciones=datos.get('observaciones', ''),
+            subtotal=subtotal,
+            descuento=descuento,
+            impuesto=impuesto,
+            total=subtotal - descuento + impuesto,
+        )
+
+        DetalleCompra.objects.bulk_create([
+            DetalleCompra(
+                compra=compra,
+                producto_id=producto_id,
+                cantidad=linea['cantidad'],
+                precio_unitario=linea['precio'],
+            )
+            for producto_id, linea in lineas.items()
+        ])
+
+        movimientos = [
+            Movimiento(producto_id, linea['cantidad'], 'COMPRA', f'Compra {compra.numero_compra}')
+            for producto_id, linea in lineas.items()
+        ]
+        if ubicacion_id is None:
+            saldos = aplicar_movimientos(movimientos, usuario=usuario, sender=Compra)
+        else:
+            _, saldos = aplicar_en_ubicacion(movimientos, ubicacion_id, usuario=usuario, sender=Compra)
+
+        Kardex.objects.bulk_create([
+            Kardex(
+                producto_id=producto_id,
+                tipo_movimiento='entrada',
+                concepto='compra',
+                cantidad=linea['cantidad'],
+                precio_unitario=linea['precio'],
+                saldo_cantidad=max(int(saldos[producto_id]), 0),
+                saldo_valor=(saldos[producto_id] * linea['precio']).quantize(CENTAVOS),
+                numero_documento=compra.numero_compra,
+                observaciones=f'Compra {compra.numero_compra}',
+                usuario=usuario,
+            )
+            for producto_id, linea in lineas.items()
+        ])
+
+    return compra
+
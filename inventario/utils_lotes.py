@@ -0,0 +1,209 @@
+"""
+Asignación de lotes FEFO (First Expired, First Out) para ventas
+
+Cada venta descuenta las cantidades de los lotes (LoteProducto) de la
+ubicación de la caja, empezando por el lote que vence primero. Para no
+consultar todos los lotes en cada ticket, el proceso mantiene en memoria,
+por ubicación y producto, los lotes con saldo ordenados por
+(fecha_caducidad, fecha_ingreso, id).
+
+Por ticket el costo es constante:
+    1. Plan de asignación con los datos en memoria (sin consultas)
+    2. SELECT ... FOR UPDATE de los lotes elegidos (verifica saldos reales)
+    3. Un solo UPDATE con CASE por id para todos los descuentos
+
+Si los saldos reales no coinciden con la memoria (otro proceso vendió o
+recibió stock) se recargan sólo esos productos y se vuelve a planificar.
+La asignación es "best effort": los productos sin lotes suficientes se
+venden igual (el stock del producto sigue siendo la referencia) y se
+devuelven como faltantes.
+"""
+import threading
+import time
+from datetime import date
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F
+from django.dispatch import receiver
+
+from .models import LoteProducto
+from .signals import stock_modificado
+from .utils_transferencias import case_por_id
+
+
+CERO = Decimal('0.00')
+
+
+class AsignadorLotesFEFO:
+    """Caché por ubicación de lotes ordenados FEFO y asignación por ticket"""
+
+    def __init__(self, ttl=120):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # ubicacion_id -> {producto_id: [[fecha_caducidad, fecha_ingreso, lote_id, disponible], ...]}
+        self._lotes = {}
+        self._cargado = {}  # ubicacion_id -> instante de carga
+
+    # ---------- caché ----------
+
+    def _lotes_ubicacion(self, ubicacion_id):
+        ahora = time.monotonic()
+        if ahora - self._cargado.get(ubicacion_id, 0) > self.ttl:
+            self._lotes[ubicacion_id] = {}
+            self._cargado[ubicacion_id] = ahora
+        return self._lotes[ubicacion_id]
+
+    @staticmethod
+    def _consultar_lotes(ubicacion_id, producto_ids, bloquear=False):
+        """Lotes vigentes con saldo, agrupados por producto y en orden FEFO"""
+        qs = LoteProducto.objects.filter(
+            ubicacion_id=ubicacion_id,
+            producto_id__in=producto_ids,
+            activo=True,
+            fecha_caducidad__gte=date.today(),
+            cantidad_disponible__gt=F('cantidad_reservada'),
+        ).order_by('fecha_caducidad', 'fecha_ingreso', 'id')
+        if bloquear:
+            qs = qs.select_for_update()
+
+        resultado = {pid: [] for pid in producto_ids}
+        for pid, caducidad, ingreso, lote_id, disponible, reservada in qs.values_list(
+            'producto_id', 'fecha_caducidad', 'fecha_ingreso', 'id', 'cantidad_disponible', 'cantidad_reservada'
+        ):
+            resultado[pid].append([caducidad, ingreso, lote_id, disponible - reservada])
+        return resultado
+
+    def _asegurar_productos(self, ubicacion_id, producto_ids):
+        with self._lock:
+            lotes = self._lotes_ubicacion(ubicacion_id)
+            faltantes = [pid for pid in producto_ids if pid not in lotes]
+        if faltantes:
+            consultado = self._consultar_lotes(ubicacion_id, faltantes)
+            with self._lock:
+                self._lotes_ubicacion(ubicacion_id).update(consultado)
+
+    def invalidar(self, ubicacion_id, producto_ids=None):
+        with self._lock:
+            lotes = self._lotes.get(ubicacion_id)
+            if lotes is None:
+                return
+            if producto_ids is None:
+                lotes.clear()
+            else:
+                for pid in producto_ids:
+                    lotes.pop(int(pid), None)
+
+    def limpiar(self):
+        with self._lock:
+            self._lotes.clear()
+            self._cargado.clear()
+
+    # ---------- asignación ----------
+
+    @staticmethod
+    def _planificar(lotes_producto, cantidad):
+        """Reparte la cantidad entre los lotes en orden FEFO"""
+        plan = []
+        pendiente = cantidad
+        for _, _, lote_id, disponible in lotes_producto:
+            if pendiente <= 0:
+                break
+            if disponible <= 0:
+                continue
+            tomado = min(disponible, pendiente)
+            plan.append((lote_id, tomado))
+            pendiente -= tomado
+        return plan, pendiente
+
+    def asignar(self, ubicacion_id, items):
+        """
+        Asigna y descuenta lotes para todos los productos de un ticket.
+
+        Debe llamarse dentro de transaction.atomic().
+
+        Args:
+            ubicacion_id: ubicación (sucursal) de la venta
+            items: lista de (producto_id, cantidad)
+
+        Returns:
+            {
+                'asignaciones': [(producto_id, lote_id, cantidad), ...],
+                'faltantes': {producto_id: cantidad sin lote},
+            }
+        """
+        cantidades = {}
+        for producto_id, cantidad in items:
+            cantidades[int(producto_id)] = cantidades.get(int(producto_id), CERO) + Decimal(str(cantidad))
+        if ubicacion_id is None or not cantidades:
+            return {'asignaciones': [], 'faltantes': cantidades}
+
+        self._asegurar_productos(ubicacion_id, list(cantidades))
+
+        # 1. Plan con los datos en memoria
+        with self._lock:
+            lotes = self._lotes_ubicacion(ubicacion_id)
+            planes = {pid: self._planificar(lotes.get(pid, []), cantidad)
+                      for pid, cantidad in cantidades.items()}
+
+        # Productos que en memoria no alcanzan: pueden tener lotes nuevos
+        recargar = {pid for pid, (_, pendiente) in planes.items() if pendiente > 0}
+
+        # 2. Bloquear los lotes elegidos y verificar saldos reales
+        elegidos = {lote_id: tomado for plan, _ in planes.values() for lote_id, tomado in plan}
+        if elegidos:
+            reales = dict(
+                (lote_id, disponible - reservada)
+                for lote_id, disponible, reservada in LoteProducto.objects.select_for_update().filter(
+                    id__in=elegidos
+                ).order_by('id').values_list('id', 'cantidad_disponible', 'cantidad_reservada')
+            )
+            for pid, (plan, _) in planes.items():
+                if any(reales.get(lote_id, CERO) < tomado for lote_id, tomado in plan):
+                    recargar.add(pid)
+
+        if recargar:
+            frescos = self._consultar_lotes(ubicacion_id, sorted(recargar), bloquear=True)
+            for pid in recargar:
+                planes[pid] = self._planificar(frescos[pid], cantidades[pid])
+            with self._lock:
+                self._lotes_ubicacion(ubicacion_id).update(frescos)
+
+        # 3. Un solo UPDATE para todos los descuentos
+        descuentos = {}
+        asignaciones = []
+        faltantes = {}
+        for pid, (plan, pendiente) in planes.items():
+            for lote_id, tomado in plan:
+                descuentos[lote_id] = descuentos.get(lote_id, CERO) + tomado
+                asignaciones.append((pid, lote_id, tomado))
+            if pendiente > 0:
+                faltantes[pid] = pendiente
+
+        if descuentos:
+            LoteProducto.objects.filter(id__in=descuentos).update(
+                cantidad_disponible=F('cantidad_disponible') - case_por_id(descuentos)
+            )
+            transaction.on_commit(lambda: self._aplicar_descuentos(ubicacion_id, descuentos))
+
+        return {'asignaciones': asignaciones, 'faltantes': faltantes}
+
+    def _aplicar_descuentos(self, ubicacion_id, descuentos):
+        """Refleja en memoria los descuentos ya confirmados en la base"""
+        with self._lock:
+            for lotes_producto in self._lotes.get(ubicacion_id, {}).values():
+                for entrada in lotes_producto:
+                    descuento = descuentos.get(entrada[2])
+                    if descuento:
+                        entrada[3] -= descuento
+                lotes_producto[:] = [entrada for entrada in lotes_producto if entrada[3] > 0]
+
+
+asignador_lotes = AsignadorLotesFEFO()
+
+
+@receiver(stock_modificado, dispatch_uid='lotes_fefo_por_stock_modificado')
+def _invalidar_por_stock_modificado(sender, producto_ids, ubicacion_id=None, **kwargs):
+    # Transferencias, compras y ajustes pueden crear lotes nuevos en la ubicación
+    if ubicacion_id is not None:
+        asignador_lotes.invalidar(ubicacion_id, producto_ids)
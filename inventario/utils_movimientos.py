@@ -0,0 +1,180 @@
+"""
+Servicio único de movimientos de stock (libro de inventario)
+
+Todos los módulos que cambian stock (ventas, compras, ingresos de
+productos, anulaciones, ajustes por ubicación) aplican sus cambios aquí
+como un lote de movimientos con cantidad con signo:
+
+    1. Un UPDATE atómico por lote: stock = stock + CASE id WHEN ... END.
+       Ningún proceso lee un saldo para escribir después un valor absoluto,
+       así que dos movimientos simultáneos sobre el mismo producto no se
+       pisan.
+    2. Una lectura de los saldos resultantes (las filas siguen bloqueadas
+       por el UPDATE hasta el fin de la transacción, por lo que el saldo
+       leído es exactamente el de este lote).
+    3. Un bulk_create en kardex_movimientos con el saldo después de cada
+       movimiento.
+    4. stock_modificado al confirmar la transacción (alertas, cachés).
+
+Ámbitos:
+    - Global (ubicacion_id=None): productos.stock
+    - Por ubicación: StockUbicacion.cantidad (las filas faltantes se crean
+      en cero antes de aplicar el lote)
+    - Ubicación y total (aplicar_en_ubicacion): el lote se aplica a la
+      ubicación, con su kardex, y al total de la empresa sin kardex. Lo usan
+      ventas, compras e ingresos con VENTAS_STOCK_POR_UBICACION.
+"""
+from collections import namedtuple
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from productos.models import Producto
+from .models import KardexMovimiento, StockUbicacion
+from .signals import notificar_stock_modificado
+from .utils_transferencias import case_por_id
+
+
+TAMANO_LOTE = 500
+CERO = Decimal('0.00')
+
+
+Movimiento = namedtuple('Movimiento', ['producto_id', 'cantidad', 'tipo', 'detalle'])
+Movimiento.__doc__ = """
+Movimiento de stock.
+
+    producto_id: producto afectado
+    cantidad: positiva para ingresos, negativa para egresos
+    tipo: tipoMovimiento del kardex (VENTA, COMPRA, AJUSTE INGRESO...)
+    detalle: detalle del kardex (ej: Factura Venta N° 001-001-000000015)
+"""
+
+
+class StockInsuficiente(ValueError):
+    """Un lote dejaría el stock de algún producto en negativo"""
+
+    def __init__(self, faltantes):
+        self.faltantes = faltantes  # producto_id -> saldo que quedaría
+        detalle = ', '.join(f'producto {pid}: {saldo}' for pid, saldo in sorted(faltantes.items()))
+        super().__init__(f'Stock insuficiente ({detalle})')
+
+
+def _sumar_por_producto(movimientos):
+    deltas = {}
+    for movimiento in movimientos:
+        deltas[movimiento.producto_id] = deltas.get(movimiento.producto_id, CERO) + Decimal(str(movimiento.cantidad))
+    return deltas
+
+
+def _aplicar_global(deltas):
+    Producto.objects.filter(id__in=deltas).update(stock=F('stock') + case_por_id(deltas))
+    return dict(Producto.objects.filter(id__in=deltas).values_list('id', 'stock'))
+
+
+def _aplicar_ubicacion(deltas, ubicacion_id, usuario):
+    StockUbicacion.objects.bulk_create(
+        [StockUbicacion(producto_id=pid, ubicacion_id=ubicacion_id, creadoPor=usuario) for pid in deltas],
+        batch_size=TAMANO_LOTE,
+        ignore_conflicts=True,
+    )
+    # case_por_id compara con la columna id: se traducen los deltas a ids de StockUbicacion
+    filas = dict(StockUbicacion.objects.filter(
+        ubicacion_id=ubicacion_id, producto_id__in=deltas
+    ).values_list('producto_id', 'id'))
+    por_fila = {filas[pid]: delta for pid, delta in deltas.items()}
+    # editadoDate es la versión de la caché de stock en memoria (utils_stock)
+    StockUbicacion.objects.filter(id__in=por_fila).update(
+        cantidad=F('cantidad') + case_por_id(por_fila),
+        editadoPor=usuario,
+        editadoDate=timezone.now(),
+    )
+    return dict(StockUbicacion.objects.filter(id__in=por_fila).values_list('producto_id', 'cantidad'))
+
+
+def aplicar_movimientos(movimientos, ubicacion_id=None, usuario=None, permitir_negativo=True,
+                        registrar_kardex=True, notificar=True, sender=None):
+    """
+    Aplica un lote de movimientos de stock de forma atómica.
+
+    Args:
+        movimientos: lista de Movimiento (puede repetir productos)
+        ubicacion_id: None para el stock global, o la ubicación de StockUbicacion
+        usuario: usuario que registra (auditoría de StockUbicacion)
+        permitir_negativo: si es False y algún saldo queda negativo se
+            lanza StockInsuficiente y no se aplica nada
+        registrar_kardex: escribir una fila de kardex_movimientos por movimiento
+        notificar: emitir stock_modificado (False si el llamador ya emite
+            otra señal que invalida lo mismo, como venta_registrada)
+        sender: remitente de stock_modificado
+
+    Returns:
+        dict producto_id -> saldo después del lote
+    """
+    movimientos = [m for m in movimientos if m.cantidad]
+    if not movimientos:
+        return {}
+
+    deltas = _sumar_por_producto(movimientos)
+
+    with transaction.atomic():
+        if ubicacion_id is None:
+            saldos = _aplicar_global(deltas)
+        else:
+            saldos = _aplicar_ubicacion(deltas, ubicacion_id, usuario)
+
+        faltantes = set(deltas) - set(saldos)
+        if faltantes:
+            raise Producto.DoesNotExist(f'Productos no encontrados: {", ".join(map(str, sorted(faltantes)))}')
+
+        if not permitir_negativo:
+            negativos = {pid: saldo for pid, saldo in saldos.items() if saldo < 0}
+            if negativos:
+                raise StockInsuficiente(negativos)
+
+        if registrar_kardex:
+            # Saldo después de cada movimiento: se parte del saldo previo al lote
+            corriente = {pid: saldos[pid] - delta for pid, delta in deltas.items()}
+            filas = []
+            for movimiento in movimientos:
+                cantidad = Decimal(str(movimiento.cantidad))
+                corriente[movimiento.producto_id] += cantidad
+                filas.append(KardexMovimiento(
+                    idProducto=movimiento.producto_id,
+                    idUbicacion=ubicacion_id,
+                    tipoMovimiento=movimiento.tipo,
+                    detalle=movimiento.detalle[:300],
+                    ingreso=cantidad if cantidad > 0 else CERO,
+                    egreso=-cantidad if cantidad < 0 else CERO,
+                    saldo=corriente[movimiento.producto_id],
+                ))
+            KardexMovimiento.objects.bulk_create(filas, batch_size=TAMANO_LOTE)
+
+        if notificar:
+            notificar_stock_modificado(sender, list(saldos), ubicacion_id=ubicacion_id, saldos=saldos)
+
+    return saldos
+
+
+def aplicar_en_ubicacion(movimientos, ubicacion_id, usuario=None, permitir_negativo=True,
+                         notificar=True, sender=None):
+    """
+    Aplica un lote a StockUbicacion de una ubicación y a productos.stock.
+
+    El kardex se registra una sola vez, con el idUbicacion de la ubicación;
+    el total de la empresa sólo acompaña (los reportes de kardex suman todas
+    las filas del producto). permitir_negativo se evalúa contra el stock de
+    la ubicación. El total se actualiza al final: su UPDATE bloquea la fila
+    del producto, compartida por todas las sucursales, hasta el commit.
+
+    Returns:
+        (saldos de la ubicación, saldos del total), dicts producto_id -> saldo
+    """
+    with transaction.atomic():
+        saldos = aplicar_movimientos(
+            movimientos, ubicacion_id=ubicacion_id, usuario=usuario,
+            permitir_negativo=permitir_negativo, notificar=notificar, sender=sender,
+        )
+        totales = aplicar_movimientos(movimientos, registrar_kardex=False, notificar=notificar, sender=sender)
+    return saldos, totales
@@ -0,0 +1,217 @@
+"""
+Pronóstico de demanda y cálculo automático de puntos de reorden
+
+La demanda diaria de cada (producto, ubicación) se obtiene de las ventas no
+anuladas (facturas_venta_detalle), asignando cada factura a la ubicación
+de la caja en que se cobró. Las ventas se agregan en la base de datos por
+producto, ubicación y día, por ventanas de fechas, y en Python se pronostica
+con promedio móvil o suavizado exponencial simple sobre la serie diaria
+(los días sin venta cuentan como demanda cero).
+
+Con la demanda pronosticada se calculan:
+    stock de seguridad = Z * desviación diaria * raíz(días de reposición)
+    punto de reorden   = demanda diaria * días de reposición + stock de seguridad
+    cantidad a pedir   = demanda diaria * días de cobertura
+
+y se guardan con bulk_update en StockUbicacion (stock_minimo, punto_reorden,
+stock_maximo) y ConfiguracionStock (además cantidad_reorden). Solo se
+actualizan las combinaciones con ventas en el período: los productos sin
+movimiento conservan los niveles ingresados a mano.
+
+Se ejecuta cada noche con el comando calcular_puntos_reorden.
+"""
+import math
+from datetime import date, timedelta
+from decimal import Decimal, ROUND_CEILING
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import ConfiguracionStock, StockUbicacion, Ubicacion
+from .signals import notificar_stock_modificado
+
+
+DIAS_HISTORIAL = 90
+DIAS_VENTANA = 31  # días de ventas agregados por consulta
+DIAS_REPOSICION = 7  # tiempo de entrega del proveedor
+DIAS_COBERTURA = 30  # días de demanda que cubre un pedido
+FACTOR_SERVICIO = 1.65  # Z para ~95% de nivel de servicio
+ALFA = 0.3  # suavizado exponencial
+TAMANO_LOTE = 500
+
+METODOS = ('exponencial', 'promedio')
+
+
+def cargar_demanda_diaria(fecha_inicio, fecha_fin, dias_ventana=DIAS_VENTANA):
+    """
+    Ventas diarias por (producto, ubicación) entre fecha_inicio y fecha_fin.
+
+    Returns:
+        dict (producto_id, ubicacion_id) -> {dia (índice desde fecha_inicio): unidades}
+    """
+    ubicacion_principal = Ubicacion.objects.filter(
+        es_principal=True, activo=True
+    ).values_list('id', flat=True).first()
+
+    series = {}
+    desde = fecha_inicio
+    with connection.cursor() as cursor:
+        while desde <= fecha_fin:
+            hasta = min(desde + timedelta(days=dias_ventana), fecha_fin + timedelta(days=1))
+            # Las facturas sin caja o de cajas sin ubicación se asignan a la principal
+            cursor.execute("""
+                SELECT fvd.idProducto,
+                       COALESCE(c.idUbicacion, %s),
+                       DATE(fv.fechaEmision),
+                       SUM(fvd.cantidad)
+                FROM facturas_venta_detalle fvd
+                JOIN facturas_venta fv ON fvd.idFacturaVenta = fv.id
+                LEFT JOIN cierres_caja cc ON fv.idCierreCaja = cc.id
+                LEFT JOIN cajas c ON cc.idCaja = c.id
+                WHERE fv.fechaEmision >= %s AND fv.fechaEmision < %s
+                AND fv.estado != 'ANULADA'
+                GROUP BY fvd.idProducto, COALESCE(c.idUbicacion, %s), DATE(fv.fechaEmision)
+            """, [ubicacion_principal, desde, hasta, ubicacion_principal])
+            for producto_id, ubicacion_id, dia, unidades in cursor.fetchall():
+                if ubicacion_id is None:
+                    continue
+                if isinstance(dia, str):
+                    dia = date.fromisoformat(dia)
+                serie = series.setdefault((producto_id, ubicacion_id), {})
+                indice = (dia - fecha_inicio).days
+                serie[indice] = serie.get(indice, 0.0) + float(unidades or 0)
+            desde = hasta
+    return series
+
+
+def pronosticar(serie, dias, metodo='exponencial', alfa=ALFA):
+    """
+    Pronóstico de demanda diaria y su desviación para una serie dispersa.
+
+    Args:
+        serie: dict día -> unidades (los días ausentes son demanda cero)
+        dias: largo del período
+
+    Returns:
+        (demanda diaria pronosticada, desviación estándar diaria)
+    """
+    total = sum(serie.values())
+    promedio = total / dias
+    varianza = max(sum(valor * valor for valor in serie.values()) / dias - promedio * promedio, 0.0)
+    desviacion = math.sqrt(varianza)
+
+    if metodo == 'promedio':
+        return promedio, desviacion
+
+    # Suavizado exponencial partiendo del promedio del período; una racha de
+    # g días sin venta multiplica el nivel por (1 - alfa) ** g
+    nivel = promedio
+    anterior = -1
+    for dia in sorted(serie):
+        nivel *= (1 - alfa) ** (dia - anterior - 1)
+        nivel = alfa * serie[dia] + (1 - alfa) * nivel
+        anterior = dia
+    nivel *= (1 - alfa) ** (dias - 1 - anterior)
+    return nivel, desviacion
+
+
+def calcular_niveles(demanda, desviacion, dias_reposicion=DIAS_REPOSICION,
+                     dias_cobertura=DIAS_COBERTURA, factor_servicio=FACTOR_SERVICIO):
+    """Devuelve (stock_minimo, punto_reorden, cantidad_reorden, stock_maximo) en unidades enteras"""
+    seguridad = math.ceil(factor_servicio * desviacion * math.sqrt(dias_reposicion))
+    punto_reorden = math.ceil(demanda * dias_reposicion) + seguridad
+    cantidad_reorden = math.ceil(demanda * dias_cobertura)
+    return seguridad, punto_reorden, cantidad_reorden, punto_reorden + cantidad_reorden
+
+
+def calcular_puntos_reorden(dias=DIAS_HISTORIAL, metodo='exponencial', fecha_fin=None):
+    """
+    Pronóstico y niveles por (producto, ubicación) con ventas en el período.
+
+    Returns:
+        dict (producto_id, ubicacion_id) -> dict con demanda, desviacion,
+        stock_minimo, punto_reorden, cantidad_reorden y stock_maximo
+    """
+    if metodo not in METODOS:
+        raise ValueError(f'Método de pronóstico no válido: {metodo}')
+
+    fecha_fin = fecha_fin or date.today() - timedelta(days=1)
+    fecha_inicio = fecha_fin - timedelta(days=dias - 1)
+
+    niveles = {}
+    for clave, serie in cargar_demanda_diaria(fecha_inicio, fecha_fin).items():
+        demanda, desviacion = pronosticar(serie, dias, metodo)
+        stock_minimo, punto_reorden, cantidad_reorden, stock_maximo = calcular_niveles(demanda, desviacion)
+        niveles[clave] = {
+            'demanda': demanda,
+            'desviacion': desviacion,
+            'stock_minimo': stock_minimo,
+            'punto_reorden': punto_reorden,
+            'cantidad_reorden': cantidad_reorden,
+            'stock_maximo': stock_maximo,
+        }
+    return niveles
+
+
+def _decimal(valor):
+    return Decimal(valor).quantize(Decimal('1'), rounding=ROUND_CEILING)
+
+
+def guardar_puntos_reorden(niveles):
+    """
+    Guarda los niveles calculados en StockUbicacion y ConfiguracionStock.
+
+    Solo se leen los ids de las filas existentes (por ubicación) y se
+    escriben con bulk_update por lotes; no se crean filas nuevas.
+
+    Returns:
+        (filas de StockUbicacion actualizadas, filas de ConfiguracionStock actualizadas)
+    """
+    productos_por_ubicacion = {}
+    for producto_id, ubicacion_id in niveles:
+        productos_por_ubicacion.setdefault(ubicacion_id, []).append(producto_id)
+
+    stocks = []
+    configuraciones = []
+    ahora = timezone.now()
+    for ubicacion_id, producto_ids in productos_por_ubicacion.items():
+        for inicio in range(0, len(producto_ids), TAMANO_LOTE):
+            bloque = producto_ids[inicio:inicio + TAMANO_LOTE]
+
+            for stock_id, producto_id in StockUbicacion.objects.filter(
+                ubicacion_id=ubicacion_id, producto_id__in=bloque
+            ).values_list('id', 'producto_id'):
+                nivel = niveles[(producto_id, ubicacion_id)]
+                stocks.append(StockUbicacion(
+                    id=stock_id,
+                    stock_minimo=_decimal(nivel['stock_minimo']),
+                    punto_reorden=_decimal(nivel['punto_reorden']),
+                    stock_maximo=_decimal(nivel['stock_maximo']),
+                    editadoDate=ahora,
+                ))
+
+            for config_id, producto_id in ConfiguracionStock.objects.filter(
+                ubicacion_id=ubicacion_id, producto_id__in=bloque, anulado=False
+            ).values_list('id', 'producto_id'):
+                nivel = niveles[(producto_id, ubicacion_id)]
+                configuraciones.append(ConfiguracionStock(
+                    id=config_id,
+                    stock_minimo=nivel['stock_minimo'],
+                    punto_reorden=nivel['punto_reorden'],
+                    cantidad_reorden=nivel['cantidad_reorden'],
+                    stock_maximo=nivel['stock_maximo'],
+                ))
+
+    with transaction.atomic():
+        StockUbicacion.objects.bulk_update(
+            stocks, ['stock_minimo', 'punto_reorden', 'stock_maximo', 'editadoDate'], batch_size=TAMANO_LOTE
+        )
+        ConfiguracionStock.objects.bulk_update(
+            configuraciones, ['stock_minimo', 'punto_reorden', 'cantidad_reorden', 'stock_maximo'],
+            batch_size=TAMANO_LOTE
+        )
+        # bulk_update no emite post_save: avisar para recalcular alertas y cachés
+        for ubicacion_id, producto_ids in productos_por_ubicacion.items():
+            notificar_stock_modificado(None, producto_ids, ubicacion_id=ubicacion_id)
+
+    return len(stocks), len(configuraciones)
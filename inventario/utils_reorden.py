@@ -0,0 +1,172 @@
+"""
+Planificador de órdenes de compra automáticas
+
+Toma las configuraciones de stock con generar_orden_automatica y proveedor
+preferido cuya ubicación está en el punto de reorden, y genera una sola
+orden por (proveedor, ubicación destino) con todos sus productos.
+
+Todo se resuelve en pocas consultas sin importar el tamaño del catálogo:
+    1. Configuraciones a reordenar con el stock de la ubicación y el costo
+       del producto (una consulta con subconsulta).
+    2. Productos que ya están en órdenes abiertas (para no duplicarlos).
+    3. bulk_create de órdenes y de detalles.
+"""
+import uuid
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import DecimalField, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import ConfiguracionStock, DetalleOrdenCompra, OrdenCompra, StockUbicacion
+
+
+ESTADOS_ABIERTOS = ('borrador', 'enviada', 'confirmada', 'recibida_parcial')
+TAMANO_LOTE = 500
+
+
+def configuraciones_a_reordenar():
+    """
+    Configuraciones automáticas cuyo stock en la ubicación está en el punto
+    de reorden (o bajo el mínimo si no tiene punto de reorden).
+
+    Returns:
+        lista de dicts (values) con producto, ubicación, proveedor, niveles,
+        stock actual y costo
+    """
+    stock_ubicacion = StockUbicacion.objects.filter(
+        producto_id=OuterRef('producto_id'), ubicacion_id=OuterRef('ubicacion_id')
+    ).values('cantidad')[:1]
+
+    return list(
+        ConfiguracionStock.objects.filter(
+            generar_orden_automatica=True,
+            proveedor_preferido__isnull=False,
+            anulado=False,
+        ).annotate(
+            stock_actual=Coalesce(
+                Subquery(stock_ubicacion),
+                Value(Decimal('0')),
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            ),
+        ).filter(
+            Q(punto_reorden__gt=0, stock_actual__lte=F('punto_reorden')) |
+            Q(punto_reorden=0, stock_minimo__gt=0, stock_actual__lte=F('stock_minimo'))
+        ).values(
+            'producto_id', 'ubicacion_id', 'proveedor_preferido_id',
+            'stock_minimo', 'stock_maximo', 'punto_reorden', 'cantidad_reorden',
+            'stock_actual', 'producto__costo_unidad',
+        )
+    )
+
+
+def _productos_en_ordenes_abiertas(ubicacion_ids):
+    """Conjunto de (producto_id, ubicacion_id) que ya tienen una orden abierta"""
+    return set(
+        DetalleOrdenCompra.objects.filter(
+            orden__estado__in=ESTADOS_ABIERTOS,
+            orden__anulado=False,
+            orden__ubicacion_destino_id__in=ubicacion_ids,
+        ).values_list('producto_id', 'orden__ubicacion_destino_id')
+    )
+
+
+def _cantidad_a_pedir(config):
+    if config['cantidad_reorden'] > 0:
+        return config['cantidad_reorden']
+    # Sin cantidad configurada se completa hasta el stock máximo
+    faltante = int(config['stock_maximo'] - config['stock_actual'])
+    return max(faltante, 0)
+
+
+def _prioridad(lineas):
+    if any(config['stock_actual'] <= 0 for config, _ in lineas):
+        return 'urgente'
+    if any(config['stock_actual'] <= config['stock_minimo'] for config, _ in lineas):
+        return 'alta'
+    return 'normal'
+
+
+def planificar_reorden():
+    """
+    Agrupa los productos a reordenar por (proveedor, ubicación).
+
+    Returns:
+        dict (proveedor_id, ubicacion_id) -> lista de (config, cantidad)
+    """
+    configuraciones = configuraciones_a_reordenar()
+    if not configuraciones:
+        return {}
+
+    en_ordenes = _productos_en_ordenes_abiertas({config['ubicacion_id'] for config in configuraciones})
+
+    plan = {}
+    for config in configuraciones:
+        if (config['producto_id'], config['ubicacion_id']) in en_ordenes:
+            continue
+        cantidad = _cantidad_a_pedir(config)
+        if cantidad <= 0:
+            continue
+        clave = (config['proveedor_preferido_id'], config['ubicacion_id'])
+        plan.setdefault(clave, []).append((config, cantidad))
+    return plan
+
+
+def generar_ordenes_automaticas(usuario):
+    """
+    Crea una orden de compra por proveedor y ubicación con los productos a
+    reordenar.
+
+    Returns:
+        (órdenes creadas, líneas creadas)
+    """
+    plan = planificar_reorden()
+    if not plan:
+        return 0, 0
+
+    fecha = timezone.now().strftime('%Y%m%d')
+    ordenes = []
+    lineas_por_numero = {}
+    for (proveedor_id, ubicacion_id), lineas in plan.items():
+        numero = f"OC-AUTO-{fecha}-{uuid.uuid4().hex[:6].upper()}"
+        subtotal = sum(
+            (cantidad * (config['producto__costo_unidad'] or Decimal('0')) for config, cantidad in lineas),
+            Decimal('0'),
+        )
+        ordenes.append(OrdenCompra(
+            numero_orden=numero,
+            proveedor_id=proveedor_id,
+            ubicacion_destino_id=ubicacion_id,
+            prioridad=_prioridad(lineas),
+            observaciones='Orden generada automáticamente por stock bajo',
+            generada_automaticamente=True,
+            subtotal=subtotal,
+            total=subtotal,
+            usuario_creacion=usuario,
+            creadoPor=usuario,
+        ))
+        lineas_por_numero[numero] = lineas
+
+    with transaction.atomic():
+        OrdenCompra.objects.bulk_create(ordenes, batch_size=TAMANO_LOTE)
+        # MySQL no devuelve los ids de bulk_create: se leen por número de orden
+        ids = dict(
+            OrdenCompra.objects.filter(numero_orden__in=lineas_por_numero).values_list('numero_orden', 'id')
+        )
+
+        detalles = []
+        for numero, lineas in lineas_por_numero.items():
+            for config, cantidad in lineas:
+                detalles.append(DetalleOrdenCompra(
+                    orden_id=ids[numero],
+                    producto_id=config['producto_id'],
+                    cantidad_solicitada=cantidad,
+                    precio_unitario=config['producto__costo_unidad'] or 0,
+                    stock_actual=max(int(config['stock_actual']), 0),
+                    stock_minimo=config['stock_minimo'],
+                    motivo_solicitud='Stock bajo - Reorden automático',
+                ))
+        DetalleOrdenCompra.objects.bulk_create(detalles, batch_size=TAMANO_LOTE)
+
+    return len(ordenes), len(detalles)
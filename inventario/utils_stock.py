@@ -0,0 +1,326 @@
+"""
+Consultas agregadas y caché de stock por ubicación
+
+- Resumen de inventario por sucursal calculado en una sola pasada SQL
+  (GROUP BY ubicación) y guardado en caché por ubicación. Los movimientos de
+  stock invalidan sólo la ubicación afectada; un cambio de precio invalida
+  todas (el valor del inventario depende de productos.precioVenta).
+- Caché en memoria del proceso con el stock de cada (producto, ubicación),
+  usada por la consulta en lote de stock y por el punto de venta
+  (ventas.utils_sucursal). Se invalida entre procesos con la última edición
+  de StockUbicacion leída de la base: CACHES es LocMemCache, propia de cada
+  proceso, y no sirve para avisar a los demás.
+"""
+import threading
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Max, Q, Sum
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from productos.models import Producto
+from ventas.signals import venta_registrada
+from .models import StockUbicacion
+from .signals import stock_modificado
+
+
+TTL_RESUMEN = 300
+CLAVE_GENERACION = 'stock:resumen:generacion'
+
+
+def _generacion():
+    generacion = cache.get(CLAVE_GENERACION)
+    if generacion is None:
+        cache.add(CLAVE_GENERACION, 1, None)
+        generacion = cache.get(CLAVE_GENERACION, 1)
+    return generacion
+
+
+def _clave_resumen(ubicacion_id, generacion):
+    return f'stock:resumen:{generacion}:{ubicacion_id}'
+
+
+def calcular_resumen_stocks(ubicacion_ids):
+    """
+    Calcula el resumen de las ubicaciones indicadas en una sola consulta.
+
+    Returns:
+        dict {ubicacion_id: {'total_productos', 'productos_con_stock',
+                             'productos_stock_bajo', 'valor_inventario'}}
+        con valor_inventario en Decimal
+    """
+    valor = ExpressionWrapper(
+        F('cantidad') * F('producto__precio_venta'),
+        output_field=DecimalField(max_digits=24, decimal_places=6),
+    )
+    filas = StockUbicacion.objects.filter(
+        ubicacion_id__in=ubicacion_ids
+    ).values('ubicacion_id').annotate(
+        total_productos=Count('id'),
+        productos_con_stock=Count('id', filter=Q(cantidad__gt=0)),
+        productos_stock_bajo=Count('id', filter=Q(stock_minimo__gt=0, cantidad__lte=F('stock_minimo'))),
+        valor_inventario=Sum(valor),
+    ).order_by()
+
+    resumen = {
+        ubicacion_id: {
+            'total_productos': 0,
+            'productos_con_stock': 0,
+            'productos_stock_bajo': 0,
+            'valor_inventario': Decimal('0.00'),
+        }
+        for ubicacion_id in ubicacion_ids
+    }
+    for fila in filas:
+        resumen[fila['ubicacion_id']] = {
+            'total_productos': fila['total_productos'],
+            'productos_con_stock': fila['productos_con_stock'],
+            'productos_stock_bajo': fila['productos_stock_bajo'],
+            'valor_inventario': Decimal(fila['valor_inventario'] or 0).quantize(Decimal('0.01')),
+        }
+    return resumen
+
+
+def obtener_resumen_stocks(ubicacion_ids):
+    """
+    Resumen por ubicación servido desde caché; sólo las ubicaciones sin
+    entrada en caché se calculan (todas juntas, en una consulta).
+    """
+    generacion = _generacion()
+    claves = {_clave_resumen(uid, generacion): uid for uid in ubicacion_ids}
+    en_cache = cache.get_many(list(claves))
+
+    resumen = {claves[clave]: valor for clave, valor in en_cache.items()}
+    faltantes = [uid for uid in ubicacion_ids if uid not in resumen]
+    if faltantes:
+        calculado = calcular_resumen_stocks(faltantes)
+        cache.set_many(
+            {_clave_resumen(uid, generacion): datos for uid, datos in calculado.items()},
+            TTL_RESUMEN,
+        )
+        resumen.update(calculado)
+    return resumen
+
+
+def invalidar_resumen_stocks(ubicacion_id=None):
+    """Invalida el resumen de una ubicación, o de todas si no se indica"""
+    if ubicacion_id is None:
+        try:
+            cache.incr(CLAVE_GENERACION)
+        except ValueError:
+            cache.set(CLAVE_GENERACION, 1, None)
+    else:
+        cache.delete(_clave_resumen(ubicacion_id, _generacion()))
+
+
+# ============================================
+# CACHÉ EN MEMORIA DE STOCK POR UBICACIÓN
+# ============================================
+
+class CacheStockUbicacion:
+    """
+    Stock por (producto, ubicación) guardado en memoria del proceso.
+
+    La versión de cada ubicación es la última edición de sus filas
+    (MAX(editadoDate) de StockUbicacion, índice ubicacion_id + editadoDate),
+    leída de la base como máximo cada intervalo_version segundos. Cuando otro
+    proceso modifica el stock de una ubicación la versión cambia y este
+    proceso descarta sus datos de esa ubicación en la siguiente verificación.
+    Los cambios hechos por este mismo proceso se aplican directamente
+    (write-through) para que se vean antes de esa verificación.
+
+    Todo escritor de StockUbicacion debe actualizar editadoDate (save() lo
+    hace solo; los UPDATE y bulk_update deben incluirlo). Sirve para mostrar
+    stock: las ventas validan el saldo en la base (descontar_stock_venta).
+
+    Las combinaciones sin fila en StockUbicacion también se guardan (con
+    cantidad 0) para no volver a consultarlas.
+    """
+
+    def __init__(self, ttl=60, intervalo_version=2):
+        self.ttl = ttl
+        self.intervalo_version = intervalo_version
+        self._lock = threading.Lock()
+        self._datos = {}       # ubicacion_id -> {producto_id: (cantidad, stock_minimo, punto_reorden)}
+        self._versiones = {}   # ubicacion_id -> versión con la que se cargaron los datos
+        self._cargado = {}     # ubicacion_id -> instante de carga (monotonic)
+        self._verificado = {}  # ubicacion_id -> instante de la última lectura de la versión
+        self.aciertos = 0
+        self.fallos = 0
+
+    @property
+    def habilitada(self):
+        return getattr(settings, 'STOCK_CACHE_EN_MEMORIA', True)
+
+    @staticmethod
+    def _consultar_versiones(ubicacion_ids):
+        return dict(
+            StockUbicacion.objects.filter(ubicacion_id__in=ubicacion_ids)
+            .values('ubicacion_id').annotate(version=Max('editadoDate'))
+            .order_by().values_list('ubicacion_id', 'version')
+        )
+
+    def _sincronizar_versiones(self, ubicacion_ids):
+        """Descarta las ubicaciones modificadas por otros procesos o vencidas"""
+        ahora = time.monotonic()
+        with self._lock:
+            pendientes = [
+                uid for uid in ubicacion_ids
+                if uid not in self._datos or ahora - self._verificado.get(uid, ahora) >= self.intervalo_version
+            ]
+        versiones = self._consultar_versiones(pendientes) if pendientes else {}
+        with self._lock:
+            for uid in ubicacion_ids:
+                vencida = ahora - self._cargado.get(uid, ahora) > self.ttl
+                if uid in pendientes:
+                    self._verificado[uid] = ahora
+                    version = versiones.get(uid)
+                    cambiada = uid not in self._datos or self._versiones.get(uid) != version
+                else:
+                    version = self._versiones.get(uid)
+                    cambiada = False
+                if cambiada or vencida:
+                    self._datos[uid] = {}
+                    self._versiones[uid] = version
+                    self._cargado[uid] = ahora
+
+    def obtener(self, producto_ids, ubicacion_ids):
+        """
+        Devuelve {(producto_id, ubicacion_id): (cantidad, stock_minimo, punto_reorden)}
+        consultando en una sola query sólo las combinaciones que no están en memoria.
+        """
+        producto_ids = {int(pid) for pid in producto_ids}
+        ubicacion_ids = {int(uid) for uid in ubicacion_ids}
+        if not producto_ids or not ubicacion_ids:
+            return {}
+
+        if not self.habilitada:
+            return self._consultar(producto_ids, ubicacion_ids)
+
+        self._sincronizar_versiones(ubicacion_ids)
+
+        resultado = {}
+        faltantes_productos = set()
+        faltantes_ubicaciones = set()
+        with self._lock:
+            for uid in ubicacion_ids:
+                datos = self._datos[uid]
+                for pid in producto_ids:
+                    valor = datos.get(pid)
+                    if valor is None:
+                        faltantes_productos.add(pid)
+                        faltantes_ubicaciones.add(uid)
+                    else:
+                        resultado[(pid, uid)] = valor
+            self.aciertos += len(resultado)
+
+        if faltantes_productos:
+            consultado = self._consultar(faltantes_productos, faltantes_ubicaciones)
+            with self._lock:
+                self.fallos += len(consultado)
+                for (pid, uid), valor in consultado.items():
+                    self._datos.setdefault(uid, {})[pid] = valor
+            resultado.update(consultado)
+
+        return resultado
+
+    @staticmethod
+    def _consultar(producto_ids, ubicacion_ids):
+        cero = (Decimal('0.00'), Decimal('0.00'), Decimal('0.00'))
+        resultado = {(pid, uid): cero for pid in producto_ids for uid in ubicacion_ids}
+        filas = StockUbicacion.objects.filter(
+            producto_id__in=producto_ids, ubicacion_id__in=ubicacion_ids
+        ).values_list('producto_id', 'ubicacion_id', 'cantidad', 'stock_minimo', 'punto_reorden')
+        for pid, uid, cantidad, stock_minimo, punto_reorden in filas:
+            resultado[(pid, uid)] = (cantidad, stock_minimo, punto_reorden)
+        return resultado
+
+    def aplicar_cambios(self, ubicacion_id, producto_ids, saldos=None, filas=None):
+        """
+        Registra un cambio de stock hecho por este proceso.
+
+        Args:
+            saldos: {producto_id: nueva cantidad} cuando sólo se conoce el saldo
+            filas: {producto_id: (cantidad, stock_minimo, punto_reorden)} completas
+
+        Los productos con datos conocidos se actualizan en memoria; los demás
+        se descartan. El cambio también movió la versión en la base, así que
+        la siguiente verificación recarga la ubicación.
+        """
+        saldos = saldos or {}
+        filas = filas or {}
+        with self._lock:
+            datos = self._datos.get(ubicacion_id)
+            if datos is None:
+                return
+            for pid in producto_ids:
+                pid = int(pid)
+                saldo = saldos.get(pid)
+                if pid in filas:
+                    datos[pid] = filas[pid]
+                elif saldo is not None and pid in datos:
+                    _, stock_minimo, punto_reorden = datos[pid]
+                    datos[pid] = (Decimal(str(saldo)), stock_minimo, punto_reorden)
+                else:
+                    datos.pop(pid, None)
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
+            self._versiones.clear()
+            self._cargado.clear()
+            self._verificado.clear()
+            self.aciertos = 0
+            self.fallos = 0
+
+    def estadisticas(self):
+        with self._lock:
+            total = self.aciertos + self.fallos
+            return {
+                'ubicaciones': len(self._datos),
+                'entradas': sum(len(datos) for datos in self._datos.values()),
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'tasa_aciertos': round(self.aciertos / total, 4) if total else 0,
+            }
+
+
+cache_stock = CacheStockUbicacion()
+
+
+# ============================================
+# INVALIDACIÓN POR SEÑALES
+# ============================================
+
+@receiver(stock_modificado, dispatch_uid='resumen_stocks_por_stock_modificado')
+def _invalidar_por_stock_modificado(sender, producto_ids, ubicacion_id=None, saldos=None, **kwargs):
+    if ubicacion_id is not None:
+        invalidar_resumen_stocks(ubicacion_id)
+        cache_stock.aplicar_cambios(ubicacion_id, producto_ids, saldos)
+
+
+@receiver(venta_registrada, dispatch_uid='resumen_stocks_por_venta')
+def _actualizar_por_venta(sender, producto_ids, ubicacion_id=None, saldos=None, **kwargs):
+    # Sólo las ventas que descuentan StockUbicacion envían los saldos de la sucursal
+    if ubicacion_id is not None and saldos is not None:
+        invalidar_resumen_stocks(ubicacion_id)
+        cache_stock.aplicar_cambios(ubicacion_id, producto_ids, saldos)
+
+
+@receiver(post_save, sender=StockUbicacion, dispatch_uid='resumen_stocks_por_stock_ubicacion')
+def _invalidar_por_stock_ubicacion(sender, instance, **kwargs):
+    invalidar_resumen_stocks(instance.ubicacion_id)
+    fila = (instance.cantidad, instance.stock_minimo, instance.punto_reorden)
+    transaction.on_commit(lambda: cache_stock.aplicar_cambios(
+        instance.ubicacion_id, [instance.producto_id], filas={instance.producto_id: fila}
+    ))
+
+
+@receiver(post_save, sender=Producto, dispatch_uid='resumen_stocks_por_producto')
+def _invalidar_por_producto(sender, **kwargs):
+    # Un cambio de precio afecta el valor de inventario de todas las ubicaciones
+    invalidar_resumen_stocks()
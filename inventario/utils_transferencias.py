@@ -0,0 +1,258 @@
+"""
+Motor de procesamiento de transferencias de stock por conjuntos
+
+TransferenciaStock.enviar() y procesar() delegan aquí. En lugar de guardar
+cada lote y cada detalle por separado, se cargan todos los detalles y lotes
+de una vez, se bloquean los lotes con SELECT ... FOR UPDATE y se aplican las
+cantidades con UPDATE masivos (CASE por id), bulk_create y bulk_update.
+Una transferencia de cientos de líneas se procesa con un número pequeño y
+constante de consultas.
+
+Con VENTAS_STOCK_POR_UBICACION procesar_transferencia mueve además
+StockUbicacion (egreso del origen, ingreso del destino) con el servicio de
+movimientos; el kardex de la transferencia es el de los lotes.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import DetalleTransferencia, KardexMovimiento, LoteProducto
+from .signals import notificar_stock_modificado
+
+
+TAMANO_LOTE = 500
+CERO = Decimal('0.00')
+
+
+def case_por_id(valores):
+    """CASE id WHEN ... THEN cantidad ... END para aplicar deltas en un UPDATE"""
+    return Case(
+        *[When(id=pk, then=Value(cantidad)) for pk, cantidad in valores.items()],
+        default=Value(CERO),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+
+
+def _sumar_por_lote(pares):
+    totales = {}
+    for lote_id, cantidad in pares:
+        totales[lote_id] = totales.get(lote_id, CERO) + cantidad
+    return totales
+
+
+def _bloquear_lotes(lote_ids):
+    """Carga y bloquea los lotes en orden de id (evita interbloqueos)"""
+    lotes = LoteProducto.objects.select_for_update().filter(id__in=lote_ids).order_by('id')
+    return {lote.id: lote for lote in lotes}
+
+
+def enviar_transferencia(transferencia, usuario):
+    """
+    Marca la transferencia como 'transferido' y RESERVA (no descuenta) stock
+    Estado: guardado → transferido
+    """
+    if transferencia.estado != 'guardado':
+        raise ValueError(f'No se puede enviar una transferencia en estado {transferencia.estado}. Debe estar en estado "guardado".')
+
+    with transaction.atomic():
+        detalles = list(transferencia.detalles.select_related('producto'))
+        if not detalles:
+            raise ValueError('La transferencia no tiene productos agregados.')
+
+        for detalle in detalles:
+            if not detalle.lote_id:
+                raise ValueError(f'El producto {detalle.producto.nombre} no tiene un lote asignado.')
+
+        lotes = _bloquear_lotes({detalle.lote_id for detalle in detalles})
+
+        reservas = _sumar_por_lote((d.lote_id, Decimal(str(d.cantidad))) for d in detalles)
+        for detalle in detalles:
+            lote = lotes[detalle.lote_id]
+            if lote.ubicacion_id != transferencia.ubicacion_origen_id:
+                raise ValueError(f'El lote {lote.numero_lote} no pertenece a la ubicación origen.')
+            if reservas[lote.id] > lote.cantidad_disponible_real:
+                raise ValueError(
+                    f'Error al reservar {detalle.producto.nombre}: No hay suficiente stock disponible en el lote. '
+                    f'Disponible: {lote.cantidad_disponible_real}, Solicitado: {reservas[lote.id]}'
+                )
+            # Guardar stock antes del movimiento
+            detalle.stock_origen_antes = int(lote.cantidad_disponible)
+
+        DetalleTransferencia.objects.bulk_update(detalles, ['stock_origen_antes'], batch_size=TAMANO_LOTE)
+
+        # RESERVAR cantidad en los lotes (NO descontar)
+        LoteProducto.objects.filter(id__in=reservas).update(
+            cantidad_reservada=F('cantidad_reservada') + case_por_id(reservas)
+        )
+
+        transferencia.estado = 'transferido'
+        transferencia.fecha_envio = timezone.now()
+        transferencia.usuario_envio = usuario
+        transferencia.save(update_fields=['estado', 'fecha_envio', 'usuario_envio', 'editadoDate'])
+
+
+def procesar_transferencia(transferencia, usuario, cantidades_recibidas=None):
+    """
+    Procesa la transferencia: descuenta stock del origen y suma al destino
+    Estado: transferido → procesado
+
+    REGLA DE SEGURIDAD: El usuario que procesa NO puede ser el mismo que envió
+
+    Args:
+        usuario: Usuario que recibe/procesa
+        cantidades_recibidas: Dict con {detalle_id: cantidad_recibida} (opcional)
+    """
+    if transferencia.estado != 'transferido':
+        raise ValueError(f'No se puede procesar una transferencia en estado {transferencia.estado}. Debe estar en estado "transferido".')
+
+    # VALIDACIÓN CRÍTICA: Usuario receptor ≠ usuario envío
+    if transferencia.usuario_envio_id and usuario.id == transferencia.usuario_envio_id:
+        raise ValueError(
+            f'ERROR DE SEGURIDAD: El usuario que transfiere ({transferencia.usuario_envio.username}) '
+            f'no puede ser el mismo que procesa la transferencia. '
+            f'Debe ser procesada por un usuario diferente para garantizar auditoría.'
+        )
+
+    cantidades_recibidas = cantidades_recibidas or {}
+    origen = transferencia.ubicacion_origen
+    destino = transferencia.ubicacion_destino
+
+    with transaction.atomic():
+        detalles = list(transferencia.detalles.select_related('producto'))
+        lotes_origen = _bloquear_lotes({detalle.lote_id for detalle in detalles})
+
+        # 1. Cantidades a recibir y validación contra el stock bloqueado
+        recibir = {}
+        for detalle in detalles:
+            cantidad = cantidades_recibidas.get(detalle.id, detalle.cantidad)
+            recibir[detalle.id] = Decimal(str(cantidad))
+
+        descuentos = _sumar_por_lote((d.lote_id, recibir[d.id]) for d in detalles)
+        for lote_id, cantidad in descuentos.items():
+            lote = lotes_origen[lote_id]
+            if cantidad > lote.cantidad_disponible:
+                raise ValueError(
+                    f'No hay suficiente stock en el lote {lote.numero_lote}. '
+                    f'Disponible: {lote.cantidad_disponible}, Solicitado: {cantidad}'
+                )
+
+        # 2. DESCONTAR de los lotes origen y liberar reservas (un solo UPDATE)
+        delta = case_por_id(descuentos)
+        LoteProducto.objects.filter(id__in=descuentos).update(
+            cantidad_disponible=F('cantidad_disponible') - delta,
+            cantidad_reservada=Greatest(F('cantidad_reservada') - delta, Value(CERO)),
+        )
+
+        # 3. Lotes destino: sumar a los existentes y crear los que faltan
+        claves = {}
+        for detalle in detalles:
+            lote = lotes_origen[detalle.lote_id]
+            clave = (detalle.producto_id, lote.numero_lote, lote.fecha_caducidad)
+            claves[clave] = claves.get(clave, CERO) + recibir[detalle.id]
+
+        existentes = {
+            (lote.producto_id, lote.numero_lote, lote.fecha_caducidad): lote
+            for lote in LoteProducto.objects.select_for_update().filter(
+                ubicacion=destino,
+                producto_id__in={clave[0] for clave in claves},
+                numero_lote__in={clave[1] for clave in claves},
+            )
+        }
+
+        incrementos = {}
+        nuevos = {}
+        for detalle in detalles:
+            lote = lotes_origen[detalle.lote_id]
+            clave = (detalle.producto_id, lote.numero_lote, lote.fecha_caducidad)
+            if clave in existentes:
+                incrementos[existentes[clave].id] = claves[clave]
+            elif clave not in nuevos:
+                nuevos[clave] = LoteProducto(
+                    producto_id=detalle.producto_id,
+                    ubicacion=destino,
+                    numero_lote=lote.numero_lote,
+                    fecha_caducidad=lote.fecha_caducidad,
+                    creadoPor=usuario,
+                    fecha_ingreso=timezone.now().date(),
+                    fecha_creacion=lote.fecha_creacion,
+                    cantidad_inicial=claves[clave],
+                    cantidad_disponible=claves[clave],
+                    proveedor_id=lote.proveedor_id,
+                    costo_unitario=lote.costo_unitario,
+                )
+
+        if incrementos:
+            LoteProducto.objects.filter(id__in=incrementos).update(
+                cantidad_disponible=F('cantidad_disponible') + case_por_id(incrementos)
+            )
+        if nuevos:
+            LoteProducto.objects.bulk_create(list(nuevos.values()), batch_size=TAMANO_LOTE)
+
+        # 4. Detalles y kardex
+        saldo_origen = {lote_id: lotes_origen[lote_id].cantidad_disponible - cantidad
+                        for lote_id, cantidad in descuentos.items()}
+        saldo_destino = {}
+        for clave, cantidad in claves.items():
+            antes = existentes[clave].cantidad_disponible if clave in existentes else CERO
+            saldo_destino[clave] = (antes, antes + cantidad)
+
+        movimientos = []
+        for detalle in detalles:
+            lote = lotes_origen[detalle.lote_id]
+            clave = (detalle.producto_id, lote.numero_lote, lote.fecha_caducidad)
+            cantidad = recibir[detalle.id]
+
+            detalle.stock_destino_antes = int(saldo_destino[clave][0])
+            detalle.cantidad_recibida = int(cantidad)
+
+            # Aplicar cambio de precio si corresponde
+            if detalle.cambio_precio and detalle.precio_destino != detalle.precio_origen:
+                # Por ahora solo se registra en el detalle
+                detalle.observaciones += f'\nPrecio cambiado de ${detalle.precio_origen} a ${detalle.precio_destino}'
+
+            movimientos.append(KardexMovimiento(
+                idProducto=detalle.producto_id,
+                idUbicacion=origen.id,
+                tipoMovimiento='TRANSFERENCIA SALIDA',
+                detalle=f'Transfer. {transferencia.numero_transferencia} → {destino.nombre} (Lote: {lote.numero_lote})',
+                egreso=cantidad,
+                ingreso=0,
+                saldo=saldo_origen[lote.id],
+            ))
+            movimientos.append(KardexMovimiento(
+                idProducto=detalle.producto_id,
+                idUbicacion=destino.id,
+                tipoMovimiento='TRANSFERENCIA ENTRADA',
+                detalle=f'Transfer. {transferencia.numero_transferencia} ← {origen.nombre} (Lote: {lote.numero_lote})',
+                ingreso=cantidad,
+                egreso=0,
+                saldo=saldo_destino[clave][1],
+            ))
+
+        DetalleTransferencia.objects.bulk_update(
+            detalles, ['stock_destino_antes', 'cantidad_recibida', 'observaciones'], batch_size=TAMANO_LOTE
+        )
+        KardexMovimiento.objects.bulk_create(movimientos, batch_size=TAMANO_LOTE)
+
+        # 5. Stock de las sucursales que vende el punto de venta
+        from ventas.utils_sucursal import stock_por_sucursal
+        if stock_por_sucursal():
+            from .utils_movimientos import Movimiento, aplicar_movimientos
+            for ubicacion, signo, tipo in ((origen, -1, 'TRANSFERENCIA SALIDA'), (destino, 1, 'TRANSFERENCIA ENTRADA')):
+                aplicar_movimientos(
+                    [Movimiento(d.producto_id, signo * recibir[d.id], tipo, transferencia.numero_transferencia)
+                     for d in detalles],
+                    ubicacion_id=ubicacion.id, usuario=usuario, registrar_kardex=False, notificar=False,
+                )
+
+        transferencia.estado = 'procesado'
+        transferencia.fecha_recepcion = timezone.now()
+        transferencia.usuario_recepcion = usuario
+        transferencia.save(update_fields=['estado', 'fecha_recepcion', 'usuario_recepcion', 'editadoDate'])
+
+        producto_ids = [detalle.producto_id for detalle in detalles]
+        notificar_stock_modificado(sender=LoteProducto, producto_ids=producto_ids, ubicacion_id=origen.id)
+        notificar_stock_modificado(sender=LoteProducto, producto_ids=producto_ids, ubicacion_id=destino.id)
@@ -8,7 +8,7 @@ from django.utils import timezone
 from django.db import transaction
 from decimal import Decimal
 from .models import (
-    Compra, DetalleCompra, Kardex, AjusteInventario, OrdenCompra, DetalleOrdenCompra,
+    Compra, Kardex, AjusteInventario, OrdenCompra, DetalleOrdenCompra,
     TransferenciaStock, DetalleTransferencia, Ubicacion, ConfiguracionStock, KardexMovimiento,
     StockUbicacion
 )
@@ -36,81 +36,28 @@ def lista_compras(request):
 @login_required
 def nueva_compra(request):
     """Crear nueva compra"""
+    from .utils_compras import leer_lineas_compra, registrar_compra
+    from ventas.utils_sucursal import stock_por_sucursal, ubicacion_de_recepcion
+    
     if request.method == 'POST':
         try:
-            with transaction.atomic():
-                # Crear la compra
-                compra = Compra.objects.create(
-                    numero_compra=f"COMP-{timezone.now().strftime('%Y%m%d')}-{str(uuid.uuid4())[:8]}",
-                    numero_factura_proveedor=request.POST.get('numero_factura_proveedor', ''),
-                    fecha_factura=request.POST.get('fecha_factura'),
-                    proveedor_id=request.POST.get('proveedor'),
-                    usuario=request.user,
-                    tipo_pago=request.POST.get('tipo_pago', 'efectivo'),
-                    observaciones=request.POST.get('observaciones', '')
-                )
-                
-                # Procesar productos
-                subtotal = 0
-                productos_data = {}
-                
-                # Extraer datos de productos del POST
-                for key, value in request.POST.items():
-                    if key.startswith('productos[') and '][' in key:
-                        # Extraer índice y campo
-                        parts = key.replace('productos[', '').replace(']', '').split('][')
-                        if len(parts) == 2:
-                            index, field = parts
-                            if index not in productos_data:
-                                productos_data[index] = {}
-                            productos_data[index][field] = value
-                
-                # Crear detalles de compra
-                for index, producto_data in productos_data.items():
-                    if all(key in producto_data for key in ['id', 'cantidad', 'precio']):
-                        producto = get_object_or_404(Producto, id=producto_data['id'])
-                        cantidad = int(producto_data['cantidad'])
-                        precio_unitario = float(producto_data['precio'])
-                        
-                        detalle = DetalleCompra.objects.create(
-                            compra=compra,
-                            producto=producto,
-                            cantidad=cantidad,
-                            precio_unitario=precio_unitario
-                        )
-                        
-                        subtotal += detalle.subtotal
-                        
-                        # Actualizar stock del producto
-                        producto.stock += cantidad
-                        producto.save()
-                        
-                        # Crear registro en Kardex
-                        Kardex.objects.create(
-                            producto=producto,
-                            tipo_movimiento='entrada',
-                            cantidad=cantidad,
-                            precio_unitario=precio_unitario,
-                            motivo=f'Compra {compra.numero_compra}',
-                            documento_referencia=compra.numero_compra,
-                            usuario=request.user
-                        )
-                
-                # Calcular totales
-                descuento = float(request.POST.get('descuento', 0))
-                subtotal_con_descuento = subtotal - descuento
-                impuesto = subtotal_con_descuento * 0.15  # IVA 15%
-                total = subtotal_con_descuento + impuesto
-                
-                # Actualizar totales de la compra
-                compra.subtotal = subtotal
-                compra.descuento = descuento
-                compra.impuesto = impuesto
-                compra.total = total
-                compra.save()
-                
-                messages.success(request, f'Compra {compra.numero_compra} creada exitosamente')
-                return redirect('inventario:detalle_compra', pk=compra.pk)
+            compra = registrar_compra(
+                request.user,
+                {
+                    'numero_compra': f"COMP-{timezone.now().strftime('%Y%m%d')}-{str(uuid.uuid4())[:8]}",
+                    'numero_factura_proveedor': request.POST.get('numero_factura_proveedor', ''),
+                    'fecha_factura': request.POST.get('fecha_factura'),
+                    'proveedor_id': request.POST.get('proveedor'),
+                    'tipo_pago': request.POST.get('tipo_pago', 'efectivo'),
+                    'observaciones': request.POST.get('observaciones', ''),
+                    'descuento': request.POST.get('descuento', 0),
+                },
+                leer_lineas_compra(request.POST),
+                ubicacion_id=ubicacion_de_recepcion(request.user, request.POST.get('ubicacion')),
+            )
+            
+            messages.success(request, f'Compra {compra.numero_compra} creada exitosamente')
+            return redirect('inventario:detalle_compra', pk=compra.pk)
                 
         except Exception as e:
             messages.error(request, f'Error al crear la compra: {str(e)}')
@@ -120,7 +67,10 @@ def nueva_compra(request):
     
     context = {
         'titulo': 'Nueva Compra',
-        'proveedores': proveedores
+        'proveedores': proveedores,
+        # Con stock por sucursal se elige la ubicación que recibe la compra
+        'ubicaciones': Ubicacion.objects.filter(activo=True, anulado=False).order_by('-es_principal', 'nombre')
+                       if stock_por_sucursal() else None,
     }
     return render(request, 'inventario/nueva_compra.html', context)
 
@@ -627,47 +577,15 @@ def enviar_orden_compra(request, pk):
 
 @login_required
 def generar_ordenes_automaticas(request):
-    """Generar órdenes de compra automáticas basadas en stock mínimo"""
+    """Generar órdenes de compra automáticas (una por proveedor y ubicación) basadas en el punto de reorden"""
+    from .utils_reorden import generar_ordenes_automaticas as generar_ordenes
+    
     if request.method == 'POST':
         try:
-            ordenes_generadas = 0
-            configuraciones = ConfiguracionStock.objects.filter(
-                generar_orden_automatica=True,
-                proveedor_preferido__isnull=False
-            )
-            
-            for config in configuraciones:
-                # Verificar si necesita reorden (lógica simplificada)
-                if config.necesita_reorden:
-                    # Crear orden automática
-                    orden = OrdenCompra.objects.create(
-                        numero_orden=f"OC-AUTO-{timezone.now().strftime('%Y%m%d')}-{uuid.uuid4().hex[:6].upper()}",
-                        proveedor=config.proveedor_preferido,
-                        ubicacion_destino=config.ubicacion,
-                        prioridad='normal',
-                        observaciones='Orden generada automáticamente por stock bajo',
-                        generada_automaticamente=True,
-                        usuario_creacion=request.user
-                    )
-                    
-                    DetalleOrdenCompra.objects.create(
-                        orden=orden,
-                        producto=config.producto,
-                        cantidad_solicitada=config.cantidad_reorden,
-                        precio_unitario=config.producto.precio_compra or 0,
-                        stock_actual=config.producto.stock,
-                        stock_minimo=config.stock_minimo,
-                        motivo_solicitud='Stock bajo - Reorden automático'
-                    )
-                    
-                    orden.subtotal = config.cantidad_reorden * (config.producto.precio_compra or 0)
-                    orden.total = orden.subtotal
-                    orden.save()
-                    
-                    ordenes_generadas += 1
+            ordenes_generadas, productos_incluidos = generar_ordenes(request.user)
             
             if ordenes_generadas > 0:
-                messages.success(request, f'Se generaron {ordenes_generadas} órdenes de compra automáticas')
+                messages.success(request, f'Se generaron {ordenes_generadas} órdenes de compra automáticas con {productos_incluidos} productos')
             else:
                 messages.info(request, 'No se encontraron productos que requieran reorden automático')
                 
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ProductosConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'productos'
+
+    def ready(self):
+        # Conectar los receptores que mantienen el índice de nombres de productos
+        from . import utils_duplicados  # noqa: F401
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Comando para agrupar los productos duplicados de todo el catálogo
+Uso: python manage.py agrupar_productos_duplicados [--umbral 0.7] [--procesos 4] [--sin-guardar]
+
+Programarlo cada noche; los grupos se revisan en Productos > Duplicados.
+"""
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from productos.utils_duplicados import UMBRAL_CLUSTER, indice_nombres
+from productos.utils_grupos_duplicados import TAMANO_BLOQUE, calcular_grupos, guardar_grupos
+
+
+class Command(BaseCommand):
+    help = 'Agrupa los productos activos con nombres muy similares para revisar duplicados'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--umbral', type=float, default=UMBRAL_CLUSTER,
+                            help=f'Similitud mínima de nombre entre 0 y 1 (default: {UMBRAL_CLUSTER})')
+        parser.add_argument('--procesos', type=int, default=os.cpu_count() or 1,
+                            help='Procesos en paralelo (default: núcleos disponibles)')
+        parser.add_argument('--tamano-bloque', type=int, default=TAMANO_BLOQUE,
+                            help=f'Productos por tarea (default: {TAMANO_BLOQUE})')
+        parser.add_argument('--sin-guardar', action='store_true',
+                            help='Solo calcular, sin reemplazar los grupos pendientes')
+
+    def handle(self, *args, **options):
+        if not 0 < options['umbral'] <= 1:
+            raise CommandError('--umbral debe estar entre 0 y 1')
+
+        inicio = time.monotonic()
+        productos = len(indice_nombres)
+        self.stdout.write(f'📦 Índice de nombres: {productos} productos activos en {time.monotonic() - inicio:.2f}s')
+
+        grupos = calcular_grupos(
+            umbral=options['umbral'],
+            procesos=max(options['procesos'], 1),
+            tamano_bloque=max(options['tamano_bloque'], 1),
+        )
+        transcurrido = time.monotonic() - inicio
+        en_grupos = sum(len(grupo['producto_ids']) for grupo in grupos)
+        self.stdout.write(
+            f'📊 {len(grupos)} grupos con {en_grupos} productos en {transcurrido:.2f}s '
+            f'({productos / transcurrido if transcurrido else 0:.0f} productos/s)'
+        )
+
+        if options['sin_guardar']:
+            for grupo in grupos[:10]:
+                self.stdout.write(f'   - {grupo["producto_ids"]} (similitud {grupo["similitud_maxima"]:.2f})')
+            self.stdout.write('ℹ Grupos no guardados (--sin-guardar)')
+            return
+
+        guardados, omitidos = guardar_grupos(grupos)
+        self.stdout.write(self.style.SUCCESS(f'✓ {guardados} grupos pendientes de revisión guardados'))
+        if omitidos:
+            self.stdout.write(f'ℹ {omitidos} grupos omitidos (ya revisados o descartados)')
@@ -323,3 +323,41 @@ class UnidadMedida(models.Model):
     
     def __str__(self):
         return f"{self.nombre} ({self.abreviacion})"
+
+
+class GrupoDuplicados(models.Model):
+    """
+    Grupo de productos que probablemente son el mismo producto, generado por
+    el comando agrupar_productos_duplicados y revisado desde la pantalla de
+    duplicados (ver productos.utils_grupos_duplicados).
+
+    Requiere crear la tabla en MySQL: ver crear_tabla_grupos_duplicados.sql
+    """
+    ESTADO_CHOICES = [
+        ('pendiente', 'Pendiente'),
+        ('revisado', 'Revisado'),
+        ('descartado', 'Descartado'),
+    ]
+
+    clave = models.CharField(max_length=40, help_text='SHA-1 de los IDs de productos del grupo')
+    producto_ids = models.JSONField(default=list)
+    pares = models.JSONField(default=list, help_text='[[id1, id2, similitud], ...]')
+    tamano = models.IntegerField(default=0)
+    similitud_maxima = models.DecimalField(max_digits=5, decimal_places=4, default=0)
+    estado = models.CharField(max_length=10, choices=ESTADO_CHOICES, default='pendiente')
+    fecha_generacion = models.DateTimeField(auto_now_add=True)
+    revisado_por = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='grupos_duplicados_revisados')
+    fecha_revision = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'grupos_duplicados_productos'
+        verbose_name = "Grupo de Productos Duplicados"
+        verbose_name_plural = "Grupos de Productos Duplicados"
+        ordering = ['-tamano', '-similitud_maxima', 'id']
+        indexes = [
+            models.Index(fields=['estado', 'tamano']),
+            models.Index(fields=['clave']),
+        ]
+
+    def __str__(self):
+        return f"Grupo {self.id}: {self.tamano} productos ({self.get_estado_display()})"
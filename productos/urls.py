@@ -2,6 +2,7 @@ from django.urls import path
 from . import views
 from . import views_ubicaciones
 from . import api_duplicados
+from . import views_duplicados
 
 app_name = 'productos'
 
@@ -49,6 +50,10 @@ urlpatterns = [
     path('api/duplicados/vincular/', api_duplicados.api_vincular_codigo, name='api_vincular_codigo'),
     path('api/duplicados/codigo/<str:codigo>/', api_duplicados.api_obtener_por_codigo, name='api_obtener_por_codigo'),
     
+    # Revisión de grupos de duplicados (comando agrupar_productos_duplicados)
+    path('duplicados/', views_duplicados.grupos_duplicados, name='grupos_duplicados'),
+    path('duplicados/<int:pk>/revisar/', views_duplicados.revisar_grupo_duplicados, name='revisar_grupo_duplicados'),
+    
     # Unidades de medida
     path('unidades/', views.lista_unidades, name='unidades'),
     path('unidades/crear/', views.crear_unidad, name='crear_unidad'),
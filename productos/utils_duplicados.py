@@ -1,11 +1,44 @@
 """
 Utilidades para detección de productos duplicados y mapeo de códigos alternativos
+
+La búsqueda de similares usa un índice invertido de trigramas sobre los
+nombres normalizados de los productos activos (IndiceNombresProductos),
+construido por proceso, al día con los productos nuevos de la base y
+reconstruido cada TTL_INDICE segundos:
+
+- Los candidatos salen de la intersección de las listas de trigramas del
+  nombre buscado (sin consultar la base); los trigramas muy frecuentes
+  ("tab", "mg ") no generan candidatos.
+- La similitud de nombre es el coeficiente de Dice entre trigramas, que se
+  obtiene para todos los candidatos a la vez del conteo de coincidencias.
+- buscar_clusters_duplicados compara cada producto sólo con sus candidatos
+  del índice, por lo que revisar todo el catálogo crece casi linealmente en
+  lugar de comparar todos contra todos.
 """
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, namedtuple
 from difflib import SequenceMatcher
-from django.db.models import Q
+
+from django.db import transaction
+from django.db.models import Max, Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
 from productos.models import Producto, CodigoAlternativo
 
 
+MAX_CANDIDATOS = 100
+UMBRAL_CLUSTER = 0.7
+
+# Cada cuántos segundos el índice busca productos nuevos en la base
+# (id mayor al último indexado) y cada cuántos se reconstruye completo
+INTERVALO_VERIFICACION = 30
+TTL_INDICE = 60 * 10
+
+
 def similitud_texto(texto1, texto2):
     """
     Calcula la similitud entre dos textos usando SequenceMatcher
@@ -36,6 +69,236 @@ def extraer_palabras_clave(nombre):
     return palabras_clave
 
 
+def normalizar_nombre(nombre):
+    """Minúsculas, sin tildes y sin signos: 'Ácido Fólico-5mg' -> 'acido folico 5mg'"""
+    texto = unicodedata.normalize('NFKD', nombre or '')
+    texto = ''.join(c for c in texto if not unicodedata.combining(c)).lower()
+    return re.sub(r'[^a-z0-9]+', ' ', texto).strip()
+
+
+def trigramas_palabras(palabras):
+    """Trigramas de cada palabra con un espacio de relleno a cada lado"""
+    trigramas = set()
+    for palabra in palabras:
+        relleno = f' {palabra} '
+        trigramas.update(relleno[i:i + 3] for i in range(len(relleno) - 2))
+    return frozenset(trigramas)
+
+
+DocumentoProducto = namedtuple(
+    'DocumentoProducto', ['nombre', 'palabras', 'trigramas', 'codigo_principal', 'codigo_auxiliar']
+)
+
+
+def documento_producto(nombre, codigo_principal=None, codigo_auxiliar=None):
+    """Representación indexada de un nombre de producto"""
+    normalizado = normalizar_nombre(nombre)
+    palabras = extraer_palabras_clave(normalizado) or normalizado.split()
+    return DocumentoProducto(
+        normalizado, tuple(palabras), trigramas_palabras(palabras), codigo_principal, codigo_auxiliar
+    )
+
+
+def dice(trigramas1, trigramas2, comunes=None):
+    """Coeficiente de Dice entre dos conjuntos de trigramas (0 a 1)"""
+    total = len(trigramas1) + len(trigramas2)
+    if not total:
+        return 0.0
+    if comunes is None:
+        comunes = len(trigramas1 & trigramas2)
+    return 2.0 * comunes / total
+
+
+class IndiceNombresProductos:
+    """
+    Índice invertido trigrama -> productos activos, en memoria del proceso.
+
+    Se construye con una sola consulta la primera vez que se usa. Se
+    mantiene al día sin caché compartida (CACHES es LocMemCache, propia de
+    cada proceso):
+
+    - cada intervalo_verificacion segundos se indexan los productos con id
+      mayor al último indexado, también los creados con INSERT directo;
+    - los cambios hechos en este proceso (señales de Producto, o
+      actualizar() después de un INSERT directo) se aplican en la siguiente
+      consulta;
+    - los cambios de nombre o bajas hechos por otros procesos se ven al
+      reconstruir el índice, cada ttl segundos.
+    """
+
+    def __init__(self, frecuencia_maxima=0.05, minimo_frecuentes=50,
+                 intervalo_verificacion=INTERVALO_VERIFICACION, ttl=TTL_INDICE):
+        # Un trigrama presente en más de frecuencia_maxima del catálogo (y en
+        # más de minimo_frecuentes productos) no genera candidatos
+        self.frecuencia_maxima = frecuencia_maxima
+        self.minimo_frecuentes = minimo_frecuentes
+        self.intervalo_verificacion = intervalo_verificacion
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._documentos = {}   # producto_id -> DocumentoProducto
+        self._listas = {}       # trigrama -> [producto_id, ...]
+        self._max_id = 0        # mayor id de producto revisado
+        self._pendientes = set()
+        self._construido = None
+        self._verificado = None
+
+    def _asegurar(self):
+        ahora = time.monotonic()
+        with self._lock:
+            if self._construido is None or ahora - self._construido > self.ttl:
+                self._pendientes = set()
+                self._construir()
+                self._construido = self._verificado = ahora
+                return
+            pendientes, self._pendientes = self._pendientes, set()
+            if ahora - self._verificado >= self.intervalo_verificacion:
+                self._verificado = ahora
+                pendientes.update(Producto.objects.filter(id__gt=self._max_id).values_list('id', flat=True))
+            if pendientes:
+                self._aplicar(pendientes)
+
+    def _construir(self):
+        documentos = {}
+        listas = {}
+        filas = Producto.objects.filter(activo=True).values_list(
+            'id', 'nombre', 'codigo_principal', 'codigo_auxiliar'
+        ).iterator(chunk_size=5000)
+        for producto_id, nombre, codigo_principal, codigo_auxiliar in filas:
+            documento = documento_producto(nombre, codigo_principal, codigo_auxiliar)
+            documentos[producto_id] = documento
+            for trigrama in documento.trigramas:
+                listas.setdefault(trigrama, []).append(producto_id)
+        self._documentos = documentos
+        self._listas = listas
+        self._max_id = Producto.objects.aggregate(maximo=Max('id'))['maximo'] or 0
+
+    def _aplicar(self, producto_ids):
+        """Relee los productos indicados y los vuelve a indexar (o los quita)"""
+        filas = Producto.objects.filter(id__in=producto_ids, activo=True).values_list(
+            'id', 'nombre', 'codigo_principal', 'codigo_auxiliar'
+        )
+        for producto_id in producto_ids:
+            self._quitar(producto_id)
+        for producto_id, nombre, codigo_principal, codigo_auxiliar in filas:
+            documento = documento_producto(nombre, codigo_principal, codigo_auxiliar)
+            self._documentos[producto_id] = documento
+            for trigrama in documento.trigramas:
+                self._listas.setdefault(trigrama, []).append(producto_id)
+        self._max_id = max(self._max_id, *producto_ids)
+
+    def __len__(self):
+        self._asegurar()
+        return len(self._documentos)
+
+    def documentos(self, producto_ids):
+        """{producto_id: DocumentoProducto} de los productos activos indicados"""
+        self._asegurar()
+        with self._lock:
+            return {pid: self._documentos[pid] for pid in producto_ids if pid in self._documentos}
+
+    def producto_ids(self):
+        self._asegurar()
+        with self._lock:
+            return sorted(self._documentos)
+
+    def candidatos(self, trigramas, limite=MAX_CANDIDATOS, excluir=None):
+        """
+        Productos que comparten más trigramas con los indicados.
+
+        Returns:
+            lista de (producto_id, dice) ordenada de mayor a menor similitud
+        """
+        self._asegurar()
+        return self._candidatos(trigramas, limite, excluir)
+
+    def _candidatos(self, trigramas, limite, excluir=None):
+        if not trigramas:
+            return []
+        with self._lock:
+            maximo = max(self.minimo_frecuentes, int(len(self._documentos) * self.frecuencia_maxima))
+            listas = [self._listas[t] for t in trigramas if t in self._listas]
+            raras = [lista for lista in listas if len(lista) <= maximo] or listas
+
+            conteo = Counter()
+            for lista in raras:
+                conteo.update(lista)
+            if excluir is not None:
+                conteo.pop(excluir, None)
+
+            # El conteo con trigramas raros ordena; la similitud se calcula con todos
+            resultado = []
+            for producto_id, _ in conteo.most_common(limite):
+                documento = self._documentos[producto_id]
+                resultado.append((producto_id, dice(trigramas, documento.trigramas)))
+        resultado.sort(key=lambda par: par[1], reverse=True)
+        return resultado
+
+    def pares_similares(self, producto_ids, umbral=UMBRAL_CLUSTER, limite=MAX_CANDIDATOS, verificar_version=True):
+        """
+        Pares (producto_id, otro_id, dice) con otro_id > producto_id y
+        similitud de nombre mayor o igual al umbral.
+
+        verificar_version=False usa el índice tal como está (procesos hijos
+        que lo heredaron ya construido).
+        """
+        if verificar_version:
+            self._asegurar()
+        pares = []
+        for producto_id in producto_ids:
+            documento = self._documentos.get(producto_id)
+            if documento is None:
+                continue
+            for otro_id, similitud in self._candidatos(documento.trigramas, limite, excluir=producto_id):
+                if similitud < umbral:
+                    break
+                if otro_id > producto_id:
+                    pares.append((producto_id, otro_id, similitud))
+        return pares
+
+    def actualizar(self, producto_id):
+        """
+        Registra el alta, cambio o baja de un producto hecho en este proceso;
+        se aplica en la siguiente consulta al índice. Los productos creados
+        con INSERT directo deben avisarse así al confirmar la transacción.
+        """
+        with self._lock:
+            self._pendientes.add(int(producto_id))
+
+    def _quitar(self, producto_id):
+        documento = self._documentos.pop(producto_id, None)
+        if documento is None:
+            return
+        for trigrama in documento.trigramas:
+            lista = self._listas.get(trigrama)
+            if lista is not None:
+                lista.remove(producto_id)
+                if not lista:
+                    del self._listas[trigrama]
+
+    def limpiar(self):
+        with self._lock:
+            self._documentos = {}
+            self._listas = {}
+            self._max_id = 0
+            self._pendientes = set()
+            self._construido = None
+            self._verificado = None
+
+
+indice_nombres = IndiceNombresProductos()
+
+
+@receiver(post_save, sender=Producto, dispatch_uid='indice_nombres_por_producto')
+def _actualizar_indice_nombres(sender, instance, **kwargs):
+    transaction.on_commit(lambda: indice_nombres.actualizar(instance.id))
+
+
+@receiver(post_delete, sender=Producto, dispatch_uid='indice_nombres_por_baja_producto')
+def _quitar_del_indice_nombres(sender, instance, **kwargs):
+    producto_id = instance.id  # delete() lo pone en None al terminar
+    transaction.on_commit(lambda: indice_nombres.actualizar(producto_id))
+
+
 def buscar_producto_por_codigo_exacto(codigo):
     """
     Busca un producto por código exacto (principal, auxiliar o alternativo)
@@ -90,84 +353,78 @@ def buscar_productos_similares(nombre, codigo=None, umbral_similitud=0.75, max_r
             }]
     
     # Normalizar nombre de búsqueda
-    nombre_busqueda = nombre.lower().strip()
-    palabras_busqueda = extraer_palabras_clave(nombre)
-    
-    # OPTIMIZACIÓN: Construir query SQL con LIKE para filtrar candidatos
-    # En lugar de cargar TODOS los productos, solo cargamos los que contienen
-    # alguna palabra clave relevante
-    q_objects = Q()
-    
-    for palabra in palabras_busqueda:
-        if len(palabra) >= 3:  # Solo palabras significativas (mínimo 3 caracteres)
-            q_objects |= Q(nombre__icontains=palabra)
-    
-    # Si se proporcionó código, agregar búsqueda por código
-    if codigo and len(codigo) >= 3:
-        q_objects |= Q(codigo_principal__icontains=codigo)
-        q_objects |= Q(codigo_auxiliar__icontains=codigo)
+    busqueda = documento_producto(nombre)
+    palabras_busqueda = [p for p in busqueda.palabras if len(p) >= 3]
+    buscar_codigo = bool(codigo and len(codigo) >= 3)
     
     # Si no hay palabras clave válidas, retornar vacío
-    if not q_objects:
+    if not palabras_busqueda and not buscar_codigo:
         return []
     
-    # Ejecutar query optimizada - SQL: WHERE nombre LIKE '%palabra1%' OR nombre LIKE '%palabra2%'
-    # Esto trae solo candidatos potenciales en lugar de toda la tabla
-    productos_activos = Producto.objects.filter(
-        q_objects,
-        activo=True
-    ).only(
-        'id', 'nombre', 'codigo_principal', 'codigo_auxiliar', 'stock', 'precio_venta'
-    )[:100]  # Limitar a 100 candidatos máximo para seguridad
+    # Candidatos del índice de trigramas con su similitud de nombre (Dice)
+    candidatos = dict(indice_nombres.candidatos(busqueda.trigramas)) if palabras_busqueda else {}
     
+    # Si se proporcionó código, agregar los productos con código parecido
+    if buscar_codigo:
+        por_codigo = Producto.objects.filter(
+            Q(codigo_principal__icontains=codigo) | Q(codigo_auxiliar__icontains=codigo),
+            activo=True
+        ).values_list('id', flat=True)[:MAX_CANDIDATOS]
+        for producto_id in por_codigo:
+            candidatos.setdefault(producto_id, None)
+    
+    documentos = indice_nombres.documentos(candidatos)
     similitudes = []
     
-    for producto in productos_activos:
-        producto_nombre = producto.nombre.lower()
+    for producto_id, ratio_nombre in candidatos.items():
+        documento = documentos.get(producto_id)
+        if documento is None:
+            continue
+        if ratio_nombre is None:
+            ratio_nombre = dice(busqueda.trigramas, documento.trigramas)
+        producto_nombre = documento.nombre
+        palabras_producto = documento.palabras
         
-        # 1. Similitud por nombre completo (difflib)
-        ratio_nombre = similitud_texto(nombre, producto.nombre)
+        # 1. Similitud por nombre completo: ratio_nombre (Dice de trigramas, del índice)
         
         # 2. Similitud por palabras clave comunes
-        palabras_producto = extraer_palabras_clave(producto.nombre)
         palabras_comunes = set(palabras_busqueda) & set(palabras_producto)
         ratio_palabras = len(palabras_comunes) / max(len(palabras_busqueda), 1) if palabras_busqueda else 0.0
         
-        # 3. NUEVO: Búsqueda por subcadenas (para casos como "finalin" vs "FINALIN FORTE")
+        # 3. Búsqueda por subcadenas (para casos como "finalin" vs "FINALIN FORTE")
         # Si alguna palabra de búsqueda está contenida en el nombre del producto
         ratio_subcadena = 0.0
         for palabra_busq in palabras_busqueda:
-            if len(palabra_busq) >= 3:  # Reducido a 3+ caracteres para más flexibilidad
-                if palabra_busq in producto_nombre:
-                    # Coincidencia exacta de subcadena
-                    ratio_subcadena = max(ratio_subcadena, 0.95)
-                elif any(palabra_busq in palabra_prod for palabra_prod in palabras_producto):
-                    # Coincidencia parcial
-                    ratio_subcadena = max(ratio_subcadena, 0.85)
-                elif any(palabra_prod in palabra_busq for palabra_prod in palabras_producto if len(palabra_prod) >= 3):
-                    # Inverso: palabra del producto contenida en palabra de búsqueda
-                    ratio_subcadena = max(ratio_subcadena, 0.75)
+            if palabra_busq in producto_nombre:
+                # Coincidencia exacta de subcadena
+                ratio_subcadena = 0.95
+                break
+            elif any(palabra_busq in palabra_prod for palabra_prod in palabras_producto):
+                # Coincidencia parcial
+                ratio_subcadena = max(ratio_subcadena, 0.85)
+            elif any(palabra_prod in palabra_busq for palabra_prod in palabras_producto if len(palabra_prod) >= 3):
+                # Inverso: palabra del producto contenida en palabra de búsqueda
+                ratio_subcadena = max(ratio_subcadena, 0.75)
         
-        # 4. NUEVO: Coincidencia al inicio del nombre (boost para marcas)
+        # 4. Coincidencia al inicio del nombre (boost para marcas)
         ratio_inicio = 0.0
         if palabras_busqueda:
             primera_palabra = palabras_busqueda[0]
-            if len(primera_palabra) >= 3:  # Reducido a 3+ caracteres
-                if producto_nombre.startswith(primera_palabra):
-                    ratio_inicio = 1.0
-                elif any(p.startswith(primera_palabra) for p in palabras_producto):
-                    ratio_inicio = 0.85
+            if producto_nombre.startswith(primera_palabra):
+                ratio_inicio = 1.0
+            elif any(p.startswith(primera_palabra) for p in palabras_producto):
+                ratio_inicio = 0.85
         
         # 5. Similitud por código (si se proporcionó)
         ratio_codigo = 0.0
         if codigo:
-            if producto.codigo_principal:
-                ratio_codigo = max(ratio_codigo, similitud_texto(codigo, producto.codigo_principal))
-            if producto.codigo_auxiliar:
-                ratio_codigo = max(ratio_codigo, similitud_texto(codigo, producto.codigo_auxiliar))
+            if documento.codigo_principal:
+                ratio_codigo = max(ratio_codigo, similitud_texto(codigo, documento.codigo_principal))
+            if documento.codigo_auxiliar:
+                ratio_codigo = max(ratio_codigo, similitud_texto(codigo, documento.codigo_auxiliar))
         
         # Score combinado optimizado:
-        # - 25% similitud de nombre completo (difflib)
+        # - 25% similitud de nombre completo (trigramas)
         # - 20% palabras clave comunes
         # - 35% coincidencia de subcadena (AUMENTADO - es el más importante para nombres parciales)
         # - 15% coincidencia al inicio (importante para marcas)
@@ -180,8 +437,6 @@ def buscar_productos_similares(nombre, codigo=None, umbral_similitud=0.75, max_r
             (ratio_codigo * 0.05)
         )
         
-        # Reducir el umbral efectivo si hay buena coincidencia de subcadena o inicio
-        umbral_efectivo = umbral_similitud
         # Reducir el umbral efectivo si hay buena coincidencia de subcadena o inicio
         umbral_efectivo = umbral_similitud
         if ratio_subcadena >= 0.85 or ratio_inicio >= 0.85:
@@ -189,7 +444,7 @@ def buscar_productos_similares(nombre, codigo=None, umbral_similitud=0.75, max_r
         
         if score_final >= umbral_efectivo:
             similitudes.append({
-                'producto': producto,
+                'producto_id': producto_id,
                 'similitud_nombre': round(ratio_nombre * 100, 1),
                 'similitud_codigo': round(ratio_codigo * 100, 1) if codigo else 0.0,
                 'score_total': round(score_final * 100, 1),
@@ -201,13 +456,70 @@ def buscar_productos_similares(nombre, codigo=None, umbral_similitud=0.75, max_r
                     'palabras': round(ratio_palabras * 100, 1),
                     'subcadena': round(ratio_subcadena * 100, 1),
                     'inicio': round(ratio_inicio * 100, 1),
-                    'candidatos_sql': len(productos_activos)
+                    'candidatos_indice': len(candidatos)
                 }
             })
     
-    # Ordenar por score y retornar los mejores resultados
+    # Ordenar por score y cargar solo los productos que se retornan
     similitudes.sort(key=lambda x: x['score_total'], reverse=True)
-    return similitudes[:max_resultados]
+    similitudes = similitudes[:max_resultados]
+    productos = Producto.objects.in_bulk([s['producto_id'] for s in similitudes])
+    resultado = []
+    for similitud in similitudes:
+        producto = productos.get(similitud.pop('producto_id'))
+        if producto is not None:
+            similitud['producto'] = producto
+            resultado.append(similitud)
+    return resultado
+
+
+def buscar_clusters_duplicados(umbral=UMBRAL_CLUSTER, producto_ids=None):
+    """
+    Agrupa el catálogo en grupos de probables duplicados.
+    
+    Cada producto se compara sólo con sus candidatos del índice de
+    trigramas; los pares con similitud de nombre >= umbral se unen en
+    grupos (componentes conexas).
+    
+    Returns:
+        Lista de dicts {'producto_ids', 'pares', 'similitud_maxima'}
+        ordenada por tamaño del grupo
+    """
+    if producto_ids is None:
+        producto_ids = indice_nombres.producto_ids()
+    return agrupar_pares(indice_nombres.pares_similares(producto_ids, umbral))
+
+
+def agrupar_pares(pares):
+    """Une los pares (a, b, similitud) en grupos conexos (union-find)"""
+    padres = {}
+    
+    def raiz(x):
+        padres.setdefault(x, x)
+        while padres[x] != x:
+            padres[x] = padres[padres[x]]
+            x = padres[x]
+        return x
+    
+    for a, b, _ in pares:
+        ra, rb = raiz(a), raiz(b)
+        if ra != rb:
+            padres[max(ra, rb)] = min(ra, rb)
+    
+    grupos = {}
+    for a, b, similitud in pares:
+        grupo = grupos.setdefault(raiz(a), {'producto_ids': set(), 'pares': [], 'similitud_maxima': 0.0})
+        grupo['producto_ids'].update((a, b))
+        grupo['pares'].append((a, b, round(similitud, 4)))
+        grupo['similitud_maxima'] = max(grupo['similitud_maxima'], similitud)
+    
+    clusters = []
+    for grupo in grupos.values():
+        grupo['producto_ids'] = sorted(grupo['producto_ids'])
+        grupo['similitud_maxima'] = round(grupo['similitud_maxima'], 4)
+        clusters.append(grupo)
+    clusters.sort(key=lambda g: (-len(g['producto_ids']), g['producto_ids'][0]))
+    return clusters
 
 
 def vincular_codigo_alternativo(producto_id, codigo, nombre_proveedor=None, id_proveedor=None):
@@ -0,0 +1,109 @@
+"""
+Agrupación de productos duplicados de todo el catálogo
+
+Trabajo nocturno (comando agrupar_productos_duplicados) que reemplaza las
+miles de consultas interactivas de a un nombre por una sola pasada:
+
+    1. Bloqueo: el índice de trigramas (utils_duplicados.indice_nombres)
+       sólo propone como candidatos los productos que comparten trigramas
+       poco frecuentes, así que nadie se compara con todo el catálogo.
+    2. Unión por similitud: cada bloque de productos calcula sus pares con
+       Dice >= umbral. Los bloques se reparten entre procesos (fork: los
+       hijos heredan el índice ya construido y no consultan la base).
+    3. Los pares se unen en grupos y se guardan en GrupoDuplicados para
+       revisarlos por páginas. Los grupos ya revisados o descartados no
+       se vuelven a proponer.
+"""
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .models import GrupoDuplicados
+from .utils_duplicados import UMBRAL_CLUSTER, agrupar_pares, indice_nombres
+
+
+TAMANO_BLOQUE = 2000
+TAMANO_LOTE = 500
+
+
+def clave_grupo(producto_ids):
+    """Identifica un grupo por sus productos, sin importar el orden"""
+    return hashlib.sha1(','.join(map(str, sorted(producto_ids))).encode()).hexdigest()
+
+
+def _pares_bloque(args):
+    producto_ids, umbral = args
+    return indice_nombres.pares_similares(producto_ids, umbral, verificar_version=False)
+
+
+def calcular_grupos(umbral=UMBRAL_CLUSTER, procesos=1, tamano_bloque=TAMANO_BLOQUE):
+    """
+    Grupos de probables duplicados de todo el catálogo.
+
+    Args:
+        umbral: similitud de nombre (Dice de trigramas) mínima de un par
+        procesos: procesos en paralelo (1 = en este proceso; sólo donde
+            existe fork, en otro caso se calcula en este proceso)
+        tamano_bloque: productos por tarea
+
+    Returns:
+        lista de dicts {'producto_ids', 'pares', 'similitud_maxima'}
+    """
+    producto_ids = indice_nombres.producto_ids()  # construye el índice antes de repartir
+    bloques = [
+        (producto_ids[i:i + tamano_bloque], umbral)
+        for i in range(0, len(producto_ids), tamano_bloque)
+    ]
+
+    if procesos > 1 and len(bloques) > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        # Los hijos no deben compartir las conexiones abiertas del padre
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=procesos, mp_context=multiprocessing.get_context('fork')) as ejecutor:
+            pares = [par for resultado in ejecutor.map(_pares_bloque, bloques) for par in resultado]
+    else:
+        pares = [par for bloque in bloques for par in _pares_bloque(bloque)]
+
+    return agrupar_pares(pares)
+
+
+def guardar_grupos(grupos):
+    """
+    Reemplaza los grupos pendientes por los calculados.
+
+    Returns:
+        (grupos guardados, grupos omitidos porque ya fueron revisados o descartados)
+    """
+    with transaction.atomic():
+        GrupoDuplicados.objects.filter(estado='pendiente').delete()
+        revisados = set(GrupoDuplicados.objects.values_list('clave', flat=True))
+
+        nuevos = []
+        for grupo in grupos:
+            clave = clave_grupo(grupo['producto_ids'])
+            if clave in revisados:
+                continue
+            nuevos.append(GrupoDuplicados(
+                clave=clave,
+                producto_ids=grupo['producto_ids'],
+                pares=[list(par) for par in grupo['pares']],
+                tamano=len(grupo['producto_ids']),
+                similitud_maxima=Decimal(str(grupo['similitud_maxima'])),
+            ))
+        GrupoDuplicados.objects.bulk_create(nuevos, batch_size=TAMANO_LOTE)
+
+    return len(nuevos), len(grupos) - len(nuevos)
+
+
+def revisar_grupo(grupo, estado, usuario):
+    """Marca un grupo como revisado o descartado"""
+    if estado not in ('revisado', 'descartado'):
+        raise ValueError(f'Estado de revisión inválido: {estado}')
+    grupo.estado = estado
+    grupo.revisado_por = usuario
+    grupo.fecha_revision = timezone.now()
+    grupo.save(update_fields=['estado', 'revisado_por', 'fecha_revision'])
+    return grupo
@@ -2,7 +2,8 @@ from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.core.paginator import Paginator
-from django.db.models import Q, F
+from django.db import transaction
+from django.db.models import Q
 from django.http import JsonResponse
 from django.utils import timezone
 from datetime import datetime
@@ -10,6 +11,10 @@ from .models import (
     Producto, Categoria, Marca, Laboratorio, TipoProducto, 
     ClaseProducto, Subcategoria, SubnivelProducto
 )
+from inventario.utils_alertas import (
+    alertas_globales, contar_productos_bajo_stock, ids_productos_bajo_stock
+)
+from .utils_duplicados import indice_nombres
 
 
 def lista_productos_simple(request):
@@ -107,7 +112,7 @@ def lista_productos(request):
     # Estadísticas
     total_productos = Producto.objects.filter(activo=True, anulado=False).count()
     productos_en_stock = Producto.objects.filter(activo=True, anulado=False, stock__gt=0).count()
-    productos_stock_bajo = Producto.objects.filter(activo=True, anulado=False, stock__lte=F('stock_minimo')).count()
+    productos_stock_bajo = contar_productos_bajo_stock()
     total_categorias = Categoria.objects.count()
     
     # Obtener datos para filtros
@@ -154,12 +159,10 @@ def detalle_producto(request, producto_id):
 @login_required
 def productos_con_stock_bajo(request):
     """Lista productos que necesitan reabastecimiento"""
+    # Los productos en alerta salen del índice AlertaStock (sin recorrer el catálogo)
     productos = Producto.objects.filter(
-        activo=True,
-        anulado=False
-    ).annotate(
-        necesita_restock=F('stock') <= F('stock_minimo')
-    ).filter(necesita_restock=True).select_related(
+        id__in=ids_productos_bajo_stock()
+    ).select_related(
         'id_categoria', 'id_marca', 'id_laboratorio'
     )
     
@@ -399,6 +402,10 @@ def crear_producto(request):
                         es_divisible, es_psicotropico, requiere_cadena_frio, requiere_seguimiento,
                         calculo_abc_manual, activo, request.user.id
                     ])
+                    producto_id = cursor.lastrowid
+                
+                # El INSERT directo no emite post_save: avisar al índice de nombres
+                transaction.on_commit(lambda: indice_nombres.actualizar(producto_id))
                 
                 messages.success(request, f'Producto "{nombre}" creado exitosamente con código {codigo_principal}')
                 return redirect('productos:lista')
@@ -834,8 +841,7 @@ def productos_bajo_stock(request):
     """Productos que necesitan restock - NUEVA IMPLEMENTACIÓN CON PAGINACIÓN"""
     try:
         productos_list = Producto.objects.filter(
-            activo=True,
-            stock__lte=F('stock_minimo')
+            id__in=ids_productos_bajo_stock()
         ).select_related('id_categoria', 'id_marca').order_by('stock', 'nombre')
         
         # Paginación
@@ -844,9 +850,10 @@ def productos_bajo_stock(request):
         productos = paginator.get_page(page_number)
         
         # Estadísticas
-        total_productos = productos_list.count()
-        productos_agotados = productos_list.filter(stock=0).count()
-        productos_bajo_minimo = productos_list.filter(stock__gt=0, stock__lte=F('stock_minimo')).count()
+        alertas = alertas_globales()
+        total_productos = alertas.count()
+        productos_agotados = alertas.filter(nivel='agotado').count()
+        productos_bajo_minimo = alertas.filter(nivel='bajo').count()
         
         context = {
             'productos': productos,
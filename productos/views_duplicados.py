@@ -0,0 +1,66 @@
+"""
+Revisión de los grupos de productos duplicados del catálogo
+
+Los grupos los genera cada noche el comando agrupar_productos_duplicados
+(ver productos.utils_grupos_duplicados); aquí sólo se recorren por páginas
+y se marcan como revisados o descartados.
+"""
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.core.paginator import Paginator
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404, redirect, render
+from django.urls import reverse
+from django.views.decorators.http import require_http_methods
+
+from .models import GrupoDuplicados, Producto
+from .utils_grupos_duplicados import revisar_grupo
+
+
+@login_required
+def grupos_duplicados(request):
+    """Grupos de probables duplicados, 20 por página"""
+    estado = request.GET.get('estado', 'pendiente')
+    if estado not in dict(GrupoDuplicados.ESTADO_CHOICES):
+        estado = 'pendiente'
+
+    paginator = Paginator(GrupoDuplicados.objects.filter(estado=estado), 20)
+    page_obj = paginator.get_page(request.GET.get('page'))
+
+    # Productos de todos los grupos de la página en una sola consulta
+    ids = {producto_id for grupo in page_obj for producto_id in grupo.producto_ids}
+    productos = Producto.objects.only(
+        'id', 'nombre', 'codigo_principal', 'stock', 'precio_venta', 'activo'
+    ).in_bulk(ids)
+    for grupo in page_obj:
+        grupo.productos = [productos[pid] for pid in grupo.producto_ids if pid in productos]
+
+    context = {
+        'titulo': 'Productos Duplicados',
+        'page_obj': page_obj,
+        'estado': estado,
+        'estados': GrupoDuplicados.ESTADO_CHOICES,
+        'total_pendientes': GrupoDuplicados.objects.filter(estado='pendiente').count(),
+    }
+    return render(request, 'productos/grupos_duplicados.html', context)
+
+
+@login_required
+@require_http_methods(["POST"])
+def revisar_grupo_duplicados(request, pk):
+    """Marca un grupo como revisado o descartado"""
+    grupo = get_object_or_404(GrupoDuplicados, pk=pk)
+    es_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+    try:
+        revisar_grupo(grupo, request.POST.get('estado', ''), request.user)
+    except ValueError as e:
+        if es_ajax:
+            return JsonResponse({'success': False, 'error': str(e)}, status=400)
+        messages.error(request, str(e))
+        return redirect('productos:grupos_duplicados')
+
+    if es_ajax:
+        return JsonResponse({'success': True, 'estado': grupo.estado})
+    messages.success(request, f'Grupo {grupo.id} marcado como {grupo.get_estado_display().lower()}')
+    # Volver a la misma página de pendientes
+    return redirect(f"{reverse('productos:grupos_duplicados')}?page={request.POST.get('page', 1)}")
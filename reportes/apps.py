@@ -4,4 +4,12 @@ from django.apps import AppConfig
 class ReportesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'reportes'
-    verbose_name = 'Reportes'
\ No newline at end of file
+    verbose_name = 'Reportes'
+
+    def ready(self):
+        # Registrar las exportaciones y las tareas de reportes de cada módulo
+        # (también en el proceso del worker de trabajos)
+        from . import exportaciones, utils_exportacion  # noqa: F401
+        from contabilidad import utils_reportes as reportes_contabilidad  # noqa: F401
+        from inventario import utils_caducidad  # noqa: F401
+        from ventas import utils_reportes as reportes_ventas  # noqa: F401
@@ -0,0 +1,152 @@
+"""
+Definiciones de las exportaciones de catálogos (productos, clientes y
+proveedores) para el motor de reportes.utils_exportacion.
+
+Se importan desde ReportesConfig.ready() para que estén registradas también
+en el proceso del worker de trabajos.
+"""
+from clientes.models import Cliente
+from productos.models import Producto
+from proveedores.models import Proveedor
+
+from .utils_exportacion import Exportacion, registrar_exportacion
+
+
+def _si_no(valor):
+    return 'Sí' if valor else 'No'
+
+
+def _nombre(objeto):
+    return getattr(objeto, 'nombre', '') if objeto else ''
+
+
+def _fecha(valor):
+    return valor.strftime('%Y-%m-%d %H:%M:%S') if valor else ''
+
+
+@registrar_exportacion('productos')
+def exportacion_productos():
+    """Lista completa de productos"""
+    return Exportacion(
+        nombre='productos',
+        titulo='REPORTE DE PRODUCTOS',
+        queryset=Producto.objects.select_related('id_laboratorio', 'id_marca', 'id_categoria'),
+        orden='nombre',
+        columnas=[
+            ('ID', lambda p: p.id),
+            ('Código Principal', lambda p: p.codigo_principal),
+            ('Código Auxiliar', lambda p: p.codigo_auxiliar or ''),
+            ('Nombre', lambda p: p.nombre),
+            ('Descripción', lambda p: p.descripcion or ''),
+            ('Laboratorio', lambda p: _nombre(p.id_laboratorio)),
+            ('Marca', lambda p: _nombre(p.id_marca)),
+            ('Categoría', lambda p: _nombre(p.id_categoria)),
+            ('Costo Unidad', lambda p: f"{p.costo_unidad:.2f}"),
+            ('Precio Venta', lambda p: f"{p.precio_venta:.2f}"),
+            ('Stock', lambda p: p.stock),
+            ('Stock Mínimo', lambda p: p.stock_minimo),
+            ('Stock Máximo', lambda p: p.stock_maximo),
+            ('Activo', lambda p: _si_no(p.activo)),
+            ('Requiere Frío', lambda p: _si_no(p.requiere_cadena_frio)),
+            ('Psicotrópico', lambda p: _si_no(p.es_psicotropico)),
+        ],
+        columnas_pdf=['Código Principal', 'Nombre', 'Precio Venta', 'Stock', 'Categoría'],
+        lineas_txt=_lineas_txt_producto,
+    )
+
+
+def _lineas_txt_producto(producto):
+    lineas = [f"Código Principal: {producto.codigo_principal}"]
+    if producto.codigo_auxiliar:
+        lineas.append(f"Código Auxiliar: {producto.codigo_auxiliar}")
+    lineas.append(f"Nombre: {producto.nombre}")
+    if producto.descripcion:
+        lineas.append(f"Descripción: {producto.descripcion}")
+    if producto.id_categoria:
+        lineas.append(f"Categoría: {producto.id_categoria.nombre}")
+    if producto.id_laboratorio:
+        lineas.append(f"Laboratorio: {producto.id_laboratorio.nombre}")
+    if producto.id_marca:
+        lineas.append(f"Marca: {producto.id_marca.nombre}")
+    lineas.append(f"Costo Unidad: ${producto.costo_unidad:.2f}")
+    lineas.append(f"Precio Venta: ${producto.precio_venta:.2f}")
+    lineas.append(f"Stock: {producto.stock}")
+    lineas.append(f"Estado: {'Activo' if producto.activo and not producto.anulado else 'Inactivo'}")
+    return lineas
+
+
+@registrar_exportacion('clientes')
+def exportacion_clientes():
+    """Clientes no anulados"""
+    return Exportacion(
+        nombre='clientes',
+        titulo='REPORTE DE CLIENTES',
+        queryset=Cliente.objects.exclude(anulado=True),
+        orden='nombres',
+        columnas=[
+            ('ID', lambda c: c.id),
+            ('Nombres', lambda c: c.nombres or ''),
+            ('Apellidos', lambda c: c.apellidos or ''),
+            ('Cédula/RUC', lambda c: c.cedula_ruc),
+            ('Teléfono', lambda c: c.telefono or ''),
+            ('Celular', lambda c: c.celular or ''),
+            ('Email', lambda c: c.email or ''),
+            ('Dirección', lambda c: c.direccion or ''),
+            ('Tipo Cliente', lambda c: c.tipo_cliente or ''),
+            ('Estado', lambda c: 'Activo' if not c.anulado else 'Anulado'),
+            ('Fecha Registro', lambda c: _fecha(c.creado_date)),
+        ],
+        columnas_pdf=['Nombres', 'Apellidos', 'Cédula/RUC', 'Teléfono', 'Email'],
+        lineas_txt=_lineas_txt_cliente,
+    )
+
+
+def _lineas_txt_cliente(cliente):
+    nombre = cliente.razon_social or f"{cliente.nombres or ''} {cliente.apellidos or ''}".strip()
+    lineas = [f"Nombre: {nombre}", f"Cédula/RUC: {cliente.cedula_ruc}"]
+    if cliente.telefono:
+        lineas.append(f"Teléfono: {cliente.telefono}")
+    if cliente.email:
+        lineas.append(f"Email: {cliente.email}")
+    if cliente.direccion:
+        lineas.append(f"Dirección: {cliente.direccion}")
+    lineas.append(f"Estado: {'Activo' if cliente.estado and not cliente.anulado else 'Inactivo'}")
+    return lineas
+
+
+@registrar_exportacion('proveedores')
+def exportacion_proveedores():
+    """Proveedores no anulados"""
+    return Exportacion(
+        nombre='proveedores',
+        titulo='REPORTE DE PROVEEDORES',
+        queryset=Proveedor.objects.exclude(anulado=True),
+        orden='razon_social',
+        columnas=[
+            ('ID', lambda p: p.id),
+            ('RUC', lambda p: p.ruc),
+            ('Razón Social', lambda p: p.razon_social),
+            ('Nombre Comercial', lambda p: p.nombre_comercial or ''),
+            ('Teléfono', lambda p: p.telefono or ''),
+            ('Email', lambda p: p.email or ''),
+            ('Dirección', lambda p: p.direccion or ''),
+            ('Estado', lambda p: 'Activo' if not p.anulado else 'Anulado'),
+            ('Fecha Registro', lambda p: _fecha(p.creado_date)),
+        ],
+        columnas_pdf=['RUC', 'Razón Social', 'Nombre Comercial', 'Teléfono', 'Email'],
+        lineas_txt=_lineas_txt_proveedor,
+    )
+
+
+def _lineas_txt_proveedor(proveedor):
+    lineas = [f"RUC: {proveedor.ruc}", f"Razón Social: {proveedor.razon_social}"]
+    if proveedor.nombre_comercial:
+        lineas.append(f"Nombre Comercial: {proveedor.nombre_comercial}")
+    if proveedor.telefono:
+        lineas.append(f"Teléfono: {proveedor.telefono}")
+    if proveedor.email:
+        lineas.append(f"Email: {proveedor.email}")
+    if proveedor.direccion:
+        lineas.append(f"Dirección: {proveedor.direccion}")
+    lineas.append(f"Estado: {'Activo' if proveedor.estado and not proveedor.anulado else 'Inactivo'}")
+    return lineas
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+Comando para calcular la analítica de ventas y la clasificación ABC de productos
+Uso: python manage.py calcular_analitica_ventas [--dias 365] [--sin-guardar]
+
+Programarlo una vez al día o a la semana. Los productos con
+calculoABCManual conservan la clasificación ingresada a mano.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from reportes.utils_analitica import DIAS_HISTORIAL, actualizar_clasificacion_abc, calcular_analitica
+
+
+class Command(BaseCommand):
+    help = 'Calcula clasificación ABC, velocidad de venta, días de inventario y rotación por producto'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=DIAS_HISTORIAL,
+                            help=f'Días de historial de ventas a analizar (default: {DIAS_HISTORIAL})')
+        parser.add_argument('--sin-guardar', action='store_true',
+                            help='Solo mostrar el resumen, sin actualizar clasificacionABC')
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+        resultados = calcular_analitica(dias=options['dias'])
+        duracion_calculo = time.monotonic() - inicio
+
+        por_clase = {'A': [0, 0.0], 'B': [0, 0.0], 'C': [0, 0.0]}
+        for resultado in resultados:
+            por_clase[resultado['clase']][0] += 1
+            por_clase[resultado['clase']][1] += resultado['ingresos']
+
+        self.stdout.write(f'📊 {len(resultados)} productos analizados ({options["dias"]} días) en {duracion_calculo:.2f}s')
+        for clase, (productos, ingresos) in por_clase.items():
+            self.stdout.write(f'   Clase {clase}: {productos} productos, ${ingresos:,.2f} en ventas')
+
+        sin_rotacion = sum(1 for resultado in resultados if resultado['unidades'] == 0)
+        if sin_rotacion:
+            self.stdout.write(self.style.WARNING(f'⚠ {sin_rotacion} productos sin ventas en el período'))
+
+        if options['sin_guardar']:
+            self.stdout.write('ℹ Clasificación no guardada (--sin-guardar)')
+            return
+
+        actualizados = actualizar_clasificacion_abc(resultados)
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ Clasificación ABC actualizada: {actualizados} productos en {time.monotonic() - inicio:.2f}s'
+        ))
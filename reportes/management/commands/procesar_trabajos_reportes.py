@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Worker de la cola de trabajos de reportes (TrabajoReporte)
+Uso: python manage.py procesar_trabajos_reportes [--una-vez] [--intervalo 2]
+
+Procesa en orden los reportes encolados por las vistas (reporte consolidado,
+reportes contables, exportaciones grandes). Se pueden ejecutar varios
+workers a la vez: cada trabajo se toma con SELECT ... FOR UPDATE SKIP LOCKED.
+Ejecutarlo como servicio (systemd/supervisor) junto a gunicorn.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from reportes.utils_trabajos import (
+    ejecutar, limpiar_trabajos, reencolar_abandonados, tomar_siguiente,
+)
+
+
+class Command(BaseCommand):
+    help = 'Procesa los trabajos de reportes en segundo plano'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--una-vez', action='store_true',
+                            help='Procesar los trabajos pendientes y terminar')
+        parser.add_argument('--intervalo', type=float, default=2,
+                            help='Segundos de espera cuando no hay trabajos (default: 2)')
+        parser.add_argument('--dias-retencion', type=int, default=7,
+                            help='Días que se conservan los trabajos terminados y sus archivos (default: 7)')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('✓ Worker de reportes iniciado'))
+        ultimo_mantenimiento = 0
+
+        while True:
+            close_old_connections()
+
+            # Mantenimiento cada 10 minutos
+            if time.monotonic() - ultimo_mantenimiento > 600:
+                reencolados, fallidos = reencolar_abandonados()
+                eliminados = limpiar_trabajos(options['dias_retencion'])
+                if reencolados or fallidos or eliminados:
+                    self.stdout.write(
+                        f'  Mantenimiento: {reencolados} reencolados, {fallidos} fallidos, {eliminados} eliminados'
+                    )
+                ultimo_mantenimiento = time.monotonic()
+
+            trabajo = tomar_siguiente()
+            if trabajo is None:
+                if options['una_vez']:
+                    break
+                time.sleep(options['intervalo'])
+                continue
+
+            inicio = time.monotonic()
+            ejecutar(trabajo)
+            duracion = time.monotonic() - inicio
+            if trabajo.estado == 'completado':
+                self.stdout.write(self.style.SUCCESS(f'✓ {trabajo} en {duracion:.2f}s'))
+            else:
+                self.stdout.write(self.style.ERROR(f'✗ {trabajo}: {trabajo.error}'))
+
+        self.stdout.write(self.style.SUCCESS('✓ No hay trabajos pendientes'))
@@ -0,0 +1,48 @@
+from django.contrib.auth.models import User
+from django.db import models
+
+
+class TrabajoReporte(models.Model):
+    """
+    Cola de reportes pesados que se generan fuera de las peticiones web.
+
+    Cada trabajo guarda el tipo de reporte, sus parámetros y una clave
+    (hash de tipo + parámetros). Un trabajo completado sirve como resultado
+    en caché para las peticiones idénticas hasta su fecha de expiración.
+    Lo procesa el comando procesar_trabajos_reportes (ver reportes.utils_trabajos).
+
+    Requiere crear la tabla en MySQL: ver crear_tabla_trabajos_reportes.sql
+    """
+    ESTADO_CHOICES = [
+        ('pendiente', 'Pendiente'),
+        ('procesando', 'Procesando'),
+        ('completado', 'Completado'),
+        ('error', 'Error'),
+    ]
+
+    tipo = models.CharField(max_length=50)
+    parametros = models.JSONField(default=dict)
+    clave = models.CharField(max_length=64, help_text='SHA-256 de tipo + parámetros')
+    estado = models.CharField(max_length=10, choices=ESTADO_CHOICES, default='pendiente')
+    resultado = models.JSONField(null=True, blank=True)
+    archivo = models.CharField(max_length=255, blank=True, help_text='Ruta del archivo generado (exportaciones)')
+    error = models.TextField(blank=True)
+    intentos = models.IntegerField(default=0)
+
+    usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='trabajos_reportes')
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_inicio = models.DateTimeField(null=True, blank=True)
+    fecha_fin = models.DateTimeField(null=True, blank=True)
+    fecha_expiracion = models.DateTimeField(null=True, blank=True, help_text='Hasta cuándo el resultado sirve como caché')
+
+    class Meta:
+        verbose_name = "Trabajo de Reporte"
+        verbose_name_plural = "Trabajos de Reportes"
+        ordering = ['-fecha_creacion']
+        indexes = [
+            models.Index(fields=['estado', 'id']),
+            models.Index(fields=['clave', 'estado']),
+        ]
+
+    def __str__(self):
+        return f"{self.tipo} #{self.id} ({self.get_estado_display()})"
@@ -12,6 +12,10 @@ urlpatterns = [
     path('clientes/exportar/', views.exportar_clientes, name='exportar_clientes'),
     path('proveedores/exportar/', views.exportar_proveedores, name='exportar_proveedores'),
     
+    # Trabajos en segundo plano
+    path('trabajos/<int:trabajo_id>/estado/', views.estado_trabajo, name='estado_trabajo'),
+    path('trabajos/<int:trabajo_id>/descargar/', views.descargar_trabajo, name='descargar_trabajo'),
+    
     # Estadísticas
     path('estadisticas/', views.reporte_estadisticas, name='estadisticas'),
 ]
\ No newline at end of file
@@ -0,0 +1,157 @@
+"""
+Analítica de ventas por producto: clasificación ABC (Pareto), velocidad de
+venta, días de inventario y rotación.
+
+El historial de facturas_venta_detalle se agrega en la base de datos por
+ventanas de fechas (una consulta GROUP BY por ventana, aprovechando el
+índice de fechaEmision) y en Python solo se trabaja con un acumulado por
+producto. Así un año de ventas se procesa en pocas consultas y la memoria
+depende del número de productos, no del número de líneas vendidas.
+
+La clasificación calculada se guarda en productos.clasificacionABC con una
+actualización por clase (por bloques de ids), respetando los productos
+marcados con calculoABCManual.
+"""
+from datetime import date, timedelta
+
+from django.db import connection, transaction
+
+from productos.models import Producto
+
+
+DIAS_HISTORIAL = 365
+DIAS_VENTANA = 31  # días de ventas agregados por consulta
+CORTE_A = 0.80  # participación acumulada en ingresos hasta la que un producto es clase A
+CORTE_B = 0.95  # ... y clase B; el resto es clase C
+TAMANO_BLOQUE_UPDATE = 1000
+
+
+def cargar_ventas_por_producto(fecha_inicio, fecha_fin, dias_ventana=DIAS_VENTANA):
+    """
+    Agrega las ventas no anuladas entre fecha_inicio y fecha_fin (inclusive).
+
+    Returns:
+        dict producto_id -> [unidades, ingresos, dias_con_venta]
+    """
+    acumulado = {}
+    desde = fecha_inicio
+    with connection.cursor() as cursor:
+        while desde <= fecha_fin:
+            hasta = min(desde + timedelta(days=dias_ventana), fecha_fin + timedelta(days=1))
+            cursor.execute("""
+                SELECT fvd.idProducto,
+                       SUM(fvd.cantidad),
+                       SUM(fvd.total),
+                       COUNT(DISTINCT DATE(fv.fechaEmision))
+                FROM facturas_venta_detalle fvd
+                JOIN facturas_venta fv ON fvd.idFacturaVenta = fv.id
+                WHERE fv.fechaEmision >= %s AND fv.fechaEmision < %s
+                AND fv.estado != 'ANULADA'
+                GROUP BY fvd.idProducto
+            """, [desde, hasta])
+            for producto_id, unidades, ingresos, dias in cursor.fetchall():
+                fila = acumulado.get(producto_id)
+                if fila is None:
+                    acumulado[producto_id] = [float(unidades or 0), float(ingresos or 0), dias]
+                else:
+                    # Las ventanas no se solapan: los días con venta se suman
+                    fila[0] += float(unidades or 0)
+                    fila[1] += float(ingresos or 0)
+                    fila[2] += dias
+            desde = hasta
+    return acumulado
+
+
+def clasificar_abc(ingresos, corte_a=CORTE_A, corte_b=CORTE_B):
+    """
+    Clasificación de Pareto por ingresos.
+
+    Args:
+        ingresos: dict producto_id -> ingresos del período
+
+    Returns:
+        dict producto_id -> (clase, participación acumulada antes del producto)
+    """
+    total = sum(valor for valor in ingresos.values() if valor > 0)
+    clases = {}
+    acumulado = 0.0
+    for producto_id, valor in sorted(ingresos.items(), key=lambda item: item[1], reverse=True):
+        if total <= 0 or valor <= 0:
+            clases[producto_id] = ('C', 1.0)
+            continue
+        participacion = acumulado / total
+        if participacion < corte_a:
+            clase = 'A'
+        elif participacion < corte_b:
+            clase = 'B'
+        else:
+            clase = 'C'
+        clases[producto_id] = (clase, participacion)
+        acumulado += valor
+    return clases
+
+
+def calcular_analitica(dias=DIAS_HISTORIAL, fecha_fin=None):
+    """
+    Indicadores por producto activo para los últimos `dias` días.
+
+    Returns:
+        lista de dicts con producto_id, unidades, ingresos, dias_con_venta,
+        velocidad (unidades/día), dias_inventario, rotacion (costo vendido /
+        valor del inventario actual), clase y participacion_acumulada
+    """
+    fecha_fin = fecha_fin or date.today()
+    fecha_inicio = fecha_fin - timedelta(days=dias - 1)
+    ventas = cargar_ventas_por_producto(fecha_inicio, fecha_fin)
+
+    productos = Producto.objects.filter(activo=True, anulado=False).values_list('id', 'stock', 'costo_unidad')
+    inventario = {producto_id: (float(stock or 0), float(costo or 0)) for producto_id, stock, costo in productos}
+
+    clases = clasificar_abc({
+        producto_id: ventas[producto_id][1] if producto_id in ventas else 0.0
+        for producto_id in inventario
+    })
+
+    resultados = []
+    for producto_id, (stock, costo) in inventario.items():
+        unidades, ingresos, dias_con_venta = ventas.get(producto_id, (0.0, 0.0, 0))
+        velocidad = unidades / dias
+        valor_inventario = stock * costo
+        clase, participacion = clases[producto_id]
+        resultados.append({
+            'producto_id': producto_id,
+            'unidades': unidades,
+            'ingresos': ingresos,
+            'dias_con_venta': dias_con_venta,
+            'velocidad': velocidad,
+            'dias_inventario': stock / velocidad if velocidad > 0 else None,
+            'rotacion': unidades * costo / valor_inventario if valor_inventario > 0 else None,
+            'clase': clase,
+            'participacion_acumulada': participacion,
+        })
+    return resultados
+
+
+def actualizar_clasificacion_abc(resultados):
+    """
+    Guarda la clase calculada en productos.clasificacionABC.
+
+    Se hace un UPDATE por clase y bloque de ids, solo sobre los productos
+    cuya clase cambió y que no tienen la clasificación manual.
+
+    Returns:
+        número de productos actualizados
+    """
+    ids_por_clase = {}
+    for resultado in resultados:
+        ids_por_clase.setdefault(resultado['clase'], []).append(resultado['producto_id'])
+
+    actualizados = 0
+    with transaction.atomic():
+        for clase, ids in ids_por_clase.items():
+            for inicio in range(0, len(ids), TAMANO_BLOQUE_UPDATE):
+                bloque = ids[inicio:inicio + TAMANO_BLOQUE_UPDATE]
+                actualizados += Producto.objects.filter(
+                    id__in=bloque, calculo_abc_manual=False
+                ).exclude(clasificacion_abc=clase).update(clasificacion_abc=clase)
+    return actualizados
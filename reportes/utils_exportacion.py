@@ -0,0 +1,288 @@
+"""
+Motor común de exportación de reportes (CSV, TXT, XLSX y PDF)
+
+Cada exportación se describe con una Exportacion (consulta, columnas y
+formato de texto) y se registra con @registrar_exportacion para poder
+generarla también en segundo plano. La memoria usada es constante sin
+importar el número de filas:
+
+    - Las filas se leen por bloques con paginación por clave (keyset). El
+      backend MySQL de Django carga en memoria todo el resultado aunque se use
+      .iterator(), por eso no se depende de un cursor del servidor.
+    - CSV y TXT se envían con StreamingHttpResponse a medida que se leen.
+    - XLSX se escribe con openpyxl en modo write_only.
+    - PDF se dibuja página por página con el canvas de reportlab (sin
+      acumular una tabla platypus con todas las filas).
+
+Las exportaciones XLSX/PDF grandes (o las pedidas con ?segundo_plano=1) se
+encolan como trabajos 'exportacion' (reportes.utils_trabajos) que escriben
+el archivo en MEDIA_ROOT/exportaciones para descargarlo al terminar.
+"""
+import csv
+import os
+import tempfile
+import uuid
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import F, Q, Value
+from django.db.models.functions import Coalesce
+from django.http import FileResponse, StreamingHttpResponse
+
+from .utils_trabajos import registrar_tarea
+
+
+TAMANO_BLOQUE = 2000
+UMBRAL_SEGUNDO_PLANO = 20000  # filas a partir de las que XLSX/PDF se generan en segundo plano
+
+FORMATOS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'txt': ('text/plain; charset=utf-8', 'txt'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+    'pdf': ('application/pdf', 'pdf'),
+}
+
+_EXPORTACIONES = {}
+
+
+class Exportacion:
+    """
+    Definición de una exportación.
+
+    Args:
+        nombre: prefijo del archivo (productos, clientes...)
+        titulo: título de los reportes TXT y PDF
+        queryset: consulta base (sin ordenar)
+        columnas: lista de (encabezado, función(objeto) -> valor)
+        orden: campo por el que se recorren las filas (además del id)
+        columnas_pdf: encabezados de columnas incluidas en el PDF (default: todas)
+        lineas_txt: función(objeto) -> lista de líneas del formato TXT
+    """
+
+    def __init__(self, nombre, titulo, queryset, columnas, orden='pk', columnas_pdf=None, lineas_txt=None):
+        self.nombre = nombre
+        self.titulo = titulo
+        self.queryset = queryset
+        self.columnas = columnas
+        self.orden = orden
+        self.columnas_pdf = columnas_pdf
+        self.lineas_txt = lineas_txt
+
+    @property
+    def encabezados(self):
+        return [encabezado for encabezado, _ in self.columnas]
+
+    def fila(self, objeto):
+        return [funcion(objeto) for _, funcion in self.columnas]
+
+    def objetos(self, tamano=TAMANO_BLOQUE):
+        """Recorre la consulta por bloques ordenados por (orden, id)"""
+        qs = self.queryset
+        if self.orden == 'pk':
+            qs = qs.order_by('pk')
+            ultimo = None
+            while True:
+                bloque = list((qs.filter(pk__gt=ultimo) if ultimo is not None else qs)[:tamano])
+                if not bloque:
+                    return
+                yield from bloque
+                ultimo = bloque[-1].pk
+
+        # Los valores nulos se ordenan como cadena vacía para que la clave sea comparable
+        qs = qs.annotate(_clave_orden=Coalesce(F(self.orden), Value(''))).order_by('_clave_orden', 'pk')
+        ultimo = None
+        while True:
+            filtrado = qs
+            if ultimo is not None:
+                filtrado = qs.filter(Q(_clave_orden__gt=ultimo[0]) | Q(_clave_orden=ultimo[0], pk__gt=ultimo[1]))
+            bloque = list(filtrado[:tamano])
+            if not bloque:
+                return
+            yield from bloque
+            ultimo = (bloque[-1]._clave_orden, bloque[-1].pk)
+
+    def nombre_archivo(self, formato):
+        return f'{self.nombre}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{FORMATOS[formato][1]}'
+
+
+def registrar_exportacion(nombre):
+    """Registra la función que construye una Exportacion (para generarla en segundo plano)"""
+    def decorador(funcion):
+        _EXPORTACIONES[nombre] = funcion
+        return funcion
+    return decorador
+
+
+def obtener_exportacion(nombre):
+    funcion = _EXPORTACIONES.get(nombre)
+    return funcion() if funcion else None
+
+
+# ---------- escritores ----------
+
+class _Eco:
+    """Pseudo-archivo para csv.writer: devuelve la línea en lugar de guardarla"""
+
+    def write(self, valor):
+        return valor
+
+
+def generar_csv(exportacion):
+    writer = csv.writer(_Eco())
+    yield '\ufeff'  # BOM para Excel
+    yield writer.writerow(exportacion.encabezados)
+    for objeto in exportacion.objetos():
+        yield writer.writerow(exportacion.fila(objeto))
+
+
+def generar_txt(exportacion):
+    yield '\ufeff'  # BOM para caracteres especiales
+    yield f"{exportacion.titulo} - {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}\n"
+    yield "=" * 80 + "\n\n"
+    for objeto in exportacion.objetos():
+        if exportacion.lineas_txt:
+            lineas = exportacion.lineas_txt(objeto)
+        else:
+            lineas = [f'{encabezado}: {valor}' for encabezado, valor in zip(exportacion.encabezados, exportacion.fila(objeto))]
+        yield '\n'.join(lineas) + '\n' + "-" * 40 + "\n\n"
+
+
+def escribir_archivo(exportacion, formato, destino):
+    """Escribe la exportación en un archivo abierto en modo binario; devuelve las filas escritas"""
+    if formato == 'xlsx':
+        return _escribir_xlsx(exportacion, destino)
+    if formato == 'pdf':
+        return _escribir_pdf(exportacion, destino)
+
+    if formato == 'csv':
+        generador, encabezado = generar_csv(exportacion), 2  # BOM y encabezados
+    else:
+        generador, encabezado = generar_txt(exportacion), 3  # BOM, título y separador
+    partes = 0
+    for parte in generador:
+        destino.write(parte.encode('utf-8'))
+        partes += 1
+    return max(partes - encabezado, 0)
+
+
+def _escribir_xlsx(exportacion, destino):
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+
+    libro = Workbook(write_only=True)
+    hoja = libro.create_sheet(exportacion.nombre[:31])
+    encabezados = []
+    for encabezado in exportacion.encabezados:
+        celda = WriteOnlyCell(hoja, value=encabezado)
+        celda.font = Font(bold=True)
+        encabezados.append(celda)
+    hoja.append(encabezados)
+
+    filas = 0
+    for objeto in exportacion.objetos():
+        hoja.append(exportacion.fila(objeto))
+        filas += 1
+    libro.save(destino)
+    return filas
+
+
+def _escribir_pdf(exportacion, destino):
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4, landscape
+    from reportlab.pdfgen import canvas
+
+    ancho, alto = landscape(A4)
+    margen = 30
+    alto_fila = 14
+
+    indices = list(range(len(exportacion.columnas)))
+    if exportacion.columnas_pdf:
+        indices = [i for i, encabezado in enumerate(exportacion.encabezados) if encabezado in exportacion.columnas_pdf]
+    encabezados = [exportacion.encabezados[i] for i in indices]
+    ancho_columna = (ancho - 2 * margen) / len(indices)
+    max_caracteres = max(int(ancho_columna / 4.5), 4)
+
+    lienzo = canvas.Canvas(destino, pagesize=(ancho, alto), pageCompression=1)
+    fecha = datetime.now().strftime('%d/%m/%Y %H:%M:%S')
+    pagina = 0
+
+    def nueva_pagina():
+        nonlocal pagina
+        pagina += 1
+        lienzo.setFont('Helvetica-Bold', 14)
+        lienzo.drawString(margen, alto - margen, f'{exportacion.titulo} - {fecha}')
+        lienzo.setFont('Helvetica', 8)
+        lienzo.drawRightString(ancho - margen, margen / 2, f'Página {pagina}')
+        y = alto - margen - 30
+        lienzo.setFillColor(colors.grey)
+        lienzo.rect(margen, y - 4, ancho - 2 * margen, alto_fila, fill=1, stroke=0)
+        lienzo.setFillColor(colors.whitesmoke)
+        lienzo.setFont('Helvetica-Bold', 9)
+        for posicion, encabezado in enumerate(encabezados):
+            lienzo.drawString(margen + posicion * ancho_columna + 2, y, str(encabezado)[:max_caracteres])
+        lienzo.setFillColor(colors.black)
+        lienzo.setFont('Helvetica', 8)
+        return y - alto_fila
+
+    y = nueva_pagina()
+    filas = 0
+    for objeto in exportacion.objetos():
+        if y < margen:
+            lienzo.showPage()
+            y = nueva_pagina()
+        fila = exportacion.fila(objeto)
+        for posicion, indice in enumerate(indices):
+            valor = '' if fila[indice] is None else str(fila[indice])
+            lienzo.drawString(margen + posicion * ancho_columna + 2, y, valor[:max_caracteres])
+        y -= alto_fila
+        filas += 1
+
+    lienzo.showPage()
+    lienzo.save()
+    return filas
+
+
+# ---------- respuestas ----------
+
+def respuesta_exportacion(exportacion, formato):
+    """Respuesta HTTP con la exportación en el formato pedido"""
+    tipo, _ = FORMATOS[formato]
+    if formato in ('csv', 'txt'):
+        generador = generar_csv(exportacion) if formato == 'csv' else generar_txt(exportacion)
+        response = StreamingHttpResponse(generador, content_type=tipo)
+    else:
+        # Archivo temporal en disco: FileResponse lo envía por bloques
+        archivo = tempfile.TemporaryFile()
+        escribir_archivo(exportacion, formato, archivo)
+        archivo.seek(0)
+        response = FileResponse(archivo, content_type=tipo)
+    response['Content-Disposition'] = f'attachment; filename="{exportacion.nombre_archivo(formato)}"'
+    return response
+
+
+def requiere_segundo_plano(exportacion, formato, forzar=False):
+    if forzar:
+        return True
+    return formato in ('xlsx', 'pdf') and exportacion.queryset.count() > UMBRAL_SEGUNDO_PLANO
+
+
+# ---------- segundo plano ----------
+
+def directorio_exportaciones():
+    directorio = os.path.join(settings.MEDIA_ROOT, 'exportaciones')
+    os.makedirs(directorio, exist_ok=True)
+    return directorio
+
+
+@registrar_tarea('exportacion', ttl=600)
+def tarea_exportacion(parametros):
+    """Genera una exportación registrada como archivo descargable"""
+    exportacion = obtener_exportacion(parametros['nombre'])
+    if exportacion is None:
+        raise ValueError(f"Exportación no registrada: {parametros['nombre']}")
+    nombre_archivo = exportacion.nombre_archivo(parametros['formato'])
+    ruta = os.path.join(directorio_exportaciones(), f'{uuid.uuid4().hex}_{nombre_archivo}')
+    with open(ruta, 'wb') as destino:
+        filas = escribir_archivo(exportacion, parametros['formato'], destino)
+    return {'archivo': ruta, 'nombre_archivo': nombre_archivo, 'formato': parametros['formato'], 'filas': filas}
@@ -0,0 +1,215 @@
+"""
+Cola de trabajos de reportes respaldada por la base de datos (TrabajoReporte)
+
+Los reportes pesados no se calculan dentro de la petición web: la vista
+encola un trabajo y la página consulta su estado hasta que el comando
+procesar_trabajos_reportes lo termina. Cada trabajo tiene una clave (hash
+de tipo + parámetros); mientras su resultado no expire, las peticiones
+idénticas reciben el trabajo completado sin volver a calcularlo, y si ya hay
+uno idéntico pendiente se reutiliza en lugar de encolar otro.
+
+Las tareas se registran con @registrar_tarea(tipo, ttl). Una tarea recibe
+los parámetros (dict serializable en JSON) y devuelve el resultado
+(también serializable); si el resultado incluye 'archivo' se guarda como
+archivo descargable del trabajo.
+
+Con REPORTES_TRABAJOS_EN_HILO = True (desarrollo) cada trabajo encolado se
+procesa además en un hilo del mismo proceso, sin necesidad del comando.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.http import JsonResponse
+from django.shortcuts import render
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import TrabajoReporte
+
+logger = logging.getLogger(__name__)
+
+
+MAX_INTENTOS = 3
+MINUTOS_ABANDONO = 30  # un trabajo 'procesando' más antiguo se considera abandonado
+SEGUNDOS_REINTENTO = 60  # un trabajo con error se muestra como tal durante este tiempo antes de reintentarlo
+
+_TAREAS = {}
+
+
+def registrar_tarea(tipo, ttl=300):
+    """
+    Registra una tarea de reporte.
+
+    Args:
+        tipo: nombre único del tipo de trabajo
+        ttl: segundos que el resultado sirve como caché, o función(parametros) -> segundos
+    """
+    def decorador(funcion):
+        _TAREAS[tipo] = (funcion, ttl)
+        return funcion
+    return decorador
+
+
+def clave_trabajo(tipo, parametros):
+    texto = json.dumps([tipo, parametros], sort_keys=True, default=str)
+    return hashlib.sha256(texto.encode('utf-8')).hexdigest()
+
+
+def encolar(tipo, parametros, usuario=None):
+    """
+    Devuelve el trabajo para (tipo, parámetros): el resultado vigente en
+    caché, un trabajo idéntico en curso, uno que acaba de fallar (para
+    mostrar el error) o uno nuevo encolado.
+    """
+    if tipo not in _TAREAS:
+        raise ValueError(f'Tipo de reporte no registrado: {tipo}')
+
+    clave = clave_trabajo(tipo, parametros)
+    ahora = timezone.now()
+
+    trabajo = TrabajoReporte.objects.filter(
+        clave=clave, estado='completado', fecha_expiracion__gt=ahora
+    ).order_by('-id').first()
+    if trabajo:
+        return trabajo
+
+    trabajo = TrabajoReporte.objects.filter(
+        clave=clave, estado__in=['pendiente', 'procesando']
+    ).order_by('-id').first()
+    if trabajo:
+        return trabajo
+
+    trabajo = TrabajoReporte.objects.filter(
+        clave=clave, estado='error', fecha_fin__gt=ahora - timedelta(seconds=SEGUNDOS_REINTENTO)
+    ).order_by('-id').first()
+    if trabajo:
+        return trabajo
+
+    trabajo = TrabajoReporte.objects.create(
+        tipo=tipo,
+        parametros=parametros,
+        clave=clave,
+        usuario=usuario if getattr(usuario, 'is_authenticated', False) else None,
+    )
+    if getattr(settings, 'REPORTES_TRABAJOS_EN_HILO', False):
+        transaction.on_commit(lambda: threading.Thread(target=_procesar_en_hilo, daemon=True).start())
+    return trabajo
+
+
+def _procesar_en_hilo():
+    try:
+        procesar_pendientes(maximo=1)
+    finally:
+        # El hilo abrió su propia conexión
+        connection.close()
+
+
+def tomar_siguiente():
+    """Marca como 'procesando' el trabajo pendiente más antiguo y lo devuelve"""
+    with transaction.atomic():
+        pendientes = TrabajoReporte.objects.filter(estado='pendiente').order_by('id')
+        if connection.features.has_select_for_update_skip_locked:
+            # Varios workers pueden tomar trabajos distintos sin esperarse
+            pendientes = pendientes.select_for_update(skip_locked=True)
+        else:
+            pendientes = pendientes.select_for_update()
+        trabajo = pendientes.first()
+        if trabajo is None:
+            return None
+
+        trabajo.estado = 'procesando'
+        trabajo.fecha_inicio = timezone.now()
+        trabajo.intentos += 1
+        trabajo.save(update_fields=['estado', 'fecha_inicio', 'intentos'])
+    return trabajo
+
+
+def ejecutar(trabajo):
+    """Ejecuta la tarea de un trabajo ya tomado y guarda el resultado"""
+    funcion, ttl = _TAREAS[trabajo.tipo]
+    try:
+        resultado = funcion(trabajo.parametros)
+    except Exception as e:
+        logger.exception('Error en el trabajo de reporte %s', trabajo.id)
+        trabajo.estado = 'error'
+        trabajo.error = str(e)
+        trabajo.fecha_fin = timezone.now()
+        trabajo.save(update_fields=['estado', 'error', 'fecha_fin'])
+        return trabajo
+
+    segundos = ttl(trabajo.parametros) if callable(ttl) else ttl
+    trabajo.estado = 'completado'
+    trabajo.resultado = resultado
+    trabajo.archivo = (resultado or {}).get('archivo', '') if isinstance(resultado, dict) else ''
+    trabajo.error = ''
+    trabajo.fecha_fin = timezone.now()
+    trabajo.fecha_expiracion = trabajo.fecha_fin + timedelta(seconds=segundos)
+    trabajo.save(update_fields=['estado', 'resultado', 'archivo', 'error', 'fecha_fin', 'fecha_expiracion'])
+    return trabajo
+
+
+def procesar_pendientes(maximo=None):
+    """Procesa trabajos pendientes en orden de llegada; devuelve cuántos procesó"""
+    procesados = 0
+    while maximo is None or procesados < maximo:
+        trabajo = tomar_siguiente()
+        if trabajo is None:
+            break
+        ejecutar(trabajo)
+        procesados += 1
+    return procesados
+
+
+def reencolar_abandonados(minutos=MINUTOS_ABANDONO):
+    """Devuelve a la cola los trabajos de un worker que terminó sin finalizarlos"""
+    limite = timezone.now() - timedelta(minutes=minutos)
+    abandonados = TrabajoReporte.objects.filter(estado='procesando', fecha_inicio__lt=limite)
+    fallidos = abandonados.filter(intentos__gte=MAX_INTENTOS).update(
+        estado='error', error='El trabajo superó el número máximo de intentos', fecha_fin=timezone.now()
+    )
+    reencolados = abandonados.filter(intentos__lt=MAX_INTENTOS).update(estado='pendiente')
+    return reencolados, fallidos
+
+
+def limpiar_trabajos(dias=7):
+    """Elimina trabajos terminados antiguos y sus archivos"""
+    limite = timezone.now() - timedelta(days=dias)
+    antiguos = TrabajoReporte.objects.filter(estado__in=['completado', 'error'], fecha_creacion__lt=limite)
+    for archivo in antiguos.exclude(archivo='').values_list('archivo', flat=True):
+        try:
+            os.remove(archivo)
+        except OSError:
+            pass
+    eliminados, _ = antiguos.delete()
+    return eliminados
+
+
+def resultado_o_encolar(tipo, parametros, usuario=None):
+    """
+    Atajo para las vistas: (trabajo, listo).
+
+    listo es True cuando el trabajo está completado y trabajo.resultado
+    puede usarse directamente.
+    """
+    trabajo = encolar(tipo, parametros, usuario)
+    return trabajo, trabajo.estado == 'completado'
+
+
+def respuesta_en_proceso(request, trabajo, titulo):
+    """
+    Respuesta mientras el trabajo no termina: JSON 202 para AJAX o una página
+    que consulta el estado y descarga el archivo o recarga la página al terminar.
+    """
+    url_estado = reverse('reportes:estado_trabajo', args=[trabajo.id])
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return JsonResponse({'success': True, 'trabajo_id': trabajo.id, 'url_estado': url_estado}, status=202)
+    return render(request, 'reportes/trabajo_en_proceso.html', {
+        'titulo': titulo,
+        'url_estado': url_estado,
+    })
@@ -135,6 +135,35 @@ CACHES = {
     }
 }
 
+# Caché en memoria del stock por ubicación (inventario.utils_stock.cache_stock)
+STOCK_CACHE_EN_MEMORIA = True
+
+# Punto de venta multisucursal (ventas.utils_sucursal): cada caja vende del
+# stock de su ubicación (StockUbicacion) y el kardex registra idUbicacion.
+# Las compras e ingresos suman a la ubicación que recibe y las transferencias
+# mueven StockUbicacion. Activar después de cargar el stock de las sucursales con:
+#     python manage.py migrar_stock_sucursales
+VENTAS_STOCK_POR_UBICACION = False
+
+# Cola de reportes pesados (reportes.utils_trabajos). En producción los
+# trabajos los procesa: python manage.py procesar_trabajos_reportes
+# Con True cada trabajo se procesa además en un hilo del proceso web.
+REPORTES_TRABAJOS_EN_HILO = DEBUG
+
+# Servicio local del SRI (facturación electrónica y consulta de claves de acceso).
+# Las vistas encolan en EnvioSRI (ventas.utils_cola_sri); los envíos los hace:
+#     python manage.py procesar_envios_sri
+# Con SRI_ENVIOS_EN_HILO = True cada envío se procesa además en un hilo del proceso web.
+SRI_API_URL = 'http://127.0.0.1:5001'
+SRI_TIMEOUT = 30                # segundos por llamada
+SRI_MAX_CONCURRENCIA = 4        # llamadas simultáneas por worker
+SRI_MAX_INTENTOS = 6            # después queda 'fallido' hasta reenviarlo a mano
+SRI_ESPERA_BASE = 30            # segundos antes del 1er reintento; se duplica en cada uno
+SRI_ESPERA_MAXIMA = 60 * 60
+SRI_CACHE_TTL = 60 * 60 * 24    # comprobantes autorizados por clave de acceso (no cambian)
+SRI_CACHE_MAX_ENTRADAS = 1000
+SRI_ENVIOS_EN_HILO = DEBUG
+
 # Usar sesiones basadas en cache en lugar de BD para soporte offline
 SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
 SESSION_COOKIE_HTTPONLY = True
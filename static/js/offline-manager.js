@@ -381,7 +381,17 @@ class OfflineManager {
         }
         
         try {
-            const response = await fetch('/clientes/api/cache/');
+            // Sincronización incremental: sólo los clientes creados, editados o dados
+            // de baja desde la versión guardada. Una vez al día se recarga completo.
+            const versionState = await this.db.appState.get('clientsCacheVersion');
+            const fullSyncState = await this.db.appState.get('lastClientsFullSync');
+            const now = Date.now();
+            const incremental = versionState && fullSyncState && (now - fullSyncState.value) < 86400000;
+            
+            const url = incremental
+                ? `/clientes/api/cache/?desde=${encodeURIComponent(versionState.value)}`
+                : '/clientes/api/cache/';
+            const response = await fetch(url);
             
             if (!response.ok) {
                 throw new Error(`HTTP ${response.status}: ${response.statusText}`);
@@ -389,17 +399,35 @@ class OfflineManager {
             
             const data = await response.json();
             
-            if (data.success && data.clientes && data.clientes.length > 0) {
-                
+            if (!data.success) {
+                throw new Error(data.error || 'Respuesta inválida del servidor');
+            }
+            
+            const clientes = data.clientes || [];
+            const eliminados = data.eliminados || [];
+            
+            if (data.metadata.completo) {
+                if (clientes.length === 0) {
+                    console.warn('⚠️ No hay clientes para guardar en cache');
+                    return;
+                }
                 await this.db.transaction('rw', this.db.cachedClients, async () => {
                     await this.db.cachedClients.clear();
-                    await this.db.cachedClients.bulkAdd(data.clientes);
+                    await this.db.cachedClients.bulkAdd(clientes);
                 });
-                
-                this.cachedClients = data.clientes;
-                this.showToast(`Clientes sincronizados: ${data.clientes.length}`, 'success');
-            } else {
-                console.warn('⚠️ No hay clientes para guardar en cache');
+                await this.saveAppState('lastClientsFullSync', now);
+            } else if (clientes.length > 0 || eliminados.length > 0) {
+                await this.db.transaction('rw', this.db.cachedClients, async () => {
+                    await this.db.cachedClients.bulkPut(clientes);
+                    await this.db.cachedClients.bulkDelete(eliminados);
+                });
+            }
+            
+            await this.saveAppState('clientsCacheVersion', data.metadata.version);
+            
+            if (data.metadata.completo || clientes.length > 0 || eliminados.length > 0) {
+                await this.loadClientsCache();
+                this.showToast(`Clientes sincronizados: ${clientes.length}`, 'success');
             }
             
         } catch (error) {
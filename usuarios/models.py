@@ -200,6 +200,14 @@ class ConfiguracionEmpresa(models.Model):
     def __str__(self):
         return self.nombre_comercial or self.razon_social
     
+    def save(self, *args, **kwargs):
+        # actualizado_en marca la versión de la configuración que cachean los demás procesos
+        self.actualizado_en = timezone.now()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'actualizado_en' not in update_fields:
+            kwargs['update_fields'] = list(update_fields) + ['actualizado_en']
+        super().save(*args, **kwargs)
+    
     @classmethod
     def obtener_configuracion(cls):
         """Obtener la configuración activa de la empresa"""
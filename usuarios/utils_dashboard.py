@@ -0,0 +1,299 @@
+"""
+Servicio de métricas del dashboard
+
+Cada widget del dashboard (total de productos, bajo stock, ventas de hoy...)
+se calcula con su propia consulta y se guarda en caché con un TTL propio.
+Al inicio de turno muchos usuarios inician sesión a la vez; para que no
+recalculen todos la misma métrica contra la base de datos remota, el
+recálculo es "single-flight": sólo un hilo/proceso calcula cada widget y
+los demás esperan su resultado o reciben el valor anterior mientras tanto.
+
+Las ventas y los cambios de stock invalidan los widgets afectados mediante
+las señales venta_registrada y stock_modificado.
+"""
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from inventario.signals import stock_modificado
+from inventario.utils_alertas import contar_productos_bajo_stock
+from ventas.signals import venta_registrada
+
+
+PREFIJO_CACHE = 'dashboard:widget:'
+PREFIJO_VERSION = 'dashboard:version:'
+
+# El valor se conserva en caché más allá de su TTL para poder servirlo
+# mientras otro hilo lo recalcula (stale-while-revalidate)
+FACTOR_RETENCION = 10
+
+# Tiempo máximo que un cálculo puede mantener el candado entre procesos
+TTL_CANDADO = 30
+
+# Espera máxima de un hilo que no tiene valor previo para servir
+ESPERA_MAXIMA = 5.0
+
+
+# ============================================
+# CÁLCULO DE CADA WIDGET
+# ============================================
+
+def _escalar(sql, params=None):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params or [])
+        row = cursor.fetchone()
+    return row[0] if row and row[0] is not None else 0
+
+
+def calcular_total_productos():
+    return _escalar("SELECT COUNT(*) FROM productos WHERE activo = 1 AND anulado = 0")
+
+
+def calcular_productos_bajo_stock():
+    # Se lee del índice de alertas en lugar de recorrer la tabla productos
+    return contar_productos_bajo_stock()
+
+
+def calcular_total_clientes():
+    return _escalar("SELECT COUNT(*) FROM clientes WHERE estado = 1 AND anulado = 0")
+
+
+def calcular_total_proveedores():
+    return _escalar("SELECT COUNT(*) FROM proveedores WHERE estado = 1 AND anulado = 0")
+
+
+def calcular_ventas_hoy():
+    """Cantidad y monto de ventas del día en una sola consulta"""
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT COUNT(*), COALESCE(SUM(total), 0)
+            FROM facturas_venta
+            WHERE fechaEmision >= CURDATE()
+            AND fechaEmision < DATE_ADD(CURDATE(), INTERVAL 1 DAY)
+            AND estado != 'ANULADA'
+        """)
+        row = cursor.fetchone()
+    return {
+        'cantidad': row[0] or 0,
+        'monto': float(row[1] or 0),
+    }
+
+
+def calcular_ultimas_ventas():
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT fv.numeroFactura, fv.fechaEmision, fv.total,
+                   c.nombres, c.apellidos
+            FROM facturas_venta fv
+            LEFT JOIN clientes c ON fv.idCliente = c.id
+            WHERE fv.estado != 'ANULADA'
+            ORDER BY fv.fechaEmision DESC
+            LIMIT 5
+        """)
+        return [{
+            'numero': row[0],
+            'fecha': row[1],
+            'total': float(row[2]) if row[2] else 0,
+            'cliente': f"{row[3] or ''} {row[4] or ''}".strip() or 'Cliente General'
+        } for row in cursor.fetchall()]
+
+
+def calcular_productos_top():
+    """Top 5 productos más vendidos (últimos 30 días)"""
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT p.nombre, p.codigoPrincipal, SUM(fvd.cantidad) as total_vendido
+            FROM facturas_venta_detalle fvd
+            JOIN facturas_venta fv ON fvd.idFacturaVenta = fv.id
+            JOIN productos p ON fvd.idProducto = p.id
+            WHERE fv.fechaEmision >= DATE_SUB(CURDATE(), INTERVAL 30 DAY)
+            AND fv.estado != 'ANULADA'
+            GROUP BY p.id, p.nombre, p.codigoPrincipal
+            ORDER BY total_vendido DESC
+            LIMIT 5
+        """)
+        return [{
+            'nombre': row[0],
+            'codigo': row[1],
+            'cantidad': float(row[2]) if row[2] else 0
+        } for row in cursor.fetchall()]
+
+
+# Registro de widgets: nombre -> (función de cálculo, TTL en segundos, depende del día)
+WIDGETS = {
+    'total_productos': (calcular_total_productos, 300, False),
+    'productos_bajo_stock': (calcular_productos_bajo_stock, 60, False),
+    'total_clientes': (calcular_total_clientes, 300, False),
+    'total_proveedores': (calcular_total_proveedores, 600, False),
+    'ventas_hoy': (calcular_ventas_hoy, 30, True),
+    'ultimas_ventas': (calcular_ultimas_ventas, 30, False),
+    'productos_top': (calcular_productos_top, 600, True),
+}
+
+# Widgets afectados por cada tipo de evento
+WIDGETS_POR_VENTA = ('ventas_hoy', 'ultimas_ventas', 'productos_top', 'productos_bajo_stock')
+WIDGETS_POR_STOCK = ('productos_bajo_stock',)
+
+
+# ============================================
+# CACHÉ CON RECÁLCULO SINGLE-FLIGHT
+# ============================================
+
+_candados = {}
+_candados_guard = threading.Lock()
+
+
+def _candado_local(clave):
+    """Candado por widget dentro del proceso actual"""
+    with _candados_guard:
+        candado = _candados.get(clave)
+        if candado is None:
+            candado = _candados[clave] = threading.Lock()
+        return candado
+
+
+def _clave_widget(nombre):
+    _, _, por_dia = WIDGETS[nombre]
+    if por_dia:
+        return f"{PREFIJO_CACHE}{nombre}:{timezone.localdate().isoformat()}"
+    return f"{PREFIJO_CACHE}{nombre}"
+
+
+def _version(nombre):
+    """Versión vigente del widget; invalidar_widgets la incrementa"""
+    clave_version = f"{PREFIJO_VERSION}{nombre}"
+    version = cache.get(clave_version)
+    if version is None:
+        cache.add(clave_version, time.time_ns(), None)
+        version = cache.get(clave_version)
+    return version
+
+
+def _vigente(entrada, version):
+    return (
+        entrada is not None
+        and entrada['expira'] > time.time()
+        and entrada.get('version') == version
+    )
+
+
+def _recalcular(nombre, clave):
+    calcular, ttl, _ = WIDGETS[nombre]
+    # La versión se lee antes de calcular: si una venta invalida el widget
+    # durante el cálculo, el valor queda guardado ya vencido
+    version = _version(nombre)
+    valor = calcular()
+    cache.set(clave, {'valor': valor, 'expira': time.time() + ttl, 'version': version}, ttl * FACTOR_RETENCION)
+    return valor
+
+
+def _esperar_valor(clave):
+    """Espera a que otro proceso publique el valor del widget"""
+    limite = time.monotonic() + ESPERA_MAXIMA
+    while time.monotonic() < limite:
+        time.sleep(0.05)
+        entrada = cache.get(clave)
+        if entrada is not None:
+            return entrada
+    return None
+
+
+def obtener_widget(nombre):
+    """
+    Devuelve el valor de un widget del dashboard desde caché.
+
+    Si el valor venció, un solo hilo lo recalcula; el resto recibe el valor
+    anterior. Si no hay valor previo, los demás esperan al que calcula.
+    """
+    clave = _clave_widget(nombre)
+    entrada = cache.get(clave)
+    if _vigente(entrada, _version(nombre)):
+        return entrada['valor']
+
+    candado = _candado_local(clave)
+    if entrada is not None:
+        if not candado.acquire(blocking=False):
+            return entrada['valor']
+    else:
+        candado.acquire()
+
+    try:
+        # Otro hilo pudo haberlo recalculado mientras esperábamos el candado
+        entrada = cache.get(clave)
+        if _vigente(entrada, _version(nombre)):
+            return entrada['valor']
+
+        # Candado entre procesos (cuando la caché es compartida)
+        clave_candado = f"{clave}:calculando"
+        candado_tomado = cache.add(clave_candado, 1, TTL_CANDADO)
+        if not candado_tomado:
+            if entrada is None:
+                entrada = _esperar_valor(clave)
+            if entrada is not None:
+                return entrada['valor']
+
+        try:
+            return _recalcular(nombre, clave)
+        finally:
+            if candado_tomado:
+                cache.delete(clave_candado)
+    finally:
+        candado.release()
+
+
+def obtener_metricas_dashboard():
+    """Devuelve todos los widgets del dashboard"""
+    return {nombre: obtener_widget(nombre) for nombre in WIDGETS}
+
+
+def invalidar_widgets(*nombres):
+    """
+    Marca los widgets como vencidos.
+
+    No se eliminan de la caché: el siguiente acceso los recalcula una sola
+    vez mientras los demás siguen viendo el valor anterior. Se incrementa
+    la versión del widget de forma atómica, así dos invalidaciones
+    simultáneas no se pisan.
+    """
+    for nombre in nombres or WIDGETS.keys():
+        clave_version = f"{PREFIJO_VERSION}{nombre}"
+        try:
+            cache.incr(clave_version)
+        except ValueError:
+            # La versión se perdió de la caché: se parte de un valor nuevo
+            # para que ninguna entrada guardada vuelva a coincidir
+            cache.add(clave_version, time.time_ns(), None)
+
+
+# ============================================
+# INVALIDACIÓN POR SEÑALES
+# ============================================
+
+@receiver(venta_registrada, dispatch_uid='dashboard_invalidar_por_venta')
+def _invalidar_por_venta(sender, **kwargs):
+    invalidar_widgets(*WIDGETS_POR_VENTA)
+
+
+@receiver(stock_modificado, dispatch_uid='dashboard_invalidar_por_stock')
+def _invalidar_por_stock(sender, **kwargs):
+    invalidar_widgets(*WIDGETS_POR_STOCK)
+
+
+@receiver(post_save, sender='clientes.Cliente', dispatch_uid='dashboard_invalidar_por_cliente')
+def _invalidar_por_cliente(sender, **kwargs):
+    invalidar_widgets('total_clientes')
+
+
+@receiver(post_save, sender='proveedores.Proveedor', dispatch_uid='dashboard_invalidar_por_proveedor')
+def _invalidar_por_proveedor(sender, **kwargs):
+    invalidar_widgets('total_proveedores')
+
+
+@receiver(post_save, sender='productos.Producto', dispatch_uid='dashboard_invalidar_por_producto')
+def _invalidar_por_producto(sender, **kwargs):
+    invalidar_widgets('total_productos', 'productos_bajo_stock')
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class VentasConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'ventas'
+
+    def ready(self):
+        # Conectar el receptor que invalida la configuración de empresa en caché
+        from . import utils_sri  # noqa: F401
+        # Conectar los receptores que mantienen la proyección de búsqueda de ventas
+        from . import utils_busqueda  # noqa: F401
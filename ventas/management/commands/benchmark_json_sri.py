@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark de la generación del JSON del SRI
+Uso: python manage.py benchmark_json_sri [--facturas 2000] [--detalles 5]
+
+Crea facturas sintéticas dentro de una transacción, mide la implementación
+anterior (una factura a la vez, con una consulta por cliente y por producto
+de cada detalle) contra construir_documentos_sri, verifica que ambas
+produzcan el mismo JSON y revierte todo al terminar: no deja datos en la base.
+"""
+import time
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from clientes.models import Cliente
+from productos.models import Producto
+from usuarios.models import ConfiguracionEmpresa
+from ventas.models import FacturaVenta, FacturaVentaDetalle
+from ventas.utils_sri import (
+    CLAVE_CONFIGURACION_EMPRESA, CONFIGURACION_NO_CONFIGURADA, _configuracion_desde_empresa,
+    construir_documentos_sri,
+)
+
+User = get_user_model()
+
+
+class _Revertir(Exception):
+    """Se lanza para deshacer los datos sintéticos al final del benchmark"""
+
+
+def json_legado(factura_venta):
+    """Implementación anterior: empresa, cliente y cada producto consultados por separado"""
+    empresa_config = ConfiguracionEmpresa.obtener_configuracion()
+    empresa = _configuracion_desde_empresa(empresa_config) if empresa_config else CONFIGURACION_NO_CONFIGURADA
+    cliente = factura_venta.cliente
+
+    json_factura = {
+        "empresaRuc": empresa['ruc'],
+        "ambiente": 1,
+        "tipoComprobante": "01",
+        "infoTributaria": {
+            "estab": empresa['codigo_establecimiento'],
+            "ptoEmi": empresa['codigo_punto_emision'],
+            "secuencial": str(factura_venta.idFactura).zfill(9),
+            "dirMatriz": empresa['direccion_matriz']
+        },
+        "infoFactura": {
+            "fechaEmision": factura_venta.fechaEmision.strftime("%d/%m/%Y"),
+            "dirEstablecimiento": empresa['direccion_establecimiento'],
+            "obligadoContabilidad": empresa['obligado_contabilidad'],
+            "tipoIdentificacionComprador": "05",
+            "razonSocialComprador": cliente.nombre_completo if cliente else "CONSUMIDOR FINAL",
+            "identificacionComprador": cliente.cedula_ruc if cliente and cliente.cedula_ruc else "9999999999999",
+            "direccionComprador": cliente.direccion if cliente and cliente.direccion else "GUAYAQUIL",
+            "totalSinImpuestos": float(factura_venta.subtotal),
+            "totalDescuento": float(factura_venta.descuento) if factura_venta.descuento else 0.00,
+            "totalConImpuestos": [
+                {
+                    "codigo": "2",
+                    "codigoPorcentaje": "2",
+                    "baseImponible": float(factura_venta.subtotal),
+                    "valor": float(factura_venta.iva)
+                }
+            ] if factura_venta.iva > 0 else [],
+            "propina": 0.00,
+            "importeTotal": float(factura_venta.total),
+            "moneda": "DOLAR"
+        },
+        "detalles": []
+    }
+
+    for detalle in FacturaVentaDetalle.objects.filter(idFacturaVenta=factura_venta.idFactura).order_by('id'):
+        cantidad = float(detalle.cantidad)
+        precio_unitario = float(detalle.precioUnitario)
+        descuento_detalle = float(detalle.descuentoValor) if detalle.descuentoValor else 0.00
+        precio_total_sin_impuesto = cantidad * precio_unitario - descuento_detalle
+        try:
+            codigo_principal = Producto.objects.get(id=detalle.idProducto).codigo_principal
+        except Producto.DoesNotExist:
+            codigo_principal = f"PROD-{detalle.idProducto}"
+
+        json_factura["detalles"].append({
+            "codigoPrincipal": codigo_principal,
+            "descripcion": detalle.productoNombre,
+            "cantidad": cantidad,
+            "precioUnitario": precio_unitario,
+            "descuento": descuento_detalle,
+            "precioTotalSinImpuesto": precio_total_sin_impuesto,
+            "impuestos": [
+                {
+                    "codigo": "2",
+                    "codigoPorcentaje": "2",
+                    "tarifa": 15.00,
+                    "baseImponible": precio_total_sin_impuesto,
+                    "valor": float(detalle.ivaValor)
+                }
+            ] if detalle.ivaValor > 0 else []
+        })
+
+    return json_factura
+
+
+class Command(BaseCommand):
+    help = 'Mide la generación del JSON del SRI con datos sintéticos (no guarda cambios)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--facturas', type=int, default=2000, help='Número de facturas (default: 2000)')
+        parser.add_argument('--detalles', type=int, default=5, help='Detalles por factura (default: 5)')
+        parser.add_argument('--sin-legado', action='store_true',
+                            help='No medir la implementación anterior (es lenta con muchos datos)')
+
+    def handle(self, *args, **options):
+        n_facturas = options['facturas']
+        n_detalles = options['detalles']
+
+        self.stdout.write(self.style.WARNING('=' * 70))
+        self.stdout.write(self.style.WARNING(
+            f'BENCHMARK JSON SRI: {n_facturas} facturas × {n_detalles} detalles'
+        ))
+        self.stdout.write(self.style.WARNING('=' * 70))
+
+        try:
+            with transaction.atomic():
+                factura_ids = self._crear_datos(n_facturas, n_detalles)
+                cache.delete(CLAVE_CONFIGURACION_EMPRESA)
+
+                legado = None
+                if not options['sin_legado']:
+                    legado = self._medir('Implementación anterior', n_facturas, lambda: {
+                        factura.idFactura: json_legado(factura)
+                        for factura in FacturaVenta.objects.filter(idFactura__in=factura_ids)
+                    })
+
+                documentos = self._medir('Consulta por bloque', n_facturas, lambda: construir_documentos_sri(factura_ids))
+
+                if legado is not None:
+                    if legado == documentos:
+                        self.stdout.write(self.style.SUCCESS('  ✓ Ambas implementaciones generan el mismo JSON'))
+                    else:
+                        distintos = sum(1 for factura_id in factura_ids if legado.get(factura_id) != documentos.get(factura_id))
+                        self.stdout.write(self.style.ERROR(f'  ✗ {distintos} documentos difieren'))
+
+                raise _Revertir()
+        except _Revertir:
+            self.stdout.write(self.style.SUCCESS('\n✓ Datos sintéticos revertidos'))
+
+    def _crear_datos(self, n_facturas, n_detalles):
+        inicio = time.monotonic()
+        usuario = User.objects.order_by('id').first()
+        ahora = timezone.now()
+
+        Producto.objects.bulk_create([
+            Producto(nombre=f'Producto benchmark {i}', codigo_principal=f'BENCH-{i:07d}', precio_venta=Decimal('2.50'))
+            for i in range(max(n_detalles * 20, 100))
+        ], batch_size=2000)
+        producto_ids = list(
+            Producto.objects.filter(codigo_principal__startswith='BENCH-').values_list('id', flat=True)
+        )
+
+        Cliente.objects.bulk_create([
+            Cliente(
+                tipo_identificacion='CEDULA', cedula_ruc=f'BENCH{i:08d}', nombres=f'Cliente {i}',
+                apellidos='Benchmark', direccion='Dirección benchmark', creado_por=usuario, creado_date=ahora,
+            )
+            for i in range(max(n_facturas // 10, 1))
+        ], batch_size=2000)
+        cliente_ids = list(Cliente.objects.filter(cedula_ruc__startswith='BENCH').values_list('id', flat=True))
+
+        FacturaVenta.objects.bulk_create([
+            FacturaVenta(
+                idCliente=cliente_ids[i % len(cliente_ids)], idUsuario=usuario.id, numeroFactura=f'BENCH-{i:09d}',
+                fechaEmision=ahora, subtotal=Decimal('10.00') * n_detalles, iva=Decimal('1.50') * n_detalles,
+                total=Decimal('11.50') * n_detalles, creadoPor=usuario.id, creadoDate=ahora,
+            )
+            for i in range(n_facturas)
+        ], batch_size=2000)
+        factura_ids = list(
+            FacturaVenta.objects.filter(numeroFactura__startswith='BENCH-').order_by('idFactura')
+            .values_list('idFactura', flat=True)
+        )
+
+        FacturaVentaDetalle.objects.bulk_create([
+            FacturaVentaDetalle(
+                idFacturaVenta=factura_id, idProducto=producto_ids[(factura_id + j) % len(producto_ids)],
+                cantidad=Decimal('4'), precioUnitario=Decimal('2.50'), ivaValor=Decimal('1.50'),
+                total=Decimal('11.50'), productoNombre=f'Producto benchmark {j}',
+            )
+            for factura_id in factura_ids
+            for j in range(n_detalles)
+        ], batch_size=2000)
+
+        self.stdout.write(f'  Datos creados en {time.monotonic() - inicio:.1f}s')
+        return factura_ids
+
+    def _medir(self, nombre, n_facturas, funcion):
+        consultas = 0
+
+        def contar(execute, sql, params, many, context):
+            nonlocal consultas
+            consultas += 1
+            return execute(sql, params, many, context)
+
+        # execute_wrapper en vez de CaptureQueriesContext: el registro de consultas se corta en 9000
+        with connection.execute_wrapper(contar):
+            inicio = time.monotonic()
+            resultado = funcion()
+            duracion = time.monotonic() - inicio
+        self.stdout.write(
+            f'  {nombre}: {duracion:.3f}s, {consultas} consultas, '
+            f'{n_facturas / duracion if duracion else 0:.0f} facturas/s'
+        )
+        return resultado
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Consulta en lote claves de acceso en el servicio del SRI
+Uso: python manage.py consultar_claves_sri claves.txt [--concurrencia 4] [--salida resultados.jsonl]
+
+El archivo tiene una clave de acceso (49 dígitos) por línea. Las claves se
+consultan en paralelo reutilizando las conexiones al SRI; las autorizadas
+quedan en la caché del proceso. Escribe una línea JSON por clave
+({'clave_acceso', 'success', ...}) y al final las métricas del cliente.
+"""
+import json
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ventas.utils_cliente_sri import cliente_sri
+from ventas.utils_sri import interpretar_consulta_sri
+
+
+class Command(BaseCommand):
+    help = 'Consulta en el SRI una lista de claves de acceso (JSON Lines)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo', type=str, help='Archivo con una clave de acceso por línea')
+        parser.add_argument('--concurrencia', type=int,
+                            default=getattr(settings, 'SRI_MAX_CONCURRENCIA', 4),
+                            help='Consultas simultáneas (default: SRI_MAX_CONCURRENCIA)')
+        parser.add_argument('--salida', type=str, help='Archivo de salida (default: salida estándar)')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['archivo'], encoding='utf-8') as archivo:
+                claves = [linea.strip() for linea in archivo if linea.strip()]
+        except OSError as e:
+            raise CommandError(f'No se pudo leer {options["archivo"]}: {e}')
+
+        validas = [clave for clave in claves if len(clave) == 49 and clave.isdigit()]
+        if len(validas) < len(claves):
+            self.stderr.write(self.style.WARNING(f'⚠ {len(claves) - len(validas)} claves inválidas ignoradas'))
+        claves = validas
+        if not claves:
+            raise CommandError('No hay claves de acceso válidas')
+
+        inicio = time.monotonic()
+        resultados = cliente_sri.consultar_claves(claves, concurrencia=options['concurrencia'])
+        duracion = time.monotonic() - inicio
+
+        salida = open(options['salida'], 'w', encoding='utf-8') if options['salida'] else sys.stdout
+        errores = 0
+        try:
+            for clave, resultado in resultados.items():
+                if isinstance(resultado, Exception):
+                    errores += 1
+                    datos = {'success': False, 'error': str(resultado)}
+                else:
+                    datos = interpretar_consulta_sri(resultado, clave)
+                salida.write(json.dumps({'clave_acceso': clave, **datos}, ensure_ascii=False) + '\n')
+        finally:
+            if salida is not sys.stdout:
+                salida.close()
+
+        # Resumen por stderr para no mezclarlo con los resultados en la salida estándar
+        metricas = cliente_sri.metricas()
+        estilo = self.style.WARNING if errores else self.style.SUCCESS
+        self.stderr.write(estilo(
+            f'✓ {len(resultados)} claves consultadas en {duracion:.2f}s ({errores} con error)'
+        ))
+        self.stderr.write(
+            f"ℹ {metricas['llamadas_sri']} llamadas al SRI, latencia promedio {metricas['latencia_promedio']:.2f}s, "
+            f"p95 {metricas['latencia_p95']:.2f}s; caché {metricas['aciertos_cache']}/{metricas['consultas']} aciertos"
+        )
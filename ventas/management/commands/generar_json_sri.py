@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Genera en lote el JSON de facturación electrónica del SRI
+Uso: python manage.py generar_json_sri [--fecha 2025-11-14] [--hasta 2025-11-15] [--salida facturas.jsonl]
+
+Por defecto toma las facturas del día sin número de autorización y escribe
+un documento JSON por línea (JSON Lines).
+"""
+import json
+import sys
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ventas.utils_sri import TAMANO_BLOQUE, construir_documentos_sri, facturas_para_sri
+
+
+class Command(BaseCommand):
+    help = 'Genera el JSON del SRI de las facturas pendientes de un día (JSON Lines)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fecha', type=str, help='Fecha de emisión YYYY-MM-DD (default: hoy)')
+        parser.add_argument('--hasta', type=str, help='Fecha final YYYY-MM-DD para un rango (default: --fecha)')
+        parser.add_argument('--todas', action='store_true', help='Incluir facturas ya autorizadas')
+        parser.add_argument('--salida', type=str, help='Archivo de salida (default: salida estándar)')
+        parser.add_argument('--tamano-bloque', type=int, default=TAMANO_BLOQUE,
+                            help=f'Facturas por consulta (default: {TAMANO_BLOQUE})')
+
+    def handle(self, *args, **options):
+        try:
+            fecha_inicio = date.fromisoformat(options['fecha']) if options['fecha'] else date.today()
+            fecha_fin = date.fromisoformat(options['hasta']) if options['hasta'] else fecha_inicio
+        except ValueError:
+            raise CommandError('Las fechas deben tener el formato YYYY-MM-DD')
+
+        inicio = time.monotonic()
+        factura_ids = facturas_para_sri(fecha_inicio, fecha_fin, solo_sin_autorizacion=not options['todas'])
+        if not factura_ids:
+            self.stderr.write(self.style.WARNING(f'⚠ No hay facturas pendientes entre {fecha_inicio} y {fecha_fin}'))
+            return
+
+        documentos = construir_documentos_sri(factura_ids, tamano_bloque=options['tamano_bloque'])
+
+        salida = open(options['salida'], 'w', encoding='utf-8') if options['salida'] else sys.stdout
+        try:
+            for factura_id in factura_ids:
+                salida.write(json.dumps(documentos[factura_id], ensure_ascii=False) + '\n')
+        finally:
+            if salida is not sys.stdout:
+                salida.close()
+
+        duracion = time.monotonic() - inicio
+        # Resumen por stderr para no mezclarlo con los documentos en la salida estándar
+        self.stderr.write(self.style.SUCCESS(
+            f'✓ {len(documentos)} documentos generados en {duracion:.2f}s '
+            f'({len(documentos) / duracion if duracion else 0:.0f} facturas/s)'
+        ))
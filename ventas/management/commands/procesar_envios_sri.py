@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Worker de la cola de envíos al SRI (EnvioSRI)
+Uso: python manage.py procesar_envios_sri [--una-vez] [--concurrencia 4] [--intervalo 2]
+
+Envía las facturas y consultas de clave de acceso encoladas por las vistas
+con a lo sumo --concurrencia llamadas simultáneas al servicio del SRI,
+reintentando con espera exponencial los errores transitorios. Se pueden
+ejecutar varios workers a la vez: cada envío se toma con
+SELECT ... FOR UPDATE SKIP LOCKED. Ejecutarlo como servicio
+(systemd/supervisor) junto a gunicorn.
+"""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from ventas.models import EnvioSRI
+from ventas.utils_cliente_sri import cliente_sri
+from ventas.utils_cola_sri import despachar, reencolar_abandonados, reenviar
+
+
+class Command(BaseCommand):
+    help = 'Envía al SRI las facturas y consultas encoladas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--una-vez', action='store_true',
+                            help='Procesar los envíos vencidos y terminar')
+        parser.add_argument('--concurrencia', type=int,
+                            default=getattr(settings, 'SRI_MAX_CONCURRENCIA', 4),
+                            help='Llamadas simultáneas al SRI (default: SRI_MAX_CONCURRENCIA)')
+        parser.add_argument('--intervalo', type=float, default=2,
+                            help='Segundos de espera cuando no hay envíos vencidos (default: 2)')
+        parser.add_argument('--reenviar-fallidos', action='store_true',
+                            help='Devolver a la cola los envíos fallidos antes de empezar '
+                                 '(verificar antes en el SRI las facturas que quedaron sin respuesta)')
+
+    def handle(self, *args, **options):
+        if options['reenviar_fallidos']:
+            fallidos = list(EnvioSRI.objects.filter(estado='fallido'))
+            for envio in fallidos:
+                reenviar(envio)
+            self.stdout.write(f'ℹ {len(fallidos)} envíos fallidos devueltos a la cola')
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✓ Worker SRI iniciado (concurrencia: {options['concurrencia']})"
+        ))
+        ultimo_mantenimiento = 0
+
+        while True:
+            close_old_connections()
+
+            # Mantenimiento cada 5 minutos
+            if time.monotonic() - ultimo_mantenimiento > 300:
+                reencolados, fallidos = reencolar_abandonados()
+                if reencolados or fallidos:
+                    self.stdout.write(f'  Mantenimiento: {reencolados} reencolados, {fallidos} fallidos')
+                metricas = cliente_sri.metricas()
+                if metricas['llamadas_sri'] or metricas['consultas']:
+                    self.stdout.write(
+                        f"  SRI: {metricas['llamadas_sri']} llamadas ({metricas['errores_sri']} con error), "
+                        f"latencia promedio {metricas['latencia_promedio']:.2f}s, p95 {metricas['latencia_p95']:.2f}s; "
+                        f"caché de claves {metricas['aciertos_cache']}/{metricas['consultas']} aciertos"
+                    )
+                ultimo_mantenimiento = time.monotonic()
+
+            inicio = time.monotonic()
+            resumen = despachar(concurrencia=options['concurrencia'])
+            if not resumen:
+                if options['una_vez']:
+                    break
+                time.sleep(options['intervalo'])
+                continue
+
+            duracion = time.monotonic() - inicio
+            partes = ', '.join(f'{cantidad} {estado}' for estado, cantidad in sorted(resumen.items()))
+            estilo = self.style.ERROR if resumen.get('fallido') else self.style.SUCCESS
+            self.stdout.write(estilo(f'✓ Lote en {duracion:.2f}s: {partes}'))
+
+        self.stdout.write(self.style.SUCCESS('✓ No hay envíos vencidos'))
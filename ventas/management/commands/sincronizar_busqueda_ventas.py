@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Sincroniza la proyección de búsqueda de ventas (ventas_busqueda)
+Uso: python manage.py sincronizar_busqueda_ventas [--completo] [--dias 2]
+
+Proyecta las facturas que otro sistema insertó o modificó directamente en
+facturas_venta (anulaciones, cambios de total) y que todavía no están en la
+proyección o no coinciden con ella. Programarlo en cron: con --dias 2 cada
+pocos minutos (sólo revisa las facturas recientes) y sin opciones cada
+noche (revisa todas). --completo reconstruye toda la proyección (después
+de crear las tablas con crear_tabla_ventas_busqueda.sql) y borra las filas
+de documentos eliminados.
+"""
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ventas.utils_busqueda import TAMANO_BLOQUE, reconstruir_busqueda_ventas, sincronizar_facturas_externas
+
+
+class Command(BaseCommand):
+    help = 'Sincroniza la proyección de búsqueda de facturas y ventas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--completo', action='store_true',
+                            help='Reconstruir toda la proyección')
+        parser.add_argument('--dias', type=int, default=0,
+                            help='Revisar sólo las facturas de los últimos N días (default: todas)')
+        parser.add_argument('--tamano-bloque', type=int, default=TAMANO_BLOQUE,
+                            help=f'Documentos por bloque (default: {TAMANO_BLOQUE})')
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+
+        if options['completo']:
+            resumen = reconstruir_busqueda_ventas(tamano_bloque=options['tamano_bloque'])
+            self.stdout.write(self.style.SUCCESS(
+                f"✓ Proyección reconstruida: {resumen['FACTURA']} facturas, {resumen['VENTA']} ventas "
+                f"en {time.monotonic() - inicio:.2f}s"
+            ))
+            return
+
+        desde = timezone.now() - timedelta(days=options['dias']) if options['dias'] else None
+        proyectadas = sincronizar_facturas_externas(desde=desde, tamano_bloque=options['tamano_bloque'])
+        alcance = f"últimos {options['dias']} días" if desde else 'todo el historial'
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ {proyectadas} facturas nuevas o modificadas fuera del sistema web proyectadas ({alcance})'
+        ))
+
+        self.stdout.write(self.style.SUCCESS(f'✓ Sincronización terminada en {time.monotonic() - inicio:.2f}s'))
@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models import Value
+from django.db.models.functions import Replace, Reverse
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
 from decimal import Decimal
@@ -8,6 +10,31 @@ from caja.models import CierreCaja
 
 
 # Modelos para las tablas reales de la base de datos
+
+def relacionado(instancia, nombre, modelo, pk):
+    """
+    Objeto relacionado por una columna de id entera (las tablas heredadas no
+    tienen ForeignKey). Se consulta una vez por instancia; los cargadores de
+    ventas.utils_cargadores lo dejan resuelto para muchas filas con in_bulk.
+    """
+    relacionados = instancia.__dict__.setdefault('_relacionados', {})
+    if nombre not in relacionados:
+        relacionados[nombre] = modelo.objects.filter(pk=pk).first() if pk is not None else None
+    return relacionados[nombre]
+
+
+class FacturaVentaManager(models.Manager):
+    """
+    Las columnas numeroBusqueda y numeroBusquedaInverso existen sólo después
+    de aplicar indices_busqueda_facturas.sql. Las consultas del ORM no las
+    seleccionan (se cargan al acceder al campo); la búsqueda por número las
+    usa con su propio SQL (ventas.utils_busqueda).
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().defer('numeroBusqueda', 'numeroBusquedaInverso')
+
+
 class FacturaVenta(models.Model):
     """Modelo para la tabla facturas_venta existente"""
     ESTADO_CHOICES = [
@@ -32,6 +59,18 @@ class FacturaVenta(models.Model):
     creadoDate = models.DateTimeField(db_column='creadoDate')
     anulado = models.BooleanField(default=False, db_column='anulado')
     numeroAutorizacion = models.CharField(max_length=50, null=True, blank=True, db_column='numeroAutorizacion')
+    # Claves de búsqueda calculadas por la base (ver indices_busqueda_facturas.sql):
+    # el número sin guiones y el mismo invertido, para buscar por sufijo con el índice
+    numeroBusqueda = models.GeneratedField(
+        expression=Replace('numeroFactura', Value('-'), Value('')),
+        output_field=models.CharField(max_length=50), db_persist=True, db_column='numeroBusqueda',
+    )
+    numeroBusquedaInverso = models.GeneratedField(
+        expression=Reverse(Replace('numeroFactura', Value('-'), Value(''))),
+        output_field=models.CharField(max_length=50), db_persist=True, db_column='numeroBusquedaInverso',
+    )
+
+    objects = FacturaVentaManager()
     
     class Meta:
         db_table = 'facturas_venta'
@@ -39,6 +78,12 @@ class FacturaVenta(models.Model):
         verbose_name = "Factura de Venta"
         verbose_name_plural = "Facturas de Venta"
         ordering = ['-fechaEmision']
+        indexes = [
+            models.Index(fields=['numeroBusqueda'], name='idx_facturas_venta_busqueda'),
+            models.Index(fields=['numeroBusquedaInverso'], name='idx_facturas_venta_inverso'),
+            models.Index(fields=['numeroAutorizacion'], name='idx_facturas_venta_autoriz'),
+            models.Index(fields=['fechaEmision'], name='idx_facturas_venta_fecha'),
+        ]
     
     def __str__(self):
         return f"Factura {self.numeroFactura}"
@@ -46,18 +91,12 @@ class FacturaVenta(models.Model):
     @property
     def cliente(self):
         """Obtener objeto cliente"""
-        try:
-            return Cliente.objects.get(id=self.idCliente)
-        except Cliente.DoesNotExist:
-            return None
+        return relacionado(self, 'cliente', Cliente, self.idCliente)
     
     @property
     def usuario(self):
         """Obtener objeto usuario"""
-        try:
-            return User.objects.get(id=self.idUsuario)
-        except User.DoesNotExist:
-            return None
+        return relacionado(self, 'usuario', User, self.idUsuario)
 
 
 class FacturaVentaDetalle(models.Model):
@@ -85,18 +124,12 @@ class FacturaVentaDetalle(models.Model):
     @property
     def factura_venta(self):
         """Obtener factura de venta"""
-        try:
-            return FacturaVenta.objects.get(id=self.idFacturaVenta)
-        except FacturaVenta.DoesNotExist:
-            return None
+        return relacionado(self, 'factura_venta', FacturaVenta, self.idFacturaVenta)
     
     @property
     def producto(self):
         """Obtener objeto producto"""
-        try:
-            return Producto.objects.get(id=self.idProducto)
-        except Producto.DoesNotExist:
-            return None
+        return relacionado(self, 'producto', Producto, self.idProducto)
 
 
 # Modelos originales de Django (mantenidos para compatibilidad)
@@ -341,3 +374,121 @@ class PagoVenta(models.Model):
 #         if detalle:
 #             return self.cantidad_devuelta * detalle.precioUnitario
 #         return 0
+
+
+class EnvioSRI(models.Model):
+    """
+    Cola de envíos al servicio local del SRI (facturas y consultas de clave de acceso).
+
+    Las vistas sólo encolan; el comando procesar_envios_sri hace las llamadas
+    HTTP con concurrencia limitada y reintentos con espera exponencial. Un
+    envío que agota sus intentos queda 'fallido' hasta que se reenvíe a mano
+    (ver ventas.utils_cola_sri).
+
+    Requiere crear la tabla en MySQL: ver crear_tabla_envios_sri.sql
+    """
+    TIPO_CHOICES = [
+        ('factura', 'Envío de factura'),
+        ('consulta', 'Consulta de clave de acceso'),
+    ]
+    ESTADO_CHOICES = [
+        ('pendiente', 'Pendiente'),
+        ('procesando', 'Procesando'),
+        ('completado', 'Completado'),
+        ('fallido', 'Fallido'),
+    ]
+
+    tipo = models.CharField(max_length=10, choices=TIPO_CHOICES)
+    factura_id = models.IntegerField(null=True, blank=True, help_text='facturas_venta.id (tipo factura)')
+    clave_acceso = models.CharField(max_length=49, blank=True, help_text='Clave consultada (tipo consulta)')
+    estado = models.CharField(max_length=10, choices=ESTADO_CHOICES, default='pendiente')
+    intentos = models.IntegerField(default=0)
+    proximo_intento = models.DateTimeField(auto_now_add=True, help_text='No se envía antes de esta fecha (espera entre reintentos)')
+    respuesta = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='envios_sri')
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_inicio = models.DateTimeField(null=True, blank=True)
+    fecha_fin = models.DateTimeField(null=True, blank=True)
+    # 'factura:<id>' o 'consulta:<clave>' mientras está pendiente o procesando,
+    # nulo al terminar: el índice único impide dos envíos en curso del mismo objetivo
+    en_curso = models.CharField(max_length=60, null=True, blank=True, unique=True)
+
+    class Meta:
+        db_table = 'envios_sri'
+        verbose_name = "Envío al SRI"
+        verbose_name_plural = "Envíos al SRI"
+        ordering = ['-fecha_creacion']
+        indexes = [
+            models.Index(fields=['estado', 'proximo_intento']),
+            models.Index(fields=['factura_id', 'estado']),
+            models.Index(fields=['clave_acceso', 'estado']),
+        ]
+
+    def __str__(self):
+        objetivo = f"factura {self.factura_id}" if self.tipo == 'factura' else f"clave {self.clave_acceso}"
+        return f"Envío SRI {self.id} ({objetivo}) - {self.get_estado_display()}"
+
+
+class VentaBusqueda(models.Model):
+    """
+    Proyección de búsqueda de las ventas: una fila por documento de
+    facturas_venta (FACTURA) y de ventas_venta (VENTA) con el nombre del
+    cliente y del vendedor ya resueltos, para listar y buscar con una sola
+    consulta indexada en lugar de un UNION de las dos tablas.
+
+    Se mantiene al escribir (ver ventas.utils_busqueda) y se reconstruye con
+    el comando sincronizar_busqueda_ventas.
+
+    Requiere crear la tabla en MySQL: ver crear_tabla_ventas_busqueda.sql
+    """
+    TIPO_CHOICES = [
+        ('FACTURA', 'Factura (facturas_venta)'),
+        ('VENTA', 'Venta (ventas_venta)'),
+    ]
+
+    tipo_documento = models.CharField(max_length=10, choices=TIPO_CHOICES)
+    documento_id = models.IntegerField(help_text='facturas_venta.id o ventas_venta.id')
+    numero = models.CharField(max_length=50)
+    cliente_id = models.IntegerField(null=True, blank=True)
+    cliente = models.CharField(max_length=300, blank=True)
+    cliente_documento = models.CharField(max_length=20, blank=True)
+    vendedor_id = models.IntegerField(null=True, blank=True)
+    vendedor = models.CharField(max_length=300, blank=True)
+    total = models.DecimalField(max_digits=12, decimal_places=4, default=0)
+    estado = models.CharField(max_length=20)
+    metodo_pago = models.CharField(max_length=20)
+    fecha = models.DateTimeField()
+
+    class Meta:
+        db_table = 'ventas_busqueda'
+        verbose_name = "Búsqueda de venta"
+        verbose_name_plural = "Búsqueda de ventas"
+        ordering = ['-fecha', '-id']
+        constraints = [
+            models.UniqueConstraint(fields=['tipo_documento', 'documento_id'], name='uq_venta_busqueda_documento'),
+        ]
+        indexes = [
+            models.Index(fields=['fecha'], name='idx_venta_busqueda_fecha'),
+            models.Index(fields=['cliente_id'], name='idx_venta_busqueda_cliente'),
+            models.Index(fields=['vendedor_id'], name='idx_venta_busqueda_vendedor'),
+        ]
+
+    def __str__(self):
+        return f"{self.tipo_documento} {self.numero}"
+
+
+class PalabraVentaBusqueda(models.Model):
+    """Palabras buscables de una VentaBusqueda (número, cliente, cédula/RUC y vendedor), una por fila"""
+    venta = models.ForeignKey(VentaBusqueda, on_delete=models.CASCADE, related_name='palabras')
+    palabra = models.CharField(max_length=50)
+
+    class Meta:
+        db_table = 'ventas_busqueda_palabras'
+        indexes = [
+            models.Index(fields=['palabra', 'venta'], name='idx_venta_busqueda_palabra'),
+        ]
+
+    def __str__(self):
+        return self.palabra
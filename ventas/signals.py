@@ -0,0 +1,30 @@
+"""
+Señales del módulo de ventas
+
+venta_registrada se emite cuando se confirma una factura de venta.
+
+Argumentos enviados:
+    factura_id: ID de la factura en facturas_venta
+    producto_ids: lista de IDs de productos vendidos
+    ubicacion_id: ID de la ubicación (sucursal) donde se vendió, si se conoce
+    saldos: dict opcional {producto_id: stock que quedó en la ubicación}
+        cuando la venta descontó StockUbicacion
+"""
+from django.db import transaction
+from django.dispatch import Signal
+
+
+venta_registrada = Signal()
+
+
+def notificar_venta_registrada(sender, factura_id, producto_ids, ubicacion_id=None, saldos=None):
+    """Emite venta_registrada cuando la transacción actual se confirma."""
+    producto_ids = [int(pid) for pid in producto_ids if pid is not None]
+
+    transaction.on_commit(lambda: venta_registrada.send(
+        sender=sender,
+        factura_id=factura_id,
+        producto_ids=producto_ids,
+        ubicacion_id=ubicacion_id,
+        saldos=saldos,
+    ))
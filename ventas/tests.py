@@ -1,3 +1,611 @@
-from django.test import TestCase
+import json
+import socket
+import threading
+import time
+import unittest
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import Client, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from inventario.tests import crear_tablas_no_administradas
+from clientes.models import Cliente
+from usuarios.models import ConfiguracionEmpresa
+from productos.models import Categoria, ClaseProducto, Laboratorio, Marca, Producto, Subcategoria, TipoProducto
+from .models import EnvioSRI, FacturaVenta, FacturaVentaDetalle, Venta, VentaBusqueda
+from .signals import notificar_venta_registrada
+from .utils_busqueda import (
+    SQL_LISTA_VENTAS, buscar_ids_facturas, buscar_ventas, consulta_busqueda_ventas, consultas_busqueda_factura,
+    listar_ventas, sincronizar_facturas_externas,
+)
+from .utils_cliente_sri import cliente_sri
+from .utils_sri import CLAVE_CONFIGURACION_EMPRESA, obtener_configuracion_empresa
+from .utils_cola_sri import FacturaYaEnviada, despachar, encolar_consulta, encolar_factura, reenviar
+
+
+CLAVE_ACCESO = '1' * 49
+XML_AUTORIZADO = """<factura>
+    <infoTributaria><ruc>1790000000001</ruc><razonSocial>Distribuidora</razonSocial>
+        <estab>001</estab><ptoEmi>002</ptoEmi><secuencial>000000123</secuencial></infoTributaria>
+    <infoFactura><fechaEmision>14/11/2025</fechaEmision><importeTotal>11.50</importeTotal></infoFactura>
+    <detalles><detalle><codigoPrincipal>P001</codigoPrincipal><descripcion>Paracetamol</descripcion>
+        <cantidad>10</cantidad><precioUnitario>1.00</precioUnitario><descuento>0</descuento>
+        <precioTotalSinImpuesto>10.00</precioTotalSinImpuesto>
+        <impuestos><impuesto><codigo>2</codigo><valor>1.50</valor></impuesto></impuestos></detalle></detalles>
+</factura>"""
+
+
+class ServicioSRISimulado(BaseHTTPRequestHandler):
+    """
+    Servicio del SRI de prueba. Cada petición consume la siguiente respuesta
+    programada en el servidor (status, cuerpo, demora); sin respuestas
+    programadas responde 200 después de servidor.demora segundos.
+    """
+
+    protocol_version = 'HTTP/1.1'  # keep-alive, como el servicio real
+
+    def _responder(self):
+        servidor = self.server
+        with servidor.candado:
+            servidor.simultaneas += 1
+            servidor.max_simultaneas = max(servidor.max_simultaneas, servidor.simultaneas)
+            status, cuerpo, demora = (
+                servidor.respuestas.pop(0) if servidor.respuestas
+                else (200, {'estado': 'RECIBIDA'}, servidor.demora)
+            )
+        try:
+            longitud = int(self.headers.get('Content-Length') or 0)
+            documento = json.loads(self.rfile.read(longitud)) if longitud else None
+            servidor.peticiones.append((self.command, self.path, documento))
+            servidor.puertos_cliente.add(self.client_address[1])
+            time.sleep(demora)
+            datos = json.dumps(cuerpo).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(datos)))
+            self.end_headers()
+            self.wfile.write(datos)
+        except (BrokenPipeError, ConnectionResetError):
+            # El cliente abandonó la petición por timeout
+            pass
+        finally:
+            with servidor.candado:
+                servidor.simultaneas -= 1
+
+    do_GET = _responder
+    do_POST = _responder
+
+    def log_message(self, *args):
+        pass
+
+
+class ColaSRITests(TransactionTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        crear_tablas_no_administradas()
+        cls.servidor = ThreadingHTTPServer(('127.0.0.1', 0), ServicioSRISimulado)
+        cls.servidor.daemon_threads = True
+        cls.servidor.candado = threading.Lock()
+        threading.Thread(target=cls.servidor.serve_forever, daemon=True).start()
+        cls.ajustes = override_settings(
+            SRI_API_URL=f'http://127.0.0.1:{cls.servidor.server_address[1]}',
+            SRI_TIMEOUT=2, SRI_MAX_INTENTOS=3, SRI_ESPERA_BASE=10, SRI_ESPERA_MAXIMA=3600,
+            SRI_ENVIOS_EN_HILO=False,
+        )
+        cls.ajustes.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.ajustes.disable()
+        cls.servidor.shutdown()
+        cls.servidor.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.servidor.respuestas = []
+        self.servidor.peticiones = []
+        self.servidor.demora = 0
+        self.servidor.simultaneas = 0
+        self.servidor.max_simultaneas = 0
+        self.servidor.puertos_cliente = set()
+        cliente_sri.limpiar()
+        self.usuario = User.objects.create(username='cajero')
+
+    def _fixture_teardown(self):
+        super()._fixture_teardown()
+        # El flush entre pruebas no incluye las tablas no administradas
+        FacturaVenta.objects.all().delete()
+
+    def _factura(self, numero):
+        ahora = timezone.now()
+        return FacturaVenta.objects.create(
+            idCliente=0, idUsuario=self.usuario.id, numeroFactura=f'001-001-{numero:09d}', fechaEmision=ahora,
+            subtotal=10, iva=0, total=10, creadoPor=self.usuario.id, creadoDate=ahora,
+        )
+
+    def _vencer(self, envio):
+        EnvioSRI.objects.filter(pk=envio.pk).update(proximo_intento=timezone.now())
+
+    def test_respeta_el_limite_de_concurrencia(self):
+        self.servidor.demora = 0.3
+        facturas = [self._factura(i) for i in range(6)]
+        for factura in facturas:
+            encolar_factura(factura.idFactura, self.usuario)
+
+        inicio = time.monotonic()
+        resumen = despachar(concurrencia=2)
+        duracion = time.monotonic() - inicio
+
+        self.assertEqual(resumen, {'completado': 6})
+        self.assertEqual(self.servidor.max_simultaneas, 2)
+        self.assertGreaterEqual(duracion, 0.9)
+        self.assertEqual(
+            sorted(documento['infoTributaria']['secuencial'] for _, _, documento in self.servidor.peticiones),
+            sorted(str(factura.idFactura).zfill(9) for factura in facturas),
+        )
+
+    def test_encolar_dos_veces_reutiliza_el_envio_en_curso(self):
+        factura = self._factura(1)
+        self.assertEqual(encolar_factura(factura.idFactura).pk, encolar_factura(factura.idFactura).pk)
+
+    def test_no_encola_una_factura_ya_enviada(self):
+        autorizada = self._factura(1)
+        FacturaVenta.objects.filter(pk=autorizada.pk).update(numeroAutorizacion='AUT-1')
+        with self.assertRaises(FacturaYaEnviada):
+            encolar_factura(autorizada.idFactura)
+
+        enviada = self._factura(2)
+        encolar_factura(enviada.idFactura)
+        self.assertEqual(despachar(), {'completado': 1})
+        with self.assertRaises(FacturaYaEnviada):
+            encolar_factura(enviada.idFactura)
+
+        cliente = Client()
+        cliente.force_login(self.usuario)
+        url = reverse('ventas:reenviar_sri', args=[enviada.idFactura])
+        self.assertEqual(cliente.get(url).status_code, 405)
+        self.assertEqual(cliente.post(url, HTTP_X_REQUESTED_WITH='XMLHttpRequest').status_code, 409)
+        self.assertEqual(EnvioSRI.objects.filter(factura_id=enviada.idFactura).count(), 1)
+
+    @unittest.skipIf(connection.vendor == 'sqlite', 'Requiere una base de datos con escrituras concurrentes')
+    def test_encolar_a_la_vez_crea_un_solo_envio(self):
+        factura = self._factura(1)
+        barrera = threading.Barrier(4)
+        envios = []
+
+        def encolar():
+            try:
+                barrera.wait()
+                envios.append(encolar_factura(factura.idFactura).pk)
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=encolar) for _ in range(4)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(len(envios), 4)
+        self.assertEqual(len(set(envios)), 1)
+        self.assertEqual(EnvioSRI.objects.filter(factura_id=factura.idFactura).count(), 1)
+
+    def test_reintenta_errores_transitorios_con_espera_exponencial(self):
+        factura = self._factura(1)
+        self.servidor.respuestas = [
+            (503, {}, 0),
+            (429, {}, 0),
+            (200, {'estado': 'AUTORIZADO', 'numeroAutorizacion': 'AUT-123'}, 0),
+        ]
+        envio = encolar_factura(factura.idFactura)
+
+        esperas = []
+        for _ in range(2):
+            self.assertEqual(despachar(), {'pendiente': 1})
+            envio.refresh_from_db()
+            esperas.append((envio.proximo_intento - envio.fecha_fin).total_seconds())
+            self.assertEqual(despachar(), {})  # todavía no vence
+            self._vencer(envio)
+
+        self.assertEqual(despachar(), {'completado': 1})
+        envio.refresh_from_db()
+        self.assertEqual(envio.intentos, 3)
+        self.assertTrue(8 <= esperas[0] <= 12, esperas)
+        self.assertTrue(16 <= esperas[1] <= 24, esperas)
+        self.assertEqual(FacturaVenta.objects.get(pk=factura.pk).numeroAutorizacion, 'AUT-123')
+
+    def test_agota_los_intentos_y_queda_fallido_hasta_reenviarlo(self):
+        factura = self._factura(1)
+        self.servidor.respuestas = [(503, {}, 0)] * 3
+        envio = encolar_factura(factura.idFactura)
+
+        for _ in range(3):
+            self._vencer(envio)
+            despachar()
+        envio.refresh_from_db()
+        self.assertEqual(envio.estado, 'fallido')
+        self.assertIn('3 intentos', envio.error)
+
+        reenviar(envio)
+        self.assertEqual(despachar(), {'completado': 1})
+
+    def test_factura_sin_respuesta_no_se_reenvia(self):
+        # El servicio pudo haber recibido la factura: reenviarla la duplicaría
+        for respuesta in [(200, {}, 3), (500, {}, 0)]:  # 3 s: más que SRI_TIMEOUT
+            factura = self._factura(len(self.servidor.peticiones) + 1)
+            self.servidor.respuestas = [respuesta]
+            envio = encolar_factura(factura.idFactura)
+
+            self.assertEqual(despachar(), {'fallido': 1})
+            envio.refresh_from_db()
+            self.assertEqual(envio.intentos, 1)
+            self.assertIn('verifique el comprobante', envio.error)
+
+    def test_factura_que_no_llego_al_servicio_se_reintenta(self):
+        with socket.socket() as libre:
+            libre.bind(('127.0.0.1', 0))
+            puerto = libre.getsockname()[1]
+        factura = self._factura(1)
+        envio = encolar_factura(factura.idFactura)
+
+        with override_settings(SRI_API_URL=f'http://127.0.0.1:{puerto}'):
+            self.assertEqual(despachar(), {'pendiente': 1})
+        self._vencer(envio)
+        self.assertEqual(despachar(), {'completado': 1})
+        self.assertEqual(len(self.servidor.peticiones), 1)
+
+    def test_error_definitivo_no_se_reintenta(self):
+        factura = self._factura(1)
+        self.servidor.respuestas = [(400, {'error': 'Comprobante inválido'}, 0)]
+        envio = encolar_factura(factura.idFactura)
+
+        self.assertEqual(despachar(), {'fallido': 1})
+        envio.refresh_from_db()
+        self.assertEqual(envio.intentos, 1)
+        self.assertIn('HTTP 400', envio.error)
+
+    def test_consulta_de_clave_de_acceso_por_estado(self):
+        self.servidor.respuestas = [
+            (200, {'estado': 'AUTORIZADO', 'comprobanteXml': XML_AUTORIZADO, 'numeroAutorizacion': CLAVE_ACCESO}, 0.2),
+        ]
+        cliente = Client()
+        cliente.force_login(self.usuario)
+
+        respuesta = cliente.post(
+            reverse('ventas:consultar_clave'), json.dumps({'clave_acceso': CLAVE_ACCESO}),
+            content_type='application/json',
+        )
+        self.assertEqual(respuesta.status_code, 202)
+        estado = respuesta.json()
+        self.assertFalse(estado['terminado'])
+
+        despachar()
+        estado = cliente.get(estado['url_estado']).json()
+
+        self.assertTrue(estado['terminado'])
+        self.assertEqual(self.servidor.peticiones[0][:2], ('GET', f'/api/consulta_sri/{CLAVE_ACCESO}'))
+        resultado = estado['resultado']
+        self.assertTrue(resultado['success'])
+        self.assertEqual(resultado['proveedor']['ruc'], '1790000000001')
+        self.assertEqual(resultado['factura_info']['numero'], '001-002-000000123')
+        self.assertEqual([p['codigo'] for p in resultado['productos']], ['P001'])
+
+    def test_consultas_repetidas_salen_de_la_cache_y_reutilizan_la_conexion(self):
+        autorizado = {'estado': 'AUTORIZADO', 'comprobanteXml': XML_AUTORIZADO}
+        self.servidor.respuestas = [(200, {'estado': 'EN PROCESO'}, 0), (200, autorizado, 0)]
+
+        # Las respuestas no autorizadas no se guardan: la siguiente consulta vuelve al SRI
+        self.assertEqual(cliente_sri.consultar_clave(CLAVE_ACCESO)['estado'], 'EN PROCESO')
+        for _ in range(3):
+            self.assertEqual(cliente_sri.consultar_clave(CLAVE_ACCESO)['estado'], 'AUTORIZADO')
+
+        metricas = cliente_sri.metricas()
+        self.assertEqual(len(self.servidor.peticiones), 2)
+        self.assertEqual(metricas['llamadas_sri'], 2)
+        self.assertEqual(metricas['tasa_aciertos'], 0.5)
+        self.assertEqual(metricas['entradas_cache'], 1)
+        self.assertEqual(len(self.servidor.puertos_cliente), 1)
+
+    def test_consultar_claves_en_paralelo(self):
+        self.servidor.demora = 0.2
+        self.servidor.respuestas = [(200, {'estado': 'AUTORIZADO'}, 0.2)] * 7 + [(503, {}, 0.2)]
+        claves = [str(i) * 49 for i in range(1, 9)]
+
+        with override_settings(SRI_MAX_CONCURRENCIA=4):
+            inicio = time.monotonic()
+            resultados = cliente_sri.consultar_claves(claves + claves[:3], concurrencia=4)
+            duracion = time.monotonic() - inicio
+
+        self.assertEqual(list(resultados), claves)
+        self.assertEqual(len(self.servidor.peticiones), 8)
+        self.assertEqual(self.servidor.max_simultaneas, 4)
+        self.assertLess(duracion, 0.8)
+        self.assertEqual(sum(isinstance(r, Exception) for r in resultados.values()), 1)
+        self.assertLessEqual(len(self.servidor.puertos_cliente), 4)
+
+    def test_clave_consultada_hace_poco_no_se_vuelve_a_encolar(self):
+        self.servidor.respuestas = [(200, {'estado': 'AUTORIZADO', 'comprobanteXml': XML_AUTORIZADO}, 0)]
+        envio = encolar_consulta(CLAVE_ACCESO)
+        despachar()
+
+        repetido = encolar_consulta(CLAVE_ACCESO)
+        self.assertEqual(repetido.pk, envio.pk)
+        self.assertEqual(repetido.estado, 'completado')
+        with override_settings(SRI_CACHE_TTL=0):
+            self.assertNotEqual(encolar_consulta(CLAVE_ACCESO).pk, envio.pk)
+
+
+def plan_consulta(sql, params):
+    """Plan de ejecución de una consulta como lista de textos (SQLite o MySQL)"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [fila[-1] for fila in cursor.fetchall()]
+        cursor.execute('EXPLAIN ' + sql, params)
+        columnas = [col[0] for col in cursor.description]
+        filas = [dict(zip(columnas, fila)) for fila in cursor.fetchall()]
+        # Las filas <subqueryN>/<derivedN> son resultados intermedios, no tablas
+        return [f"{'SEARCH' if fila['type'] in ('ref', 'range', 'eq_ref', 'const') else 'SCAN'} USING INDEX {fila['key']}"
+                for fila in filas if not (fila['table'] or '').startswith('<')]
+
+
+class BusquedaFacturasTests(TransactionTestCase):
+
+    NUMEROS = [
+        '001-001-000000123', '001-002-000000123', '001-001-000001123',
+        '001-001-000000124', 'FAC-20251031-5A355D',
+    ]
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        crear_tablas_no_administradas()
+
+    def setUp(self):
+        ahora = timezone.now()
+        self.ids = {}
+        for i, numero in enumerate(self.NUMEROS):
+            factura = FacturaVenta.objects.create(
+                idCliente=0, idUsuario=1, numeroFactura=numero, fechaEmision=ahora - timedelta(hours=i),
+                subtotal=10, total=10, creadoPor=1, creadoDate=ahora,
+                numeroAutorizacion=f'141120250117900{i}'.ljust(49, '0'),
+            )
+            self.ids[numero] = factura.idFactura
+
+    def _fixture_teardown(self):
+        super()._fixture_teardown()
+        FacturaVenta.objects.all().delete()
+
+    def _buscar(self, termino, limite=50):
+        return [
+            numero for factura_id in buscar_ids_facturas(termino, limite)
+            for numero, id_numero in self.ids.items() if id_numero == factura_id
+        ]
+
+    def test_claves_de_busqueda_calculadas_por_la_base(self):
+        factura = FacturaVenta.objects.get(pk=self.ids['001-001-000000123'])
+        self.assertEqual(factura.numeroBusqueda, '001001000000123')
+        self.assertEqual(factura.numeroBusquedaInverso, '321000000100100')
+
+    def test_orden_de_coincidencias(self):
+        # Secuencial exacto (más reciente primero), luego sufijo
+        self.assertEqual(self._buscar('123'), ['001-001-000000123', '001-002-000000123', '001-001-000001123'])
+        self.assertEqual(self._buscar('001-002-000000123'), ['001-002-000000123'])
+        self.assertEqual(self._buscar('001001000000123', limite=1), ['001-001-000000123'])
+        self.assertEqual(self._buscar('1123'), ['001-001-000001123'])
+        self.assertEqual(self._buscar('001-002'), ['001-002-000000123'])
+        self.assertEqual(self._buscar('FAC-2025'), ['FAC-20251031-5A355D'])
+        self.assertEqual(self._buscar('1411202501179003'), ['001-001-000000124'])
+        self.assertEqual(self._buscar('999'), [])
+
+    def test_cada_busqueda_usa_un_indice(self):
+        for termino in ['123', '001-001-000000123', 'FAC-2025', '1411202501179003']:
+            for sql, params in consultas_busqueda_factura(termino):
+                plan = plan_consulta(sql, params)
+                with self.subTest(termino=termino, sql=sql):
+                    self.assertTrue(any('USING INDEX idx_facturas_venta_' in paso for paso in plan), plan)
+                    self.assertFalse(any(paso.startswith('SCAN') for paso in plan), plan)
+
+
+class BusquedaVentasTests(TransactionTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        crear_tablas_no_administradas()
+
+    def setUp(self):
+        self.ahora = timezone.now()
+        self.vendedor = User.objects.create(username='cajero', first_name='Ana', last_name='Pérez')
+        self.cliente = Cliente.objects.create(
+            tipo_identificacion='CEDULA', cedula_ruc='0912345678', nombres='José', apellidos='Núñez',
+            creado_por=self.vendedor, creado_date=self.ahora,
+        )
+        self.factura = self._factura('001-001-000000123')
+        notificar_venta_registrada(FacturaVenta, self.factura.idFactura, [])
+        self.venta = Venta.objects.create(
+            numero_factura='V-000045', cliente=self.cliente, vendedor=self.vendedor, total=5, tipo_pago='tarjeta',
+        )
+
+    def _fixture_teardown(self):
+        Venta.objects.all().delete()
+        Cliente.objects.all().delete()
+        FacturaVenta.objects.all().delete()
+        super()._fixture_teardown()
+
+    def _factura(self, numero, horas=0):
+        return FacturaVenta.objects.create(
+            idCliente=self.cliente.id, idUsuario=self.vendedor.id, numeroFactura=numero,
+            fechaEmision=self.ahora - timedelta(hours=horas), subtotal=10, total=10,
+            creadoPor=self.vendedor.id, creadoDate=self.ahora,
+        )
+
+    def _numeros(self, filas):
+        return [(fila['TipoDocumento'], fila['NumeroVenta']) for fila in filas]
+
+    def test_lista_y_busqueda_en_una_consulta(self):
+        with self.assertNumQueries(1):
+            ventas = buscar_ventas('jose nu')
+        self.assertEqual(self._numeros(ventas), [('VENTA', 'V-000045'), ('FACTURA', '001-001-000000123')])
+        self.assertEqual(ventas[0]['Cliente'], 'José Núñez')
+        self.assertEqual(ventas[0]['Vendedor'], 'Ana Pérez')
+
+        self.assertEqual(self._numeros(buscar_ventas('123')), [('FACTURA', '001-001-000000123')])
+        self.assertEqual(self._numeros(buscar_ventas('001001000000123')), [('FACTURA', '001-001-000000123')])
+        self.assertEqual(self._numeros(buscar_ventas('0912 ana')), self._numeros(ventas))
+        self.assertEqual(buscar_ventas('maria'), [])
+
+        hoy = timezone.localdate()
+        with self.assertNumQueries(1):
+            self.assertEqual(len(listar_ventas(hoy, hoy)), 2)
+        self.assertEqual(listar_ventas(hoy - timedelta(days=3), hoy - timedelta(days=2)), [])
+
+    def test_se_mantiene_al_escribir(self):
+        self.cliente.razon_social = 'Farmacia Central'
+        self.cliente.save()
+        self.vendedor.first_name = 'María'
+        self.vendedor.save()
+        self.assertEqual(
+            set(VentaBusqueda.objects.values_list('cliente', 'vendedor')), {('Farmacia Central', 'María Pérez')}
+        )
+        self.assertEqual(len(buscar_ventas('farm maria')), 2)
+
+        # Factura insertada por otro sistema, sin venta_registrada, seguida
+        # de una del POS con id mayor que ya se proyecta al confirmarse
+        self._factura('001-002-000000007', horas=1)
+        notificar_venta_registrada(FacturaVenta, self._factura('001-001-000000124').idFactura, [])
+        self.assertEqual(buscar_ventas('7'), [])
+        self.assertEqual(sincronizar_facturas_externas(tamano_bloque=2), 1)
+        self.assertEqual(self._numeros(buscar_ventas('7')), [('FACTURA', '001-002-000000007')])
+
+        # Anulación hecha por el otro sistema
+        FacturaVenta.objects.filter(pk=self.factura.pk).update(estado='ANULADA')
+        self.assertEqual(sincronizar_facturas_externas(), 1)
+        self.assertEqual(buscar_ventas('123')[0]['Estado'], 'ANULADA')
+        self.assertEqual(sincronizar_facturas_externas(), 0)
+
+        self.venta.delete()
+        self.assertFalse(VentaBusqueda.objects.filter(tipo_documento='VENTA').exists())
+
+    def test_cada_consulta_usa_un_indice(self):
+        consultas = [consulta_busqueda_ventas('jose nu'), consulta_busqueda_ventas('001-001-000000123')]
+        consultas.append((
+            SQL_LISTA_VENTAS.format(condiciones='b.fecha >= %s AND b.fecha < %s'), ['2025-11-14', '2025-11-15', 100]
+        ))
+        for sql, params in consultas:
+            plan = plan_consulta(sql, params)
+            with self.subTest(sql=sql):
+                self.assertTrue(any('INDEX idx_venta_busqueda_' in paso for paso in plan), plan)
+                self.assertFalse(any(paso.startswith('SCAN') for paso in plan), plan)
+
+
+class DetalleVentaTests(TransactionTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        crear_tablas_no_administradas()
+
+    def setUp(self):
+        ahora = timezone.now()
+        self.usuario = User.objects.create(username='cajero', first_name='Ana', last_name='Pérez')
+        self.cliente = Cliente.objects.create(
+            tipo_identificacion='CEDULA', cedula_ruc='0912345678', nombres='José', apellidos='Núñez',
+            creado_por=self.usuario, creado_date=ahora,
+        )
+        TipoProducto.objects.get_or_create(id=1, defaults={'nombre': 'Medicamento'})
+        ClaseProducto.objects.get_or_create(id=1, defaults={'nombre': 'General'})
+        categoria, _ = Categoria.objects.get_or_create(id=1, defaults={'nombre': 'General'})
+        Subcategoria.objects.get_or_create(id=1, defaults={'nombre': 'General', 'id_categoria': categoria})
+        Marca.objects.get_or_create(id=1, defaults={'nombre': 'Genérico'})
+        Laboratorio.objects.get_or_create(id=1, defaults={'nombre': 'Genérico'})
+        self.productos = [
+            Producto.objects.create(nombre=f'Producto {i}', codigo_principal=f'P{i:03d}', stock=100)
+            for i in range(20)
+        ]
+        self.facturas = {}
+        for lineas in (2, 20):
+            factura = FacturaVenta.objects.create(
+                idCliente=self.cliente.id, idUsuario=self.usuario.id, numeroFactura=f'001-001-{lineas:09d}',
+                fechaEmision=ahora, subtotal=lineas, total=lineas, estado='PAGADA',
+                creadoPor=self.usuario.id, creadoDate=ahora,
+            )
+            FacturaVentaDetalle.objects.bulk_create([
+                FacturaVentaDetalle(
+                    idFacturaVenta=factura.idFactura, idProducto=producto.id, cantidad=1,
+                    precioUnitario=1, total=1,
+                )
+                for producto in self.productos[:lineas]
+            ])
+            self.facturas[lineas] = factura
+        self.cliente_http = Client()
+        self.cliente_http.force_login(self.usuario)
+
+    def _fixture_teardown(self):
+        FacturaVentaDetalle.objects.all().delete()
+        FacturaVenta.objects.all().delete()
+        Cliente.objects.all().delete()
+        Producto.objects.all().delete()
+        super()._fixture_teardown()
+
+    def _consultas(self, peticion):
+        peticion()  # la primera petición de la sesión hace consultas propias
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = peticion()
+        self.assertEqual(respuesta.status_code, 200)
+        return len(consultas), respuesta.json()
+
+    def test_detalle_de_venta_con_consultas_constantes(self):
+        cantidades = {}
+        for lineas, factura in self.facturas.items():
+            cantidades[lineas], datos = self._consultas(
+                lambda: self.cliente_http.get(reverse('ventas:venta_detalle', args=[factura.idFactura]))
+            )
+            self.assertEqual(len(datos['detalle']), lineas)
+        self.assertEqual(cantidades[2], cantidades[20])
+        self.assertEqual(datos['encabezado']['RazonSocial'], 'José Núñez')
+        self.assertEqual(datos['encabezado']['Vendedor'], 'Ana Pérez')
+        self.assertEqual([linea['Codigo'] for linea in datos['detalle']], [f'P{i:03d}' for i in range(20)])
+
+    def test_busqueda_para_devolucion_con_consultas_constantes(self):
+        cantidades = {}
+        for lineas, factura in self.facturas.items():
+            cantidades[lineas], datos = self._consultas(lambda: self.cliente_http.get(
+                reverse('ventas:buscar_venta_devolucion'), {'numero_factura': factura.numeroFactura},
+                HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+            ))
+            self.assertTrue(datos['success'], datos)
+            self.assertEqual(len(datos['venta']['detalles']), lineas)
+        self.assertEqual(cantidades[2], cantidades[20])
+        self.assertEqual(datos['venta']['cliente']['nombre'], 'José Núñez')
+        self.assertEqual(datos['venta']['detalles'][0]['producto_codigo'], 'P000')
+
+
+class ConfiguracionEmpresaSRITests(TransactionTestCase):
+
+    def setUp(self):
+        cache.delete(CLAVE_CONFIGURACION_EMPRESA)
+        self.empresa = ConfiguracionEmpresa.objects.create(ruc='0990000000001', razon_social='Farmacia Uno')
+
+    def test_edicion_desde_otro_proceso_invalida_la_cache(self):
+        self.assertEqual(obtener_configuracion_empresa()['razon_social'], 'Farmacia Uno')
+        # Otro worker guarda la configuración: su post_save no llega a esta caché local
+        ConfiguracionEmpresa.objects.filter(pk=self.empresa.pk).update(
+            razon_social='Farmacia Dos', actualizado_en=self.empresa.actualizado_en + timedelta(seconds=1),
+        )
+        self.assertEqual(obtener_configuracion_empresa()['razon_social'], 'Farmacia Dos')
+
+    def test_sin_cambios_no_relee_la_fila(self):
+        obtener_configuracion_empresa()
+        with CaptureQueriesContext(connection) as consultas:
+            obtener_configuracion_empresa()
+        self.assertEqual(len(consultas), 1)
+        self.assertNotIn('logo', consultas[0]['sql'])
@@ -32,6 +32,7 @@ urlpatterns = [
     path('facturas/<int:pk>/detalle/', views.detalle_factura_electronica, name='detalle_factura_electronica'),
     path('facturas/<int:pk>/anular/', views.anular_factura_electronica, name='anular_factura_electronica'),
     path('facturas/<int:pk>/reenviar-sri/', views.reenviar_al_sri, name='reenviar_sri'),
+    path('envios-sri/<int:envio_id>/estado/', views.estado_envio_sri, name='estado_envio_sri'),
     path('facturas/exportar/', views.exportar_facturas, name='exportar_facturas'),
     path('facturas/imprimir/', views.imprimir_facturas, name='imprimir_facturas'),
     
@@ -0,0 +1,427 @@
+"""
+Búsqueda de facturas de venta por número
+
+facturas_venta tiene dos columnas calculadas por la base a partir de
+numeroFactura (ver indices_busqueda_facturas.sql), ambas indexadas:
+
+- numeroBusqueda: el número sin guiones ('001001000000123').
+- numeroBusquedaInverso: el mismo invertido ('321000000100100'). Un
+  número que "termina en 123" es un inverso que "empieza por 321", así que
+  la búsqueda por sufijo también es un rango del índice.
+
+Cada forma de búsqueda es una consulta por rango o igualdad sobre uno de
+esos índices (nunca LIKE '%...%' ni funciones sobre la columna), en orden
+de prioridad: número exacto, secuencial exacto (los últimos 9 dígitos),
+sufijo, prefijo y clave de acceso / número de autorización.
+
+Proyección de búsqueda de ventas (VentaBusqueda): una fila por documento de
+facturas_venta y de ventas_venta con el cliente y el vendedor ya resueltos,
+y sus palabras (número, cliente, cédula/RUC, vendedor) en
+PalabraVentaBusqueda. Listar es un rango sobre la fecha y buscar un rango
+por prefijo de palabra, ambos con índice y sin UNION. Se mantiene al
+escribir: venta_registrada (facturas del POS) y las señales de Venta,
+Cliente y User. Las facturas que otro sistema inserta o modifica
+directamente en facturas_venta las recoge sincronizar_facturas_externas,
+desde el comando sincronizar_busqueda_ventas (nunca en una petición web).
+"""
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from clientes.models import Cliente
+from clientes.utils_busqueda import nombre_cliente
+from productos.utils_duplicados import normalizar_nombre
+from .models import FacturaVenta, PalabraVentaBusqueda, Venta, VentaBusqueda
+from .signals import venta_registrada
+
+
+MAX_RESULTADOS = 50
+DIGITOS_SECUENCIAL = 9
+
+SQL_FACTURAS_POR_ID = """
+    SELECT
+        fv.id AS Id,
+        fv.numeroFactura AS Factura,
+        fv.numeroAutorizacion AS Autorizacion,
+        COALESCE(NULLIF(c.razonSocial,''), TRIM(CONCAT(IFNULL(c.nombres,''),' ',IFNULL(c.apellidos,'')))) AS Cliente,
+        fv.total AS Total,
+        fv.estado AS Estado,
+        fv.numeroAutorizacion AS ClaveAcceso,
+        fv.fechaEmision AS FechaEmision
+    FROM facturas_venta fv
+    JOIN clientes c ON fv.idCliente = c.id
+    WHERE fv.id IN ({marcadores})
+"""
+
+
+def normalizar_numero_factura(texto):
+    """Clave de búsqueda de un número de factura: sin guiones ni espacios (igual que numeroBusqueda)"""
+    return (texto or '').strip().replace('-', '').replace(' ', '')
+
+
+def _hasta_prefijo(prefijo):
+    """Menor cadena mayor que todas las que empiezan con el prefijo (col >= p AND col < esto)"""
+    return prefijo[:-1] + chr(ord(prefijo[-1]) + 1)
+
+
+def _por_igualdad(columna, valor, limite):
+    return (
+        f"SELECT id FROM facturas_venta WHERE {columna} = %s ORDER BY fechaEmision DESC LIMIT %s",
+        [valor, limite],
+    )
+
+
+def _por_prefijo(columna, prefijo, limite):
+    return (
+        f"SELECT id FROM facturas_venta WHERE {columna} >= %s AND {columna} < %s "
+        f"ORDER BY fechaEmision DESC LIMIT %s",
+        [prefijo, _hasta_prefijo(prefijo), limite],
+    )
+
+
+def consultas_busqueda_factura(termino, limite=MAX_RESULTADOS):
+    """
+    Consultas (sql, params) de la búsqueda de un término, en orden de prioridad.
+    Cada una resuelve con el índice de una columna (las pruebas lo verifican con EXPLAIN).
+    """
+    clave = normalizar_numero_factura(termino)
+    if not clave:
+        return []
+    digitos = ''.join(filter(str.isdigit, clave))
+
+    consultas = [_por_igualdad('numeroBusqueda', clave, limite)]
+    if digitos and len(digitos) <= DIGITOS_SECUENCIAL:
+        # '123' es el secuencial 000000123 de cualquier establecimiento y punto de emisión
+        consultas.append(_por_prefijo('numeroBusquedaInverso', digitos.zfill(DIGITOS_SECUENCIAL)[::-1], limite))
+    if digitos:
+        consultas.append(_por_prefijo('numeroBusquedaInverso', digitos[::-1], limite))
+    consultas.append(_por_prefijo('numeroBusqueda', clave, limite))
+    if len(digitos) > DIGITOS_SECUENCIAL:
+        # Clave de acceso (49 dígitos) o número de autorización, escritos desde el inicio
+        consultas.append(_por_prefijo('numeroAutorizacion', digitos, limite))
+    return consultas
+
+
+def buscar_ids_facturas(termino, limite=MAX_RESULTADOS):
+    """
+    Ids de las facturas que coinciden con el término: primero las coincidencias
+    exactas, luego por secuencial, sufijo, prefijo y autorización; dentro de
+    cada grupo las más recientes primero.
+    """
+    ids = []
+    vistos = set()
+    with connection.cursor() as cursor:
+        for sql, params in consultas_busqueda_factura(termino, limite):
+            cursor.execute(sql, params)
+            for (factura_id,) in cursor.fetchall():
+                if factura_id not in vistos:
+                    vistos.add(factura_id)
+                    ids.append(factura_id)
+            if len(ids) >= limite:
+                break
+    return ids[:limite]
+
+
+def facturas_por_id(ids):
+    """Filas de la lista de facturas electrónicas para esos ids, en el mismo orden"""
+    if not ids:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(SQL_FACTURAS_POR_ID.format(marcadores=', '.join(['%s'] * len(ids))), list(ids))
+        columns = [col[0] for col in cursor.description]
+        por_id = {fila[0]: dict(zip(columns, fila)) for fila in cursor.fetchall()}
+    return [por_id[factura_id] for factura_id in ids if factura_id in por_id]
+
+
+# ============================================
+# PROYECCIÓN DE BÚSQUEDA DE VENTAS
+# ============================================
+
+MAX_VENTAS = 100
+TAMANO_BLOQUE = 1000
+LARGO_PALABRA = 50
+
+SQL_LISTA_VENTAS = """
+    SELECT
+        b.documento_id AS Id,
+        b.numero AS NumeroVenta,
+        b.cliente AS Cliente,
+        b.total AS Total,
+        b.estado AS Estado,
+        b.fecha AS FechaVenta,
+        b.metodo_pago AS MetodoPago,
+        b.vendedor AS Vendedor,
+        b.tipo_documento AS TipoDocumento
+    FROM ventas_busqueda b
+    WHERE {condiciones}
+    ORDER BY b.fecha DESC, b.id DESC
+    LIMIT %s
+"""
+
+SQL_VENTAS_CON_PALABRA = (
+    "b.id IN (SELECT p.venta_id FROM ventas_busqueda_palabras p WHERE p.palabra >= %s AND p.palabra < %s)"
+)
+
+
+def palabras_venta(numero, cliente, cliente_documento, vendedor):
+    """
+    Palabras buscables de un documento: las partes del número, el número
+    sin guiones, el secuencial sin ceros a la izquierda y las palabras del
+    cliente, su cédula/RUC y el vendedor (normalizadas como normalizar_nombre).
+    """
+    partes = normalizar_nombre(numero).split()
+    palabras = set(partes)
+    palabras.add(''.join(partes))
+    if partes and partes[-1].isdigit():
+        palabras.add(partes[-1].lstrip('0') or '0')
+    palabras.update(normalizar_nombre(f'{cliente} {cliente_documento} {vendedor}').split())
+    palabras.discard('')
+    return sorted({palabra[:LARGO_PALABRA] for palabra in palabras})
+
+
+def _proyectar(tipo_documento, documentos):
+    """
+    Reemplaza las filas de la proyección de esos documentos.
+
+    Args:
+        documentos: tuplas (documento_id, numero, cliente_id, vendedor_id, total, estado, metodo_pago, fecha)
+    """
+    if not documentos:
+        return 0
+    cliente_ids = {doc[2] for doc in documentos if doc[2]}
+    vendedor_ids = {doc[3] for doc in documentos if doc[3]}
+    clientes = {
+        cliente_id: (nombre_cliente(razon_social, nombres, apellidos), cedula_ruc or '')
+        for cliente_id, razon_social, nombres, apellidos, cedula_ruc in Cliente.objects.filter(
+            id__in=cliente_ids
+        ).values_list('id', 'razon_social', 'nombres', 'apellidos', 'cedula_ruc')
+    }
+    vendedores = {
+        usuario_id: f"{first_name or ''} {last_name or ''}".strip()
+        for usuario_id, first_name, last_name in User.objects.filter(
+            id__in=vendedor_ids
+        ).values_list('id', 'first_name', 'last_name')
+    }
+
+    filas = []
+    palabras = {}
+    for documento_id, numero, cliente_id, vendedor_id, total, estado, metodo_pago, fecha in documentos:
+        cliente, cliente_documento = clientes.get(cliente_id, ('', ''))
+        vendedor = vendedores.get(vendedor_id, '')
+        filas.append(VentaBusqueda(
+            tipo_documento=tipo_documento, documento_id=documento_id, numero=numero or '',
+            cliente_id=cliente_id, cliente=cliente, cliente_documento=cliente_documento,
+            vendedor_id=vendedor_id, vendedor=vendedor, total=total or 0, estado=estado or '',
+            metodo_pago=metodo_pago or '', fecha=fecha,
+        ))
+        palabras[documento_id] = palabras_venta(numero or '', cliente, cliente_documento, vendedor)
+
+    ids = [fila.documento_id for fila in filas]
+    with transaction.atomic():
+        VentaBusqueda.objects.filter(tipo_documento=tipo_documento, documento_id__in=ids).delete()
+        VentaBusqueda.objects.bulk_create(filas)
+        # bulk_create no devuelve los ids en MySQL
+        nuevos = VentaBusqueda.objects.filter(
+            tipo_documento=tipo_documento, documento_id__in=ids
+        ).values_list('documento_id', 'id')
+        PalabraVentaBusqueda.objects.bulk_create([
+            PalabraVentaBusqueda(venta_id=venta_id, palabra=palabra)
+            for documento_id, venta_id in nuevos
+            for palabra in palabras[documento_id]
+        ], batch_size=TAMANO_BLOQUE)
+    return len(filas)
+
+
+def sincronizar_facturas(factura_ids):
+    """Proyecta (o vuelve a proyectar) esas facturas de facturas_venta"""
+    documentos = [
+        (factura_id, numero, cliente_id, usuario_id, total, estado, 'ELECTRONICO', fecha)
+        for factura_id, numero, cliente_id, usuario_id, total, estado, fecha in FacturaVenta.objects.filter(
+            idFactura__in=list(factura_ids)
+        ).order_by().values_list('idFactura', 'numeroFactura', 'idCliente', 'idUsuario', 'total', 'estado', 'fechaEmision')
+    ]
+    return _proyectar('FACTURA', documentos)
+
+
+def sincronizar_ventas(venta_ids):
+    """Proyecta (o vuelve a proyectar) esas ventas de ventas_venta"""
+    documentos = list(Venta.objects.filter(id__in=list(venta_ids)).order_by().values_list(
+        'id', 'numero_factura', 'cliente_id', 'vendedor_id', 'total', 'estado', 'tipo_pago', 'fecha'
+    ))
+    return _proyectar('VENTA', documentos)
+
+
+def facturas_desactualizadas(facturas):
+    """Facturas del queryset sin fila en la proyección o cuya fila ya no coincide con la factura"""
+    return facturas.exclude(Exists(VentaBusqueda.objects.filter(
+        tipo_documento='FACTURA', documento_id=OuterRef('idFactura'), numero=OuterRef('numeroFactura'),
+        cliente_id=OuterRef('idCliente'), vendedor_id=OuterRef('idUsuario'), total=OuterRef('total'),
+        estado=OuterRef('estado'), fecha=OuterRef('fechaEmision'),
+    )))
+
+
+def sincronizar_facturas_externas(desde=None, tamano_bloque=TAMANO_BLOQUE):
+    """
+    Proyecta las facturas que otro sistema insertó o modificó directamente
+    en facturas_venta (sin venta_registrada).
+
+    No depende de la última factura proyectada: las del POS se proyectan al
+    confirmarse y pueden tener ids mayores que una factura externa aún no
+    proyectada. Recorre facturas_venta por bloques de la clave primaria y en
+    cada bloque busca, con el índice único de la proyección, las facturas
+    sin fila o con una fila que no coincide (anulaciones, cambios de total).
+
+    Args:
+        desde: sólo las facturas emitidas desde esa fecha (None = todas)
+
+    Returns:
+        facturas proyectadas
+    """
+    facturas = FacturaVenta.objects.order_by()
+    if desde is not None:
+        facturas = facturas.filter(fechaEmision__gte=desde)
+    proyectadas = 0
+    ultimo = 0
+    while True:
+        bloque = list(facturas.filter(idFactura__gt=ultimo).order_by('idFactura').values_list(
+            'idFactura', flat=True
+        )[:tamano_bloque])
+        if not bloque:
+            return proyectadas
+        ids = list(facturas_desactualizadas(
+            facturas.filter(idFactura__gt=ultimo, idFactura__lte=bloque[-1])
+        ).values_list('idFactura', flat=True))
+        if ids:
+            proyectadas += sincronizar_facturas(ids)
+        ultimo = bloque[-1]
+
+
+def reconstruir_busqueda_ventas(tamano_bloque=TAMANO_BLOQUE):
+    """
+    Vuelve a proyectar todas las facturas y ventas por bloques y borra las
+    filas de documentos que ya no existen.
+
+    Returns:
+        dict tipo_documento -> documentos proyectados
+    """
+    resumen = {}
+    for tipo_documento, ids, sincronizar in (
+        ('FACTURA', FacturaVenta.objects.order_by('idFactura').values_list('idFactura', flat=True), sincronizar_facturas),
+        ('VENTA', Venta.objects.order_by('id').values_list('id', flat=True), sincronizar_ventas),
+    ):
+        ids = list(ids)
+        for inicio in range(0, len(ids), tamano_bloque):
+            sincronizar(ids[inicio:inicio + tamano_bloque])
+        existentes = set(ids)
+        huerfanos = [
+            documento_id for documento_id in VentaBusqueda.objects.filter(
+                tipo_documento=tipo_documento
+            ).values_list('documento_id', flat=True)
+            if documento_id not in existentes
+        ]
+        for inicio in range(0, len(huerfanos), tamano_bloque):
+            VentaBusqueda.objects.filter(
+                tipo_documento=tipo_documento, documento_id__in=huerfanos[inicio:inicio + tamano_bloque]
+            ).delete()
+        resumen[tipo_documento] = len(ids)
+    return resumen
+
+
+def _reproyectar(filas):
+    """Vuelve a proyectar los documentos de esas filas de VentaBusqueda"""
+    por_tipo = {'FACTURA': [], 'VENTA': []}
+    for tipo_documento, documento_id in filas.values_list('tipo_documento', 'documento_id'):
+        por_tipo[tipo_documento].append(documento_id)
+    for tipo_documento, sincronizar in (('FACTURA', sincronizar_facturas), ('VENTA', sincronizar_ventas)):
+        ids = por_tipo[tipo_documento]
+        for inicio in range(0, len(ids), TAMANO_BLOQUE):
+            sincronizar(ids[inicio:inicio + TAMANO_BLOQUE])
+
+
+def reindexar_cliente(cliente):
+    """Actualiza los documentos de un cliente cuyo nombre o cédula/RUC cambió"""
+    _reproyectar(VentaBusqueda.objects.filter(cliente_id=cliente.id).exclude(
+        cliente=cliente.nombre_completo, cliente_documento=cliente.cedula_ruc or '',
+    ))
+
+
+def reindexar_vendedor(usuario):
+    """Actualiza los documentos de un vendedor cuyo nombre cambió"""
+    nombre = f"{usuario.first_name or ''} {usuario.last_name or ''}".strip()
+    _reproyectar(VentaBusqueda.objects.filter(vendedor_id=usuario.id).exclude(vendedor=nombre))
+
+
+def _listar(condiciones, params, limite):
+    with connection.cursor() as cursor:
+        cursor.execute(SQL_LISTA_VENTAS.format(condiciones=' AND '.join(condiciones)), params + [limite])
+        columns = [col[0] for col in cursor.description]
+        return [dict(zip(columns, fila)) for fila in cursor.fetchall()]
+
+
+def listar_ventas(fecha_inicio, fecha_fin, limite=MAX_VENTAS):
+    """Facturas y ventas entre dos fechas date (inclusive), las más recientes primero"""
+    hasta = fecha_fin + timedelta(days=1)
+    return _listar(
+        ['b.fecha >= %s', 'b.fecha < %s'], [fecha_inicio.strftime('%Y-%m-%d'), hasta.strftime('%Y-%m-%d')], limite
+    )
+
+
+def consulta_busqueda_ventas(texto, limite=MAX_VENTAS):
+    """(sql, params) de buscar_ventas: cada palabra del texto como prefijo de una palabra del documento"""
+    palabras = list(dict.fromkeys(normalizar_nombre(texto).split()))
+    condiciones = []
+    params = []
+    for palabra in palabras:
+        palabra = palabra[:LARGO_PALABRA]
+        condiciones.append(SQL_VENTAS_CON_PALABRA)
+        params.extend([palabra, _hasta_prefijo(palabra)])
+    if not condiciones:
+        return None
+    return SQL_LISTA_VENTAS.format(condiciones=' AND '.join(condiciones)), params + [limite]
+
+
+def buscar_ventas(texto, limite=MAX_VENTAS):
+    """Facturas y ventas cuyo número, cliente o vendedor tienen palabras que empiezan con las del texto"""
+    consulta = consulta_busqueda_ventas(texto, limite)
+    if consulta is None:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(*consulta)
+        columns = [col[0] for col in cursor.description]
+        return [dict(zip(columns, fila)) for fila in cursor.fetchall()]
+
+
+@receiver(venta_registrada, dispatch_uid='busqueda_ventas_por_factura')
+def _proyectar_factura_registrada(sender, factura_id, **kwargs):
+    # venta_registrada ya se emite al confirmar la transacción
+    sincronizar_facturas([factura_id])
+
+
+@receiver(post_save, sender=Venta, dispatch_uid='busqueda_ventas_por_venta')
+def _proyectar_venta(sender, instance, **kwargs):
+    transaction.on_commit(lambda: sincronizar_ventas([instance.id]))
+
+
+@receiver(post_delete, sender=Venta, dispatch_uid='busqueda_ventas_por_baja_venta')
+def _quitar_venta(sender, instance, **kwargs):
+    transaction.on_commit(lambda: VentaBusqueda.objects.filter(
+        tipo_documento='VENTA', documento_id=instance.id
+    ).delete())
+
+
+@receiver(post_save, sender=Cliente, dispatch_uid='busqueda_ventas_por_cliente')
+def _reindexar_cliente(sender, instance, created, **kwargs):
+    if not created:
+        transaction.on_commit(lambda: reindexar_cliente(instance))
+
+
+@receiver(post_save, sender=User, dispatch_uid='busqueda_ventas_por_usuario')
+def _reindexar_vendedor(sender, instance, created, update_fields=None, **kwargs):
+    # El login guarda last_login en cada inicio de sesión: sólo interesan los nombres
+    if created or (update_fields is not None and not {'first_name', 'last_name'} & set(update_fields)):
+        return
+    transaction.on_commit(lambda: reindexar_vendedor(instance))
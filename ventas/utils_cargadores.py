@@ -0,0 +1,51 @@
+"""
+Carga en lote de los objetos relacionados de las tablas heredadas de ventas
+
+facturas_venta y facturas_venta_detalle guardan idCliente, idUsuario,
+idProducto e idFacturaVenta como enteros (los modelos son managed = False y
+no tienen ForeignKey), así que select_related/prefetch_related no sirven y
+cada FacturaVenta.cliente / .usuario / FacturaVentaDetalle.producto hace su
+propia consulta: una vista que recorre N líneas hace N consultas.
+
+Estas funciones resuelven los relacionados de todas las filas con un
+in_bulk por modelo y los dejan en cada instancia, donde las propiedades de
+los modelos (ventas.models.relacionado) los encuentran sin consultar.
+"""
+from django.contrib.auth.models import User
+
+from clientes.models import Cliente
+from productos.models import Producto
+
+
+def precargar(instancias, nombre, modelo, campo_id):
+    """
+    Resuelve con un in_bulk el relacionado `nombre` de todas las instancias
+    a partir de su columna de id `campo_id`.
+
+    Returns:
+        la lista de instancias
+    """
+    instancias = list(instancias)
+    ids = {getattr(instancia, campo_id) for instancia in instancias} - {None}
+    objetos = modelo.objects.in_bulk(ids) if ids else {}
+    for instancia in instancias:
+        instancia.__dict__.setdefault('_relacionados', {})[nombre] = objetos.get(getattr(instancia, campo_id))
+    return instancias
+
+
+def precargar_facturas(facturas):
+    """Clientes y usuarios de las facturas: dos consultas sin importar cuántas sean"""
+    facturas = precargar(facturas, 'cliente', Cliente, 'idCliente')
+    return precargar(facturas, 'usuario', User, 'idUsuario')
+
+
+def precargar_detalles(detalles, factura=None):
+    """
+    Productos de las líneas de detalle con una consulta. Si las líneas son
+    de una misma factura ya cargada se asigna sin consultar.
+    """
+    detalles = precargar(detalles, 'producto', Producto, 'idProducto')
+    if factura is not None:
+        for detalle in detalles:
+            detalle.__dict__.setdefault('_relacionados', {})['factura_venta'] = factura
+    return detalles
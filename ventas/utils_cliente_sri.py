@@ -0,0 +1,268 @@
+"""
+Cliente HTTP del servicio local del SRI
+
+- Una sola requests.Session por proceso (keep-alive): las llamadas reutilizan
+  las conexiones abiertas en lugar de abrir una por consulta. El pool admite
+  SRI_MAX_CONCURRENCIA conexiones simultáneas, las mismas que usa el worker
+  de la cola (ventas.utils_cola_sri).
+- Caché LRU con vencimiento (SRI_CACHE_TTL, SRI_CACHE_MAX_ENTRADAS) de los
+  comprobantes AUTORIZADOS por clave de acceso: un comprobante autorizado no
+  cambia, así que reintentar la misma clave no vuelve a consultar al SRI.
+  Las respuestas no autorizadas (EN PROCESO, NO AUTORIZADO...) no se guardan.
+- consultar_claves consulta muchas claves a la vez en un pool de hilos.
+- El envío de una factura (POST) no es idempotente: sólo se reintenta si
+  falló antes de llegar al servicio (no se pudo conectar) o si el servicio
+  respondió que no la procesó (408, 425, 429, 503). Un timeout o una
+  conexión cortada después de enviarla es un ErrorIncierto: la factura pudo
+  quedar recibida y reenviarla la duplicaría.
+- metricas(): aciertos de la caché y latencia de las llamadas al SRI.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+
+CODIGOS_REINTENTABLES = {408, 425, 429, 500, 502, 503, 504}
+# Respuestas con las que el servicio indica que no procesó la petición
+CODIGOS_SIN_PROCESAR = {408, 425, 429, 503}
+METODOS_IDEMPOTENTES = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+MUESTRAS_LATENCIA = 1000
+
+
+def _configuracion(nombre, defecto):
+    return getattr(settings, nombre, defecto)
+
+
+class ErrorReintentable(Exception):
+    """Error transitorio del servicio del SRI: el envío se reintenta más tarde"""
+
+
+class ErrorDefinitivo(Exception):
+    """El servicio rechazó el envío: reintentarlo daría el mismo resultado"""
+
+
+class ErrorIncierto(ErrorDefinitivo):
+    """
+    Un envío no idempotente pudo haber llegado al servicio sin que se
+    recibiera la respuesta: no se reintenta solo, hay que verificarlo en el
+    SRI antes de reenviarlo.
+    """
+
+
+def _sin_enviar(error):
+    """True si la petición falló al conectar, antes de enviar nada al servicio"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    causa = error.args[0] if error.args else None
+    return isinstance(getattr(causa, 'reason', causa), NewConnectionError)
+
+
+class CacheLRU:
+    """Diccionario acotado a max_entradas (descarta el menos usado) cuyas entradas vencen a los ttl segundos"""
+
+    def __init__(self, max_entradas, ttl):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._entradas = OrderedDict()  # clave -> (vence, valor)
+        self._lock = threading.Lock()
+
+    def obtener(self, clave):
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return None
+            if entrada[0] < time.monotonic():
+                del self._entradas[clave]
+                return None
+            self._entradas.move_to_end(clave)
+            return entrada[1]
+
+    def guardar(self, clave, valor):
+        with self._lock:
+            self._entradas[clave] = (time.monotonic() + self.ttl, valor)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+
+    def __len__(self):
+        return len(self._entradas)
+
+
+class ClienteSRI:
+    """Cliente del servicio del SRI compartido por los hilos del proceso"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._session = None
+        self._cache = None
+        self._metricas_lock = threading.Lock()
+        self._reiniciar_metricas()
+
+    def _reiniciar_metricas(self):
+        self._aciertos = 0
+        self._fallos = 0
+        self._llamadas = 0
+        self._errores = 0
+        self._latencias = deque(maxlen=MUESTRAS_LATENCIA)
+
+    @property
+    def session(self):
+        with self._lock:
+            if self._session is None:
+                conexiones = _configuracion('SRI_MAX_CONCURRENCIA', 4)
+                session = requests.Session()
+                adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=conexiones)
+                session.mount('http://', adaptador)
+                session.mount('https://', adaptador)
+                self._session = session
+            return self._session
+
+    @property
+    def cache(self):
+        with self._lock:
+            if self._cache is None:
+                self._cache = CacheLRU(
+                    _configuracion('SRI_CACHE_MAX_ENTRADAS', 1000), _configuracion('SRI_CACHE_TTL', 60 * 60 * 24)
+                )
+            return self._cache
+
+    def limpiar(self):
+        """Cierra las conexiones, vacía la caché y reinicia las métricas"""
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+            self._session = None
+            self._cache = None
+        with self._metricas_lock:
+            self._reiniciar_metricas()
+
+    def solicitar(self, metodo, ruta, documento=None):
+        """
+        Llamada al servicio del SRI.
+
+        Returns:
+            la respuesta JSON
+
+        Raises:
+            ErrorReintentable: conexión, timeout, HTTP 429/5xx (en un POST,
+                sólo si no llegó a enviarse o el servicio no lo procesó)
+            ErrorIncierto: un POST que pudo haberse recibido sin respuesta
+            ErrorDefinitivo: otro HTTP 4xx o respuesta que no es JSON
+        """
+        url = _configuracion('SRI_API_URL', 'http://127.0.0.1:5001').rstrip('/') + ruta
+        idempotente = metodo.upper() in METODOS_IDEMPOTENTES
+        inicio = time.monotonic()
+        try:
+            try:
+                response = self.session.request(
+                    metodo, url, json=documento, timeout=_configuracion('SRI_TIMEOUT', 30)
+                )
+            except requests.exceptions.RequestException as e:
+                if _sin_enviar(e):
+                    raise ErrorReintentable('No se pudo conectar al servicio del SRI')
+                if not idempotente:
+                    raise ErrorIncierto(
+                        'El SRI no respondió después de recibir el envío; verifique el comprobante '
+                        f'en el SRI antes de reenviarlo ({e.__class__.__name__})'
+                    )
+                if isinstance(e, requests.exceptions.Timeout):
+                    raise ErrorReintentable('Timeout al comunicarse con el SRI')
+                raise ErrorReintentable(f'Error al comunicarse con el SRI: {str(e)}')
+
+            if response.status_code in CODIGOS_REINTENTABLES:
+                if idempotente or response.status_code in CODIGOS_SIN_PROCESAR:
+                    raise ErrorReintentable(f'El SRI respondió HTTP {response.status_code}')
+                raise ErrorIncierto(
+                    f'El SRI respondió HTTP {response.status_code} después de recibir el envío; '
+                    'verifique el comprobante en el SRI antes de reenviarlo'
+                )
+            if response.status_code >= 400:
+                raise ErrorDefinitivo(f'El SRI rechazó el envío: HTTP {response.status_code} {response.text[:500]}')
+            try:
+                return response.json()
+            except ValueError:
+                raise ErrorDefinitivo('El SRI devolvió una respuesta que no es JSON')
+        except (ErrorReintentable, ErrorDefinitivo):
+            with self._metricas_lock:
+                self._errores += 1
+            raise
+        finally:
+            with self._metricas_lock:
+                self._llamadas += 1
+                self._latencias.append(time.monotonic() - inicio)
+
+    def enviar_factura(self, documento):
+        """Envía el JSON de una factura (ventas.utils_sri) y devuelve la respuesta del SRI"""
+        return self.solicitar('POST', '/factura', documento)
+
+    def consultar_clave(self, clave_acceso):
+        """Respuesta del SRI para una clave de acceso; las autorizadas salen de la caché"""
+        api_data = self.cache.obtener(clave_acceso)
+        with self._metricas_lock:
+            if api_data is not None:
+                self._aciertos += 1
+            else:
+                self._fallos += 1
+        if api_data is not None:
+            return api_data
+
+        api_data = self.solicitar('GET', f'/api/consulta_sri/{clave_acceso}')
+        if isinstance(api_data, dict) and api_data.get('estado') == 'AUTORIZADO':
+            self.cache.guardar(clave_acceso, api_data)
+        return api_data
+
+    def consultar_claves(self, claves, concurrencia=None):
+        """
+        Consulta muchas claves a la vez (claves repetidas se consultan una vez).
+
+        Returns:
+            dict clave -> respuesta del SRI, o la excepción si la consulta falló
+        """
+        claves = list(dict.fromkeys(claves))
+        resultados = {}
+        if not claves:
+            return resultados
+
+        def consultar(clave):
+            try:
+                return self.consultar_clave(clave)
+            except (ErrorReintentable, ErrorDefinitivo) as e:
+                return e
+
+        # Más hilos que conexiones en el pool abrirían conexiones que no se reutilizan
+        conexiones = _configuracion('SRI_MAX_CONCURRENCIA', 4)
+        concurrencia = min(concurrencia or conexiones, conexiones, len(claves))
+        with ThreadPoolExecutor(max_workers=concurrencia) as pool:
+            for clave, resultado in zip(claves, pool.map(consultar, claves)):
+                resultados[clave] = resultado
+        return resultados
+
+    def metricas(self):
+        """Aciertos de la caché de claves y latencia (segundos) de las llamadas al SRI"""
+        with self._metricas_lock:
+            latencias = sorted(self._latencias)
+            consultas = self._aciertos + self._fallos
+            return {
+                'consultas': consultas,
+                'aciertos_cache': self._aciertos,
+                'tasa_aciertos': round(self._aciertos / consultas, 4) if consultas else 0.0,
+                'llamadas_sri': self._llamadas,
+                'errores_sri': self._errores,
+                'latencia_promedio': round(sum(latencias) / len(latencias), 4) if latencias else 0.0,
+                'latencia_p95': round(latencias[min(len(latencias) - 1, int(len(latencias) * 0.95))], 4)
+                if latencias else 0.0,
+                'entradas_cache': len(self._cache) if self._cache is not None else 0,
+            }
+
+
+cliente_sri = ClienteSRI()
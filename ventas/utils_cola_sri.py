@@ -0,0 +1,315 @@
+"""
+Cola de envíos al servicio local del SRI (EnvioSRI)
+
+Las llamadas al servicio del SRI (SRI_API_URL) pueden tardar decenas de
+segundos; hacerlas dentro de la petición web bloquea un worker de gunicorn
+por cada una. Las vistas sólo encolan el envío y la página consulta su
+estado (estado_envio) hasta que termina.
+
+El comando procesar_envios_sri toma los envíos vencidos por lotes y hace
+las llamadas HTTP en un pool de SRI_MAX_CONCURRENCIA hilos; las escrituras
+en la base las hace el hilo principal al terminar cada llamada. Los errores
+transitorios (conexión, timeout, HTTP 429/5xx) se reintentan con espera
+exponencial (SRI_ESPERA_BASE, duplicada en cada intento hasta
+SRI_ESPERA_MAXIMA); al agotar SRI_MAX_INTENTOS, o ante un error definitivo
+(otro 4xx, respuesta que no es JSON), el envío queda 'fallido' y sólo vuelve
+a la cola con reenviar(). El envío de una factura sólo se reintenta si no
+llegó al servicio (ver ventas.utils_cliente_sri): si pudo haberse recibido
+queda 'fallido' para verificarlo en el SRI antes de reenviarlo.
+
+Cada objetivo (factura o clave de acceso) tiene a lo sumo un envío en curso:
+EnvioSRI.en_curso es único, así que dos peticiones simultáneas que encolan
+lo mismo terminan en el mismo envío.
+
+Con SRI_ENVIOS_EN_HILO = True (desarrollo) cada envío encolado se procesa
+además en un hilo del mismo proceso, sin necesidad del comando.
+"""
+import logging
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import EnvioSRI, FacturaVenta
+from .utils_cliente_sri import ErrorDefinitivo, ErrorReintentable, cliente_sri
+from .utils_sri import construir_documentos_sri, interpretar_consulta_sri
+
+logger = logging.getLogger(__name__)
+
+
+MINUTOS_ABANDONO = 15  # un envío 'procesando' más antiguo se considera abandonado
+
+
+def _configuracion(nombre, defecto):
+    return getattr(settings, nombre, defecto)
+
+
+# ============================================
+# ENCOLAR Y CONSULTAR ESTADO
+# ============================================
+
+class FacturaYaEnviada(ValueError):
+    """La factura ya fue autorizada o enviada con éxito: enviarla otra vez la duplicaría"""
+
+
+def factura_ya_enviada(factura_id):
+    """True si la factura tiene número de autorización o un envío completado"""
+    return (
+        FacturaVenta.objects.filter(idFactura=factura_id).exclude(numeroAutorizacion__isnull=True)
+        .exclude(numeroAutorizacion='').exists()
+        or EnvioSRI.objects.filter(tipo='factura', factura_id=factura_id, estado='completado').exists()
+    )
+
+
+def encolar_factura(factura_id, usuario=None):
+    """
+    Encola el envío de una factura al SRI (o devuelve el envío de esa factura aún en curso).
+
+    Raises:
+        FacturaYaEnviada: la factura ya tiene autorización o un envío completado
+    """
+    if factura_ya_enviada(factura_id):
+        raise FacturaYaEnviada(f'La factura {factura_id} ya fue enviada al SRI')
+    return _encolar('factura', usuario, factura_id=factura_id)
+
+
+def encolar_consulta(clave_acceso, usuario=None):
+    """
+    Encola la consulta de una clave de acceso. Si la misma clave ya se
+    consultó con éxito dentro de SRI_CACHE_TTL (o se está consultando)
+    devuelve ese envío: un comprobante autorizado no cambia.
+    """
+    limite = timezone.now() - timedelta(seconds=_configuracion('SRI_CACHE_TTL', 60 * 60 * 24))
+    envio = EnvioSRI.objects.filter(
+        tipo='consulta', clave_acceso=clave_acceso, estado='completado',
+        fecha_fin__gt=limite, respuesta__success=True,
+    ).order_by('-id').first()
+    if envio:
+        return envio
+    return _encolar('consulta', usuario, clave_acceso=clave_acceso)
+
+
+def clave_en_curso(tipo, factura_id=None, clave_acceso=''):
+    """Valor de EnvioSRI.en_curso para un objetivo"""
+    return f"{tipo}:{factura_id if tipo == 'factura' else clave_acceso}"
+
+
+def _envio_en_curso(en_curso):
+    # Lectura con bloqueo: ve el envío que otra transacción acaba de confirmar
+    with transaction.atomic():
+        return EnvioSRI.objects.select_for_update().filter(en_curso=en_curso).first()
+
+
+def _encolar(tipo, usuario, **campos):
+    en_curso = clave_en_curso(tipo, **campos)
+    envio = EnvioSRI.objects.filter(en_curso=en_curso).first()
+    if envio:
+        return envio
+
+    try:
+        with transaction.atomic():
+            envio = EnvioSRI.objects.create(
+                tipo=tipo,
+                usuario=usuario if getattr(usuario, 'is_authenticated', False) else None,
+                en_curso=en_curso,
+                **campos
+            )
+    except IntegrityError:
+        # Otra petición encoló el mismo objetivo entre la consulta y el INSERT
+        envio = _envio_en_curso(en_curso)
+        if envio is None:
+            raise
+        return envio
+    if _configuracion('SRI_ENVIOS_EN_HILO', False):
+        transaction.on_commit(lambda: threading.Thread(target=_procesar_en_hilo, daemon=True).start())
+    return envio
+
+
+def _procesar_en_hilo():
+    try:
+        despachar(maximo=1)
+    finally:
+        # El hilo abrió su propia conexión
+        connection.close()
+
+
+def estado_envio(envio):
+    """Estado de un envío para la página que lo consulta (JSON)"""
+    datos = {
+        'success': True,
+        'envio_id': envio.id,
+        'tipo': envio.tipo,
+        'estado': envio.estado,
+        'intentos': envio.intentos,
+        'terminado': envio.estado in ('completado', 'fallido'),
+        'url_estado': reverse('ventas:estado_envio_sri', args=[envio.id]),
+    }
+    if envio.estado == 'pendiente' and envio.intentos:
+        datos['proximo_intento'] = envio.proximo_intento.isoformat()
+        datos['error'] = envio.error
+    elif envio.estado == 'completado':
+        datos['resultado'] = envio.respuesta
+    elif envio.estado == 'fallido':
+        datos['success'] = False
+        datos['error'] = envio.error
+    return datos
+
+
+def reenviar(envio):
+    """
+    Devuelve a la cola un envío fallido, con los intentos en cero. No
+    reenvía una factura que entretanto quedó autorizada.
+    """
+    if envio.estado != 'fallido':
+        return envio
+    if envio.tipo == 'factura' and factura_ya_enviada(envio.factura_id):
+        return envio
+    envio.estado = 'pendiente'
+    envio.intentos = 0
+    envio.error = ''
+    envio.proximo_intento = timezone.now()
+    envio.en_curso = clave_en_curso(envio.tipo, envio.factura_id, envio.clave_acceso)
+    try:
+        with transaction.atomic():
+            envio.save(update_fields=['estado', 'intentos', 'error', 'proximo_intento', 'en_curso'])
+    except IntegrityError:
+        # El mismo objetivo ya se volvió a encolar
+        return _envio_en_curso(envio.en_curso) or envio
+    return envio
+
+
+# ============================================
+# DESPACHO
+# ============================================
+
+def espera_reintento(intentos):
+    """Segundos antes del siguiente intento: exponencial con ±20% para no reintentar todos a la vez"""
+    base = _configuracion('SRI_ESPERA_BASE', 30)
+    maxima = _configuracion('SRI_ESPERA_MAXIMA', 60 * 60)
+    espera = min(base * 2 ** max(intentos - 1, 0), maxima)
+    return espera * random.uniform(0.8, 1.2)
+
+
+def tomar_envios(maximo):
+    """Marca como 'procesando' hasta `maximo` envíos vencidos y los devuelve"""
+    with transaction.atomic():
+        vencidos = EnvioSRI.objects.filter(
+            estado='pendiente', proximo_intento__lte=timezone.now()
+        ).order_by('proximo_intento', 'id')
+        if connection.features.has_select_for_update_skip_locked:
+            # Varios workers pueden tomar envíos distintos sin esperarse
+            vencidos = vencidos.select_for_update(skip_locked=True)
+        else:
+            vencidos = vencidos.select_for_update()
+        envios = list(vencidos[:maximo])
+        if not envios:
+            return []
+
+        ahora = timezone.now()
+        for envio in envios:
+            envio.estado = 'procesando'
+            envio.fecha_inicio = ahora
+            envio.intentos += 1
+        EnvioSRI.objects.bulk_update(envios, ['estado', 'fecha_inicio', 'intentos'])
+    return envios
+
+
+def _ejecutar(envio, documento):
+    """Llamada al SRI de un envío; sólo red, sin acceso a la base (corre en el pool)"""
+    if envio.tipo == 'factura':
+        if documento is None:
+            raise ErrorDefinitivo(f'La factura {envio.factura_id} no existe')
+        return cliente_sri.enviar_factura(documento)
+    api_data = cliente_sri.consultar_clave(envio.clave_acceso)
+    return interpretar_consulta_sri(api_data, envio.clave_acceso)
+
+
+def _registrar_resultado(envio, respuesta=None, error=None):
+    ahora = timezone.now()
+    envio.fecha_fin = ahora
+    envio.en_curso = None
+    if error is None:
+        envio.estado = 'completado'
+        envio.respuesta = respuesta
+        envio.error = ''
+        if envio.tipo == 'factura' and isinstance(respuesta, dict) and respuesta.get('numeroAutorizacion'):
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "UPDATE facturas_venta SET numeroAutorizacion = %s WHERE id = %s",
+                    [respuesta['numeroAutorizacion'], envio.factura_id]
+                )
+    elif isinstance(error, ErrorReintentable) and envio.intentos < _configuracion('SRI_MAX_INTENTOS', 6):
+        envio.estado = 'pendiente'
+        envio.error = str(error)
+        envio.proximo_intento = ahora + timedelta(seconds=espera_reintento(envio.intentos))
+        envio.en_curso = clave_en_curso(envio.tipo, envio.factura_id, envio.clave_acceso)
+    else:
+        envio.estado = 'fallido'
+        envio.error = str(error)
+        if isinstance(error, ErrorReintentable):
+            envio.error += f' (después de {envio.intentos} intentos)'
+    envio.save(update_fields=['estado', 'respuesta', 'error', 'proximo_intento', 'fecha_fin', 'en_curso'])
+
+
+def despachar(concurrencia=None, maximo=None):
+    """
+    Envía un lote de envíos vencidos con a lo sumo `concurrencia` llamadas simultáneas.
+
+    Args:
+        concurrencia: hilos del pool (default: SRI_MAX_CONCURRENCIA)
+        maximo: envíos a tomar (default: 4 por hilo)
+
+    Returns:
+        dict estado -> cantidad de envíos del lote que terminaron en ese estado
+    """
+    concurrencia = concurrencia or _configuracion('SRI_MAX_CONCURRENCIA', 4)
+    envios = tomar_envios(maximo or concurrencia * 4)
+    resumen = {}
+    if not envios:
+        return resumen
+
+    # Los JSON de todas las facturas del lote se arman con una consulta
+    documentos = construir_documentos_sri([envio.factura_id for envio in envios if envio.tipo == 'factura'])
+
+    with ThreadPoolExecutor(max_workers=min(concurrencia, len(envios))) as pool:
+        futuros = {
+            pool.submit(_ejecutar, envio, documentos.get(envio.factura_id)): envio
+            for envio in envios
+        }
+        for futuro in as_completed(futuros):
+            envio = futuros[futuro]
+            try:
+                _registrar_resultado(envio, respuesta=futuro.result())
+            except (ErrorReintentable, ErrorDefinitivo) as e:
+                _registrar_resultado(envio, error=e)
+            except Exception as e:
+                logger.exception('Error inesperado en el envío SRI %s', envio.id)
+                _registrar_resultado(envio, error=ErrorDefinitivo(str(e)))
+            resumen[envio.estado] = resumen.get(envio.estado, 0) + 1
+    return resumen
+
+
+def reencolar_abandonados(minutos=MINUTOS_ABANDONO):
+    """
+    Devuelve a la cola los envíos de un worker que terminó sin registrarlos.
+
+    Las facturas no se reenvían solas: el worker pudo haberlas enviado antes
+    de terminar, así que quedan 'fallido' para verificarlas en el SRI.
+    """
+    limite = timezone.now() - timedelta(minutes=minutos)
+    abandonados = EnvioSRI.objects.filter(estado='procesando', fecha_inicio__lt=limite)
+    fallidos = abandonados.filter(tipo='factura').update(
+        estado='fallido', en_curso=None, fecha_fin=timezone.now(),
+        error='El envío quedó sin respuesta; verifique el comprobante en el SRI antes de reenviarlo',
+    )
+    fallidos += abandonados.filter(intentos__gte=_configuracion('SRI_MAX_INTENTOS', 6)).update(
+        estado='fallido', en_curso=None, error='El envío superó el número máximo de intentos',
+        fecha_fin=timezone.now()
+    )
+    reencolados = abandonados.update(estado='pendiente', proximo_intento=timezone.now())
+    return reencolados, fallidos
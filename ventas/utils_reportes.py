@@ -0,0 +1,189 @@
+"""
+Cálculo de reportes de ventas para la cola de trabajos de reportes
+
+Los reportes se calculan fuera de la petición web (comando
+procesar_trabajos_reportes) y el resultado queda en caché por parámetros;
+ver reportes.utils_trabajos.
+"""
+from datetime import date, datetime
+
+from django.db import connection
+
+from reportes.utils_trabajos import registrar_tarea
+
+
+def _ttl_consolidado(parametros):
+    # Un período cerrado no cambia: su resultado se conserva un día
+    if parametros['fecha_fin'] < date.today().isoformat():
+        return 60 * 60 * 24
+    return 300
+
+
+def reporte_consolidado_vacio(fecha_inicio, fecha_fin):
+    """Estructura del reporte consolidado sin datos"""
+    # Calcular días del período
+    fecha_inicio_dt = datetime.strptime(fecha_inicio, '%Y-%m-%d')
+    fecha_fin_dt = datetime.strptime(fecha_fin, '%Y-%m-%d')
+    dias_periodo = (fecha_fin_dt - fecha_inicio_dt).days + 1
+
+    return {
+        'estadisticas': {
+            'total_ventas': 0,
+            'total_facturas': 0,
+            'total_monto': 0,
+            'total_clientes': 0,
+            'total_productos_vendidos': 0,
+            'promedio_venta': 0,
+            'promedio_diario': 0,
+            'dias_periodo': dias_periodo,
+        },
+        'ventas_por_dia': [],
+        'productos_top': [],
+        'clientes_top': [],
+        'formas_pago': [],
+    }
+
+
+@registrar_tarea('ventas.reporte_consolidado', ttl=_ttl_consolidado)
+def calcular_reporte_consolidado(parametros):
+    """Reporte consolidado de ventas por rango de fechas (resultado serializable)"""
+    fecha_inicio = parametros['fecha_inicio']
+    fecha_fin = parametros['fecha_fin']
+
+    resultado = reporte_consolidado_vacio(fecha_inicio, fecha_fin)
+    estadisticas = resultado['estadisticas']
+    dias_periodo = estadisticas['dias_periodo']
+    ventas_por_dia = resultado['ventas_por_dia']
+    productos_top = resultado['productos_top']
+    clientes_top = resultado['clientes_top']
+    formas_pago = resultado['formas_pago']
+
+    with connection.cursor() as cursor:
+        # Total de ventas y monto
+        cursor.execute("""
+            SELECT 
+                COUNT(*) as total_ventas,
+                COALESCE(SUM(total), 0) as total_monto,
+                COUNT(DISTINCT idCliente) as total_clientes
+            FROM facturas_venta
+            WHERE DATE(fechaEmision) BETWEEN %s AND %s
+            AND estado != 'ANULADA'
+        """, [fecha_inicio, fecha_fin])
+        
+        row = cursor.fetchone()
+        if row:
+            estadisticas['total_ventas'] = row[0] or 0
+            estadisticas['total_monto'] = float(row[1]) if row[1] else 0
+            estadisticas['total_clientes'] = row[2] or 0
+            estadisticas['promedio_venta'] = (
+                estadisticas['total_monto'] / estadisticas['total_ventas'] 
+                if estadisticas['total_ventas'] > 0 else 0
+            )
+            estadisticas['promedio_diario'] = (
+                estadisticas['total_ventas'] / dias_periodo
+                if dias_periodo > 0 else 0
+            )
+        
+        # Total de productos vendidos
+        cursor.execute("""
+            SELECT COALESCE(SUM(fvd.cantidad), 0) as total_productos
+            FROM facturas_venta_detalle fvd
+            JOIN facturas_venta fv ON fvd.idFacturaVenta = fv.id
+            WHERE DATE(fv.fechaEmision) BETWEEN %s AND %s
+            AND fv.estado != 'ANULADA'
+        """, [fecha_inicio, fecha_fin])
+        
+        row = cursor.fetchone()
+        if row:
+            estadisticas['total_productos_vendidos'] = float(row[0]) if row[0] else 0
+        
+        # Ventas por día para gráfico
+        cursor.execute("""
+            SELECT 
+                DATE(fechaEmision) as fecha,
+                COUNT(*) as cantidad,
+                COALESCE(SUM(total), 0) as monto
+            FROM facturas_venta
+            WHERE DATE(fechaEmision) BETWEEN %s AND %s
+            AND estado != 'ANULADA'
+            GROUP BY DATE(fechaEmision)
+            ORDER BY fecha
+        """, [fecha_inicio, fecha_fin])
+        
+        for row in cursor.fetchall():
+            ventas_por_dia.append({
+                'fecha': row[0].strftime('%Y-%m-%d'),
+                'cantidad': row[1],
+                'monto': float(row[2]) if row[2] else 0
+            })
+        
+        # Top 10 productos más vendidos
+        cursor.execute("""
+            SELECT 
+                p.nombre,
+                p.codigoPrincipal,
+                SUM(fvd.cantidad) as cantidad,
+                COALESCE(SUM(fvd.total), 0) as total
+            FROM facturas_venta_detalle fvd
+            JOIN facturas_venta fv ON fvd.idFacturaVenta = fv.id
+            JOIN productos p ON fvd.idProducto = p.id
+            WHERE DATE(fv.fechaEmision) BETWEEN %s AND %s
+            AND fv.estado != 'ANULADA'
+            GROUP BY p.id, p.nombre, p.codigoPrincipal
+            ORDER BY cantidad DESC
+            LIMIT 10
+        """, [fecha_inicio, fecha_fin])
+        
+        for row in cursor.fetchall():
+            productos_top.append({
+                'nombre': row[0],
+                'codigo': row[1],
+                'cantidad': float(row[2]) if row[2] else 0,
+                'total': float(row[3]) if row[3] else 0
+            })
+        
+        # Top 10 clientes
+        cursor.execute("""
+            SELECT 
+                CONCAT(c.nombres, ' ', c.apellidos) as cliente,
+                c.cedula_ruc,
+                COUNT(*) as num_compras,
+                COALESCE(SUM(fv.total), 0) as total_comprado
+            FROM facturas_venta fv
+            LEFT JOIN clientes c ON fv.idCliente = c.id
+            WHERE DATE(fv.fechaEmision) BETWEEN %s AND %s
+            AND fv.estado != 'ANULADA'
+            GROUP BY c.id, cliente, c.cedula_ruc
+            ORDER BY total_comprado DESC
+            LIMIT 10
+        """, [fecha_inicio, fecha_fin])
+        
+        for row in cursor.fetchall():
+            clientes_top.append({
+                'nombre': row[0] or 'Cliente General',
+                'cedula_ruc': row[1] or 'N/A',
+                'num_compras': row[2],
+                'total': float(row[3]) if row[3] else 0
+            })
+        
+        # Formas de pago
+        cursor.execute("""
+            SELECT 
+                formaPago,
+                COUNT(*) as cantidad,
+                COALESCE(SUM(total), 0) as total
+            FROM facturas_venta
+            WHERE DATE(fechaEmision) BETWEEN %s AND %s
+            AND estado != 'ANULADA'
+            GROUP BY formaPago
+            ORDER BY total DESC
+        """, [fecha_inicio, fecha_fin])
+        
+        for row in cursor.fetchall():
+            formas_pago.append({
+                'forma_pago': row[0] or 'No especificado',
+                'cantidad': row[1],
+                'total': float(row[2]) if row[2] else 0
+            })
+
+    return resultado
@@ -0,0 +1,388 @@
+"""
+Documentos de facturación electrónica del SRI
+
+construir_documentos_sri arma el JSON de muchas facturas con una consulta
+por bloque (cabecera, cliente, detalles y código de cada producto en un
+solo JOIN) y la configuración de la empresa leída una vez desde la caché.
+Sirve tanto para la factura recién emitida en el punto de venta como para
+generar en lote los pendientes de un día (comando generar_json_sri).
+"""
+import xml.etree.ElementTree as ET
+
+from django.core.cache import cache
+from django.db import OperationalError, connection
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from clientes.utils_busqueda import nombre_cliente
+from usuarios.models import ConfiguracionEmpresa
+
+
+CLAVE_CONFIGURACION_EMPRESA = 'ventas:configuracion_empresa'
+TTL_CONFIGURACION_EMPRESA = 5 * 60
+TAMANO_BLOQUE = 500
+
+CONFIGURACION_RESPALDO = {
+    'ruc': '0915912604001',
+    'razon_social': 'FARMACIA FÉ Y SALUD',
+    'nombre_comercial': 'FARMACIA FÉ Y SALUD',
+    'direccion_matriz': 'GUAYAQUIL / FEBRES CORDERO / ORIENTE S/N Y 38 AVA',
+    'direccion_establecimiento': 'GUAYAQUIL / FEBRES CORDERO / ORIENTE S/N Y 38 AVA',
+    'telefono': '0981276460',
+    'email': '',
+    'contribuyente_especial': '',
+    'obligado_contabilidad': 'SI',
+    'activo': True,
+    'codigo_establecimiento': '001',
+    'codigo_punto_emision': '001',
+    'ambiente': 'PRODUCCIÓN',
+    'emision': 'NORMAL',
+    'eslogan': 'Tu Bienestar, Nuestra Prioridad',
+    'verificacion_url': 'https://srienlinea.sri.gob.ec/sri-en-linea/consulta/55',
+    'telefono_atencion': '0959711555',
+    'mensaje_final': 'FARMACIA FÉ Y SALUD TE ESPERA'
+}
+
+
+CONFIGURACION_NO_CONFIGURADA = {
+    'ruc': '9999999999999',
+    'razon_social': 'EMPRESA NO CONFIGURADA',
+    'nombre_comercial': 'EMPRESA NO CONFIGURADA',
+    'direccion_matriz': 'DIRECCIÓN NO CONFIGURADA',
+    'direccion_establecimiento': 'DIRECCIÓN NO CONFIGURADA',
+    'telefono': '000-0000',
+    'email': '',
+    'contribuyente_especial': '',
+    'obligado_contabilidad': 'NO',
+    'activo': True,
+    'codigo_establecimiento': '001',
+    'codigo_punto_emision': '001',
+    'ambiente': 'PRODUCCIÓN',
+    'emision': 'NORMAL',
+    'eslogan': 'Configure su empresa en el sistema',
+    'verificacion_url': 'https://srienlinea.sri.gob.ec/sri-en-linea/consulta/55',
+    'telefono_atencion': '000-0000',
+    'mensaje_final': 'CONFIGURE SU EMPRESA'
+}
+
+
+def _configuracion_desde_empresa(empresa_config):
+    return {
+        'ruc': empresa_config.ruc,
+        'razon_social': empresa_config.razon_social,
+        'nombre_comercial': empresa_config.nombre_comercial or empresa_config.razon_social,
+        'direccion_matriz': empresa_config.direccion_matriz,
+        'direccion_establecimiento': empresa_config.direccion_matriz,
+        'telefono': empresa_config.telefono or '',
+        'email': empresa_config.email or '',
+        'contribuyente_especial': empresa_config.contribuyente_especial or '',
+        'obligado_contabilidad': 'SI' if empresa_config.obligado_contabilidad else 'NO',
+        'activo': empresa_config.activo,
+        # Campos adicionales que se pueden configurar en el futuro
+        'codigo_establecimiento': '001',  # Por defecto
+        'codigo_punto_emision': '001',   # Por defecto
+        'ambiente': 'PRODUCCIÓN',        # Por defecto
+        'emision': 'NORMAL',            # Por defecto
+        'eslogan': 'Tu Bienestar, Nuestra Prioridad',  # Configurable en el futuro
+        'verificacion_url': 'https://srienlinea.sri.gob.ec/sri-en-linea/consulta/55',
+        'telefono_atencion': empresa_config.telefono or '000-0000',
+        'mensaje_final': f'{empresa_config.nombre_comercial or empresa_config.razon_social} TE ESPERA'
+    }
+
+
+
+def _version_configuracion_empresa():
+    """(id, actualizado_en) de la empresa activa, sin traer el logo ni el resto de la fila"""
+    try:
+        return ConfiguracionEmpresa.objects.filter(activo=True).values_list('id', 'actualizado_en').first()
+    except OperationalError:
+        # Modo offline, igual que ConfiguracionEmpresa.obtener_configuracion
+        return None
+
+
+def obtener_configuracion_empresa():
+    """Función centralizada para obtener configuración de la empresa.
+
+    La caché es local a cada proceso, así que la entrada guarda el
+    actualizado_en de la fila y se valida contra la base en cada llamada
+    (una consulta de dos columnas): una edición hecha desde otro worker se
+    ve en la siguiente factura. Los cambios hechos directamente en la base
+    sin tocar actualizado_en caducan con TTL_CONFIGURACION_EMPRESA.
+    """
+    try:
+        version = _version_configuracion_empresa()
+    except Exception as e:
+        print(f"ERROR al obtener configuración de empresa: {str(e)}")
+        # Fallback a configuración por defecto en caso de error
+        return dict(CONFIGURACION_RESPALDO)
+
+    if not version:
+        # Sin configuración (o sin conexión): valores por defecto, sin guardarlos en caché
+        return dict(CONFIGURACION_NO_CONFIGURADA)
+
+    entrada = cache.get(CLAVE_CONFIGURACION_EMPRESA)
+    if entrada is not None and entrada[0] == version:
+        return entrada[1]
+
+    try:
+        empresa_config = ConfiguracionEmpresa.obtener_configuracion()
+    except Exception as e:
+        print(f"ERROR al obtener configuración de empresa: {str(e)}")
+        return dict(CONFIGURACION_RESPALDO)
+
+    if not empresa_config:
+        return dict(CONFIGURACION_NO_CONFIGURADA)
+
+    configuracion = _configuracion_desde_empresa(empresa_config)
+    version = (empresa_config.id, empresa_config.actualizado_en)
+    cache.set(CLAVE_CONFIGURACION_EMPRESA, (version, configuracion), TTL_CONFIGURACION_EMPRESA)
+    return configuracion
+
+
+@receiver(post_save, sender=ConfiguracionEmpresa, dispatch_uid='ventas_invalidar_configuracion_empresa')
+def _invalidar_configuracion_empresa(sender, **kwargs):
+    cache.delete(CLAVE_CONFIGURACION_EMPRESA)
+
+
+# ============================================
+# JSON DE FACTURAS PARA EL SRI
+# ============================================
+
+SQL_DOCUMENTOS_SRI = """
+    SELECT
+        fv.id, fv.fechaEmision, fv.subtotal, fv.descuento, fv.iva, fv.total,
+        c.id, c.nombres, c.apellidos, c.razonSocial, c.cedula_ruc, c.direccion,
+        d.idProducto, d.cantidad, d.precioUnitario, d.descuentoValor, d.ivaValor, d.productoNombre,
+        p.id, p.codigoPrincipal
+    FROM facturas_venta fv
+    LEFT JOIN clientes c ON c.id = fv.idCliente
+    LEFT JOIN facturas_venta_detalle d ON d.idFacturaVenta = fv.id
+    LEFT JOIN productos p ON p.id = d.idProducto
+    WHERE fv.id IN ({marcadores})
+    ORDER BY fv.id, d.id
+"""
+
+
+def _cabecera_sri(fila, empresa):
+    (factura_id, fecha_emision, subtotal, descuento, iva, total,
+     cliente_id, nombres, apellidos, razon_social, cedula_ruc, direccion) = fila[:12]
+
+    razon_social_comprador = (
+        nombre_cliente(razon_social, nombres, apellidos) if cliente_id is not None else "CONSUMIDOR FINAL"
+    )
+
+    return {
+        "empresaRuc": empresa['ruc'],
+        "ambiente": 1,  # 1 = Pruebas, 2 = Producción
+        "tipoComprobante": "01",  # 01 = Factura
+        "infoTributaria": {
+            "estab": empresa['codigo_establecimiento'],
+            "ptoEmi": empresa['codigo_punto_emision'],
+            "secuencial": str(factura_id).zfill(9),
+            "dirMatriz": empresa['direccion_matriz']
+        },
+        "infoFactura": {
+            "fechaEmision": fecha_emision.strftime("%d/%m/%Y"),
+            "dirEstablecimiento": empresa['direccion_establecimiento'],
+            "obligadoContabilidad": empresa['obligado_contabilidad'],
+            "tipoIdentificacionComprador": "05",  # 05 = Cédula
+            "razonSocialComprador": razon_social_comprador,
+            "identificacionComprador": cedula_ruc or "9999999999999",
+            "direccionComprador": direccion or "GUAYAQUIL",
+            "totalSinImpuestos": float(subtotal),
+            "totalDescuento": float(descuento) if descuento else 0.00,
+            "totalConImpuestos": [
+                {
+                    "codigo": "2",  # Código IVA
+                    "codigoPorcentaje": "2",  # 15% IVA
+                    "baseImponible": float(subtotal),
+                    "valor": float(iva)
+                }
+            ] if iva > 0 else [],
+            "propina": 0.00,
+            "importeTotal": float(total),
+            "moneda": "DOLAR"
+        },
+        "detalles": []
+    }
+
+
+def _detalle_sri(fila):
+    (producto_id, cantidad, precio_unitario, descuento_valor, iva_valor, producto_nombre,
+     producto_existe, codigo_principal) = fila[12:]
+
+    cantidad = float(cantidad)
+    precio_unitario = float(precio_unitario)
+    descuento_detalle = float(descuento_valor) if descuento_valor else 0.00
+    precio_total_sin_impuesto = cantidad * precio_unitario - descuento_detalle
+
+    if producto_existe is None:
+        codigo_principal = f"PROD-{producto_id}"
+
+    return {
+        "codigoPrincipal": codigo_principal,
+        "descripcion": producto_nombre,
+        "cantidad": cantidad,
+        "precioUnitario": precio_unitario,
+        "descuento": descuento_detalle,
+        "precioTotalSinImpuesto": precio_total_sin_impuesto,
+        "impuestos": [
+            {
+                "codigo": "2",  # Código IVA
+                "codigoPorcentaje": "2",  # 15% IVA
+                "tarifa": 15.00,
+                "baseImponible": precio_total_sin_impuesto,
+                "valor": float(iva_valor)
+            }
+        ] if iva_valor > 0 else []
+    }
+
+
+def construir_documentos_sri(factura_ids, tamano_bloque=TAMANO_BLOQUE):
+    """
+    JSON de facturación electrónica de varias facturas.
+
+    Hace una consulta por cada bloque de tamano_bloque facturas, sin importar
+    cuántos detalles tengan.
+
+    Returns:
+        dict factura_id -> JSON del SRI (las facturas inexistentes se omiten)
+    """
+    factura_ids = list(dict.fromkeys(factura_ids))
+    empresa = obtener_configuracion_empresa()
+    documentos = {}
+
+    with connection.cursor() as cursor:
+        for inicio in range(0, len(factura_ids), tamano_bloque):
+            bloque = factura_ids[inicio:inicio + tamano_bloque]
+            cursor.execute(SQL_DOCUMENTOS_SRI.format(marcadores=', '.join(['%s'] * len(bloque))), bloque)
+            for fila in cursor.fetchall():
+                documento = documentos.get(fila[0])
+                if documento is None:
+                    documento = documentos[fila[0]] = _cabecera_sri(fila, empresa)
+                # LEFT JOIN: una factura sin detalles trae una fila con el detalle en NULL
+                if fila[12] is not None:
+                    documento["detalles"].append(_detalle_sri(fila))
+
+    return documentos
+
+
+def construir_documento_sri(factura_id):
+    """JSON de facturación electrónica de una factura (None si no existe)"""
+    return construir_documentos_sri([factura_id]).get(factura_id)
+
+
+def facturas_para_sri(fecha_inicio, fecha_fin, solo_sin_autorizacion=True):
+    """Ids de las facturas no anuladas emitidas entre dos fechas (inclusive)"""
+    sql = """
+        SELECT id FROM facturas_venta
+        WHERE DATE(fechaEmision) BETWEEN %s AND %s AND anulado = 0
+    """
+    if solo_sin_autorizacion:
+        sql += " AND (numeroAutorizacion IS NULL OR numeroAutorizacion = '')"
+    with connection.cursor() as cursor:
+        cursor.execute(sql + " ORDER BY id", [fecha_inicio, fecha_fin])
+        return [fila[0] for fila in cursor.fetchall()]
+
+
+# ============================================
+# CONSULTA DE CLAVES DE ACCESO
+# ============================================
+def interpretar_consulta_sri(api_data, clave_acceso):
+    """
+    Respuesta de consultar_clave_acceso a partir de la respuesta del servicio
+    del SRI: proveedor, datos de la factura y productos del XML autorizado.
+    """
+    # Verificar estado de la autorización
+    if api_data.get('estado') != 'AUTORIZADO':
+        return {
+            'success': False,
+            'error': f'Factura no autorizada. Estado: {api_data.get("estado", "DESCONOCIDO")}'
+        }
+
+    # Extraer XML del comprobante
+    xml_content = api_data.get('comprobanteXml', '')
+    if not xml_content:
+        return {'success': False, 'error': 'No se recibió XML del comprobante'}
+
+    # Parsear XML
+    try:
+        root = ET.fromstring(xml_content)
+    except ET.ParseError:
+        return {'success': False, 'error': 'Error al parsear XML del comprobante'}
+
+    # Extraer información del emisor (proveedor)
+    info_tributaria = root.find('infoTributaria')
+    if info_tributaria is None:
+        return {'success': False, 'error': 'XML sin información tributaria'}
+
+    proveedor = {
+        'ruc': info_tributaria.findtext('ruc', ''),
+        'razon_social': info_tributaria.findtext('razonSocial', ''),
+        'nombre_comercial': info_tributaria.findtext('nombreComercial', '')
+    }
+
+    # Extraer información de la factura
+    info_factura = root.find('infoFactura')
+    total_factura = 0.0
+    if info_factura is not None:
+        total_factura = float(info_factura.findtext('importeTotal', '0'))
+
+    factura_info = {
+        'numero': f"{info_tributaria.findtext('estab', '001')}-{info_tributaria.findtext('ptoEmi', '001')}-{info_tributaria.findtext('secuencial', '000000000')}",
+        'fecha': info_factura.findtext('fechaEmision', '') if info_factura is not None else '',
+        'autorizacion': api_data.get('numeroAutorizacion', clave_acceso),
+        'fecha_autorizacion': api_data.get('fechaAutorizacion', ''),
+        'total': total_factura
+    }
+
+    # Extraer productos del XML
+    productos = []
+    detalles = root.find('detalles')
+
+    if detalles is not None:
+        for detalle in detalles.findall('detalle'):
+            codigo = detalle.findtext('codigoPrincipal', '')
+            descripcion = detalle.findtext('descripcion', '')
+            cantidad = float(detalle.findtext('cantidad', '0'))
+            precio_unitario = float(detalle.findtext('precioUnitario', '0'))
+            descuento = float(detalle.findtext('descuento', '0'))
+            subtotal = float(detalle.findtext('precioTotalSinImpuesto', '0'))
+
+            # Extraer IVA del producto
+            iva_valor = 0.0
+            impuestos = detalle.find('impuestos')
+            if impuestos is not None:
+                for impuesto in impuestos.findall('impuesto'):
+                    codigo_impuesto = impuesto.findtext('codigo', '')
+                    if codigo_impuesto == '2':  # Código 2 = IVA
+                        iva_valor = float(impuesto.findtext('valor', '0'))
+                        break
+
+            total = subtotal + iva_valor
+
+            producto = {
+                'codigo': codigo,
+                'descripcion': descripcion,
+                'cantidad': cantidad,
+                'precio_unitario': precio_unitario,
+                'descuento': descuento,
+                'subtotal': subtotal,
+                'iva': iva_valor,
+                'total': total
+            }
+
+            productos.append(producto)
+
+    if not productos:
+        return {'success': False, 'error': 'No se encontraron productos en la factura'}
+
+    return {
+        'success': True,
+        'productos': productos,
+        'proveedor': proveedor,
+        'factura_info': factura_info,
+        'total_factura': total_factura,
+        'mensaje': f'Factura consultada exitosamente. Se encontraron {len(productos)} producto(s).',
+        'resumen_sri': api_data.get('resumen', {})
+    }
@@ -0,0 +1,113 @@
+"""
+Stock de la sucursal en el punto de venta
+
+Cada caja pertenece a una ubicación (Caja.ubicacion; sin ubicación asignada
+se usa la principal). Con VENTAS_STOCK_POR_UBICACION el punto de venta:
+
+- busca, muestra y guarda para uso offline el stock de la sucursal de la
+  caja (StockUbicacion) en lugar del stock global;
+- descuenta StockUbicacion con el servicio de movimientos, que rechaza el
+  ticket si algún saldo queda negativo (la caché en memoria del proceso sólo
+  sirve para mostrar stock, no para validar). El kardex queda con idUbicacion.
+
+productos.stock (total de la empresa) se descuenta en la misma transacción
+de la venta, después del stock de la sucursal y sin fila de kardex
+(inventario.utils_movimientos.aplicar_en_ubicacion). El UPDATE del total
+bloquea la fila del producto hasta el commit, así que ventas simultáneas del
+mismo producto en distintas sucursales se esperan entre sí; por eso el
+descuento va al final de la transacción y la vista arma el JSON del SRI
+después del commit.
+
+Las compras y los ingresos de productos suman al stock de la ubicación que
+recibe (ubicacion_de_recepcion) y las transferencias mueven StockUbicacion
+entre sucursales, de modo que el stock de cada sucursal se repone.
+"""
+from django.conf import settings
+
+from caja.models import Caja, CierreCaja
+from inventario.models import Ubicacion
+from inventario.utils_movimientos import Movimiento, aplicar_en_ubicacion, aplicar_movimientos
+from inventario.utils_stock import cache_stock
+
+
+def stock_por_sucursal():
+    """True si el punto de venta vende del stock de la sucursal de la caja"""
+    return getattr(settings, 'VENTAS_STOCK_POR_UBICACION', False)
+
+
+def ubicacion_de_caja(caja_abierta_data):
+    """Ubicación (sucursal) de una caja abierta, o None si el POS usa el stock global"""
+    if not stock_por_sucursal() or not caja_abierta_data:
+        return None
+    return Caja.obtener_ubicacion_id(caja_abierta_data['idCaja'])
+
+
+def ubicacion_de_venta(usuario):
+    """Ubicación de la caja abierta del usuario, o None si el POS usa el stock global"""
+    if not stock_por_sucursal():
+        return None
+    return ubicacion_de_caja(CierreCaja.obtener_caja_abierta(usuario))
+
+
+def ubicacion_de_recepcion(usuario, ubicacion_id=None):
+    """
+    Ubicación que recibe una compra o un ingreso de productos, o None si el
+    POS usa el stock global.
+
+    Se usa la ubicación indicada en el formulario; si no hay, la de la caja
+    abierta del usuario y, sin caja, la ubicación principal.
+    """
+    if not stock_por_sucursal():
+        return None
+    if ubicacion_id:
+        return Ubicacion.objects.filter(id=ubicacion_id, activo=True).values_list('id', flat=True).get()
+    caja_abierta_data = CierreCaja.obtener_caja_abierta(usuario)
+    if caja_abierta_data:
+        return ubicacion_de_caja(caja_abierta_data)
+    return Ubicacion.objects.filter(es_principal=True, activo=True).values_list('id', flat=True).first()
+
+
+def clave_productos_offline(ubicacion_id):
+    """Clave de caché con los productos del POS para uso offline (una por sucursal)"""
+    if ubicacion_id is None:
+        return 'productos_offline'
+    return f'productos_offline:{ubicacion_id}'
+
+
+def stock_disponible(producto_ids, ubicacion_id):
+    """
+    Stock de la sucursal servido desde la caché en memoria del proceso.
+
+    Returns:
+        dict producto_id -> cantidad (0 si el producto no tiene fila en la sucursal)
+    """
+    filas = cache_stock.obtener(producto_ids, [ubicacion_id])
+    return {producto_id: fila[0] for (producto_id, _), fila in filas.items()}
+
+
+def descontar_stock_venta(lineas, ubicacion_id, usuario, detalle):
+    """
+    Descuenta el stock vendido y registra el kardex.
+
+    Se rechaza el ticket completo (StockInsuficiente) si algún saldo queda
+    negativo. Debe llamarse dentro de la transacción de la venta.
+
+    Args:
+        lineas: lista de (producto_id, cantidad)
+        ubicacion_id: sucursal de la caja, o None para descontar productos.stock
+        usuario: cajero (auditoría de StockUbicacion)
+        detalle: detalle del kardex (ej: Factura Venta N° 001-001-000000015)
+
+    Returns:
+        dict producto_id -> stock que quedó en la sucursal, o None con stock global
+    """
+    movimientos = [Movimiento(producto_id, -cantidad, 'VENTA', detalle) for producto_id, cantidad in lineas]
+
+    if ubicacion_id is None:
+        aplicar_movimientos(movimientos, permitir_negativo=False, notificar=False)
+        return None
+
+    saldos, _ = aplicar_en_ubicacion(
+        movimientos, ubicacion_id, usuario=usuario, permitir_negativo=False, notificar=False,
+    )
+    return saldos
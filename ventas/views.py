@@ -9,14 +9,27 @@ from django.views.decorators.http import require_http_methods
 from functools import wraps
 import json
 from decimal import Decimal
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 import uuid
 import requests
 from django.utils import timezone
-from .models import Venta, DetalleVenta, PagoVenta, FacturaVenta, FacturaVentaDetalle
+from .models import Venta, DetalleVenta, PagoVenta, FacturaVenta, FacturaVentaDetalle, EnvioSRI
+from .signals import notificar_venta_registrada
 # from .models import DevolucionVenta, DetalleDevolucion  # Comentado temporalmente
 from productos.models import Producto, Categoria
+from productos.utils_duplicados import indice_nombres
 from clientes.models import Cliente
+from inventario.signals import notificar_stock_modificado
+from inventario.utils_movimientos import Movimiento, aplicar_en_ubicacion, aplicar_movimientos
+from .utils_busqueda import (
+    buscar_ids_facturas, buscar_ventas, facturas_por_id, listar_ventas,
+)
+from .utils_cargadores import precargar_detalles, precargar_facturas
+from .utils_cola_sri import FacturaYaEnviada, encolar_consulta, encolar_factura, estado_envio
+from .utils_sri import construir_documento_sri, obtener_configuracion_empresa
+from .utils_sucursal import (
+    clave_productos_offline, descontar_stock_venta, ubicacion_de_caja, ubicacion_de_recepcion, ubicacion_de_venta,
+)
 from django.db import connection
 from django.template.loader import render_to_string
 from django.conf import settings
@@ -54,83 +67,6 @@ def login_required_offline_safe(view_func):
     return wrapper
 
 
-def obtener_configuracion_empresa():
-    """Función centralizada para obtener configuración de la empresa"""
-    from usuarios.models import ConfiguracionEmpresa
-    
-    try:
-        empresa_config = ConfiguracionEmpresa.obtener_configuracion()
-        
-        if empresa_config:
-            return {
-                'ruc': empresa_config.ruc,
-                'razon_social': empresa_config.razon_social,
-                'nombre_comercial': empresa_config.nombre_comercial or empresa_config.razon_social,
-                'direccion_matriz': empresa_config.direccion_matriz,
-                'direccion_establecimiento': empresa_config.direccion_matriz,
-                'telefono': empresa_config.telefono or '',
-                'email': empresa_config.email or '',
-                'contribuyente_especial': empresa_config.contribuyente_especial or '',
-                'obligado_contabilidad': 'SI' if empresa_config.obligado_contabilidad else 'NO',
-                'activo': empresa_config.activo,
-                # Campos adicionales que se pueden configurar en el futuro
-                'codigo_establecimiento': '001',  # Por defecto
-                'codigo_punto_emision': '001',   # Por defecto
-                'ambiente': 'PRODUCCIÓN',        # Por defecto
-                'emision': 'NORMAL',            # Por defecto
-                'eslogan': 'Tu Bienestar, Nuestra Prioridad',  # Configurable en el futuro
-                'verificacion_url': 'https://srienlinea.sri.gob.ec/sri-en-linea/consulta/55',
-                'telefono_atencion': empresa_config.telefono or '000-0000',
-                'mensaje_final': f'{empresa_config.nombre_comercial or empresa_config.razon_social} TE ESPERA'
-            }
-        else:
-            # Si no hay configuración, devolver valores por defecto
-            return {
-                'ruc': '9999999999999',
-                'razon_social': 'EMPRESA NO CONFIGURADA',
-                'nombre_comercial': 'EMPRESA NO CONFIGURADA',
-                'direccion_matriz': 'DIRECCIÓN NO CONFIGURADA',
-                'direccion_establecimiento': 'DIRECCIÓN NO CONFIGURADA',
-                'telefono': '000-0000',
-                'email': '',
-                'contribuyente_especial': '',
-                'obligado_contabilidad': 'NO',
-                'activo': True,
-                'codigo_establecimiento': '001',
-                'codigo_punto_emision': '001',
-                'ambiente': 'PRODUCCIÓN',
-                'emision': 'NORMAL',
-                'eslogan': 'Configure su empresa en el sistema',
-                'verificacion_url': 'https://srienlinea.sri.gob.ec/sri-en-linea/consulta/55',
-                'telefono_atencion': '000-0000',
-                'mensaje_final': 'CONFIGURE SU EMPRESA'
-            }
-            
-    except Exception as e:
-        print(f"ERROR al obtener configuración de empresa: {str(e)}")
-        # Fallback a configuración por defecto en caso de error
-        return {
-            'ruc': '0915912604001',
-            'razon_social': 'FARMACIA FÉ Y SALUD',
-            'nombre_comercial': 'FARMACIA FÉ Y SALUD',
-            'direccion_matriz': 'GUAYAQUIL / FEBRES CORDERO / ORIENTE S/N Y 38 AVA',
-            'direccion_establecimiento': 'GUAYAQUIL / FEBRES CORDERO / ORIENTE S/N Y 38 AVA',
-            'telefono': '0981276460',
-            'email': '',
-            'contribuyente_especial': '',
-            'obligado_contabilidad': 'SI',
-            'activo': True,
-            'codigo_establecimiento': '001',
-            'codigo_punto_emision': '001',
-            'ambiente': 'PRODUCCIÓN',
-            'emision': 'NORMAL',
-            'eslogan': 'Tu Bienestar, Nuestra Prioridad',
-            'verificacion_url': 'https://srienlinea.sri.gob.ec/sri-en-linea/consulta/55',
-            'telefono_atencion': '0959711555',
-            'mensaje_final': 'FARMACIA FÉ Y SALUD TE ESPERA'
-        }
-
-
 # Sistema de Facturas Electrónicas
 @login_required
 def facturas_electronicas(request):
@@ -141,6 +77,13 @@ def facturas_electronicas(request):
     fecha_fin = request.GET.get('fecha_fin', timezone.now().date().strftime('%Y-%m-%d'))
     texto_busqueda = request.GET.get('busqueda', '')
     
+    # Rango sobre fechaEmision (usa su índice, a diferencia de DATE(fechaEmision))
+    try:
+        hasta = (datetime.strptime(fecha_fin, '%Y-%m-%d').date() + timedelta(days=1)).strftime('%Y-%m-%d')
+    except ValueError:
+        fecha_fin = timezone.now().date().strftime('%Y-%m-%d')
+        hasta = (timezone.now().date() + timedelta(days=1)).strftime('%Y-%m-%d')
+    
     # Consulta SQL siguiendo el patrón C#
     with connection.cursor() as cursor:
         sql = """
@@ -156,15 +99,22 @@ def facturas_electronicas(request):
             FROM facturas_venta fv
             JOIN clientes c ON fv.idCliente = c.id
             WHERE 
-                DATE(fv.fechaEmision) BETWEEN %s AND %s
-                AND (COALESCE(NULLIF(c.razonSocial,''), TRIM(CONCAT(IFNULL(c.nombres,''),' ',IFNULL(c.apellidos,'')))) LIKE %s 
-                     OR fv.numeroFactura LIKE %s 
-                     OR fv.numeroAutorizacion LIKE %s)
-            ORDER BY fv.fechaEmision DESC
+                fv.fechaEmision >= %s AND fv.fechaEmision < %s
         """
+        params = [fecha_inicio, hasta]
         
-        busqueda_param = f"%{texto_busqueda}%"
-        cursor.execute(sql, [fecha_inicio, fecha_fin, busqueda_param, busqueda_param, busqueda_param])
+        if texto_busqueda:
+            # Número de factura / autorización por los índices de búsqueda; cliente por nombre
+            condiciones = ["COALESCE(NULLIF(c.razonSocial,''), TRIM(CONCAT(IFNULL(c.nombres,''),' ',IFNULL(c.apellidos,'')))) LIKE %s"]
+            params.append(f"%{texto_busqueda}%")
+            ids = buscar_ids_facturas(texto_busqueda, limite=500)
+            if ids:
+                condiciones.append(f"fv.id IN ({', '.join(['%s'] * len(ids))})")
+                params.extend(ids)
+            sql += f" AND ({' OR '.join(condiciones)})"
+        
+        sql += " ORDER BY fv.fechaEmision DESC"
+        cursor.execute(sql, params)
         
         # Convertir resultados a diccionarios
         columns = [col[0] for col in cursor.description]
@@ -194,42 +144,13 @@ def buscar_facturas_por_numero(request):
         if not termino:
             return JsonResponse({'facturas': []})
         
-        # Lógica de búsqueda siguiendo el patrón C#
-        like = f"%{termino}%"
-        solo_digitos = ''.join(filter(str.isdigit, termino))
-        like_digits = f"%{solo_digitos}%"
+        # Número exacto, secuencial, sufijo, prefijo o autorización (ventas.utils_busqueda)
+        facturas = facturas_por_id(buscar_ids_facturas(termino))
         
-        with connection.cursor() as cursor:
-            sql = """
-                SELECT 
-                    fv.id AS Id,
-                    fv.numeroFactura AS Factura,
-                    fv.numeroAutorizacion AS Autorizacion,
-                    COALESCE(NULLIF(c.razonSocial,''), TRIM(CONCAT(IFNULL(c.nombres,''),' ',IFNULL(c.apellidos,'')))) AS Cliente,
-                    fv.total AS Total,
-                    fv.estado AS Estado,
-                    fv.numeroAutorizacion AS ClaveAcceso,
-                    fv.fechaEmision AS FechaEmision
-                FROM facturas_venta fv
-                JOIN clientes c ON fv.idCliente = c.id
-                WHERE 
-                    -- Coincidencia directa o por fragmento
-                    fv.numeroFactura LIKE %s
-                    OR fv.numeroAutorizacion LIKE %s
-                    -- Coincidencia por últimos dígitos ignorando guiones
-                    OR REPLACE(fv.numeroFactura, '-', '') LIKE %s
-                ORDER BY fv.fechaEmision DESC
-                LIMIT 50
-            """
-            
-            cursor.execute(sql, [like, like, like_digits])
-            columns = [col[0] for col in cursor.description]
-            facturas = [dict(zip(columns, row)) for row in cursor.fetchall()]
-            
-            # Formatear fechas para JSON
-            for factura in facturas:
-                if factura['FechaEmision']:
-                    factura['FechaEmision'] = factura['FechaEmision'].strftime('%d/%m/%Y %H:%M')
+        # Formatear fechas para JSON
+        for factura in facturas:
+            if factura['FechaEmision']:
+                factura['FechaEmision'] = factura['FechaEmision'].strftime('%d/%m/%Y %H:%M')
         
         return JsonResponse({'facturas': facturas})
     
@@ -311,31 +232,11 @@ def obtener_factura_por_numero(request):
     if not termino:
         return JsonResponse({'error': 'Término de búsqueda requerido'}, status=400)
     
-    like = f"%{termino}%"
-    solo_digitos = ''.join(filter(str.isdigit, termino))
-    like_digits = f"%{solo_digitos}%"
-    
-    # Buscar ID de la factura
-    with connection.cursor() as cursor:
-        sql_id = """
-            SELECT fv.id
-            FROM facturas_venta fv
-            WHERE 
-                fv.numeroFactura = %s
-                OR REPLACE(fv.numeroFactura, '-', '') = REPLACE(%s, '-', '')
-                OR fv.numeroFactura LIKE %s
-                OR REPLACE(fv.numeroFactura, '-', '') LIKE %s
-            ORDER BY fv.fechaEmision DESC
-            LIMIT 1
-        """
-        
-        cursor.execute(sql_id, [termino, termino, like, like_digits])
-        result = cursor.fetchone()
-        
-        if not result:
-            return JsonResponse({'error': 'Factura no encontrada'}, status=404)
-        
-        factura_id = result[0]
+    # Buscar ID de la factura (la coincidencia más exacta y reciente)
+    ids = buscar_ids_facturas(termino, limite=1)
+    if not ids:
+        return JsonResponse({'error': 'Factura no encontrada'}, status=404)
+    factura_id = ids[0]
     
     # Usar la función de detalle existente
     return obtener_factura_detalle(request, factura_id)
@@ -350,8 +251,14 @@ def detalle_factura_electronica(request, pk):
     detalles = factura.detalles.select_related('producto').all()
     pagos = factura.pagos.all()
     
+    # El envío al SRI es de la factura de facturas_venta con el mismo número
+    factura_venta_id = FacturaVenta.objects.filter(
+        numeroFactura=factura.numero_factura
+    ).values_list('idFactura', flat=True).first()
+    
     context = {
         'factura': factura,
+        'factura_venta_id': factura_venta_id,
         'detalles': detalles,
         'pagos': pagos,
         'titulo': 'FACTURA ELECTRONICA',
@@ -375,15 +282,16 @@ def anular_factura_electronica(request, pk):
             messages.error(request, 'Esta factura ya está anulada')
             return redirect('ventas:facturas_electronicas')
         
-        # Restaurar stock de productos
-        for detalle in factura.detalles.all():
-            producto = detalle.producto
-            producto.stock += detalle.cantidad
-            producto.save()
-        
-        # Anular factura
-        factura.estado = 'anulada'
-        factura.save()
+        with transaction.atomic():
+            # Restaurar stock de productos
+            aplicar_movimientos([
+                Movimiento(producto_id, cantidad, 'ANULACIÓN VENTA', f'Anulación factura {factura.numero_factura}')
+                for producto_id, cantidad in factura.detalles.values_list('producto_id', 'cantidad')
+            ], sender=Venta)
+            
+            # Anular factura
+            factura.estado = 'anulada'
+            factura.save()
         
         messages.success(request, f'Factura {factura.numero_factura} anulada exitosamente')
         return redirect('ventas:facturas_electronicas')
@@ -396,15 +304,35 @@ def anular_factura_electronica(request, pk):
 
 
 @login_required
+@require_http_methods(["POST"])
 def reenviar_al_sri(request, pk):
-    """Reenviar factura al SRI (simulado)"""
-    factura = get_object_or_404(Venta, pk=pk)
+    """Encolar el envío de la factura (facturas_venta) al SRI (lo hace el comando procesar_envios_sri)"""
+    factura = get_object_or_404(FacturaVenta, idFactura=pk)
+    es_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
     
-    # Simular reenvío al SRI
-    messages.success(request, f'Factura {factura.numero_factura} reenviada al SRI exitosamente')
+    try:
+        envio = encolar_factura(factura.idFactura, request.user)
+    except FacturaYaEnviada:
+        mensaje = f'La factura {factura.numeroFactura} ya fue enviada al SRI'
+        if es_ajax:
+            return JsonResponse({'success': False, 'error': mensaje}, status=409)
+        messages.warning(request, mensaje)
+        return redirect('ventas:facturas_electronicas')
+    
+    if es_ajax:
+        return JsonResponse(estado_envio(envio), status=202)
+    
+    messages.success(request, f'Factura {factura.numeroFactura} en cola de envío al SRI')
     return redirect('ventas:facturas_electronicas')
 
 
+@login_required
+def estado_envio_sri(request, envio_id):
+    """Estado de un envío al SRI (factura o consulta de clave de acceso) para la página que lo espera"""
+    envio = get_object_or_404(EnvioSRI, pk=envio_id)
+    return JsonResponse(estado_envio(envio))
+
+
 @login_required
 def exportar_facturas(request):
     """Exportar facturas a Excel/PDF"""
@@ -527,126 +455,18 @@ def procesar_xml_factura(request):
 
 @login_required  
 def consultar_clave_acceso(request):
-    """Consultar factura por clave de acceso desde API externa"""
+    """Consultar factura por clave de acceso desde API externa (encola la consulta)"""
     if request.method == 'POST':
         try:
-            import json
-            import requests
-            import xml.etree.ElementTree as ET
-            
             data = json.loads(request.body)
             clave_acceso = data.get('clave_acceso', '').strip()
             
-            if not clave_acceso or len(clave_acceso) != 49:
+            if len(clave_acceso) != 49 or not clave_acceso.isdigit():
                 return JsonResponse({'success': False, 'error': 'Clave de acceso debe tener 49 dígitos'})
             
-            # Consultar API externa
-            api_url = f'http://127.0.0.1:5001/api/consulta_sri/{clave_acceso}'
-            
-            try:
-                response = requests.get(api_url, timeout=30)
-                response.raise_for_status()
-                api_data = response.json()
-            except requests.exceptions.Timeout:
-                return JsonResponse({'success': False, 'error': 'Timeout al consultar el SRI. Intente nuevamente.'})
-            except requests.exceptions.ConnectionError:
-                return JsonResponse({'success': False, 'error': 'No se pudo conectar al servicio de consulta SRI. Verifique que esté ejecutándose.'})
-            except requests.exceptions.RequestException as e:
-                return JsonResponse({'success': False, 'error': f'Error al consultar API: {str(e)}'})
-            
-            # Verificar estado de la autorización
-            if api_data.get('estado') != 'AUTORIZADO':
-                return JsonResponse({
-                    'success': False, 
-                    'error': f'Factura no autorizada. Estado: {api_data.get("estado", "DESCONOCIDO")}'
-                })
-            
-            # Extraer XML del comprobante
-            xml_content = api_data.get('comprobanteXml', '')
-            if not xml_content:
-                return JsonResponse({'success': False, 'error': 'No se recibió XML del comprobante'})
-            
-            # Parsear XML
-            try:
-                root = ET.fromstring(xml_content)
-            except ET.ParseError:
-                return JsonResponse({'success': False, 'error': 'Error al parsear XML del comprobante'})
-            
-            # Extraer información del emisor (proveedor)
-            info_tributaria = root.find('infoTributaria')
-            if info_tributaria is None:
-                return JsonResponse({'success': False, 'error': 'XML sin información tributaria'})
-            
-            proveedor = {
-                'ruc': info_tributaria.findtext('ruc', ''),
-                'razon_social': info_tributaria.findtext('razonSocial', ''),
-                'nombre_comercial': info_tributaria.findtext('nombreComercial', '')
-            }
-            
-            # Extraer información de la factura
-            info_factura = root.find('infoFactura')
-            total_factura = 0.0
-            if info_factura is not None:
-                total_factura = float(info_factura.findtext('importeTotal', '0'))
-            
-            factura_info = {
-                'numero': f"{info_tributaria.findtext('estab', '001')}-{info_tributaria.findtext('ptoEmi', '001')}-{info_tributaria.findtext('secuencial', '000000000')}",
-                'fecha': info_factura.findtext('fechaEmision', '') if info_factura is not None else '',
-                'autorizacion': api_data.get('numeroAutorizacion', clave_acceso),
-                'fecha_autorizacion': api_data.get('fechaAutorizacion', ''),
-                'total': total_factura
-            }
-            
-            # Extraer productos del XML
-            productos = []
-            detalles = root.find('detalles')
-            
-            if detalles is not None:
-                for detalle in detalles.findall('detalle'):
-                    codigo = detalle.findtext('codigoPrincipal', '')
-                    descripcion = detalle.findtext('descripcion', '')
-                    cantidad = float(detalle.findtext('cantidad', '0'))
-                    precio_unitario = float(detalle.findtext('precioUnitario', '0'))
-                    descuento = float(detalle.findtext('descuento', '0'))
-                    subtotal = float(detalle.findtext('precioTotalSinImpuesto', '0'))
-                    
-                    # Extraer IVA del producto
-                    iva_valor = 0.0
-                    impuestos = detalle.find('impuestos')
-                    if impuestos is not None:
-                        for impuesto in impuestos.findall('impuesto'):
-                            codigo_impuesto = impuesto.findtext('codigo', '')
-                            if codigo_impuesto == '2':  # Código 2 = IVA
-                                iva_valor = float(impuesto.findtext('valor', '0'))
-                                break
-                    
-                    total = subtotal + iva_valor
-                    
-                    producto = {
-                        'codigo': codigo,
-                        'descripcion': descripcion,
-                        'cantidad': cantidad,
-                        'precio_unitario': precio_unitario,
-                        'descuento': descuento,
-                        'subtotal': subtotal,
-                        'iva': iva_valor,
-                        'total': total
-                    }
-                    
-                    productos.append(producto)
-            
-            if not productos:
-                return JsonResponse({'success': False, 'error': 'No se encontraron productos en la factura'})
-            
-            return JsonResponse({
-                'success': True,
-                'productos': productos,
-                'proveedor': proveedor,
-                'factura_info': factura_info,
-                'total_factura': total_factura,
-                'mensaje': f'Factura consultada exitosamente. Se encontraron {len(productos)} producto(s).',
-                'resumen_sri': api_data.get('resumen', {})
-            })
+            # La consulta al SRI se hace fuera de la petición: la página consulta el estado
+            envio = encolar_consulta(clave_acceso, request.user)
+            return JsonResponse(estado_envio(envio), status=202)
             
         except json.JSONDecodeError:
             return JsonResponse({'success': False, 'error': 'Error en formato de datos'})
@@ -701,6 +521,12 @@ def procesar_ingreso_productos(request):
             productos_actualizados = 0
             codigos_vinculados = 0
             productos_ubicados = 0
+            productos_afectados = []
+            # Ingresos de productos existentes: se aplican juntos al final (un UPDATE atómico).
+            # Con stock por sucursal suman también a la ubicación que recibe
+            ubicacion_ingreso = ubicacion_de_recepcion(request.user, data.get('ubicacion_id'))
+            ingresos = []
+            detalle_ingreso = f"Ingreso de productos - Proveedor {proveedor_data.get('ruc') or 'sin RUC'}"
             
             for producto_data in productos_seleccionados:
                 codigo = producto_data.get('codigo', '')
@@ -718,9 +544,9 @@ def procesar_ingreso_productos(request):
                 
                 if es_existente and producto_id:
                     # Producto vinculado a uno existente - actualizar stock
-                    with connection.cursor() as cursor:
-                        cursor.execute("UPDATE productos SET stock = stock + %s WHERE id = %s", [cantidad, producto_id])
+                    ingresos.append(Movimiento(int(producto_id), cantidad, 'COMPRA', detalle_ingreso))
                     productos_actualizados += 1
+                    productos_afectados.append(producto_id)
                     
                     # Vincular código alternativo si se marcó
                     if codigo_vinculado and codigo:
@@ -744,7 +570,7 @@ def procesar_ingreso_productos(request):
                         
                         if producto_existente:
                             # Ya existe - actualizar stock
-                            cursor.execute("UPDATE productos SET stock = stock + %s WHERE id = %s", [cantidad, producto_existente[0]])
+                            ingresos.append(Movimiento(producto_existente[0], cantidad, 'COMPRA', detalle_ingreso))
                             productos_actualizados += 1
                             producto_id = producto_existente[0]
                         else:
@@ -770,16 +596,31 @@ def procesar_ingreso_productos(request):
                                 fecha_caducidad if fecha_caducidad else None,
                                 costo_unidad,
                                 precio_venta,
-                                cantidad
+                                cantidad if ubicacion_ingreso is None else 0
                             ])
                             producto_id = cursor.lastrowid
                             productos_creados += 1
+                            # El INSERT directo no emite post_save: avisar al índice de nombres
+                            indice_nombres.actualizar(producto_id)
+                            if ubicacion_ingreso is not None:
+                                # El stock inicial entra por la sucursal (y el total) con su kardex
+                                ingresos.append(Movimiento(producto_id, cantidad, 'COMPRA', detalle_ingreso))
+                        
+                        productos_afectados.append(producto_id)
                         
                         # Ubicar producto si se proporcionó percha
                         if percha_id and producto_id:
                             ubicar_producto_en_percha(producto_id, percha_id, cantidad)
                             productos_ubicados += 1
             
+            saldos_ubicacion = None
+            if ubicacion_ingreso is None:
+                aplicar_movimientos(ingresos, notificar=False)
+            else:
+                saldos_ubicacion, _ = aplicar_en_ubicacion(
+                    ingresos, ubicacion_ingreso, usuario=request.user, notificar=False,
+                )
+            
             # Construir mensaje de respuesta
             mensaje_partes = []
             if productos_creados > 0:
@@ -793,6 +634,13 @@ def procesar_ingreso_productos(request):
             
             mensaje = f"Ingreso procesado exitosamente. {', '.join(mensaje_partes)}." if mensaje_partes else "No se procesaron productos."
             
+            notificar_stock_modificado(sender=Producto, producto_ids=productos_afectados)
+            if saldos_ubicacion:
+                notificar_stock_modificado(
+                    sender=Producto, producto_ids=list(saldos_ubicacion),
+                    ubicacion_id=ubicacion_ingreso, saldos=saldos_ubicacion,
+                )
+            
             return JsonResponse({
                 'success': True,
                 'mensaje': mensaje,
@@ -883,119 +731,24 @@ def lista_ventas(request):
     elif not fecha_fin:
         fecha_fin = timezone.now().date().strftime('%Y-%m-%d')
     
-    # Consulta SQL siguiendo el patrón C# - Priorizar facturas_venta
-    with connection.cursor() as cursor:
-        # Si hay búsqueda, hacer la consulta más permisiva con las fechas
-        if texto_busqueda:
-            # Buscar principalmente en facturas_venta, luego en ventas_venta como respaldo
-            sql = """
-                (SELECT 
-                    fv.id AS Id,
-                    fv.numeroFactura AS NumeroVenta,
-                    COALESCE(NULLIF(c.razonSocial,''), TRIM(CONCAT(IFNULL(c.nombres,''),' ',IFNULL(c.apellidos,'')))) AS Cliente,
-                    fv.total AS Total,
-                    fv.estado AS Estado,
-                    fv.fechaEmision AS FechaVenta,
-                    'ELECTRONICO' AS MetodoPago,
-                    CONCAT(IFNULL(u.first_name,''),' ',IFNULL(u.last_name,'')) AS Vendedor,
-                    'FACTURA' AS TipoDocumento
-                FROM facturas_venta fv
-                LEFT JOIN clientes c ON fv.idCliente = c.id
-                LEFT JOIN auth_user u ON fv.idUsuario = u.id
-                WHERE 
-                    (COALESCE(NULLIF(c.razonSocial,''), TRIM(CONCAT(IFNULL(c.nombres,''),' ',IFNULL(c.apellidos,'')))) LIKE %s 
-                     OR fv.numeroFactura LIKE %s 
-                     OR CONCAT(IFNULL(u.first_name,''),' ',IFNULL(u.last_name,'')) LIKE %s))
-                
-                UNION ALL
-                
-                (SELECT 
-                    v.id AS Id,
-                    v.numero_factura AS NumeroVenta,
-                    COALESCE(NULLIF(c.razonSocial,''), TRIM(CONCAT(IFNULL(c.nombres,''),' ',IFNULL(c.apellidos,'')))) AS Cliente,
-                    v.total AS Total,
-                    v.estado AS Estado,
-                    v.fecha AS FechaVenta,
-                    v.tipo_pago AS MetodoPago,
-                    CONCAT(IFNULL(u.first_name,''),' ',IFNULL(u.last_name,'')) AS Vendedor,
-                    'VENTA' AS TipoDocumento
-                FROM ventas_venta v
-                LEFT JOIN clientes c ON v.cliente_id = c.id
-                LEFT JOIN auth_user u ON v.vendedor_id = u.id
-                WHERE 
-                    (COALESCE(NULLIF(c.razonSocial,''), TRIM(CONCAT(IFNULL(c.nombres,''),' ',IFNULL(c.apellidos,'')))) LIKE %s 
-                     OR v.numero_factura LIKE %s 
-                     OR CONCAT(IFNULL(u.first_name,''),' ',IFNULL(u.last_name,'')) LIKE %s))
-                
-                ORDER BY FechaVenta DESC, Id DESC
-                LIMIT 100
-            """
-            
-            busqueda_param = f'%{texto_busqueda}%'
-            
-            cursor.execute(sql, [
-                busqueda_param, busqueda_param, busqueda_param,  # Para facturas_venta
-                busqueda_param, busqueda_param, busqueda_param   # Para ventas_venta
-            ])
-        else:
-            # Sin búsqueda, aplicar filtros de fecha normalmente - priorizar facturas_venta
-            sql = """
-                (SELECT 
-                    fv.id AS Id,
-                    fv.numeroFactura AS NumeroVenta,
-                    COALESCE(NULLIF(c.razonSocial,''), TRIM(CONCAT(IFNULL(c.nombres,''),' ',IFNULL(c.apellidos,'')))) AS Cliente,
-                    fv.total AS Total,
-                    fv.estado AS Estado,
-                    fv.fechaEmision AS FechaVenta,
-                    'ELECTRONICO' AS MetodoPago,
-                    CONCAT(IFNULL(u.first_name,''),' ',IFNULL(u.last_name,'')) AS Vendedor,
-                    'FACTURA' AS TipoDocumento
-                FROM facturas_venta fv
-                LEFT JOIN clientes c ON fv.idCliente = c.id
-                LEFT JOIN auth_user u ON fv.idUsuario = u.id
-                WHERE 
-                    DATE(fv.fechaEmision) BETWEEN %s AND %s)
-                
-                UNION ALL
-                
-                (SELECT 
-                    v.id AS Id,
-                    v.numero_factura AS NumeroVenta,
-                    COALESCE(NULLIF(c.razonSocial,''), TRIM(CONCAT(IFNULL(c.nombres,''),' ',IFNULL(c.apellidos,'')))) AS Cliente,
-                    v.total AS Total,
-                    v.estado AS Estado,
-                    v.fecha AS FechaVenta,
-                    v.tipo_pago AS MetodoPago,
-                    CONCAT(IFNULL(u.first_name,''),' ',IFNULL(u.last_name,'')) AS Vendedor,
-                    'VENTA' AS TipoDocumento
-                FROM ventas_venta v
-                LEFT JOIN clientes c ON v.cliente_id = c.id
-                LEFT JOIN auth_user u ON v.vendedor_id = u.id
-                WHERE 
-                    DATE(v.fecha) BETWEEN %s AND %s)
-                
-                ORDER BY FechaVenta DESC, Id DESC
-                LIMIT 100
-            """
-            
-            cursor.execute(sql, [fecha_inicio, fecha_fin, fecha_inicio, fecha_fin])
-        
-        ventas = cursor.fetchall()
-        
-        # Convertir a lista de diccionarios
-        ventas_list = []
-        for venta in ventas:
-            ventas_list.append({
-                'Id': venta[0],
-                'NumeroVenta': venta[1],
-                'Cliente': venta[2] or 'Sin cliente',
-                'Total': venta[3],
-                'Estado': venta[4],
-                'FechaVenta': venta[5],
-                'MetodoPago': venta[6],
-                'Vendedor': venta[7] or 'Sin vendedor',
-                'TipoDocumento': venta[8] if len(venta) > 8 else 'VENTA'  # Para manejar ambos casos
-            })
+    # Proyección de búsqueda (ventas_busqueda): facturas_venta y ventas_venta en una consulta indexada
+    if texto_busqueda:
+        # Con búsqueda se ignoran las fechas
+        ventas = buscar_ventas(texto_busqueda)
+    else:
+        try:
+            ventas = listar_ventas(
+                datetime.strptime(fecha_inicio, '%Y-%m-%d').date(), datetime.strptime(fecha_fin, '%Y-%m-%d').date()
+            )
+        except ValueError:
+            messages.error(request, 'Las fechas deben tener el formato AAAA-MM-DD')
+            ventas = []
+    
+    ventas_list = []
+    for venta in ventas:
+        venta['Cliente'] = venta['Cliente'] or 'Sin cliente'
+        venta['Vendedor'] = venta['Vendedor'] or 'Sin vendedor'
+        ventas_list.append(venta)
     
     context = {
         'ventas': ventas_list,
@@ -1007,6 +760,22 @@ def lista_ventas(request):
     return render(request, 'ventas/lista_ventas_new.html', context)
 
 
+def _sql_stock_pos(ubicacion_id):
+    """
+    Fragmentos SQL del stock que muestra el POS.
+
+    Returns:
+        (expresión de stock, JOIN adicional, parámetros del JOIN): con
+        ubicacion_id el stock es el de la sucursal (StockUbicacion), si no
+        productos.stock
+    """
+    if ubicacion_id is None:
+        return 'p.stock', '', []
+    join = ("INNER JOIN inventario_stockubicacion su "
+            "ON su.producto_id = p.id AND su.ubicacion_id = %s")
+    return 'su.cantidad', join, [ubicacion_id]
+
+
 @login_required_offline_safe
 def nueva_venta(request):
     """Crear nueva venta - Interfaz POS con soporte offline"""
@@ -1017,6 +786,8 @@ def nueva_venta(request):
     clientes_list = []
     productos_list = []
     categorias_list = []
+    # Sucursal de la caja (VENTAS_STOCK_POR_UBICACION); en modo offline la última conocida
+    ubicacion_id = request.session.get('ubicacion_offline')
     
     try:
         # Importar modelos solo cuando se necesiten
@@ -1026,7 +797,7 @@ def nueva_venta(request):
         
         # Verificar si hay caja abierta
         try:
-            caja_abierta_data = CierreCaja.obtener_caja_abierta()
+            caja_abierta_data = CierreCaja.obtener_caja_abierta(request.user)
             
             if not caja_abierta_data:
                 messages.warning(request, 'Debe abrir una caja antes de realizar ventas')
@@ -1055,23 +826,28 @@ def nueva_venta(request):
             try:
                 clientes_list = list(Cliente.objects.filter(estado=True, anulado=False).values('id', 'nombres', 'apellidos', 'cedula_ruc'))
                 
+                ubicacion_id = ubicacion_de_caja(caja_abierta_data)
+                request.session['ubicacion_offline'] = ubicacion_id
+                stock_sql, join_stock, params = _sql_stock_pos(ubicacion_id)
+                
                 # Cargar productos con información de ubicación usando SQL directo
                 from django.db import connection
                 with connection.cursor() as cursor:
-                    cursor.execute("""
+                    cursor.execute(f"""
                         SELECT p.id, p.codigoPrincipal, p.nombre, 
                                CAST(p.precioVenta AS DECIMAL(10,2)) as precioVenta, 
-                               CAST(p.stock AS DECIMAL(10,2)) as stock,
+                               CAST({stock_sql} AS DECIMAL(10,2)) as stock,
                                p.idCategoria, p.activo,
                                u.fila, u.columna, pr.nombre as percha_nombre, 
                                s.nombre as seccion_nombre, s.color as seccion_color
                         FROM productos p
+                        {join_stock}
                         LEFT JOIN productos_ubicacionproducto u ON p.id = u.producto_id AND u.activo = 1
                         LEFT JOIN productos_percha pr ON u.percha_id = pr.id
                         LEFT JOIN productos_seccion s ON pr.seccion_id = s.id
-                        WHERE p.activo = 1 AND p.stock > 0
+                        WHERE p.activo = 1 AND {stock_sql} > 0
                         ORDER BY p.nombre
-                    """)
+                    """, params)
                     
                     columns = [col[0] for col in cursor.description]
                     todos_productos = []
@@ -1101,7 +877,7 @@ def nueva_venta(request):
                 
                 # Guardar TODOS en cache para uso offline
                 from django.core.cache import cache
-                cache.set('productos_offline', todos_productos, timeout=None)  # Guardar todos
+                cache.set(clave_productos_offline(ubicacion_id), todos_productos, timeout=None)  # Guardar todos
                 cache.set('clientes_offline', clientes_list, timeout=None)
                 cache.set('categorias_offline', categorias_list, timeout=None)
                 
@@ -1128,7 +904,7 @@ def nueva_venta(request):
         
         # Intentar cargar productos desde cache si existe
         from django.core.cache import cache
-        productos_cache = cache.get('productos_offline', [])
+        productos_cache = cache.get(clave_productos_offline(ubicacion_id), [])
         clientes_cache = cache.get('clientes_offline', [])
         categorias_cache = cache.get('categorias_offline', [])
         
@@ -1173,88 +949,7 @@ def nueva_venta(request):
 
 def generar_json_facturacion_electronica_real(factura_venta):
     """Generar JSON para facturación electrónica del SRI usando FacturaVenta"""
-    # Obtener configuración de la empresa desde la tabla empresas
-    EMPRESA_CONFIG = obtener_configuracion_empresa()
-    
-    # Obtener secuencial de la factura
-    secuencial = str(factura_venta.idFactura).zfill(9)  # Padding con ceros a la izquierda
-    
-    # Obtener datos del cliente
-    cliente = factura_venta.cliente
-    
-    # Construir JSON según especificación SRI
-    json_factura = {
-        "empresaRuc": EMPRESA_CONFIG['ruc'],
-        "ambiente": 1,  # 1 = Pruebas, 2 = Producción
-        "tipoComprobante": "01",  # 01 = Factura
-        "infoTributaria": {
-            "estab": EMPRESA_CONFIG['codigo_establecimiento'],
-            "ptoEmi": EMPRESA_CONFIG['codigo_punto_emision'],
-            "secuencial": secuencial,
-            "dirMatriz": EMPRESA_CONFIG['direccion_matriz']
-        },
-        "infoFactura": {
-            "fechaEmision": factura_venta.fechaEmision.strftime("%d/%m/%Y"),
-            "dirEstablecimiento": EMPRESA_CONFIG['direccion_establecimiento'],
-            "obligadoContabilidad": EMPRESA_CONFIG['obligado_contabilidad'],
-            "tipoIdentificacionComprador": "05",  # 05 = Cédula
-            "razonSocialComprador": cliente.nombre_completo if cliente else "CONSUMIDOR FINAL",
-            "identificacionComprador": cliente.cedula_ruc if cliente and cliente.cedula_ruc else "9999999999999",
-            "direccionComprador": cliente.direccion if cliente and cliente.direccion else "GUAYAQUIL",
-            "totalSinImpuestos": float(factura_venta.subtotal),
-            "totalDescuento": float(factura_venta.descuento) if factura_venta.descuento else 0.00,
-            "totalConImpuestos": [
-                {
-                    "codigo": "2",  # Código IVA
-                    "codigoPorcentaje": "2",  # 15% IVA
-                    "baseImponible": float(factura_venta.subtotal),
-                    "valor": float(factura_venta.iva)
-                }
-            ] if factura_venta.iva > 0 else [],
-            "propina": 0.00,
-            "importeTotal": float(factura_venta.total),
-            "moneda": "DOLAR"
-        },
-        "detalles": []
-    }
-    
-    # Agregar detalles de productos
-    detalles = FacturaVentaDetalle.objects.filter(idFacturaVenta=factura_venta.idFactura)
-    
-    for detalle in detalles:
-        cantidad = float(detalle.cantidad)
-        precio_unitario = float(detalle.precioUnitario)
-        descuento_detalle = float(detalle.descuentoValor) if detalle.descuentoValor else 0.00
-        precio_total_sin_impuesto = cantidad * precio_unitario - descuento_detalle
-        
-        # Obtener información del producto
-        try:
-            producto = Producto.objects.get(id=detalle.idProducto)
-            codigo_principal = producto.codigo_principal
-        except Producto.DoesNotExist:
-            codigo_principal = f"PROD-{detalle.idProducto}"
-        
-        detalle_json = {
-            "codigoPrincipal": codigo_principal,
-            "descripcion": detalle.productoNombre,
-            "cantidad": cantidad,
-            "precioUnitario": precio_unitario,
-            "descuento": descuento_detalle,
-            "precioTotalSinImpuesto": precio_total_sin_impuesto,
-            "impuestos": [
-                {
-                    "codigo": "2",  # Código IVA
-                    "codigoPorcentaje": "2",  # 15% IVA
-                    "tarifa": 15.00,
-                    "baseImponible": precio_total_sin_impuesto,
-                    "valor": float(detalle.ivaValor)
-                }
-            ] if detalle.ivaValor > 0 else []
-        }
-        
-        json_factura["detalles"].append(detalle_json)
-    
-    return json_factura
+    return construir_documento_sri(factura_venta.idFactura)
 
 
 def generar_json_facturacion_electronica(venta):
@@ -1396,7 +1091,7 @@ def crear_ajax(request):
         
         # Verificar caja abierta usando función centralizada
         from caja.models import CierreCaja
-        caja_abierta_data = CierreCaja.obtener_caja_abierta()
+        caja_abierta_data = CierreCaja.obtener_caja_abierta(request.user)
         
         if not caja_abierta_data:
             return JsonResponse({'success': False, 'error': 'No hay caja abierta'})
@@ -1404,6 +1099,11 @@ def crear_ajax(request):
         # Convertir a formato que espera el código existente
         caja_abierta = (caja_abierta_data['id'], caja_abierta_data['idCaja'])
         
+        # Sucursal de la caja: lotes FEFO y, con VENTAS_STOCK_POR_UBICACION, el stock
+        from caja.models import Caja
+        ubicacion_id = Caja.obtener_ubicacion_id(caja_abierta[1])
+        ubicacion_stock = ubicacion_de_caja(caja_abierta_data)
+        
         with transaction.atomic():
             # --- 1. Calcular totales ---
             subtotal = Decimal('0.00')
@@ -1416,8 +1116,8 @@ def crear_ajax(request):
                 cantidad = Decimal(str(item['cantidad']))
                 precio_unitario = Decimal(str(item['precio_unitario']))
                 
-                # Verificar stock
-                if producto.stock < cantidad:
+                # Verificar stock global; el de la sucursal lo valida descontar_stock_venta
+                if ubicacion_stock is None and producto.stock < cantidad:
                     raise ValueError(f'Stock insuficiente para el producto "{producto.nombre}". Stock disponible: {producto.stock}, solicitado: {cantidad}')
                 
                 # Calcular valores del producto
@@ -1478,7 +1178,14 @@ def crear_ajax(request):
                 cursor.execute("SELECT LAST_INSERT_ID()")
                 id_factura_venta = cursor.fetchone()[0]
             
-            # --- 3. Insertar cada producto en el detalle (facturas_venta_detalle) ---
+            # --- 3. Descontar de los lotes de la sucursal en orden FEFO (un UPDATE por ticket) ---
+            from inventario.utils_lotes import asignador_lotes
+            asignacion_lotes = asignador_lotes.asignar(
+                ubicacion_id,
+                [(p['producto'].id, p['cantidad']) for p in productos_procesados]
+            )
+            
+            # --- 4. Insertar cada producto en el detalle (facturas_venta_detalle) ---
             for prod_data in productos_procesados:
                 producto = prod_data['producto']
                 
@@ -1500,50 +1207,48 @@ def crear_ajax(request):
                         float(prod_data['total']),            # total
                         producto.nombre                        # productoNombre
                     ])
-                
-                # Obtener stock actual
-                with connection.cursor() as cursor:
-                    cursor.execute("SELECT stock FROM productos WHERE id = %s", [producto.id])
-                    saldo_actual = Decimal(str(cursor.fetchone()[0]))
-                
-                nuevo_saldo = saldo_actual - prod_data['cantidad']
-                
-                # --- 4. INSERTAR EL MOVIMIENTO EN EL KARDEX ---
-                with connection.cursor() as cursor:
-                    sql_kardex = """
-                        INSERT INTO kardex_movimientos 
-                        (idProducto, tipoMovimiento, detalle, egreso, saldo)
-                        VALUES 
-                        (%s, 'VENTA', %s, %s, %s)
-                    """
-                    
-                    cursor.execute(sql_kardex, [
-                        producto.id,                           # idProducto
-                        f"Factura Venta N° {numero_factura}",  # detalle
-                        float(prod_data['cantidad']),         # egreso
-                        float(nuevo_saldo)                     # saldo
-                    ])
-                
-                # --- 5. ACTUALIZAR EL STOCK EN LA TABLA DE PRODUCTOS ---
-                with connection.cursor() as cursor:
-                    cursor.execute("UPDATE productos SET stock = %s WHERE id = %s", [
-                        float(nuevo_saldo),
-                        producto.id
-                    ])
             
-            # Crear objeto venta para generar JSON (usar FacturaVenta)
-            factura_venta = FacturaVenta.objects.get(idFactura=id_factura_venta)
+            # --- 5. Descontar el stock y registrar el kardex (un UPDATE atómico por ticket) ---
+            # La verificación de stock de arriba puede quedar desactualizada por una
+            # venta simultánea: el servicio rechaza el ticket si algún saldo queda negativo.
+            # venta_registrada (abajo) ya invalida alertas y cachés
+            saldos = descontar_stock_venta(
+                [(p['producto'].id, p['cantidad']) for p in productos_procesados],
+                ubicacion_stock,
+                request.user,
+                f"Factura Venta N° {numero_factura}",
+            )
             
-            # Generar JSON para facturación electrónica
-            json_facturacion = generar_json_facturacion_electronica_real(factura_venta)
+            # Notificar la venta (dashboard, alertas de stock) al confirmar la transacción
+            notificar_venta_registrada(
+                sender=FacturaVenta,
+                factura_id=id_factura_venta,
+                producto_ids=[p['producto'].id for p in productos_procesados],
+                ubicacion_id=ubicacion_id,
+                saldos=saldos,
+            )
             
-            return JsonResponse({
-                'success': True, 
-                'numero_venta': numero_factura,
-                'total': float(total_final),
-                'json_facturacion': json_facturacion,
-                'venta_id': id_factura_venta
-            })
+        # JSON para facturación electrónica, ya fuera de la transacción: las filas
+        # de productos que bloqueó el descuento del total se liberan con el commit.
+        # La venta ya quedó guardada; si el JSON falla se obtiene luego desde
+        # ventas:json_facturacion
+        try:
+            json_facturacion = construir_documento_sri(id_factura_venta)
+        except Exception as e:
+            print(f"ERROR generando JSON de facturación de {numero_factura}: {str(e)}")
+            json_facturacion = None
+        
+        return JsonResponse({
+            'success': True, 
+            'numero_venta': numero_factura,
+            'total': float(total_final),
+            'json_facturacion': json_facturacion,
+            'venta_id': id_factura_venta,
+            'lotes_asignados': [
+                {'producto_id': pid, 'lote_id': lote_id, 'cantidad': float(cantidad)}
+                for pid, lote_id, cantidad in asignacion_lotes['asignaciones']
+            ]
+        })
             
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)})
@@ -1617,13 +1322,16 @@ def buscar_producto(request):
         search = request.GET.get('search', '')
         print(f"Término de búsqueda: '{search}'")
         
+        # Stock de la sucursal de la caja (VENTAS_STOCK_POR_UBICACION) o global
+        stock_sql, join_stock, params = _sql_stock_pos(ubicacion_de_venta(request.user))
+        
         # Consulta SQL que incluye información de ubicación
         with connection.cursor() as cursor:
             if not search or search.strip() == '':
                 print("Búsqueda vacía, devolviendo productos iniciales")
-                sql = """
+                sql = f"""
                     SELECT 
-                        p.id, p.codigoPrincipal, p.nombre, p.precioVenta, p.stock,
+                        p.id, p.codigoPrincipal, p.nombre, p.precioVenta, {stock_sql} as stock,
                         c.nombre as categoria,
                         CASE WHEN u.id IS NOT NULL 
                              THEN CONCAT(s.nombre, ' - ', pr.nombre, ' (F', u.fila, 'C', u.columna, ')')
@@ -1635,20 +1343,21 @@ def buscar_producto(request):
                         END as codigo_ubicacion,
                         s.color as color_seccion
                     FROM productos p
+                    {join_stock}
                     LEFT JOIN categorias c ON p.idCategoria = c.id
                     LEFT JOIN productos_ubicacionproducto u ON p.id = u.producto_id AND u.activo = 1
                     LEFT JOIN productos_percha pr ON u.percha_id = pr.id AND pr.activo = 1
                     LEFT JOIN productos_seccion s ON pr.seccion_id = s.id AND s.activo = 1
-                    WHERE p.activo = 1 AND p.anulado = 0 AND p.stock > 0
+                    WHERE p.activo = 1 AND p.anulado = 0 AND {stock_sql} > 0
                     ORDER BY p.nombre
                     LIMIT 20
                 """
-                cursor.execute(sql)
+                cursor.execute(sql, params)
             else:
                 # Búsqueda con término específico
-                sql = """
+                sql = f"""
                     SELECT 
-                        p.id, p.codigoPrincipal, p.nombre, p.precioVenta, p.stock,
+                        p.id, p.codigoPrincipal, p.nombre, p.precioVenta, {stock_sql} as stock,
                         c.nombre as categoria,
                         CASE WHEN u.id IS NOT NULL 
                              THEN CONCAT(s.nombre, ' - ', pr.nombre, ' (F', u.fila, 'C', u.columna, ')')
@@ -1660,17 +1369,18 @@ def buscar_producto(request):
                         END as codigo_ubicacion,
                         s.color as color_seccion
                     FROM productos p
+                    {join_stock}
                     LEFT JOIN categorias c ON p.idCategoria = c.id
                     LEFT JOIN productos_ubicacionproducto u ON p.id = u.producto_id AND u.activo = 1
                     LEFT JOIN productos_percha pr ON u.percha_id = pr.id AND pr.activo = 1
                     LEFT JOIN productos_seccion s ON pr.seccion_id = s.id AND s.activo = 1
-                    WHERE p.activo = 1 AND p.anulado = 0 AND p.stock > 0
+                    WHERE p.activo = 1 AND p.anulado = 0 AND {stock_sql} > 0
                       AND (p.nombre LIKE %s OR p.codigoPrincipal LIKE %s OR p.codigoAuxiliar LIKE %s)
                     ORDER BY p.nombre
                     LIMIT 10
                 """
                 search_param = f'%{search}%'
-                cursor.execute(sql, [search_param, search_param, search_param])
+                cursor.execute(sql, params + [search_param, search_param, search_param])
             
             productos_raw = cursor.fetchall()
         
@@ -1840,8 +1550,11 @@ def buscar_venta_devolucion(request):
                 estado__in=['PAGADA', 'completada', 'COMPLETADA']  # Acepta diferentes estados
             )
             
-            # Obtener detalles de la factura
-            detalles_factura = FacturaVentaDetalle.objects.filter(idFacturaVenta=factura.idFactura)
+            # Cliente de la factura y productos de los detalles en lote (una consulta cada uno)
+            precargar_facturas([factura])
+            detalles_factura = precargar_detalles(
+                FacturaVentaDetalle.objects.filter(idFacturaVenta=factura.idFactura), factura
+            )
             
             # Verificar que la factura no esté completamente devuelta
             detalles_con_disponible = []
@@ -1852,11 +1565,12 @@ def buscar_venta_devolucion(request):
                 cantidad_disponible = detalle.cantidad
                 
                 if cantidad_disponible > 0:
+                    producto = detalle.producto
                     detalles_con_disponible.append({
                         'id': detalle.id,
                         'producto_id': detalle.idProducto,
-                        'producto_codigo': detalle.idProducto,  # Usar ID como código
-                        'producto_nombre': detalle.productoNombre or f'Producto {detalle.idProducto}',
+                        'producto_codigo': producto.codigo_principal if producto else detalle.idProducto,
+                        'producto_nombre': detalle.productoNombre or (producto.nombre if producto else f'Producto {detalle.idProducto}'),
                         'cantidad_original': detalle.cantidad,
                         'cantidad_devuelta': cantidad_devuelta,
                         'cantidad_disponible': cantidad_disponible,
@@ -2099,45 +1813,19 @@ def buscar_ventas_por_numero(request):
     if not termino:
         return JsonResponse({'ventas': []})
     
-    with connection.cursor() as cursor:
-        # Buscar por número completo o por dígitos parciales
-        sql = """
-            SELECT 
-                v.id AS Id,
-                v.numero_factura AS NumeroVenta,
-                COALESCE(NULLIF(c.razonSocial,''), TRIM(CONCAT(IFNULL(c.nombres,''),' ',IFNULL(c.apellidos,'')))) AS Cliente,
-                v.total AS Total,
-                v.estado AS Estado,
-                v.fecha AS FechaVenta,
-                v.tipo_pago AS MetodoPago
-            FROM ventas_venta v
-            LEFT JOIN clientes c ON v.cliente_id = c.id
-            WHERE v.numero_factura LIKE %s 
-               OR v.numero_factura = %s
-               OR REPLACE(v.numero_factura, '-', '') LIKE %s
-            ORDER BY v.fecha DESC
-            LIMIT 20
-        """
-        
-        # Buscar tanto el término completo como variaciones
-        busqueda_completa = f'%{termino}%'
-        busqueda_sin_guiones = f'%{termino.replace("-", "")}%'
-        
-        cursor.execute(sql, [busqueda_completa, termino, busqueda_sin_guiones])
-        ventas = cursor.fetchall()
-        
-        # Convertir a lista de diccionarios
-        ventas_list = []
-        for venta in ventas:
-            ventas_list.append({
-                'Id': venta[0],
-                'NumeroVenta': venta[1],
-                'Cliente': venta[2] or 'Sin cliente',
-                'Total': float(venta[3]) if venta[3] else 0,
-                'Estado': venta[4],
-                'FechaVenta': venta[5].strftime('%Y-%m-%d %H:%M:%S') if venta[5] else '',
-                'MetodoPago': venta[6]
-            })
+    # Número (completo, sin guiones o secuencial), cliente o vendedor en la proyección de búsqueda
+    ventas_list = []
+    for venta in buscar_ventas(termino, limite=20):
+        ventas_list.append({
+            'Id': venta['Id'],
+            'NumeroVenta': venta['NumeroVenta'],
+            'Cliente': venta['Cliente'] or 'Sin cliente',
+            'Total': float(venta['Total']) if venta['Total'] else 0,
+            'Estado': venta['Estado'],
+            'FechaVenta': venta['FechaVenta'].strftime('%Y-%m-%d %H:%M:%S') if venta['FechaVenta'] else '',
+            'MetodoPago': venta['MetodoPago'],
+            'TipoDocumento': venta['TipoDocumento'],
+        })
     
     return JsonResponse({'ventas': ventas_list})
 
@@ -2154,15 +1842,21 @@ def obtener_venta_detalle(request, venta_id):
         except FacturaVenta.DoesNotExist:
             return JsonResponse({'error': 'Venta no encontrada'}, status=404)
         
+        # Cliente y usuario en lote (las columnas idCliente/idUsuario no son ForeignKey)
+        precargar_facturas([factura])
+        
         # Obtener cliente
         cliente = factura.cliente
         cliente_nombre = cliente.nombre_completo if cliente else 'Cliente Genérico'
         cliente_documento = cliente.cedula_ruc if cliente else ''
         cliente_direccion = cliente.direccion if cliente else ''
         cliente_telefono = cliente.telefono if cliente else ''
+        usuario = factura.usuario
         
-        # Obtener detalles de la factura
-        detalles_factura = FacturaVentaDetalle.objects.filter(idFacturaVenta=factura.idFactura)
+        # Obtener detalles de la factura con sus productos (una consulta para todas las líneas)
+        detalles_factura = precargar_detalles(
+            FacturaVentaDetalle.objects.filter(idFacturaVenta=factura.idFactura), factura
+        )
         
         # Formatear datos del encabezado
         encabezado_dict = {
@@ -2179,7 +1873,7 @@ def obtener_venta_detalle(request, venta_id):
             'Identificacion': cliente_documento,
             'Direccion': cliente_direccion,
             'Telefono': cliente_telefono,
-            'Vendedor': 'Sistema POS'
+            'Vendedor': (usuario.get_full_name() or usuario.username) if usuario else 'Sistema POS'
         }
         
         # Formatear datos del detalle
@@ -2358,7 +2052,9 @@ def desvincular_codigo_alternativo(request):
 @login_required
 def reporte_consolidado(request):
     """Reporte consolidado de ventas por rango de fechas"""
-    from datetime import datetime, timedelta
+    from datetime import datetime
+    from reportes.utils_trabajos import resultado_o_encolar, respuesta_en_proceso
+    from .utils_reportes import reporte_consolidado_vacio
     
     # Obtener parámetros de fecha
     fecha_inicio = request.GET.get('fecha_inicio')
@@ -2370,173 +2066,35 @@ def reporte_consolidado(request):
         fecha_inicio = hoy.replace(day=1).strftime('%Y-%m-%d')
         fecha_fin = hoy.strftime('%Y-%m-%d')
     
-    # Calcular días del período
-    from datetime import datetime as dt
-    fecha_inicio_dt = dt.strptime(fecha_inicio, '%Y-%m-%d')
-    fecha_fin_dt = dt.strptime(fecha_fin, '%Y-%m-%d')
-    dias_periodo = (fecha_fin_dt - fecha_inicio_dt).days + 1
-    
-    # Inicializar variables
-    estadisticas = {
-        'total_ventas': 0,
-        'total_facturas': 0,
-        'total_monto': 0,
-        'total_clientes': 0,
-        'total_productos_vendidos': 0,
-        'promedio_venta': 0,
-        'promedio_diario': 0,
-        'dias_periodo': dias_periodo,
-    }
-    
-    ventas_por_dia = []
-    productos_top = []
-    clientes_top = []
-    formas_pago = []
-    
-    try:
-        with connection.cursor() as cursor:
-            # Total de ventas y monto
-            cursor.execute("""
-                SELECT 
-                    COUNT(*) as total_ventas,
-                    COALESCE(SUM(total), 0) as total_monto,
-                    COUNT(DISTINCT idCliente) as total_clientes
-                FROM facturas_venta
-                WHERE DATE(fechaEmision) BETWEEN %s AND %s
-                AND estado != 'ANULADA'
-            """, [fecha_inicio, fecha_fin])
-            
-            row = cursor.fetchone()
-            if row:
-                estadisticas['total_ventas'] = row[0] or 0
-                estadisticas['total_monto'] = float(row[1]) if row[1] else 0
-                estadisticas['total_clientes'] = row[2] or 0
-                estadisticas['promedio_venta'] = (
-                    estadisticas['total_monto'] / estadisticas['total_ventas'] 
-                    if estadisticas['total_ventas'] > 0 else 0
-                )
-                estadisticas['promedio_diario'] = (
-                    estadisticas['total_ventas'] / dias_periodo
-                    if dias_periodo > 0 else 0
-                )
-            
-            # Total de productos vendidos
-            cursor.execute("""
-                SELECT COALESCE(SUM(fvd.cantidad), 0) as total_productos
-                FROM facturas_venta_detalle fvd
-                JOIN facturas_venta fv ON fvd.idFacturaVenta = fv.id
-                WHERE DATE(fv.fechaEmision) BETWEEN %s AND %s
-                AND fv.estado != 'ANULADA'
-            """, [fecha_inicio, fecha_fin])
-            
-            row = cursor.fetchone()
-            if row:
-                estadisticas['total_productos_vendidos'] = float(row[0]) if row[0] else 0
-            
-            # Ventas por día para gráfico
-            cursor.execute("""
-                SELECT 
-                    DATE(fechaEmision) as fecha,
-                    COUNT(*) as cantidad,
-                    COALESCE(SUM(total), 0) as monto
-                FROM facturas_venta
-                WHERE DATE(fechaEmision) BETWEEN %s AND %s
-                AND estado != 'ANULADA'
-                GROUP BY DATE(fechaEmision)
-                ORDER BY fecha
-            """, [fecha_inicio, fecha_fin])
-            
-            for row in cursor.fetchall():
-                ventas_por_dia.append({
-                    'fecha': row[0].strftime('%Y-%m-%d'),
-                    'cantidad': row[1],
-                    'monto': float(row[2]) if row[2] else 0
-                })
-            
-            # Top 10 productos más vendidos
-            cursor.execute("""
-                SELECT 
-                    p.nombre,
-                    p.codigoPrincipal,
-                    SUM(fvd.cantidad) as cantidad,
-                    COALESCE(SUM(fvd.total), 0) as total
-                FROM facturas_venta_detalle fvd
-                JOIN facturas_venta fv ON fvd.idFacturaVenta = fv.id
-                JOIN productos p ON fvd.idProducto = p.id
-                WHERE DATE(fv.fechaEmision) BETWEEN %s AND %s
-                AND fv.estado != 'ANULADA'
-                GROUP BY p.id, p.nombre, p.codigoPrincipal
-                ORDER BY cantidad DESC
-                LIMIT 10
-            """, [fecha_inicio, fecha_fin])
-            
-            for row in cursor.fetchall():
-                productos_top.append({
-                    'nombre': row[0],
-                    'codigo': row[1],
-                    'cantidad': float(row[2]) if row[2] else 0,
-                    'total': float(row[3]) if row[3] else 0
-                })
-            
-            # Top 10 clientes
-            cursor.execute("""
-                SELECT 
-                    CONCAT(c.nombres, ' ', c.apellidos) as cliente,
-                    c.cedula_ruc,
-                    COUNT(*) as num_compras,
-                    COALESCE(SUM(fv.total), 0) as total_comprado
-                FROM facturas_venta fv
-                LEFT JOIN clientes c ON fv.idCliente = c.id
-                WHERE DATE(fv.fechaEmision) BETWEEN %s AND %s
-                AND fv.estado != 'ANULADA'
-                GROUP BY c.id, cliente, c.cedula_ruc
-                ORDER BY total_comprado DESC
-                LIMIT 10
-            """, [fecha_inicio, fecha_fin])
-            
-            for row in cursor.fetchall():
-                clientes_top.append({
-                    'nombre': row[0] or 'Cliente General',
-                    'cedula_ruc': row[1] or 'N/A',
-                    'num_compras': row[2],
-                    'total': float(row[3]) if row[3] else 0
-                })
-            
-            # Formas de pago
-            cursor.execute("""
-                SELECT 
-                    formaPago,
-                    COUNT(*) as cantidad,
-                    COALESCE(SUM(total), 0) as total
-                FROM facturas_venta
-                WHERE DATE(fechaEmision) BETWEEN %s AND %s
-                AND estado != 'ANULADA'
-                GROUP BY formaPago
-                ORDER BY total DESC
-            """, [fecha_inicio, fecha_fin])
-            
-            for row in cursor.fetchall():
-                formas_pago.append({
-                    'forma_pago': row[0] or 'No especificado',
-                    'cantidad': row[1],
-                    'total': float(row[2]) if row[2] else 0
-                })
-    
-    except Exception as e:
-        messages.error(request, f'Error al generar el reporte: {str(e)}')
-    
-    # Serializar datos para JavaScript
-    import json
+    # El cálculo se hace en la cola de reportes; las consultas idénticas
+    # reciben el resultado en caché
+    trabajo, listo = resultado_o_encolar(
+        'ventas.reporte_consolidado',
+        {'fecha_inicio': fecha_inicio, 'fecha_fin': fecha_fin},
+        request.user,
+    )
+    if not listo and trabajo.estado != 'error':
+        return respuesta_en_proceso(request, trabajo, 'Reporte consolidado de ventas')
+    
+    if listo:
+        resultado = trabajo.resultado
+    else:
+        messages.error(request, f'Error al generar el reporte: {trabajo.error}')
+        resultado = reporte_consolidado_vacio(fecha_inicio, fecha_fin)
+    
+    ventas_por_dia = resultado['ventas_por_dia']
+    productos_top = resultado['productos_top']
+    formas_pago = resultado['formas_pago']
     
     context = {
         'fecha_inicio': fecha_inicio,
         'fecha_fin': fecha_fin,
-        'estadisticas': estadisticas,
+        'estadisticas': resultado['estadisticas'],
         'ventas_por_dia': ventas_por_dia,
         'ventas_por_dia_json': json.dumps(ventas_por_dia),
         'productos_top': productos_top,
         'productos_top_json': json.dumps(productos_top),
-        'clientes_top': clientes_top,
+        'clientes_top': resultado['clientes_top'],
         'formas_pago': formas_pago,
         'formas_pago_json': json.dumps(formas_pago),
     }